@@ -0,0 +1,178 @@
+import re
+from functools import lru_cache
+from heapq import merge
+from itertools import islice, takewhile
+
+# Number of distinct queries whose compiled pattern is kept around
+QUERY_CACHE_SIZE = 256
+# Number of usernames sent per page when streaming results
+DEFAULT_PAGE_SIZE = 100
+
+LITERAL_PREFIX = re.compile(r'[A-Za-z0-9]*')
+QUANTIFIERS = '*+?{'
+
+
+class CompiledQuery:
+    """A ListAccounts query compiled once and reused for every later identical query.
+
+    Queries are matched case-insensitively from the start of the username, so every
+    match has to start with the query's literal prefix. That prefix lets the search
+    seek straight into the sorted account index instead of testing every account.
+    """
+
+    def __init__(self, query):
+        self.pattern = re.compile(query, flags=re.IGNORECASE)
+        if '|' in query:
+            # Each alternative can start differently
+            self.prefix = ''
+        else:
+            self.prefix = LITERAL_PREFIX.match(query).group()
+            if len(self.prefix) < len(query) and query[len(self.prefix)] in QUANTIFIERS:
+                # The quantifier applies to the last literal character, so it is optional
+                self.prefix = self.prefix[:-1]
+        # Whether everything starting with the prefix matches, so the regex can be skipped
+        self.prefix_only = query[len(self.prefix):] in ('', '.*')
+        self.prefix = self.prefix.lower()
+
+
+@lru_cache(maxsize=QUERY_CACHE_SIZE)
+def compile_query(query):
+    """Compiles a ListAccounts query, reusing the result of recent identical queries
+
+    Args:
+        query (str): The regex to match usernames against
+
+    Raises:
+        re.error: The regex is malformed
+
+    Returns:
+        CompiledQuery: The compiled query
+    """
+    return CompiledQuery(query)
+
+
+def iter_accounts(snapshot, query, cursor=None):
+    """Lazily finds the usernames matching the query in a snapshot of the accounts. The
+    snapshot is private to the caller, so no lock needs to be held while searching.
+
+    Args:
+        snapshot (SortedIndex): Snapshot of the (lowercase username, username) index from AccountStore.snapshot
+        query (str): The regex to match usernames against
+        cursor (str, optional): Only return usernames sorted after this one, i.e. the
+            last username of the previous page. Defaults to None.
+
+    Raises:
+        re.error: The regex is malformed. Raised right away rather than on first iteration.
+
+    Returns:
+        Iterator[str]: The matching usernames in sorted order
+    """
+    compiled = compile_query(query)
+    start = (compiled.prefix,) if compiled.prefix else None
+    if cursor:
+        start = max(start or (), (cursor.lower(), cursor))
+    candidates = snapshot.iter_from(start)
+    if cursor:
+        candidates = (key for key in candidates if key[1] != cursor)
+    if compiled.prefix:
+        candidates = takewhile(lambda key: key[0].startswith(compiled.prefix),
+                               candidates)
+    if compiled.prefix_only:
+        return (username for _, username in candidates)
+    pattern = compiled.pattern
+    return (username for _, username in candidates if pattern.match(username))
+
+
+def search_accounts(snapshot, query):
+    """Finds all the usernames matching the query, see iter_accounts
+
+    Returns:
+        List[str]: The matching usernames in sorted order
+    """
+    return list(iter_accounts(snapshot, query))
+
+
+def page_accounts(snapshot, query, limit=None, cursor=None):
+    """Finds one page of usernames matching the query, see iter_accounts
+
+    Args:
+        limit (int, optional): Maximum number of usernames to return. Defaults to None, which returns all of them.
+        cursor (str, optional): The next_cursor returned with the previous page. Defaults to None.
+
+    Returns:
+        Tuple[List[str], str]: The matching usernames in sorted order, and the cursor to pass
+            to get the next page, which is empty when there are no more matches
+    """
+    matches = iter_accounts(snapshot, query, cursor)
+    if limit is None:
+        return list(matches), ''
+    page = list(islice(matches, limit + 1))
+    if len(page) > limit:
+        return page[:limit], page[limit - 1]
+    return page, ''
+
+
+def stream_accounts(snapshot, query, page_size=DEFAULT_PAGE_SIZE):
+    """Finds the usernames matching the query one page at a time, see iter_accounts
+
+    Args:
+        page_size (int, optional): Maximum number of usernames per page. Defaults to DEFAULT_PAGE_SIZE.
+
+    Returns:
+        Iterator[Tuple[List[str], str]]: (page, next_cursor) pairs. The last page has an empty
+            next_cursor; there is always at least one page, even if nothing matches.
+    """
+    matches = iter_accounts(snapshot, query)
+
+    def pages():
+        page = list(islice(matches, page_size))
+        while True:
+            next_page = list(islice(matches, page_size))
+            yield page, page[-1] if next_page else ''
+            if not next_page:
+                return
+            page = next_page
+    return pages()
+
+
+def merge_pages(pages, limit=None):
+    """Merges the pages that several servers found for the same page_accounts query, each
+    over its own share of the accounts. Each server returns its first limit matches after
+    the cursor, so the first limit of them in sorted order are the page.
+
+    Args:
+        pages (Iterable[Tuple[List[str], str]]): Every server's (page, next_cursor)
+        limit (int, optional): The page's limit. Defaults to None, for no limit.
+
+    Returns:
+        Tuple[List[str], str]: The merged page and its next_cursor, as page_accounts returns
+    """
+    pages = list(pages)
+    merged = list(merge(*(page for page, _ in pages),
+                        key=lambda username: (username.lower(), username)))
+    if limit is not None and (len(merged) > limit or any(next_cursor for _, next_cursor in pages)):
+        merged = merged[:limit]
+        return merged, merged[-1]
+    return merged, ''
+
+
+def page_through(search_page, query, page_size):
+    """Streams the results of a search_page(query, limit, cursor) function one page at a
+    time, as stream_accounts does. Each page is a separate search, so accounts created
+    while streaming may or may not be seen.
+
+    Raises:
+        re.error: The regex is malformed, raised before any page is searched
+
+    Returns:
+        Iterator[Tuple[List[str], str]]: (page, next_cursor) pairs, see stream_accounts
+    """
+    compile_query(query)
+
+    def pages():
+        page, next_cursor = search_page(query, page_size)
+        yield page, next_cursor
+        while next_cursor:
+            page, next_cursor = search_page(query, page_size, next_cursor)
+            yield page, next_cursor
+    return pages()
@@ -0,0 +1,181 @@
+from bisect import bisect_left
+
+# Maximum number of keys per bucket of the sorted index before it is split in half
+BUCKET_SIZE = 1000
+
+
+class SortedIndex:
+    """Sorted collection of keys stored as a list of bounded, immutable buckets.
+
+    Finding a key is a binary search over the bucket maxima followed by one inside
+    the bucket, so seeks are O(log N), and inserts/removals only rebuild a single
+    bucket instead of shifting the whole list. Because buckets are tuples that are
+    replaced rather than mutated, a snapshot only has to copy the bucket references.
+    """
+
+    def __init__(self, buckets=None, maxes=None):
+        self.buckets = buckets or []  # List of sorted tuples of keys
+        self.maxes = maxes or []  # Largest key of each bucket
+
+    @classmethod
+    def from_sorted(cls, keys):
+        """Builds an index in one pass from keys that are already sorted and unique"""
+        half = BUCKET_SIZE // 2
+        buckets = [tuple(keys[i:i + half]) for i in range(0, len(keys), half)]
+        return cls(buckets, [bucket[-1] for bucket in buckets])
+
+    def __len__(self):
+        return sum(len(bucket) for bucket in self.buckets)
+
+    def add(self, key):
+        """Inserts key, which must not already be in the index"""
+        if not self.buckets:
+            self.buckets.append((key,))
+            self.maxes.append(key)
+            return
+        i = bisect_left(self.maxes, key)
+        if i == len(self.maxes):
+            i -= 1
+        bucket = self.buckets[i]
+        j = bisect_left(bucket, key)
+        bucket = bucket[:j] + (key,) + bucket[j:]
+        if len(bucket) > BUCKET_SIZE:
+            half = len(bucket) // 2
+            self.buckets[i:i + 1] = [bucket[:half], bucket[half:]]
+            self.maxes[i:i + 1] = [bucket[half - 1], bucket[-1]]
+        else:
+            self.buckets[i] = bucket
+            self.maxes[i] = bucket[-1]
+
+    def remove(self, key):
+        """Removes key, which must be in the index"""
+        i = bisect_left(self.maxes, key)
+        bucket = self.buckets[i]
+        j = bisect_left(bucket, key)
+        bucket = bucket[:j] + bucket[j + 1:]
+        if bucket:
+            self.buckets[i] = bucket
+            self.maxes[i] = bucket[-1]
+        else:
+            del self.buckets[i]
+            del self.maxes[i]
+
+    def iter_from(self, key=None):
+        """Iterates over the keys in order, starting at the first key >= key
+
+        Args:
+            key (optional): Key to start from. Defaults to None, which starts at the smallest key.
+        """
+        if key is None:
+            i, j = 0, 0
+        else:
+            i = bisect_left(self.maxes, key)
+            j = bisect_left(self.buckets[i], key) if i < len(self.buckets) else 0
+        for bucket in self.buckets[i:]:
+            yield from bucket[j:]
+            j = 0
+
+    def snapshot(self):
+        """Returns a read-only copy of the index that later inserts and removals don't affect.
+        This is O(number of buckets), so it is cheap enough to take under the writers' lock.
+        """
+        return SortedIndex(list(self.buckets), list(self.maxes))
+
+
+class AccountStore:
+    """Set of account usernames with O(1) membership and a case-insensitive ordered index.
+
+    The store does no locking itself. Writers (add, remove, discard) are serialized by the
+    caller's account_list lock, but readers need no lock: a membership test is a single set
+    lookup, and the index is copy-on-write, so writers publish a new SortedIndex with one
+    assignment and snapshot just hands out the current one.
+    Iterating over the store yields the usernames sorted case-insensitively.
+    """
+
+    def __init__(self, usernames=()):
+        self.accounts = set(usernames)
+        # Sorted (lowercase username, username) pairs, so usernames that only differ in case both fit
+        self.index = SortedIndex.from_sorted(
+            sorted((username.lower(), username) for username in self.accounts))
+
+    def __contains__(self, username):
+        return username in self.accounts
+
+    def __len__(self):
+        return len(self.accounts)
+
+    def __iter__(self):
+        return (username for _, username in self.index.iter_from())
+
+    def add(self, username):
+        """Adds an account
+
+        Args:
+            username (str): The account name to add
+
+        Returns:
+            bool: True if the account was added, False if it already existed
+        """
+        if username in self.accounts:
+            return False
+        index = self.index.snapshot()
+        index.add((username.lower(), username))
+        self.accounts.add(username)
+        self.index = index
+        return True
+
+    def add_all(self, usernames):
+        """Adds many accounts at once, rebuilding the index in one pass instead of once per
+        account, e.g. when loading a snapshot
+
+        Args:
+            usernames (Iterable[str]): The account names to add
+        """
+        self.accounts.update(usernames)
+        self.index = SortedIndex.from_sorted(
+            sorted((username.lower(), username) for username in self.accounts))
+
+    def remove(self, username):
+        """Removes an account
+
+        Args:
+            username (str): The account name to remove
+
+        Raises:
+            KeyError: The account does not exist
+        """
+        self.accounts.remove(username)
+        index = self.index.snapshot()
+        index.remove((username.lower(), username))
+        self.index = index
+
+    def partition(self, usernames):
+        """Splits usernames into the accounts that exist and the ones that don't, in one pass
+        so a message to many recipients is validated under a single lock acquisition.
+        Duplicates are dropped.
+
+        Args:
+            usernames (Iterable[str]): The account names to check
+
+        Returns:
+            Tuple[List[str], List[str]]: The existing and the missing usernames, each in the given order
+        """
+        existing, missing = [], []
+        for username in dict.fromkeys(usernames):
+            (existing if username in self.accounts else missing).append(username)
+        return existing, missing
+
+    def snapshot(self):
+        """Returns a read-only SortedIndex of (lowercase username, username) pairs that
+        can be scanned without holding the account_list lock. Needs no lock itself.
+        """
+        return self.index
+
+    def discard(self, username):
+        """Removes an account if it exists
+
+        Args:
+            username (str): The account name to remove
+        """
+        if username in self.accounts:
+            self.remove(username)
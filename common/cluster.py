@@ -0,0 +1,314 @@
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import cluster_pb2_grpc
+from account_query import compile_query, merge_pages, page_through
+from cluster_pb2 import (
+    Member,
+    Membership,
+    QueuedMessage,
+    SearchRequest,
+    SearchResponse,
+    SendRequest,
+    SendResponse,
+    TransferResponse,
+    UpdateMembershipResponse,
+    UserBatch
+)
+from hash_ring import DEFAULT_REPLICAS, HashRing
+
+# Threads per node answering the other nodes' calls
+REQUEST_WORKERS = 8
+# Accounts and messages per Transfer call, keeping each well under gRPC's message size limit
+TRANSFER_BATCH_SIZE = 1000
+# Transfer calls to a new owner before its users are kept here for the next membership change
+TRANSFER_ATTEMPTS = 5
+# Seconds between Transfer attempts
+RETRY_DELAY = 0.5
+
+
+class ClusterNode(cluster_pb2_grpc.ClusterServiceServicer):
+    """Membership of one chat server in a cluster that serves as a single chat service.
+
+    Usernames are placed on a consistent hash ring of the members' addresses, and the
+    owning node holds a user's account, mailbox and login, as a shard does. The node
+    routes sends to the owners of their recipients and gathers account searches from
+    every member over the ClusterService, and when a node joins or leaves, every member
+    hands the users it no longer owns over to their new owners. A user is only removed once
+    their new owner has acknowledged them, so a failed handover never loses anyone; users
+    whose owner can't be reached stay here until the next membership change. Membership
+    changes are made by one node at a time: each is a new membership with a higher epoch,
+    pushed to every member. Members that stop without leaving aren't detected.
+
+    The chat server hosting the node (the backend) does the local work, through:
+        node_send(recipients, sender, message): delivers or queues a message for recipients
+            it owns, returning those whose account doesn't exist
+        node_search_page(query, limit, cursor): one page of its own matching accounts
+        node_export(keep): copies the accounts whose username keep() rejects, with their
+            mailboxes, returning (accounts, [(recipient, sender, message)])
+        node_remove(handed_over): for each username with the number of its messages handed
+            over, drops those messages and, unless more arrived since, the account and its login
+        node_import(accounts, messages): adds the accounts and queues the messages
+    """
+
+    def __init__(self, backend, address, client_address, replicas=DEFAULT_REPLICAS):
+        """
+        Args:
+            backend: The chat server the node is part of
+            address (str): host:port this node's ClusterService listens on
+            client_address (str): host:port clients reach the chat server on, which clients
+                are sent to for accounts this node owns
+            replicas (int, optional): Points per node on the ring. Defaults to DEFAULT_REPLICAS.
+        """
+        self.backend = backend
+        self.address = address
+        self.replicas = replicas
+        # The membership, replaced as a whole under the lock and read without it
+        self.lock = threading.Lock()
+        self.epoch = 0
+        self.members = {address: client_address}  # Node address to client address
+        self.ring = HashRing([address], replicas)
+        self.stubs = {}  # Node address to the ClusterServiceStub calling it
+        self.channels = []
+        self.server = None
+
+    def start(self):
+        """Starts answering the other nodes' calls"""
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=REQUEST_WORKERS))
+        cluster_pb2_grpc.add_ClusterServiceServicer_to_server(self, self.server)
+        self.server.add_insecure_port(self.address)
+        self.server.start()
+        print(f"Cluster node listening on {self.address}")
+
+    def stop(self):
+        if self.server is not None:
+            self.server.stop(None)
+        for channel in self.channels:
+            channel.close()
+
+    def join(self, seed):
+        """Joins the cluster a running node belongs to. Returns once this node owns its range,
+        with the users in it moved here.
+
+        Args:
+            seed (str): The address of any member's ClusterService
+        """
+        membership = self._stub(seed).Join(Member(address=self.address,
+                                                  client_address=self.members[self.address]))
+        print(f"Joined a cluster of {len(membership.members)} nodes")
+
+    def leave(self):
+        """Leaves the cluster, handing every user to the remaining members"""
+        self.lock.acquire()
+        members = {address: client_address for address, client_address in self.members.items()
+                   if address != self.address}
+        epoch = self.epoch + 1
+        self.lock.release()
+        if members:
+            self._change_membership(epoch, members)
+            print("Left the cluster")
+
+    def owner(self, username):
+        """Finds the address of the node that owns a username"""
+        return self.ring.owner(username)
+
+    def is_local(self, username):
+        return self.ring.owner(username) == self.address
+
+    def client_address(self, username):
+        """Finds the address clients reach the owner of a username on"""
+        return self.members[self.ring.owner(username)]
+
+    def send(self, recipients, sender, message):
+        """Delivers or queues a message for recipients on any node. Every other node owning
+        some of them gets its share in a single call, all made at once.
+
+        Args:
+            recipients (List[str]): The recipients' usernames
+            sender (str): The sender's username
+            message (str): The message
+
+        Returns:
+            Tuple[List[str], List[str]]: The recipients that don't exist, and those whose node
+                couldn't be reached, which didn't get the message
+        """
+        by_owner = {}
+        for recipient in recipients:
+            by_owner.setdefault(self.owner(recipient), []).append(recipient)
+        replies = [(owned, self._stub(owner).Send.future(SendRequest(recipients=owned, sender=sender, message=message)))
+                   for owner, owned in by_owner.items() if owner != self.address]
+        missing = list(self.backend.node_send(by_owner.get(self.address, []), sender, message))
+        unavailable = []
+        for owned, reply in replies:
+            try:
+                missing.extend(reply.result().missing)
+            except grpc.RpcError:
+                # A node that is down or restarting only fails its own recipients
+                unavailable.extend(owned)
+        return missing, unavailable
+
+    def search_page(self, query, limit=None, cursor=None):
+        """Finds one page of the accounts matching query on every node, see
+        account_query.page_accounts
+
+        Raises:
+            ConnectionError: A node couldn't be reached, so the page would be missing its accounts
+        """
+        # Raises on a malformed regex before asking the other nodes
+        compile_query(query)
+        request = SearchRequest(query=query, limit=limit or 0, cursor=cursor or '')
+        replies = [self._stub(address).SearchAccounts.future(request)
+                   for address in list(self.members) if address != self.address]
+        pages = [self.backend.node_search_page(query, limit, cursor)]
+        for reply in replies:
+            try:
+                response = reply.result()
+            except grpc.RpcError as e:
+                raise ConnectionError(f'Cluster node unavailable: {e.code()}') from None
+            pages.append((list(response.accounts), response.next_cursor))
+        return merge_pages(pages, limit)
+
+    def search_pages(self, query, page_size):
+        """Finds the accounts matching query on every node one page at a time, see
+        account_query.page_through
+        """
+        return page_through(self.search_page, query, page_size)
+
+    def _stub(self, address):
+        stub = self.stubs.get(address)
+        if stub is None:
+            self.lock.acquire()
+            stub = self.stubs.get(address)
+            if stub is None:
+                channel = grpc.insecure_channel(address)
+                self.channels.append(channel)
+                stub = self.stubs[address] = cluster_pb2_grpc.ClusterServiceStub(channel)
+            self.lock.release()
+        return stub
+
+    def _change_membership(self, epoch, members):
+        """Pushes a new membership to every node in it or leaving it, this one included, and
+        waits until they have all moved their users"""
+        membership = Membership(epoch=epoch, members=[
+            Member(address=address, client_address=client_address)
+            for address, client_address in members.items()])
+        self.lock.acquire()
+        others = set(self.members) | set(members)
+        self.lock.release()
+        others.discard(self.address)
+        replies = [self._stub(address).UpdateMembership.future(membership) for address in others]
+        self._install(membership)
+        for reply in replies:
+            reply.result()
+        return membership
+
+    def _install(self, membership):
+        """Replaces the membership with a newer one, then hands the users this node no
+        longer owns to their new owners"""
+        self.lock.acquire()
+        if membership.epoch <= self.epoch:
+            self.lock.release()
+            return
+        self.epoch = membership.epoch
+        self.members = {member.address: member.client_address for member in membership.members}
+        ring = self.ring = HashRing(self.members, self.replicas)
+        self.lock.release()
+        if not ring:
+            return
+
+        unreachable = set()  # Owners that didn't take their users, who stay here
+
+        def keep(username):
+            owner = ring.owner(username)
+            return owner == self.address or owner in unreachable
+        # Users who got mail during a round are exported again with it
+        while self._hand_over(ring, *self.backend.node_export(keep), unreachable):
+            pass
+        if unreachable:
+            print(f"Kept the users of unreachable nodes {sorted(unreachable)}")
+
+    def _hand_over(self, ring, accounts, messages, unreachable):
+        """Transfers exported users to their new owners, then removes those that were
+        acknowledged. Owners that never acknowledge are added to unreachable.
+
+        Returns:
+            bool: False if there was nobody to hand over
+        """
+        if not accounts:
+            return False
+        batches = {}  # Owner to the UserBatches for it, the last one still being filled
+
+        def batch_for(username):
+            owner_batches = batches.setdefault(ring.owner(username), [UserBatch()])
+            if len(owner_batches[-1].accounts) + len(owner_batches[-1].messages) >= TRANSFER_BATCH_SIZE:
+                owner_batches.append(UserBatch())
+            return owner_batches[-1]
+        for username in accounts:
+            batch_for(username).accounts.append(username)
+        for recipient, sender, message in messages:
+            batch_for(recipient).messages.append(
+                QueuedMessage(recipient=recipient, sender=sender, message=message))
+        handed_over = {}  # Username to the number of their messages the new owner has
+        for owner, owner_batches in batches.items():
+            if not self._transfer(owner, owner_batches):
+                unreachable.add(owner)
+                continue
+            for batch in owner_batches:
+                for username in batch.accounts:
+                    handed_over.setdefault(username, 0)
+                for queued in batch.messages:
+                    handed_over[queued.recipient] = handed_over.get(queued.recipient, 0) + 1
+        self.backend.node_remove(handed_over)
+        if handed_over:
+            print(f"Moved {len(handed_over)} accounts to {len(batches) - len(unreachable)} nodes")
+        return True
+
+    def _transfer(self, owner, batches):
+        """Sends every batch to owner, retrying each a few times
+
+        Returns:
+            bool: True once owner has acknowledged all of them
+        """
+        for batch in batches:
+            for attempt in range(TRANSFER_ATTEMPTS):
+                try:
+                    self._stub(owner).Transfer(batch)
+                    break
+                except grpc.RpcError as e:
+                    print(f"Transfer to {owner} failed: {e.code()}")
+                    if attempt + 1 < TRANSFER_ATTEMPTS:
+                        time.sleep(RETRY_DELAY)
+            else:
+                return False
+        return True
+
+    # ClusterService, called by the other nodes
+
+    def Join(self, request: Member, context):
+        self.lock.acquire()
+        members = dict(self.members)
+        epoch = self.epoch + 1
+        self.lock.release()
+        members[request.address] = request.client_address
+        print(f"Node joining: {request.address}")
+        return self._change_membership(epoch, members)
+
+    def UpdateMembership(self, request: Membership, context):
+        self._install(request)
+        return UpdateMembershipResponse()
+
+    def Transfer(self, request: UserBatch, context):
+        self.backend.node_import(list(request.accounts), [
+            (queued.recipient, queued.sender, queued.message) for queued in request.messages])
+        return TransferResponse()
+
+    def Send(self, request: SendRequest, context):
+        return SendResponse(missing=self.backend.node_send(
+            list(request.recipients), request.sender, request.message))
+
+    def SearchAccounts(self, request: SearchRequest, context):
+        accounts, next_cursor = self.backend.node_search_page(
+            request.query, request.limit or None, request.cursor or None)
+        return SearchResponse(accounts=accounts, next_cursor=next_cursor)
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: cluster.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rcluster.proto\x12\x07\x63luster\"1\n\x06Member\x12\x0f\n\x07\x61\x64\x64ress\x18\x01 \x01(\t\x12\x16\n\x0e\x63lient_address\x18\x02 \x01(\t\"=\n\nMembership\x12\r\n\x05\x65poch\x18\x01 \x01(\x03\x12 \n\x07members\x18\x02 \x03(\x0b\x32\x0f.cluster.Member\"\x1a\n\x18UpdateMembershipResponse\"C\n\rQueuedMessage\x12\x11\n\trecipient\x18\x01 \x01(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"G\n\tUserBatch\x12\x10\n\x08\x61\x63\x63ounts\x18\x01 \x03(\t\x12(\n\x08messages\x18\x02 \x03(\x0b\x32\x16.cluster.QueuedMessage\"\x12\n\x10TransferResponse\"B\n\x0bSendRequest\x12\x12\n\nrecipients\x18\x01 \x03(\t\x12\x0e\n\x06sender\x18\x02 \x01(\t\x12\x0f\n\x07message\x18\x03 \x01(\t\"\x1f\n\x0cSendResponse\x12\x0f\n\x07missing\x18\x01 \x03(\t\"=\n\rSearchRequest\x12\r\n\x05query\x18\x01 \x01(\t\x12\r\n\x05limit\x18\x02 \x01(\x05\x12\x0e\n\x06\x63ursor\x18\x03 \x01(\t\"7\n\x0eSearchResponse\x12\x10\n\x08\x61\x63\x63ounts\x18\x01 \x03(\t\x12\x13\n\x0bnext_cursor\x18\x02 \x01(\t2\xc7\x02\n\x0e\x43lusterService\x12.\n\x04Join\x12\x0f.cluster.Member\x1a\x13.cluster.Membership\"\x00\x12L\n\x10UpdateMembership\x12\x13.cluster.Membership\x1a!.cluster.UpdateMembershipResponse\"\x00\x12;\n\x08Transfer\x12\x12.cluster.UserBatch\x1a\x19.cluster.TransferResponse\"\x00\x12\x35\n\x04Send\x12\x14.cluster.SendRequest\x1a\x15.cluster.SendResponse\"\x00\x12\x43\n\x0eSearchAccounts\x12\x16.cluster.SearchRequest\x1a\x17.cluster.SearchResponse\"\x00\x62\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'cluster_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _MEMBER._serialized_start=26
+  _MEMBER._serialized_end=75
+  _MEMBERSHIP._serialized_start=77
+  _MEMBERSHIP._serialized_end=138
+  _UPDATEMEMBERSHIPRESPONSE._serialized_start=140
+  _UPDATEMEMBERSHIPRESPONSE._serialized_end=166
+  _QUEUEDMESSAGE._serialized_start=168
+  _QUEUEDMESSAGE._serialized_end=235
+  _USERBATCH._serialized_start=237
+  _USERBATCH._serialized_end=308
+  _TRANSFERRESPONSE._serialized_start=310
+  _TRANSFERRESPONSE._serialized_end=328
+  _SENDREQUEST._serialized_start=330
+  _SENDREQUEST._serialized_end=396
+  _SENDRESPONSE._serialized_start=398
+  _SENDRESPONSE._serialized_end=429
+  _SEARCHREQUEST._serialized_start=431
+  _SEARCHREQUEST._serialized_end=492
+  _SEARCHRESPONSE._serialized_start=494
+  _SEARCHRESPONSE._serialized_end=549
+  _CLUSTERSERVICE._serialized_start=552
+  _CLUSTERSERVICE._serialized_end=879
+# @@protoc_insertion_point(module_scope)
@@ -0,0 +1,82 @@
+from google.protobuf.internal import containers as _containers
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import message as _message
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
+
+DESCRIPTOR: _descriptor.FileDescriptor
+
+class Member(_message.Message):
+    __slots__ = ["address", "client_address"]
+    ADDRESS_FIELD_NUMBER: _ClassVar[int]
+    CLIENT_ADDRESS_FIELD_NUMBER: _ClassVar[int]
+    address: str
+    client_address: str
+    def __init__(self, address: _Optional[str] = ..., client_address: _Optional[str] = ...) -> None: ...
+
+class Membership(_message.Message):
+    __slots__ = ["epoch", "members"]
+    EPOCH_FIELD_NUMBER: _ClassVar[int]
+    MEMBERS_FIELD_NUMBER: _ClassVar[int]
+    epoch: int
+    members: _containers.RepeatedCompositeFieldContainer[Member]
+    def __init__(self, epoch: _Optional[int] = ..., members: _Optional[_Iterable[_Union[Member, _Mapping]]] = ...) -> None: ...
+
+class QueuedMessage(_message.Message):
+    __slots__ = ["message", "recipient", "sender"]
+    MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    RECIPIENT_FIELD_NUMBER: _ClassVar[int]
+    SENDER_FIELD_NUMBER: _ClassVar[int]
+    message: str
+    recipient: str
+    sender: str
+    def __init__(self, recipient: _Optional[str] = ..., sender: _Optional[str] = ..., message: _Optional[str] = ...) -> None: ...
+
+class SearchRequest(_message.Message):
+    __slots__ = ["cursor", "limit", "query"]
+    CURSOR_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
+    QUERY_FIELD_NUMBER: _ClassVar[int]
+    cursor: str
+    limit: int
+    query: str
+    def __init__(self, query: _Optional[str] = ..., limit: _Optional[int] = ..., cursor: _Optional[str] = ...) -> None: ...
+
+class SearchResponse(_message.Message):
+    __slots__ = ["accounts", "next_cursor"]
+    ACCOUNTS_FIELD_NUMBER: _ClassVar[int]
+    NEXT_CURSOR_FIELD_NUMBER: _ClassVar[int]
+    accounts: _containers.RepeatedScalarFieldContainer[str]
+    next_cursor: str
+    def __init__(self, accounts: _Optional[_Iterable[str]] = ..., next_cursor: _Optional[str] = ...) -> None: ...
+
+class SendRequest(_message.Message):
+    __slots__ = ["message", "recipients", "sender"]
+    MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    RECIPIENTS_FIELD_NUMBER: _ClassVar[int]
+    SENDER_FIELD_NUMBER: _ClassVar[int]
+    message: str
+    recipients: _containers.RepeatedScalarFieldContainer[str]
+    sender: str
+    def __init__(self, recipients: _Optional[_Iterable[str]] = ..., sender: _Optional[str] = ..., message: _Optional[str] = ...) -> None: ...
+
+class SendResponse(_message.Message):
+    __slots__ = ["missing"]
+    MISSING_FIELD_NUMBER: _ClassVar[int]
+    missing: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, missing: _Optional[_Iterable[str]] = ...) -> None: ...
+
+class TransferResponse(_message.Message):
+    __slots__ = []
+    def __init__(self) -> None: ...
+
+class UpdateMembershipResponse(_message.Message):
+    __slots__ = []
+    def __init__(self) -> None: ...
+
+class UserBatch(_message.Message):
+    __slots__ = ["accounts", "messages"]
+    ACCOUNTS_FIELD_NUMBER: _ClassVar[int]
+    MESSAGES_FIELD_NUMBER: _ClassVar[int]
+    accounts: _containers.RepeatedScalarFieldContainer[str]
+    messages: _containers.RepeatedCompositeFieldContainer[QueuedMessage]
+    def __init__(self, accounts: _Optional[_Iterable[str]] = ..., messages: _Optional[_Iterable[_Union[QueuedMessage, _Mapping]]] = ...) -> None: ...
@@ -0,0 +1,207 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+
+import cluster_pb2 as cluster__pb2
+
+
+class ClusterServiceStub(object):
+    """Calls between the nodes of a cluster of chat servers, wire protocol or gRPC alike
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.Join = channel.unary_unary(
+                '/cluster.ClusterService/Join',
+                request_serializer=cluster__pb2.Member.SerializeToString,
+                response_deserializer=cluster__pb2.Membership.FromString,
+                )
+        self.UpdateMembership = channel.unary_unary(
+                '/cluster.ClusterService/UpdateMembership',
+                request_serializer=cluster__pb2.Membership.SerializeToString,
+                response_deserializer=cluster__pb2.UpdateMembershipResponse.FromString,
+                )
+        self.Transfer = channel.unary_unary(
+                '/cluster.ClusterService/Transfer',
+                request_serializer=cluster__pb2.UserBatch.SerializeToString,
+                response_deserializer=cluster__pb2.TransferResponse.FromString,
+                )
+        self.Send = channel.unary_unary(
+                '/cluster.ClusterService/Send',
+                request_serializer=cluster__pb2.SendRequest.SerializeToString,
+                response_deserializer=cluster__pb2.SendResponse.FromString,
+                )
+        self.SearchAccounts = channel.unary_unary(
+                '/cluster.ClusterService/SearchAccounts',
+                request_serializer=cluster__pb2.SearchRequest.SerializeToString,
+                response_deserializer=cluster__pb2.SearchResponse.FromString,
+                )
+
+
+class ClusterServiceServicer(object):
+    """Calls between the nodes of a cluster of chat servers, wire protocol or gRPC alike
+    """
+
+    def Join(self, request, context):
+        """Adds the calling node to the cluster. Answered with the new membership once every
+        member has installed it and moved the new node's users to it.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def UpdateMembership(self, request, context):
+        """Installs a newer membership, moving the users this node no longer owns to their owners
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Transfer(self, request, context):
+        """Takes over accounts and their queued messages from another node
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Send(self, request, context):
+        """Delivers or queues a message for recipients this node owns
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def SearchAccounts(self, request, context):
+        """One page of the matching accounts this node owns
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_ClusterServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'Join': grpc.unary_unary_rpc_method_handler(
+                    servicer.Join,
+                    request_deserializer=cluster__pb2.Member.FromString,
+                    response_serializer=cluster__pb2.Membership.SerializeToString,
+            ),
+            'UpdateMembership': grpc.unary_unary_rpc_method_handler(
+                    servicer.UpdateMembership,
+                    request_deserializer=cluster__pb2.Membership.FromString,
+                    response_serializer=cluster__pb2.UpdateMembershipResponse.SerializeToString,
+            ),
+            'Transfer': grpc.unary_unary_rpc_method_handler(
+                    servicer.Transfer,
+                    request_deserializer=cluster__pb2.UserBatch.FromString,
+                    response_serializer=cluster__pb2.TransferResponse.SerializeToString,
+            ),
+            'Send': grpc.unary_unary_rpc_method_handler(
+                    servicer.Send,
+                    request_deserializer=cluster__pb2.SendRequest.FromString,
+                    response_serializer=cluster__pb2.SendResponse.SerializeToString,
+            ),
+            'SearchAccounts': grpc.unary_unary_rpc_method_handler(
+                    servicer.SearchAccounts,
+                    request_deserializer=cluster__pb2.SearchRequest.FromString,
+                    response_serializer=cluster__pb2.SearchResponse.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'cluster.ClusterService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+ # This class is part of an EXPERIMENTAL API.
+class ClusterService(object):
+    """Calls between the nodes of a cluster of chat servers, wire protocol or gRPC alike
+    """
+
+    @staticmethod
+    def Join(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/cluster.ClusterService/Join',
+            cluster__pb2.Member.SerializeToString,
+            cluster__pb2.Membership.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def UpdateMembership(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/cluster.ClusterService/UpdateMembership',
+            cluster__pb2.Membership.SerializeToString,
+            cluster__pb2.UpdateMembershipResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Transfer(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/cluster.ClusterService/Transfer',
+            cluster__pb2.UserBatch.SerializeToString,
+            cluster__pb2.TransferResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Send(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/cluster.ClusterService/Send',
+            cluster__pb2.SendRequest.SerializeToString,
+            cluster__pb2.SendResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def SearchAccounts(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/cluster.ClusterService/SearchAccounts',
+            cluster__pb2.SearchRequest.SerializeToString,
+            cluster__pb2.SearchResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -0,0 +1,78 @@
+import hashlib
+from bisect import bisect_right, insort
+
+# Points per node on the ring; more spread each node's share of the usernames more evenly
+DEFAULT_REPLICAS = 64
+
+
+def ring_hash(key):
+    """Hashes a key onto the ring. The hash is stable across processes and machines, unlike
+    hash() on a str, so every node places a username at the same point.
+
+    Args:
+        key (str): A username, or a node's name for one of its points
+
+    Returns:
+        int: The key's point on the ring, a 64 bit integer
+    """
+    return int.from_bytes(hashlib.md5(key.encode('utf-8')).digest()[:8], 'big')
+
+
+class HashRing:
+    """Consistent hashing of usernames onto nodes.
+
+    Every node is placed on a ring of 64 bit points replicas times, and a username is owned
+    by the node of the first point at or after its own hash, wrapping around. Adding a node
+    only takes usernames from the nodes before its points, and removing one only gives its
+    usernames to the nodes after its points, so a membership change moves about 1/n of the
+    users instead of rehashing all of them as username % n would.
+    """
+
+    def __init__(self, nodes=(), replicas=DEFAULT_REPLICAS):
+        """
+        Args:
+            nodes (Iterable[str], optional): The nodes' names, e.g. their addresses. Defaults to ().
+            replicas (int, optional): Points per node. Defaults to DEFAULT_REPLICAS.
+        """
+        self.replicas = replicas
+        self.points = []  # Sorted (point, node) pairs
+        self.nodes = set()
+        for node in nodes:
+            self.add(node)
+
+    def __len__(self):
+        return len(self.nodes)
+
+    def __contains__(self, node):
+        return node in self.nodes
+
+    def add(self, node):
+        if node in self.nodes:
+            return
+        self.nodes.add(node)
+        for replica in range(self.replicas):
+            insort(self.points, (ring_hash(f'{node}#{replica}'), node))
+
+    def remove(self, node):
+        if node not in self.nodes:
+            return
+        self.nodes.remove(node)
+        self.points = [point for point in self.points if point[1] != node]
+
+    def owner(self, username):
+        """Finds the node that owns a username
+
+        Args:
+            username (str): The username
+
+        Raises:
+            LookupError: If the ring has no nodes
+
+        Returns:
+            str: The owning node
+        """
+        if not self.points:
+            raise LookupError('The ring has no nodes')
+        # Nodes sort after the empty string, so a point equal to the hash owns it
+        index = bisect_right(self.points, (ring_hash(username), ''))
+        return self.points[index % len(self.points)][1]
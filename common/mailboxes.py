@@ -0,0 +1,166 @@
+import threading
+from collections import deque
+from collections.abc import MutableMapping
+
+
+class Waiters:
+    """What every kind of mailbox has besides its messages: the lock that guards them, and
+    the subscriber to wake when mail arrives. Whoever appends to the mailbox calls notify.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.arrived = threading.Condition(self.lock)
+        # The Subscription of the stream currently waiting on this mailbox, or None
+        self.subscriber = None
+
+    def notify(self):
+        """Wakes the subscriber, if any, after messages were added"""
+        if self.subscriber is not None:
+            self.subscriber.wake()
+
+    def subscribe(self, subscription):
+        """Makes subscription the only subscriber, waking the one it replaces so it can stop
+
+        Args:
+            subscription (Subscription): The new subscriber
+        """
+        previous = self.subscriber
+        self.subscriber = subscription
+        if previous is not None:
+            previous.wake()
+
+    def unsubscribe(self, subscription=None):
+        """Drops the subscriber and wakes it so it can stop
+
+        Args:
+            subscription (Subscription, optional): Only drop the subscriber if it is this one. Defaults to None, dropping any subscriber.
+        """
+        if self.subscriber is not None and subscription in (None, self.subscriber):
+            previous = self.subscriber
+            self.subscriber = None
+            previous.wake()
+
+
+class Mailbox(Waiters, deque):
+    """The (sender, message) tuples waiting for one user, oldest first, kept in memory.
+
+    Appending and taking the oldest message are O(1), and each mailbox has its own lock,
+    so senders to different users never wait on each other. The mailbox does no locking
+    itself; callers hold mailbox.lock around any sequence of operations that must be atomic.
+
+    A long-lived stream can subscribe to the mailbox to be woken when mail arrives.
+    Other storage engines provide mailboxes with the same methods: append, extend,
+    popleft, pop_all, requeue, clear, len and iteration.
+    """
+
+    def __init__(self, messages=()):
+        deque.__init__(self, messages)
+        Waiters.__init__(self)
+
+    def pop_all(self):
+        """Takes every waiting message at once
+
+        Returns:
+            List[tuple]: The messages, oldest first
+        """
+        messages = list(self)
+        self.clear()
+        return messages
+
+    def requeue(self, messages):
+        """Puts messages that could not be delivered back in front of the mailbox
+
+        Args:
+            messages (List[tuple]): The messages, oldest first
+        """
+        self.extendleft(reversed(messages))
+
+
+class Subscription:
+    """A stream that blocks its thread until its mailbox has mail or it is unsubscribed.
+    wake and wait are called with mailbox.lock held.
+    """
+
+    def __init__(self, mailbox, username):
+        self.mailbox = mailbox
+        self.username = username  # Whose mailbox it is
+
+    def wake(self):
+        self.mailbox.arrived.notify_all()
+
+    def wait(self):
+        self.mailbox.arrived.wait()
+
+
+class MailboxStore(MutableMapping):
+    """Map of username to the Mailbox of messages waiting for them.
+
+    As a mapping it only contains the users that have mail waiting, so
+    store.get(username) is falsy once a user's mailbox has been drained. Writers get the
+    mailbox itself with mailbox(username), which creates it if needed. Mailboxes are
+    never dropped while the account exists, so a mailbox obtained by one thread stays the
+    one every other thread sees.
+    """
+
+    def __init__(self):
+        self.mailboxes = {}
+        # Only guards creating and removing mailboxes; their contents use each mailbox's lock
+        self.lock = threading.Lock()
+
+    def mailbox(self, username):
+        """Returns the username's mailbox, creating an empty one if needed
+
+        Args:
+            username (str): The recipient's username
+
+        Returns:
+            Mailbox: The recipient's mailbox
+        """
+        mailbox = self.mailboxes.get(username)
+        if mailbox is None:
+            self.lock.acquire()
+            mailbox = self.mailboxes.get(username)
+            if mailbox is None:
+                mailbox = self.mailboxes[username] = self.new_mailbox(username)
+            self.lock.release()
+        return mailbox
+
+    def new_mailbox(self, username):
+        """Creates the mailbox for a user who doesn't have one yet. Storage engines that keep
+        messages elsewhere override this.
+
+        Args:
+            username (str): The recipient's username
+
+        Returns:
+            Mailbox: An empty mailbox
+        """
+        return Mailbox()
+
+    def __getitem__(self, username):
+        mailbox = self.mailboxes.get(username)
+        if not mailbox:
+            raise KeyError(username)
+        return mailbox
+
+    def __setitem__(self, username, messages):
+        mailbox = self.mailbox(username)
+        mailbox.lock.acquire()
+        mailbox.clear()
+        mailbox.extend(messages)
+        mailbox.lock.release()
+
+    def __delitem__(self, username):
+        """Drops the mailbox along with any waiting messages, e.g. when the account is deleted"""
+        self.lock.acquire()
+        mailbox = self.mailboxes.pop(username, None)
+        self.lock.release()
+        if not mailbox:
+            raise KeyError(username)
+
+    def __iter__(self):
+        return (username for username, mailbox in list(self.mailboxes.items()) if mailbox)
+
+    def __len__(self):
+        return sum(1 for _ in self)
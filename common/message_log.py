@@ -0,0 +1,541 @@
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from enum import Enum
+
+from account_store import AccountStore
+from mailboxes import MailboxStore
+from snapshot import load_snapshot, read_snapshot, write_snapshot
+
+# Header of each record: length of the body, then its CRC32
+RECORD_HEADER = struct.Struct('<II')
+# Length prefix of each field in a record body
+FIELD_LENGTH = struct.Struct('<I')
+# Bytes after which the log moves on to a new segment file
+DEFAULT_SEGMENT_SIZE = 64 * 1024 * 1024
+# Number of sealed segments after which they are compacted into a new snapshot
+DEFAULT_SNAPSHOT_SEGMENTS = 4
+# Bytes of records a follower may fall behind by before it is dropped and has to start over
+DEFAULT_MAX_BACKLOG = 64 * 1024 * 1024
+# Bytes of records per batch when sending a new follower the state already in the log
+BOOTSTRAP_BATCH_SIZE = 1024 * 1024
+# Seconds after which an idle follower is sent an empty batch, so it knows the log is alive
+HEARTBEAT_INTERVAL = 1.0
+SEGMENT_SUFFIX = '.log'
+SNAPSHOT_SUFFIX = '.snapshot'
+
+
+class RecordType(Enum):
+    """What a record in the message log does when it is replayed. The fields of each type:
+
+    CREATE_ACCOUNT / DELETE_ACCOUNT: username
+    ENQUEUE: recipient, sender, message, appended to the back of the recipient's mailbox
+    ACK: recipient, count, removing the count oldest messages after they were delivered
+    REQUEUE: recipient, then sender, message for each message put back in front of the mailbox
+    """
+    CREATE_ACCOUNT = 1
+    DELETE_ACCOUNT = 2
+    ENQUEUE = 3
+    ACK = 4
+    REQUEUE = 5
+
+
+def encode_record(record_type, fields):
+    """Encodes one record with its length and checksum, so a torn write is detected on replay
+
+    Args:
+        record_type (RecordType): The type of the record
+        fields (Iterable[str]): The record's fields
+
+    Returns:
+        bytes: The encoded record
+    """
+    body = bytearray([record_type.value])
+    for field in fields:
+        field = field.encode('utf-8')
+        body += FIELD_LENGTH.pack(len(field))
+        body += field
+    return RECORD_HEADER.pack(len(body), zlib.crc32(body)) + body
+
+
+def decode_records(data):
+    """Decodes records until the end of data or the first incomplete or corrupt record
+
+    Args:
+        data (bytes): The contents of a log file
+
+    Yields:
+        Tuple[RecordType, List[str], int]: Each record's type and fields, and the offset just past it
+    """
+    position = 0
+    while position + RECORD_HEADER.size <= len(data):
+        length, checksum = RECORD_HEADER.unpack_from(data, position)
+        start = position + RECORD_HEADER.size
+        body = data[start:start + length]
+        if len(body) < length or not length or zlib.crc32(body) != checksum:
+            return
+        fields = []
+        field_position = 1
+        while field_position < length:
+            (field_length,) = FIELD_LENGTH.unpack_from(body, field_position)
+            field_position += FIELD_LENGTH.size
+            fields.append(str(body[field_position:field_position + field_length], 'utf-8'))
+            field_position += field_length
+        position = start + length
+        yield RecordType(body[0]), fields, position
+
+
+def apply_record(record_type, fields, account_list, undelivered_msg):
+    """Replays one record onto a server's account store and mailboxes
+
+    Args:
+        record_type (RecordType): The type of the record
+        fields (List[str]): The record's fields
+        account_list (AccountStore): The server's accounts
+        undelivered_msg (MailboxStore): The server's mailboxes
+    """
+    match record_type:
+        case RecordType.CREATE_ACCOUNT:
+            account_list.add(fields[0])
+        case RecordType.DELETE_ACCOUNT:
+            account_list.discard(fields[0])
+        case RecordType.ENQUEUE:
+            undelivered_msg.mailbox(fields[0]).append((fields[1], fields[2]))
+        case RecordType.ACK:
+            mailbox = undelivered_msg.mailbox(fields[0])
+            for _ in range(min(int(fields[1]), len(mailbox))):
+                mailbox.popleft()
+        case RecordType.REQUEUE:
+            undelivered_msg.mailbox(fields[0]).requeue(
+                list(zip(fields[1::2], fields[2::2])))
+
+
+class MessageLog:
+    """Append-only write-ahead log of account and mailbox changes, with group commit.
+
+    append only encodes the record into an in-memory batch and returns its sequence
+    number, so it is cheap enough to call while holding the lock of the state it describes,
+    which keeps the log in the same order as the changes. A background thread writes the
+    whole batch and fsyncs it once; callers that need the change to survive a crash wait
+    for their sequence number after releasing their locks. Every request that arrives
+    during an fsync shares the next one, so a busy server pays one fsync per batch rather
+    than one per message.
+
+    The log lives in a directory as numbered segments of about segment_size bytes. Once
+    snapshot_segments segments have been sealed, a background thread compacts them: it
+    loads the newest snapshot into private state, replays the sealed segments onto it and
+    writes a new snapshot, then deletes what the snapshot covers. Only closed files are
+    read, so this never touches the server's state or locks. Startup then loads the
+    snapshot and replays just the segments after it.
+
+    Opening a log drops any torn record at its end left by a crash; recover then replays
+    the rest onto the server's state.
+
+    Replicas read the log through follow: every batch is shipped to them once it is on
+    disk, and with sync_replicas set, wait also holds a request until that many replicas
+    have applied its record.
+    """
+
+    def __init__(self, directory, commit_delay=0.0, segment_size=DEFAULT_SEGMENT_SIZE,
+                 snapshot_segments=DEFAULT_SNAPSHOT_SEGMENTS, sync_replicas=0):
+        """
+        Args:
+            directory (str): The log directory, created if it doesn't exist
+            commit_delay (float, optional): Seconds the flusher waits for more records before each
+                fsync, trading latency for larger batches. Defaults to 0.0.
+            segment_size (int, optional): Bytes after which the log moves on to a new segment.
+            snapshot_segments (int, optional): Sealed segments that trigger a new snapshot.
+            sync_replicas (int, optional): Followers that must have applied a record before wait
+                returns, or all of them if fewer are caught up. Defaults to 0.
+        """
+        self.directory = directory
+        self.commit_delay = commit_delay
+        self.segment_size = segment_size
+        self.snapshot_segments = snapshot_segments
+        self.sync_replicas = sync_replicas
+        os.makedirs(directory, exist_ok=True)
+
+        segments = self._segments()
+        self.segment = segments[-1] if segments else self._snapshot_segment() + 1
+        path = self._segment_path(self.segment)
+        if os.path.exists(path):
+            with open(path, 'rb') as log_file:
+                data = log_file.read()
+            valid_length = 0
+            for _, _, valid_length in decode_records(data):
+                pass
+            if valid_length < len(data):
+                print(f"Dropping {len(data) - valid_length} bytes of incomplete records from {path}")
+                os.truncate(path, valid_length)
+        self.file = open(path, 'ab')
+
+        self.lock = threading.Lock()
+        self.has_pending = threading.Condition(self.lock)
+        self.flushed = threading.Condition(self.lock)
+        self.pending = []  # Encoded records not written yet
+        self.appended = 0  # Sequence number of the last appended record
+        self.durable = 0  # Sequence number of the last record known to be on disk
+        self.error = None
+        self.closed = False
+        self.compactor = None  # Thread writing a snapshot, if one is running
+        # Held while a batch is written and shipped, and while files are listed or deleted,
+        # so a new follower sees each batch either in the files or from its queue
+        self.ship_lock = threading.Lock()
+        self.shipped = 0  # Sequence number of the last record written and shipped
+        self.followers = []  # Followers being shipped batches, guarded by lock
+        self.flusher = threading.Thread(target=self._flush_loop, daemon=True)
+        self.flusher.start()
+
+    @classmethod
+    def from_state(cls, directory, account_list, undelivered_msg, **options):
+        """Starts a log in an empty directory with a snapshot of existing state, e.g. when a
+        replica that kept its state in memory is promoted to primary
+
+        Args:
+            directory (str): The log directory, created if it doesn't exist
+            account_list (AccountStore): The accounts, which nothing may change meanwhile
+            undelivered_msg (MailboxStore): The mailboxes, which nothing may change meanwhile
+            **options: See MessageLog
+
+        Raises:
+            ValueError: The directory isn't empty
+
+        Returns:
+            MessageLog: The log, continuing after the snapshot
+        """
+        os.makedirs(directory, exist_ok=True)
+        if os.listdir(directory):
+            raise ValueError(f'{directory} is not empty.')
+        write_snapshot(os.path.join(directory, f'{1:010d}{SNAPSHOT_SUFFIX}'), 1,
+                       account_list, undelivered_msg)
+        return cls(directory, **options)
+
+    def _segment_path(self, segment):
+        return os.path.join(self.directory, f'{segment:010d}{SEGMENT_SUFFIX}')
+
+    def _snapshot_path(self, segment):
+        return os.path.join(self.directory, f'{segment:010d}{SNAPSHOT_SUFFIX}')
+
+    def _numbered(self, suffix):
+        return sorted(int(name[:-len(suffix)]) for name in os.listdir(self.directory)
+                      if name.endswith(suffix) and name[:-len(suffix)].isdigit())
+
+    def _segments(self):
+        """Numbers of the log segments on disk, in order"""
+        return self._numbered(SEGMENT_SUFFIX)
+
+    def _snapshot_segment(self):
+        """The last segment the newest snapshot covers, or 0 without a snapshot"""
+        snapshots = self._numbered(SNAPSHOT_SUFFIX)
+        return snapshots[-1] if snapshots else 0
+
+    def recover(self, account_list, undelivered_msg):
+        """Loads the newest snapshot and replays the segments after it onto empty server state
+
+        Args:
+            account_list (AccountStore): The server's accounts
+            undelivered_msg (MailboxStore): The server's mailboxes
+        """
+        last_segment = self._load(account_list, undelivered_msg, self.segment)
+        print(f"Recovered from {self.directory} up to segment {last_segment}")
+
+    def _load(self, account_list, undelivered_msg, through_segment):
+        """Loads the newest snapshot and replays segments up to through_segment after it
+
+        Returns:
+            int: The last segment replayed, or the snapshot's if there were none
+        """
+        last_segment = self._snapshot_segment()
+        if last_segment:
+            load_snapshot(self._snapshot_path(last_segment), account_list, undelivered_msg)
+        for segment in self._segments():
+            if last_segment < segment <= through_segment:
+                with open(self._segment_path(segment), 'rb') as log_file:
+                    data = log_file.read()
+                for record_type, fields, _ in decode_records(data):
+                    apply_record(record_type, fields, account_list, undelivered_msg)
+                last_segment = segment
+        return last_segment
+
+    def append(self, record_type, *fields):
+        """Adds a record to the next batch
+
+        Args:
+            record_type (RecordType): The type of the record
+            *fields (str): The record's fields
+
+        Returns:
+            int: The record's sequence number, to pass to wait
+        """
+        record = encode_record(record_type, fields)
+        with self.lock:
+            if self.closed:
+                raise ValueError('Message log is closed.')
+            self.pending.append(record)
+            self.appended += 1
+            self.has_pending.notify()
+            return self.appended
+
+    def wait(self, sequence_number):
+        """Blocks until the record with sequence_number and everything before it is on disk
+
+        Args:
+            sequence_number (int): Returned by append
+
+        Raises:
+            OSError: Writing the log failed
+        """
+        with self.lock:
+            while (self.durable < sequence_number or not self._replicated(sequence_number)) \
+                    and self.error is None:
+                self.flushed.wait()
+            if self.durable < sequence_number:
+                raise self.error
+
+    def _replicated(self, sequence_number):
+        """Whether enough followers have applied a record for wait. Followers still being sent
+        the state from before they connected don't count. Called holding lock."""
+        if not self.sync_replicas:
+            return True
+        caught_up = [follower for follower in self.followers if follower.caught_up]
+        applied = sum(1 for follower in caught_up if follower.acked >= sequence_number)
+        return applied >= min(self.sync_replicas, len(caught_up))
+
+    def follow(self, max_backlog=DEFAULT_MAX_BACKLOG):
+        """Starts shipping the log to a replica. The files on disk are opened right away,
+        so compaction can go on while the follower reads them.
+
+        Args:
+            max_backlog (int, optional): Bytes the follower may fall behind by before it is dropped.
+                Defaults to DEFAULT_MAX_BACKLOG.
+
+        Returns:
+            Follower: The follower, whose batches() is sent to the replica
+        """
+        with self.ship_lock:
+            snapshot_segment = self._snapshot_segment()
+            snapshot_file = open(self._snapshot_path(snapshot_segment), 'rb') if snapshot_segment else None
+            segment_files = [open(self._segment_path(segment), 'rb')
+                             for segment in self._segments() if snapshot_segment < segment <= self.segment]
+            follower = Follower(self, snapshot_file, segment_files, self.file.tell(),
+                                self.shipped, max_backlog)
+            with self.lock:
+                self.followers.append(follower)
+        return follower
+
+    def _drop_follower(self, follower):
+        with self.lock:
+            if follower in self.followers:
+                self.followers.remove(follower)
+                # Requests waiting for it to apply their records may not have to any more
+                self.flushed.notify_all()
+
+    def close(self):
+        """Writes out the records still pending, waits for any snapshot being written and closes the file"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.has_pending.notify()
+        self.flusher.join()
+        if self.compactor is not None:
+            self.compactor.join()
+        self.file.close()
+        for follower in list(self.followers):
+            follower.close()
+
+    def _flush_loop(self):
+        while True:
+            with self.lock:
+                while not self.pending and not self.closed:
+                    self.has_pending.wait()
+                if not self.pending:
+                    return
+                delay = 0 if self.closed else self.commit_delay
+            if delay:
+                time.sleep(delay)
+            with self.lock:
+                batch = self.pending
+                self.pending = []
+                sequence_number = self.appended
+            try:
+                data = b''.join(batch)
+                with self.ship_lock:
+                    self.file.write(data)
+                    self.file.flush()
+                    os.fsync(self.file.fileno())
+                    self._ship(sequence_number, data)
+                    if self.file.tell() >= self.segment_size:
+                        self._next_segment()
+            except OSError as e:
+                with self.lock:
+                    self.error = e
+                    self.flushed.notify_all()
+                return
+            with self.lock:
+                self.durable = sequence_number
+                self.flushed.notify_all()
+
+    def _ship(self, sequence_number, data):
+        """Queues a batch that is on disk for every follower, dropping those too far behind.
+        Only the flusher calls this, holding ship_lock."""
+        self.shipped = sequence_number
+        with self.lock:
+            for follower in list(self.followers):
+                if not follower.push(sequence_number, data):
+                    print("Dropping a replica that fell too far behind")
+                    self.followers.remove(follower)
+                    self.flushed.notify_all()
+
+    def _next_segment(self):
+        """Seals the current segment and starts the next one. Only the flusher calls this."""
+        self.file.close()
+        self.segment += 1
+        self.file = open(self._segment_path(self.segment), 'ab')
+        sealed = self.segment - 1 - self._snapshot_segment()
+        if sealed >= self.snapshot_segments and (self.compactor is None or not self.compactor.is_alive()):
+            self.compactor = threading.Thread(
+                target=self.compact, args=(self.segment - 1,), daemon=True)
+            self.compactor.start()
+
+    def compact(self, through_segment):
+        """Writes a snapshot covering every segment up to through_segment, which must be
+        sealed, then deletes the older snapshots and the segments it covers
+
+        Args:
+            through_segment (int): The last segment to include
+        """
+        start = time.perf_counter()
+        account_list, undelivered_msg = AccountStore(), MailboxStore()
+        previous_snapshot = self._snapshot_segment()
+        if self._load(account_list, undelivered_msg, through_segment) <= previous_snapshot:
+            return
+        write_snapshot(self._snapshot_path(through_segment), through_segment,
+                       account_list, undelivered_msg)
+        with self.ship_lock:
+            for segment in self._segments():
+                if segment <= through_segment:
+                    os.remove(self._segment_path(segment))
+            for snapshot in self._numbered(SNAPSHOT_SUFFIX):
+                if snapshot < through_segment:
+                    os.remove(self._snapshot_path(snapshot))
+        print(f"Wrote snapshot through segment {through_segment} in {time.perf_counter() - start:.2f}s")
+
+
+class Follower:
+    """A replica reading a MessageLog.
+
+    It is first sent the state in the log when it started following, replayed from the
+    files on disk into private state, like compaction does, and encoded as CREATE_ACCOUNT
+    and ENQUEUE records. Then it is sent every batch written after that, in order, as
+    soon as it is on disk. A follower that falls more than max_backlog bytes behind is
+    dropped, and its replica has to follow again from the start.
+    """
+
+    def __init__(self, log, snapshot_file, segment_files, length, through_sequence, max_backlog):
+        """
+        Args:
+            log (MessageLog): The log followed
+            snapshot_file (BinaryIO): The newest snapshot, or None without one
+            segment_files (List[BinaryIO]): The segments after it, oldest first
+            length (int): Bytes of the last segment that were written when following started
+            through_sequence (int): Sequence number of the last record in the files
+            max_backlog (int): Bytes of queued batches after which the follower is dropped
+        """
+        self.log = log
+        self.snapshot_file = snapshot_file
+        self.segment_files = segment_files
+        self.length = length
+        self.through_sequence = through_sequence
+        self.max_backlog = max_backlog
+        self.lock = threading.Lock()
+        self.has_batches = threading.Condition(self.lock)
+        self.queue = deque()  # (sequence number, records) written after following started
+        self.backlog = 0  # Bytes in queue
+        self.closed = False
+        # Last sequence number the replica applied, and whether it has the files' state yet.
+        # Both are guarded by the log's lock, as wait reads them.
+        self.acked = 0
+        self.caught_up = through_sequence == 0
+
+    def push(self, sequence_number, data):
+        """Queues a batch. Returns False, dropping the follower, once it is too far behind."""
+        with self.lock:
+            if self.closed:
+                return False
+            if self.backlog + len(data) > self.max_backlog:
+                self.closed = True
+                self.queue.clear()
+                self.has_batches.notify()
+                return False
+            self.queue.append((sequence_number, data))
+            self.backlog += len(data)
+            self.has_batches.notify()
+            return True
+
+    def ack(self, sequence_number):
+        """Records that the replica has applied everything up to sequence_number"""
+        with self.log.lock:
+            self.acked = max(self.acked, sequence_number)
+            if self.acked >= self.through_sequence:
+                self.caught_up = True
+            self.log.flushed.notify_all()
+
+    def close(self):
+        with self.lock:
+            self.closed = True
+            self.queue.clear()
+            self.has_batches.notify()
+        self.log._drop_follower(self)
+        for log_file in [self.snapshot_file] + self.segment_files:
+            if log_file is not None:
+                log_file.close()
+
+    def batches(self):
+        """Yields what is sent to the replica, until the follower is closed or dropped
+
+        Yields:
+            Tuple[int, bytes, bool]: The sequence number of a batch's last record, or 0 while
+                sending the state from before following started; its encoded records; and
+                whether it is the last batch of that state. Empty batches with sequence number 0
+                are heartbeats.
+        """
+        yield from self._bootstrap()
+        while True:
+            with self.lock:
+                if not self.queue and not self.closed:
+                    self.has_batches.wait(HEARTBEAT_INTERVAL)
+                if self.closed:
+                    return
+                if not self.queue:
+                    batch = (0, b'')
+                else:
+                    batch = self.queue.popleft()
+                    self.backlog -= len(batch[1])
+            yield batch + (False,)
+
+    def _bootstrap(self):
+        account_list, undelivered_msg = AccountStore(), MailboxStore()
+        if self.snapshot_file is not None:
+            read_snapshot(self.snapshot_file, account_list, undelivered_msg)
+        for i, segment_file in enumerate(self.segment_files):
+            data = segment_file.read(self.length) if i == len(self.segment_files) - 1 else segment_file.read()
+            for record_type, fields, _ in decode_records(data):
+                apply_record(record_type, fields, account_list, undelivered_msg)
+
+        def records():
+            for username in account_list:
+                yield encode_record(RecordType.CREATE_ACCOUNT, [username])
+            for username in list(undelivered_msg):
+                for sender, message in undelivered_msg[username]:
+                    yield encode_record(RecordType.ENQUEUE, [username, sender, message])
+        batch = bytearray()
+        for record in records():
+            batch += record
+            if len(batch) >= BOOTSTRAP_BATCH_SIZE:
+                yield 0, bytes(batch), False
+                batch = bytearray()
+        yield self.through_sequence, bytes(batch), True
@@ -0,0 +1,199 @@
+import queue
+import threading
+import time
+from concurrent import futures
+
+import grpc
+import replication_pb2_grpc
+from message_log import apply_record, decode_records
+from replication_pb2 import FollowAck, PromoteRequest, PromoteResponse, RecordBatch
+
+# Threads answering Follow and Promote calls; every replica following holds one
+REQUEST_WORKERS = 8
+# Seconds between attempts to reach the primary, and between failover checks
+RETRY_DELAY = 0.5
+
+
+class ReplicationNode(replication_pb2_grpc.ReplicationServiceServicer):
+    """Primary/replica replication of a chat server's accounts and mailboxes.
+
+    A primary ships its message log: every replica following it is first sent the
+    state in the log, then every batch of records once it is on disk (see
+    MessageLog.follow), and acknowledges each batch it has applied, which the primary's
+    message log can wait for. A replica applies the records to its own state, held in
+    memory, and serves account lists from it, but not writes. It is promoted when asked
+    over Promote, or once the primary has been unreachable for failover_timeout seconds
+    after sending its whole state, never with only part of it: it stops following,
+    writes its state into a new message log if it has open_log, and starts accepting
+    writes. Only one replica should fail over on its own, or they all become primaries.
+
+    The chat server (the backend) must have account_list, undelivered_msg and
+    message_log attributes.
+    """
+
+    def __init__(self, backend, address, primary=None, failover_timeout=None, open_log=None):
+        """
+        Args:
+            backend: The chat server whose state is replicated
+            address (str): host:port to answer Follow and Promote on
+            primary (str, optional): Replication address of the primary to follow. Defaults to
+                None, which makes this node the primary.
+            failover_timeout (float, optional): Seconds without hearing from the primary after
+                which this replica promotes itself. Defaults to None, which only promotes on request.
+            open_log (Callable, optional): Called on promotion with the account_list and
+                undelivered_msg, returns the MessageLog to continue with. Defaults to None,
+                which keeps the promoted state in memory only.
+        """
+        self.backend = backend
+        self.address = address
+        self.primary = primary  # Set while following, None once primary
+        self.failover_timeout = failover_timeout
+        self.open_log = open_log
+        # Held while applying a batch and while promoting, so no batch is applied after promotion
+        self.lock = threading.Lock()
+        self.stream = None  # The Follow call being read, while following
+        # When the last batch arrived since the primary's whole state did, for failover
+        self.last_contact = None
+        self.caught_up = threading.Event()  # Set once the primary's state has been received
+        self.server = None
+
+    def is_replica(self):
+        return self.primary is not None
+
+    def start(self):
+        """Starts answering Follow and Promote, and following the primary if there is one"""
+        self.server = grpc.server(futures.ThreadPoolExecutor(max_workers=REQUEST_WORKERS))
+        replication_pb2_grpc.add_ReplicationServiceServicer_to_server(self, self.server)
+        self.server.add_insecure_port(self.address)
+        self.server.start()
+        print(f"Replication listening on {self.address}")
+        if self.primary is not None:
+            threading.Thread(target=self._follow_loop, daemon=True).start()
+            if self.failover_timeout is not None:
+                threading.Thread(target=self._failover_loop, daemon=True).start()
+
+    def stop(self):
+        self.lock.acquire()
+        stream = self.stream
+        self.primary = None
+        self.lock.release()
+        if stream is not None:
+            stream.cancel()
+        if self.server is not None:
+            self.server.stop(None)
+
+    def promote(self):
+        """Stops following the primary and starts accepting writes
+
+        Returns:
+            bool: False if this node already was the primary
+        """
+        self.lock.acquire()
+        try:
+            if self.primary is None:
+                return False
+            stream = self.stream
+            if self.open_log is not None:
+                self.backend.message_log = self.open_log(self.backend.account_list, self.backend.undelivered_msg)
+            # Writes are only accepted from here on, once the state is in the new log and
+            # while nothing changes it, so the log holds every one of them
+            self.primary = None
+        finally:
+            self.lock.release()
+        if stream is not None:
+            stream.cancel()
+        print("Promoted to primary")
+        return True
+
+    def _follow_loop(self):
+        """Follows the primary, starting over from a copy of its state after every disconnect"""
+        while self.primary is not None:
+            acks = queue.Queue()
+            channel = None
+            first = True
+            try:
+                self.lock.acquire()
+                if self.primary is None:
+                    self.lock.release()
+                    return
+                channel = grpc.insecure_channel(self.primary)
+                stub = replication_pb2_grpc.ReplicationServiceStub(channel)
+                self.stream = stub.Follow(iter(acks.get, None))
+                self.lock.release()
+                for batch in self.stream:
+                    self.lock.acquire()
+                    if self.primary is None:
+                        self.lock.release()
+                        return
+                    if first:
+                        self._reset()
+                        first = False
+                    self._apply(batch.records)
+                    self.lock.release()
+                    if batch.caught_up or self.caught_up.is_set():
+                        # Set before caught_up, so failover never sees a stale time
+                        self.last_contact = time.monotonic()
+                    if batch.caught_up:
+                        print("Caught up with the primary")
+                        self.caught_up.set()
+                    if batch.sequence_number or batch.caught_up:
+                        acks.put(FollowAck(sequence_number=batch.sequence_number))
+            except grpc.RpcError as e:
+                # Only once per stream, not on every failed attempt to reconnect
+                if self.primary is not None and not first:
+                    print(f"Lost the primary: {e.code()}")
+            finally:
+                acks.put(None)
+                if channel is not None:
+                    channel.close()
+            time.sleep(RETRY_DELAY)
+
+    def _failover_loop(self):
+        """Promotes this replica once the primary has been silent for failover_timeout seconds
+        since the last batch received with its whole state. A replica that never got the whole
+        state, or lost the primary halfway through getting it again, keeps waiting."""
+        while self.primary is not None:
+            time.sleep(RETRY_DELAY)
+            if self.primary is not None and self.caught_up.is_set() and \
+                    time.monotonic() - self.last_contact > self.failover_timeout:
+                print(f"No word from the primary for {self.failover_timeout}s, failing over")
+                self.promote()
+
+    def _reset(self):
+        """Drops the replicated state before following the primary again from the start"""
+        for username in list(self.backend.account_list):
+            self.backend.account_list.discard(username)
+        for username in list(self.backend.undelivered_msg):
+            del self.backend.undelivered_msg[username]
+        self.caught_up.clear()
+
+    def _apply(self, records):
+        # Nothing else writes to a replica's state, so no locks are needed
+        for record_type, fields, _ in decode_records(records):
+            apply_record(record_type, fields, self.backend.account_list, self.backend.undelivered_msg)
+
+    # ReplicationService
+
+    def Follow(self, request_iterator, context):
+        message_log = self.backend.message_log
+        if self.is_replica() or message_log is None:
+            context.abort(grpc.StatusCode.FAILED_PRECONDITION,
+                          'Only a primary with a message log can be followed.')
+        follower = message_log.follow()
+        context.add_callback(follower.close)
+        print("Replica following")
+
+        def read_acks():
+            try:
+                for ack in request_iterator:
+                    follower.ack(ack.sequence_number)
+            except grpc.RpcError:
+                pass
+        threading.Thread(target=read_acks, daemon=True).start()
+        for sequence_number, records, caught_up in follower.batches():
+            yield RecordBatch(sequence_number=sequence_number, records=records, caught_up=caught_up)
+
+    def Promote(self, request: PromoteRequest, context):
+        if self.promote():
+            return PromoteResponse(status='Success')
+        return PromoteResponse(status='Error: Already the primary.')
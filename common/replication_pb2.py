@@ -0,0 +1,33 @@
+# -*- coding: utf-8 -*-
+# Generated by the protocol buffer compiler.  DO NOT EDIT!
+# source: replication.proto
+"""Generated protocol buffer code."""
+from google.protobuf.internal import builder as _builder
+from google.protobuf import descriptor as _descriptor
+from google.protobuf import descriptor_pool as _descriptor_pool
+from google.protobuf import symbol_database as _symbol_database
+# @@protoc_insertion_point(imports)
+
+_sym_db = _symbol_database.Default()
+
+
+
+
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\x11replication.proto\x12\x0breplication\"$\n\tFollowAck\x12\x17\n\x0fsequence_number\x18\x01 \x01(\x03\"J\n\x0bRecordBatch\x12\x17\n\x0fsequence_number\x18\x01 \x01(\x03\x12\x0f\n\x07records\x18\x02 \x01(\x0c\x12\x11\n\tcaught_up\x18\x03 \x01(\x08\"\x10\n\x0ePromoteRequest\"!\n\x0fPromoteResponse\x12\x0e\n\x06status\x18\x01 \x01(\t2\x9e\x01\n\x12ReplicationService\x12@\n\x06\x46ollow\x12\x16.replication.FollowAck\x1a\x18.replication.RecordBatch\"\x00(\x01\x30\x01\x12\x46\n\x07Promote\x12\x1b.replication.PromoteRequest\x1a\x1c.replication.PromoteResponse\"\x00\x62\x06proto3')
+
+_builder.BuildMessageAndEnumDescriptors(DESCRIPTOR, globals())
+_builder.BuildTopDescriptorsAndMessages(DESCRIPTOR, 'replication_pb2', globals())
+if _descriptor._USE_C_DESCRIPTORS == False:
+
+  DESCRIPTOR._options = None
+  _FOLLOWACK._serialized_start=34
+  _FOLLOWACK._serialized_end=70
+  _RECORDBATCH._serialized_start=72
+  _RECORDBATCH._serialized_end=146
+  _PROMOTEREQUEST._serialized_start=148
+  _PROMOTEREQUEST._serialized_end=164
+  _PROMOTERESPONSE._serialized_start=166
+  _PROMOTERESPONSE._serialized_end=199
+  _REPLICATIONSERVICE._serialized_start=202
+  _REPLICATIONSERVICE._serialized_end=360
+# @@protoc_insertion_point(module_scope)
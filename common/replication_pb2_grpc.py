@@ -0,0 +1,105 @@
+# Generated by the gRPC Python protocol compiler plugin. DO NOT EDIT!
+"""Client and server classes corresponding to protobuf-defined services."""
+import grpc
+
+import replication_pb2 as replication__pb2
+
+
+class ReplicationServiceStub(object):
+    """Ships a primary chat server's message log to its replicas
+    """
+
+    def __init__(self, channel):
+        """Constructor.
+
+        Args:
+            channel: A grpc.Channel.
+        """
+        self.Follow = channel.stream_stream(
+                '/replication.ReplicationService/Follow',
+                request_serializer=replication__pb2.FollowAck.SerializeToString,
+                response_deserializer=replication__pb2.RecordBatch.FromString,
+                )
+        self.Promote = channel.unary_unary(
+                '/replication.ReplicationService/Promote',
+                request_serializer=replication__pb2.PromoteRequest.SerializeToString,
+                response_deserializer=replication__pb2.PromoteResponse.FromString,
+                )
+
+
+class ReplicationServiceServicer(object):
+    """Ships a primary chat server's message log to its replicas
+    """
+
+    def Follow(self, request_iterator, context):
+        """Streams the primary's state, then every batch of its log once it is on disk. The
+        replica acknowledges the batches it has applied.
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+    def Promote(self, request, context):
+        """Makes a replica stop following and start accepting writes as the primary
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
+
+def add_ReplicationServiceServicer_to_server(servicer, server):
+    rpc_method_handlers = {
+            'Follow': grpc.stream_stream_rpc_method_handler(
+                    servicer.Follow,
+                    request_deserializer=replication__pb2.FollowAck.FromString,
+                    response_serializer=replication__pb2.RecordBatch.SerializeToString,
+            ),
+            'Promote': grpc.unary_unary_rpc_method_handler(
+                    servicer.Promote,
+                    request_deserializer=replication__pb2.PromoteRequest.FromString,
+                    response_serializer=replication__pb2.PromoteResponse.SerializeToString,
+            ),
+    }
+    generic_handler = grpc.method_handlers_generic_handler(
+            'replication.ReplicationService', rpc_method_handlers)
+    server.add_generic_rpc_handlers((generic_handler,))
+
+
+ # This class is part of an EXPERIMENTAL API.
+class ReplicationService(object):
+    """Ships a primary chat server's message log to its replicas
+    """
+
+    @staticmethod
+    def Follow(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/replication.ReplicationService/Follow',
+            replication__pb2.FollowAck.SerializeToString,
+            replication__pb2.RecordBatch.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Promote(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/replication.ReplicationService/Promote',
+            replication__pb2.PromoteRequest.SerializeToString,
+            replication__pb2.PromoteResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
@@ -0,0 +1,74 @@
+from collections.abc import MutableMapping
+
+
+class SessionRegistry(MutableMapping):
+    """Map of username to the connection it is logged in from, which also keeps the
+    reverse connection to username index so both directions are O(1) lookups.
+
+    The registry does no locking itself. Callers changing a username's session hold that
+    username's user lock, so the check and update are atomic per user. Lookups need no
+    lock, since each is a single dict operation, and sessions of different users never
+    touch the same keys.
+    A connection is anything hashable identifying a client, e.g. a (socket, lock)
+    pair for the wire protocol server or a peer string for the gRPC server.
+    """
+
+    def __init__(self):
+        self.connections = {}  # Map of username to connection
+        self.usernames = {}  # Map of connection to username
+
+    def __getitem__(self, username):
+        return self.connections[username]
+
+    def __setitem__(self, username, connection):
+        # A user is logged in from one connection, and a connection is logged into one account
+        if username in self.connections:
+            del self.usernames[self.connections[username]]
+        previous_username = self.usernames.get(connection)
+        if previous_username is not None and previous_username != username:
+            del self.connections[previous_username]
+        self.connections[username] = connection
+        self.usernames[connection] = username
+
+    def __delitem__(self, username):
+        connection = self.connections.pop(username)
+        del self.usernames[connection]
+
+    def __iter__(self):
+        return iter(self.connections)
+
+    def __len__(self):
+        return len(self.connections)
+
+    def has_connection(self, connection):
+        """Checks if the connection is logged into any account
+
+        Args:
+            connection (Hashable): The client connection
+        """
+        return connection in self.usernames
+
+    def username_for(self, connection):
+        """Gets the username the connection is logged into
+
+        Args:
+            connection (Hashable): The client connection
+
+        Returns:
+            str: The username, or None if the connection isn't logged in
+        """
+        return self.usernames.get(connection)
+
+    def pop_connection(self, connection):
+        """Logs out whichever account the connection is logged into
+
+        Args:
+            connection (Hashable): The client connection
+
+        Returns:
+            str: The username that was logged out, or None if the connection wasn't logged in
+        """
+        username = self.usernames.pop(connection, None)
+        if username is not None:
+            del self.connections[username]
+        return username
@@ -0,0 +1,124 @@
+import mmap
+import os
+import struct
+import sys
+from array import array
+from itertools import accumulate
+
+# Identifies a snapshot file and the version of its layout
+MAGIC = b'CHATSNP1'
+# Header after the magic: last log segment the snapshot covers, number of mailboxes
+HEADER = struct.Struct('<QQ')
+# Header of a block of strings: how many there are, and the byte length of their UTF-8 text
+BLOCK = struct.Struct('<QQ')
+
+
+def _write_block(snapshot_file, strings):
+    """Writes a block of strings: BLOCK, the length of each string in characters as
+    little-endian uint32s, then all of them concatenated as one UTF-8 text. Loading decodes
+    the text once and slices it, rather than decoding every string separately.
+    """
+    lengths = array('I', map(len, strings))
+    if sys.byteorder == 'big':
+        lengths.byteswap()
+    text = ''.join(strings).encode('utf-8')
+    snapshot_file.write(BLOCK.pack(len(lengths), len(text)))
+    snapshot_file.write(lengths.tobytes())
+    snapshot_file.write(text)
+
+
+def write_snapshot(path, last_segment, account_list, undelivered_msg):
+    """Writes the accounts and every non-empty mailbox to a compact binary snapshot.
+    The file is written under a temporary name and renamed once it is on disk, so a
+    crash never leaves a partial snapshot behind.
+
+    Layout: MAGIC, HEADER, a block of every account, then for each mailbox a block of its
+    username followed by the sender and message of each of its messages.
+
+    Args:
+        path (str): The snapshot file
+        last_segment (int): The last log segment whose records are included
+        account_list (AccountStore): The accounts, not shared with any other thread
+        undelivered_msg (MailboxStore): The mailboxes, not shared with any other thread
+    """
+    temporary_path = path + '.tmp'
+    usernames = list(undelivered_msg)
+    with open(temporary_path, 'wb') as snapshot_file:
+        snapshot_file.write(MAGIC)
+        snapshot_file.write(HEADER.pack(last_segment, len(usernames)))
+        _write_block(snapshot_file, list(account_list))
+        for username in usernames:
+            strings = [username]
+            for message_info in undelivered_msg[username]:
+                strings.extend(message_info)
+            _write_block(snapshot_file, strings)
+        snapshot_file.flush()
+        os.fsync(snapshot_file.fileno())
+    os.replace(temporary_path, path)
+    # Make the rename itself durable
+    directory = os.open(os.path.dirname(path) or '.', os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+def load_snapshot(path, account_list, undelivered_msg):
+    """Loads a snapshot into empty server state, reading it through a memory map so the
+    file is never copied into memory as a whole
+
+    Args:
+        path (str): The snapshot file
+        account_list (AccountStore): The server's accounts
+        undelivered_msg (MailboxStore): The server's mailboxes
+
+    Raises:
+        ValueError: The file isn't a snapshot
+
+    Returns:
+        int: The last log segment the snapshot covers
+    """
+    with open(path, 'rb') as snapshot_file:
+        return read_snapshot(snapshot_file, account_list, undelivered_msg)
+
+
+def read_snapshot(snapshot_file, account_list, undelivered_msg):
+    """Loads a snapshot from an open file, see load_snapshot. The file may already have
+    been deleted, e.g. by compaction while a replica is being sent the log.
+
+    Args:
+        snapshot_file (BinaryIO): The snapshot, opened for reading
+        account_list (AccountStore): The server's accounts
+        undelivered_msg (MailboxStore): The server's mailboxes
+
+    Raises:
+        ValueError: The file isn't a snapshot
+
+    Returns:
+        int: The last log segment the snapshot covers
+    """
+    with mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+        if data[:len(MAGIC)] != MAGIC:
+            raise ValueError(f'{snapshot_file.name} is not a snapshot.')
+        last_segment, num_mailboxes = HEADER.unpack_from(data, len(MAGIC))
+        position = len(MAGIC) + HEADER.size
+
+        def read_block():
+            nonlocal position
+            count, text_length = BLOCK.unpack_from(data, position)
+            position += BLOCK.size
+            lengths = array('I')
+            lengths.frombytes(data[position:position + count * lengths.itemsize])
+            if sys.byteorder == 'big':
+                lengths.byteswap()
+            position += count * lengths.itemsize
+            text = str(data[position:position + text_length], 'utf-8')
+            position += text_length
+            offsets = list(accumulate(lengths, initial=0))
+            return [text[start:end] for start, end in zip(offsets, offsets[1:])]
+
+        account_list.add_all(read_block())
+        for _ in range(num_mailboxes):
+            strings = read_block()
+            undelivered_msg.mailbox(strings[0]).extend(zip(strings[1::2], strings[2::2]))
+    return last_segment
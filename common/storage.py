@@ -0,0 +1,254 @@
+import sqlite3
+import threading
+import time
+
+from account_store import AccountStore
+from mailboxes import MailboxStore, Waiters
+
+# Writes after which the SQLite engine commits its open transaction
+DEFAULT_BATCH_SIZE = 1000
+# Seconds after which a transaction with fewer writes is committed anyway
+DEFAULT_COMMIT_DELAY = 0.01
+
+SCHEMA = [
+    'CREATE TABLE IF NOT EXISTS accounts (username TEXT PRIMARY KEY) WITHOUT ROWID',
+    # seq orders each recipient's messages; requeued messages get seqs below the oldest one
+    'CREATE TABLE IF NOT EXISTS messages (recipient TEXT, seq INTEGER, sender TEXT, message TEXT, '
+    'PRIMARY KEY (recipient, seq)) WITHOUT ROWID',
+]
+# Every statement is a constant, so the connection's statement cache prepares each one once
+SELECT_ACCOUNTS = 'SELECT username FROM accounts'
+INSERT_ACCOUNT = 'INSERT OR IGNORE INTO accounts (username) VALUES (?)'
+DELETE_ACCOUNT = 'DELETE FROM accounts WHERE username = ?'
+SELECT_MAILBOXES = 'SELECT recipient, MIN(seq), MAX(seq) FROM messages GROUP BY recipient'
+SELECT_MESSAGES = 'SELECT sender, message FROM messages WHERE recipient = ? ORDER BY seq'
+SELECT_MESSAGE = 'SELECT sender, message FROM messages WHERE recipient = ? AND seq = ?'
+INSERT_MESSAGE = 'INSERT INTO messages (recipient, seq, sender, message) VALUES (?, ?, ?, ?)'
+DELETE_MESSAGE = 'DELETE FROM messages WHERE recipient = ? AND seq = ?'
+DELETE_MESSAGES = 'DELETE FROM messages WHERE recipient = ?'
+
+
+class MemoryStorage:
+    """Storage engine that keeps accounts and mailboxes in memory. They are lost when the
+    server stops unless a MessageLog recovers them.
+
+    A storage engine provides the server's account_list, an AccountStore, and its
+    undelivered_msg, a MailboxStore, and is closed when the server shuts down.
+    """
+
+    def __init__(self):
+        self.account_list = AccountStore()
+        self.undelivered_msg = MailboxStore()
+
+    def close(self):
+        pass
+
+
+class SqliteStorage:
+    """Storage engine that keeps accounts and queued messages in an SQLite database, so they
+    survive restarts and mail for offline users lives on disk instead of in memory.
+
+    Accounts are still indexed in memory, since every request checks them, but a mailbox
+    only holds its lock, subscriber and the range of its messages' seqs. The database runs
+    in WAL mode, so readers never wait for a checkpoint. Writes go into an open transaction
+    that is committed every batch_size writes or commit_delay seconds, so a busy server
+    batches many inserts per commit; a crash loses at most the last commit_delay seconds.
+
+    One connection is shared by every thread and guarded by the storage lock, which is
+    only held for single statements and is always taken last.
+    """
+
+    def __init__(self, path, batch_size=DEFAULT_BATCH_SIZE, commit_delay=DEFAULT_COMMIT_DELAY):
+        """
+        Args:
+            path (str): The database file, created if it doesn't exist
+            batch_size (int, optional): Writes after which the open transaction is committed.
+            commit_delay (float, optional): Seconds after which a smaller transaction is committed.
+        """
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        for statement in SCHEMA:
+            self.connection.execute(statement)
+        self.batch_size = batch_size
+        self.commit_delay = commit_delay
+
+        self.lock = threading.Lock()
+        self.has_uncommitted = threading.Condition(self.lock)
+        self.uncommitted = 0  # Rows written in the open transaction
+        self.closed = False
+
+        self.account_list = SqliteAccountStore(self)
+        self.undelivered_msg = SqliteMailboxStore(self)
+        self.committer = threading.Thread(target=self._commit_loop, daemon=True)
+        self.committer.start()
+
+    def read(self, sql, parameters=()):
+        """Runs a query, seeing every write so far, committed or not
+
+        Args:
+            sql (str): One of the statements above
+            parameters (tuple, optional): The statement's parameters
+
+        Returns:
+            List[tuple]: The resulting rows
+        """
+        with self.lock:
+            return self.connection.execute(sql, parameters).fetchall()
+
+    def write(self, sql, rows):
+        """Runs a statement once per row in the open transaction
+
+        Args:
+            sql (str): One of the statements above
+            rows (List[tuple]): The parameters of each execution
+        """
+        with self.lock:
+            if self.closed:
+                raise ValueError('Storage is closed.')
+            if not self.connection.in_transaction:
+                self.connection.execute('BEGIN')
+            self.connection.executemany(sql, rows)
+            self.uncommitted += len(rows)
+            if self.uncommitted >= self.batch_size:
+                self._commit()
+            else:
+                self.has_uncommitted.notify()
+
+    def _commit(self):
+        self.connection.execute('COMMIT')
+        self.uncommitted = 0
+
+    def _commit_loop(self):
+        while True:
+            with self.lock:
+                while not self.uncommitted and not self.closed:
+                    self.has_uncommitted.wait()
+                if self.closed:
+                    return
+            time.sleep(self.commit_delay)
+            with self.lock:
+                if self.uncommitted:
+                    self._commit()
+
+    def close(self):
+        """Commits the open transaction and closes the database"""
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.has_uncommitted.notify()
+        self.committer.join()
+        if self.connection.in_transaction:
+            self._commit()
+        self.connection.close()
+
+
+class SqliteAccountStore(AccountStore):
+    """AccountStore that also writes every change through to the accounts table"""
+
+    def __init__(self, storage):
+        super().__init__(username for (username,) in storage.read(SELECT_ACCOUNTS))
+        self.storage = storage
+
+    def add(self, username):
+        if not super().add(username):
+            return False
+        self.storage.write(INSERT_ACCOUNT, [(username,)])
+        return True
+
+    def add_all(self, usernames):
+        usernames = list(usernames)
+        super().add_all(usernames)
+        self.storage.write(INSERT_ACCOUNT, [(username,) for username in usernames])
+
+    def remove(self, username):
+        super().remove(username)
+        self.storage.write(DELETE_ACCOUNT, [(username,)])
+
+
+class SqliteMailbox(Waiters):
+    """A Mailbox whose messages are rows of the messages table. It only remembers the
+    seqs of its oldest and next message, so its length needs no query. Like Mailbox it
+    does no locking itself; callers hold mailbox.lock.
+    """
+
+    def __init__(self, storage, username, head=0, tail=0):
+        super().__init__()
+        self.storage = storage
+        self.username = username
+        self.head = head  # seq of the oldest message
+        self.tail = tail  # seq the next appended message gets
+
+    def __len__(self):
+        return self.tail - self.head
+
+    def __iter__(self):
+        return iter(self.storage.read(SELECT_MESSAGES, (self.username,)))
+
+    def append(self, message_info):
+        self.extend([message_info])
+
+    def extend(self, messages):
+        rows = [(self.username, seq, sender, message)
+                for seq, (sender, message) in enumerate(messages, self.tail)]
+        self.storage.write(INSERT_MESSAGE, rows)
+        self.tail += len(rows)
+
+    def popleft(self):
+        if not self:
+            raise IndexError('pop from an empty mailbox')
+        (message_info,) = self.storage.read(SELECT_MESSAGE, (self.username, self.head))
+        self.storage.write(DELETE_MESSAGE, [(self.username, self.head)])
+        self.head += 1
+        return message_info
+
+    def pop_all(self):
+        """Takes every waiting message at once
+
+        Returns:
+            List[tuple]: The messages, oldest first
+        """
+        if not self:
+            return []
+        messages = list(self)
+        self.clear()
+        return messages
+
+    def requeue(self, messages):
+        """Puts messages that could not be delivered back in front of the mailbox
+
+        Args:
+            messages (List[tuple]): The messages, oldest first
+        """
+        head = self.head - len(messages)
+        self.storage.write(INSERT_MESSAGE, [(self.username, seq, sender, message)
+                                            for seq, (sender, message) in enumerate(messages, head)])
+        self.head = head
+
+    def clear(self):
+        if self:
+            self.storage.write(DELETE_MESSAGES, [(self.username,)])
+            self.head = self.tail
+
+
+class SqliteMailboxStore(MailboxStore):
+    """MailboxStore of SqliteMailboxes. Every recipient with mail in the database gets its
+    mailbox when the store opens, so iterating and indexing work as they do in memory.
+    """
+
+    def __init__(self, storage):
+        super().__init__()
+        self.storage = storage
+        for username, head, last in storage.read(SELECT_MAILBOXES):
+            self.mailboxes[username] = SqliteMailbox(storage, username, head, last + 1)
+
+    def new_mailbox(self, username):
+        return SqliteMailbox(self.storage, username)
+
+    def __delitem__(self, username):
+        mailbox = self.mailboxes.get(username)
+        super().__delitem__(username)
+        mailbox.lock.acquire()
+        mailbox.clear()
+        mailbox.lock.release()
@@ -0,0 +1,28 @@
+import threading
+
+# Number of locks per StripedLock; enough that unrelated users rarely share one
+DEFAULT_STRIPES = 64
+
+
+class StripedLock:
+    """A fixed set of locks, each guarding every key that hashes to it.
+
+    Operations on different keys almost always take different locks, so they run in
+    parallel, while everything that has to be atomic for one key (e.g. checking that an
+    account exists and logging into it) is serialized by that key's lock. The number of
+    locks stays fixed however many keys there are.
+    """
+
+    def __init__(self, stripes=DEFAULT_STRIPES):
+        self.locks = [threading.Lock() for _ in range(stripes)]
+
+    def __getitem__(self, key):
+        """Returns the lock guarding key
+
+        Args:
+            key (Hashable): The key, e.g. a username
+
+        Returns:
+            threading.Lock: The key's lock
+        """
+        return self.locks[hash(key) % len(self.locks)]
@@ -0,0 +1,74 @@
+import re
+import unittest
+from account_query import (compile_query, merge_pages, page_accounts, page_through, search_accounts,
+                           stream_accounts)
+from account_store import AccountStore
+
+ACCOUNTS = ["kevin", "Kevin2", "kevlar", "howie", "howard", "joseph", "jo"]
+
+
+class AccountQueryTest(unittest.TestCase):
+    def setUp(self):
+        self.snapshot = AccountStore(ACCOUNTS).snapshot()
+
+    def assertMatchesScan(self, query):
+        pattern = re.compile(query, flags=re.IGNORECASE)
+        expected = sorted([account for account in ACCOUNTS if pattern.match(account)],
+                          key=lambda account: (account.lower(), account))
+        self.assertEqual(search_accounts(self.snapshot, query), expected)
+
+    def test_literal_prefix(self):
+        self.assertEqual(search_accounts(self.snapshot, "kev"),
+                         ["kevin", "Kevin2", "kevlar"])
+        self.assertEqual(compile_query("kev").prefix, "kev")
+        self.assertTrue(compile_query("kev.*").prefix_only)
+
+    def test_agrees_with_full_scan(self):
+        for query in ["", ".*", "KEV", "kev.n", "how(ie|ard)", "jo|kev", "jos?", "jo{1}s",
+                      "ho+w", "[a-j]", "\\w+2$", "kevin$", "z"]:
+            self.assertMatchesScan(query)
+
+    def test_compiled_queries_are_cached(self):
+        self.assertIs(compile_query("how.*"), compile_query("how.*"))
+
+    def test_pages_follow_cursor(self):
+        accounts, cursor = page_accounts(self.snapshot, ".*", limit=3)
+        self.assertEqual(accounts, ["howard", "howie", "jo"])
+        self.assertEqual(cursor, "jo")
+        accounts, cursor = page_accounts(self.snapshot, ".*", limit=3, cursor=cursor)
+        self.assertEqual(accounts, ["joseph", "kevin", "Kevin2"])
+        accounts, cursor = page_accounts(self.snapshot, ".*", limit=3, cursor=cursor)
+        self.assertEqual((accounts, cursor), (["kevlar"], ''))
+
+    def test_cursor_with_prefix_and_regex(self):
+        self.assertEqual(page_accounts(self.snapshot, "kev", limit=1, cursor="kevin"),
+                         (["Kevin2"], "Kevin2"))
+        self.assertEqual(page_accounts(self.snapshot, "ho.*e", cursor="a"),
+                         (["howie"], ''))
+
+    def test_stream_pages(self):
+        self.assertEqual(list(stream_accounts(self.snapshot, "[hj]", page_size=2)),
+                         [(["howard", "howie"], "howie"), (["jo", "joseph"], '')])
+        self.assertEqual(list(stream_accounts(self.snapshot, "z")), [([], '')])
+
+    def test_merge_split_pages(self):
+        # Each half of the accounts searched separately, as cluster nodes or shards do
+        halves = [AccountStore(ACCOUNTS[::2]).snapshot(), AccountStore(ACCOUNTS[1::2]).snapshot()]
+
+        def search_page(query, limit=None, cursor=None):
+            return merge_pages([page_accounts(half, query, limit, cursor) for half in halves], limit)
+        self.assertEqual(search_page(".*"), (search_accounts(self.snapshot, ".*"), ''))
+        self.assertEqual(list(page_through(search_page, ".*", 3)),
+                         list(stream_accounts(self.snapshot, ".*", 3)))
+        with self.assertRaises(re.error):
+            page_through(search_page, "[", 3)
+
+    def test_malformed(self):
+        with self.assertRaises(re.error):
+            search_accounts(self.snapshot, "[")
+        with self.assertRaises(re.error):
+            stream_accounts(self.snapshot, "[")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import random
+import unittest
+import account_store
+from account_store import AccountStore, SortedIndex
+
+
+class AccountStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = AccountStore(["kevin", "howie", "Joseph"])
+
+    def test_membership(self):
+        self.assertTrue("kevin" in self.store)
+        self.assertFalse("Kevin" in self.store)
+        self.assertEqual(len(self.store), 3)
+
+    def test_add_existing(self):
+        self.assertFalse(self.store.add("kevin"))
+        self.assertTrue(self.store.add("Kevin"))
+        self.assertEqual(list(self.store), ["howie", "Joseph", "Kevin", "kevin"])
+
+    def test_ordered_iteration(self):
+        self.assertEqual(list(self.store), ["howie", "Joseph", "kevin"])
+
+    def test_remove(self):
+        self.store.remove("howie")
+        self.assertFalse("howie" in self.store)
+        self.assertEqual(list(self.store), ["Joseph", "kevin"])
+        with self.assertRaises(KeyError):
+            self.store.remove("howie")
+        self.store.discard("howie")
+
+    def test_partition(self):
+        self.assertEqual(self.store.partition(["kevin", "nobody", "Joseph", "kevin", "Kevin"]),
+                         (["kevin", "Joseph"], ["nobody", "Kevin"]))
+
+    def test_snapshot_is_copy_on_write(self):
+        # Listing accounts reads the copy-on-write index while the store keeps changing
+        store = AccountStore(f'user{i}' for i in range(10))
+        snapshot = store.snapshot()
+        store.add('kevin')
+        store.remove('user0')
+        self.assertEqual(len(snapshot), 10)
+        self.assertIsNot(store.snapshot(), snapshot)
+
+    def test_snapshot_unaffected_by_writes(self):
+        snapshot = self.store.snapshot()
+        self.store.add("aaron")
+        self.store.remove("kevin")
+        self.assertEqual([username for _, username in snapshot.iter_from()],
+                         ["howie", "Joseph", "kevin"])
+
+
+class SortedIndexTest(unittest.TestCase):
+    def test_matches_sorted_list_across_bucket_splits(self):
+        old_bucket_size = account_store.BUCKET_SIZE
+        account_store.BUCKET_SIZE = 8
+        try:
+            index = SortedIndex()
+            keys = random.Random(0).sample(range(10000), 500)
+            for key in keys:
+                index.add(key)
+            for key in keys[::3]:
+                index.remove(key)
+            expected = sorted(set(keys) - set(keys[::3]))
+            self.assertEqual(list(index.iter_from()), expected)
+            self.assertEqual(len(index), len(expected))
+            self.assertEqual(list(index.iter_from(5000)),
+                             [key for key in expected if key >= 5000])
+            self.assertEqual(list(index.iter_from(10 ** 6)), [])
+        finally:
+            account_store.BUCKET_SIZE = old_bucket_size
+
+
+if __name__ == '__main__':
+    unittest.main()
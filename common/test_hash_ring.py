@@ -0,0 +1,41 @@
+import unittest
+from collections import Counter
+from hash_ring import HashRing
+
+USERNAMES = [f'user{i}' for i in range(3000)]
+
+
+class HashRingTest(unittest.TestCase):
+    def test_spreads_usernames(self):
+        ring = HashRing(['a:1', 'b:1', 'c:1'])
+        owners = Counter(ring.owner(username) for username in USERNAMES)
+        self.assertEqual(set(owners), {'a:1', 'b:1', 'c:1'})
+        for count in owners.values():
+            self.assertGreater(count, len(USERNAMES) / 6)
+        # Every ring built from the same nodes agrees, whatever the order
+        other = HashRing(['c:1', 'a:1', 'b:1'])
+        self.assertTrue(all(ring.owner(username) == other.owner(username) for username in USERNAMES))
+
+    def test_membership_change_moves_few_users(self):
+        ring = HashRing(['a:1', 'b:1', 'c:1'])
+        before = {username: ring.owner(username) for username in USERNAMES}
+        ring.add('d:1')
+        after = {username: ring.owner(username) for username in USERNAMES}
+        moved = [username for username in USERNAMES if before[username] != after[username]]
+        # Only users taken by the new node move
+        self.assertTrue(all(after[username] == 'd:1' for username in moved))
+        self.assertLess(len(moved), len(USERNAMES) / 2)
+        ring.remove('d:1')
+        self.assertEqual({username: ring.owner(username) for username in USERNAMES}, before)
+        self.assertNotIn('d:1', ring)
+        self.assertEqual(len(ring), 3)
+
+    def test_empty_ring(self):
+        ring = HashRing(['a:1'])
+        ring.remove('a:1')
+        with self.assertRaises(LookupError):
+            ring.owner('kevin')
+
+
+if __name__ == '__main__':
+    unittest.main()
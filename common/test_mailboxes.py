@@ -0,0 +1,72 @@
+import time
+import unittest
+from unittest.mock import MagicMock
+from mailboxes import Mailbox, MailboxStore
+
+
+class MailboxTest(unittest.TestCase):
+    def test_pop_all_and_requeue(self):
+        mailbox = Mailbox([('howie', 'first'), ('joseph', 'second')])
+        messages = mailbox.pop_all()
+        self.assertEqual(messages, [('howie', 'first'), ('joseph', 'second')])
+        self.assertFalse(mailbox)
+        mailbox.append(('kevin', 'third'))
+        mailbox.requeue(messages)
+        self.assertEqual(list(mailbox), [('howie', 'first'), ('joseph', 'second'), ('kevin', 'third')])
+
+    def test_drain_is_linear(self):
+        # Taking the oldest message one at a time used to be list.pop(0), quadratic in the backlog
+        mailbox = Mailbox()
+        for i in range(100000):
+            mailbox.append(('howie', str(i)))
+        start = time.perf_counter()
+        while mailbox:
+            mailbox.popleft()
+        self.assertLess(time.perf_counter() - start, 1)
+
+    def test_subscribers_woken(self):
+        mailbox = Mailbox()
+        first, second = MagicMock(), MagicMock()
+        mailbox.subscribe(first)
+        mailbox.notify()
+        first.wake.assert_called_once()
+        # A new subscriber replaces the old one, which is woken so it can stop
+        mailbox.subscribe(second)
+        self.assertEqual(first.wake.call_count, 2)
+        mailbox.unsubscribe(first)
+        self.assertIs(mailbox.subscriber, second)
+        mailbox.unsubscribe()
+        self.assertIsNone(mailbox.subscriber)
+        second.wake.assert_called_once()
+
+
+class MailboxStoreTest(unittest.TestCase):
+    def setUp(self):
+        self.store = MailboxStore()
+
+    def test_only_non_empty_mailboxes(self):
+        mailbox = self.store.mailbox('kevin')
+        self.assertIs(self.store.mailbox('kevin'), mailbox)
+        self.assertFalse('kevin' in self.store)
+        self.assertIsNone(self.store.get('kevin'))
+        mailbox.append(('howie', 'hello'))
+        self.assertTrue('kevin' in self.store)
+        self.assertEqual(list(self.store), ['kevin'])
+        self.assertEqual(len(self.store), 1)
+        mailbox.pop_all()
+        self.assertEqual(len(self.store), 0)
+
+    def test_set_and_delete(self):
+        self.store['kevin'] = [('howie', 'hello')]
+        mailbox = self.store.mailbox('kevin')
+        self.store['kevin'] = [('joseph', 'hi')]
+        self.assertIs(self.store['kevin'], mailbox)
+        self.assertEqual(list(mailbox), [('joseph', 'hi')])
+        del self.store['kevin']
+        self.assertFalse('kevin' in self.store)
+        with self.assertRaises(KeyError):
+            del self.store['kevin']
+
+
+if __name__ == '__main__':
+    unittest.main()
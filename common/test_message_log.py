@@ -0,0 +1,149 @@
+import os
+import tempfile
+import threading
+import unittest
+from unittest.mock import patch
+from account_store import AccountStore
+from mailboxes import MailboxStore
+from message_log import MessageLog, RecordType, apply_record, decode_records
+
+
+class MessageLogTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'log')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def recover(self):
+        account_list, undelivered_msg = AccountStore(), MailboxStore()
+        log = MessageLog(self.path)
+        log.recover(account_list, undelivered_msg)
+        log.close()
+        return account_list, undelivered_msg
+
+    def test_recover(self):
+        log = MessageLog(self.path)
+        log.append(RecordType.CREATE_ACCOUNT, 'kevin')
+        log.append(RecordType.CREATE_ACCOUNT, 'howie')
+        log.append(RecordType.CREATE_ACCOUNT, 'joseph')
+        for i in range(3):
+            log.append(RecordType.ENQUEUE, 'kevin', 'howie', f'hello {i}')
+        log.append(RecordType.ENQUEUE, 'joseph', 'howie', 'line one\rline=two\n☃')
+        # Two were delivered, then the second one had to be put back
+        log.append(RecordType.ACK, 'kevin', '2')
+        log.append(RecordType.REQUEUE, 'kevin', 'howie', 'hello 1')
+        log.wait(log.append(RecordType.DELETE_ACCOUNT, 'howie'))
+        log.close()
+
+        account_list, undelivered_msg = self.recover()
+        self.assertEqual(list(account_list), ['joseph', 'kevin'])
+        self.assertEqual(list(undelivered_msg['kevin']), [('howie', 'hello 1'), ('howie', 'hello 2')])
+        self.assertEqual(list(undelivered_msg['joseph']), [('howie', 'line one\rline=two\n☃')])
+
+    def test_torn_record_dropped(self):
+        log = MessageLog(self.path)
+        log.append(RecordType.CREATE_ACCOUNT, 'kevin')
+        log.append(RecordType.CREATE_ACCOUNT, 'howie')
+        log.close()
+        # Crash in the middle of writing the last record
+        segment = os.path.join(self.path, '0000000001.log')
+        os.truncate(segment, os.path.getsize(segment) - 3)
+
+        account_list, _ = self.recover()
+        self.assertEqual(list(account_list), ['kevin'])
+        # Records appended after the torn one are still readable
+        log = MessageLog(self.path)
+        log.append(RecordType.CREATE_ACCOUNT, 'joseph')
+        log.close()
+        account_list, _ = self.recover()
+        self.assertEqual(list(account_list), ['joseph', 'kevin'])
+
+    def test_group_commit(self):
+        num_threads, num_records = 8, 100
+        log = MessageLog(self.path)
+        with patch('os.fsync', wraps=os.fsync) as fsync:
+            def worker(i):
+                for j in range(num_records):
+                    log.wait(log.append(RecordType.ENQUEUE, 'kevin', f'user{i}', str(j)))
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            log.close()
+        # Waiting writers share fsyncs
+        self.assertLess(fsync.call_count, num_threads * num_records)
+        _, undelivered_msg = self.recover()
+        self.assertEqual(len(undelivered_msg['kevin']), num_threads * num_records)
+
+    def test_snapshot_and_tail(self):
+        log = MessageLog(self.path, segment_size=200, snapshot_segments=2)
+        log.append(RecordType.CREATE_ACCOUNT, 'kevin')
+        for i in range(50):
+            log.wait(log.append(RecordType.ENQUEUE, 'kevin', 'howie', f'hello {i}'))
+        log.wait(log.append(RecordType.ACK, 'kevin', '10'))
+        log.close()
+        # Segments covered by the snapshot were deleted
+        files = os.listdir(self.path)
+        snapshots = [name for name in files if name.endswith('.snapshot')]
+        self.assertEqual(len(snapshots), 1)
+        covered = int(snapshots[0].split('.')[0])
+        self.assertTrue(all(int(name.split('.')[0]) > covered for name in files if name.endswith('.log')))
+
+        account_list, undelivered_msg = self.recover()
+        self.assertEqual(list(account_list), ['kevin'])
+        self.assertEqual(list(undelivered_msg['kevin']),
+                         [('howie', f'hello {i}') for i in range(10, 50)])
+
+    def test_follow(self):
+        log = MessageLog(self.path, segment_size=200, snapshot_segments=2, sync_replicas=1)
+        log.append(RecordType.CREATE_ACCOUNT, 'kevin')
+        for i in range(30):
+            log.wait(log.append(RecordType.ENQUEUE, 'kevin', 'howie', f'hello {i}'))
+        log.wait(log.append(RecordType.ACK, 'kevin', '10'))
+        follower = log.follow()
+        batches = follower.batches()
+        account_list, undelivered_msg = AccountStore(), MailboxStore()
+
+        def apply(records):
+            for record_type, fields, _ in decode_records(records):
+                apply_record(record_type, fields, account_list, undelivered_msg)
+        caught_up = False
+        while not caught_up:
+            sequence_number, records, caught_up = next(batches)
+            apply(records)
+        self.assertEqual(sequence_number, 32)
+        self.assertEqual(list(account_list), ['kevin'])
+        self.assertEqual(list(undelivered_msg['kevin']), [('howie', f'hello {i}') for i in range(10, 30)])
+        # Not caught up yet, so writes don't wait for it
+        log.wait(log.append(RecordType.CREATE_ACCOUNT, 'howie'))
+        sequence_number, records, _ = next(batches)
+        self.assertEqual(sequence_number, 33)
+        apply(records)
+        follower.ack(33)
+        self.assertTrue(follower.caught_up)
+
+        # Once caught up, a write waits until the follower has applied it
+        done = threading.Event()
+        threading.Thread(target=lambda: (log.wait(log.append(RecordType.CREATE_ACCOUNT, 'joseph')), done.set())).start()
+        sequence_number, records, _ = next(batches)
+        apply(records)
+        self.assertFalse(done.wait(0.1))
+        follower.ack(sequence_number)
+        self.assertTrue(done.wait(5))
+        self.assertEqual(list(account_list), ['howie', 'joseph', 'kevin'])
+        follower.close()
+        self.assertEqual(log.followers, [])
+        log.close()
+
+    def test_wait_raises_write_error(self):
+        log = MessageLog(self.path)
+        with patch('os.fsync', side_effect=OSError('disk full')):
+            with self.assertRaises(OSError):
+                log.wait(log.append(RecordType.CREATE_ACCOUNT, 'kevin'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+from session_registry import SessionRegistry
+
+
+class SessionRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.registry = SessionRegistry()
+        self.registry["kevin"] = "kevin_socket"
+        self.registry["howie"] = "howie_socket"
+
+    def test_lookup_both_directions(self):
+        self.assertEqual(self.registry["kevin"], "kevin_socket")
+        self.assertEqual(self.registry.username_for("howie_socket"), "howie")
+        self.assertTrue(self.registry.has_connection("kevin_socket"))
+        self.assertFalse(self.registry.has_connection("joseph_socket"))
+        self.assertIsNone(self.registry.username_for("joseph_socket"))
+
+    def test_pop_keeps_index_consistent(self):
+        self.registry.pop("kevin")
+        self.assertFalse("kevin" in self.registry)
+        self.assertFalse(self.registry.has_connection("kevin_socket"))
+        self.assertEqual(self.registry.pop_connection("howie_socket"), "howie")
+        self.assertEqual(len(self.registry), 0)
+        self.assertIsNone(self.registry.pop_connection("howie_socket"))
+
+    def test_relogin_replaces_old_entries(self):
+        self.registry["kevin"] = "howie_socket"
+        self.assertFalse("howie" in self.registry)
+        self.assertFalse(self.registry.has_connection("kevin_socket"))
+        self.assertEqual(self.registry.username_for("howie_socket"), "kevin")
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,33 @@
+import os
+import tempfile
+import unittest
+from account_store import AccountStore
+from mailboxes import MailboxStore
+from snapshot import load_snapshot, write_snapshot
+
+
+class SnapshotTest(unittest.TestCase):
+    def test_round_trip(self):
+        account_list = AccountStore(['kevin', 'howie', 'Joseph'])
+        undelivered_msg = MailboxStore()
+        undelivered_msg['kevin'] = [('howie', 'hello'), ('Joseph', 'line one\rline=two\n☃')]
+        undelivered_msg.mailbox('howie')
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, '1.snapshot')
+            write_snapshot(path, 7, account_list, undelivered_msg)
+            loaded_accounts, loaded_mailboxes = AccountStore(), MailboxStore()
+            self.assertEqual(load_snapshot(path, loaded_accounts, loaded_mailboxes), 7)
+        self.assertEqual(list(loaded_accounts), ['howie', 'Joseph', 'kevin'])
+        self.assertEqual(dict(loaded_mailboxes), {'kevin': undelivered_msg['kevin']})
+
+    def test_not_a_snapshot(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, '1.snapshot')
+            with open(path, 'wb') as snapshot_file:
+                snapshot_file.write(b'not a snapshot at all')
+            with self.assertRaises(ValueError):
+                load_snapshot(path, AccountStore(), MailboxStore())
+
+
+if __name__ == '__main__':
+    unittest.main()
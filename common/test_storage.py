@@ -0,0 +1,55 @@
+import os
+import tempfile
+import unittest
+from storage import SqliteStorage
+
+
+class SqliteStorageTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.directory.name, 'chat.db')
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_mailbox_operations(self):
+        storage = SqliteStorage(self.path)
+        mailbox = storage.undelivered_msg.mailbox('kevin')
+        self.assertFalse(mailbox)
+        mailbox.extend([('howie', 'first'), ('joseph', 'second')])
+        messages = mailbox.pop_all()
+        self.assertEqual(messages, [('howie', 'first'), ('joseph', 'second')])
+        self.assertFalse(mailbox)
+        mailbox.append(('kevin', 'third'))
+        mailbox.requeue(messages)
+        self.assertEqual(len(mailbox), 3)
+        self.assertEqual(mailbox.popleft(), ('howie', 'first'))
+        self.assertEqual(list(mailbox), [('joseph', 'second'), ('kevin', 'third')])
+        self.assertEqual(list(storage.undelivered_msg), ['kevin'])
+        del storage.undelivered_msg['kevin']
+        self.assertNotIn('kevin', storage.undelivered_msg)
+        storage.close()
+
+    def test_survives_reopen(self):
+        storage = SqliteStorage(self.path, batch_size=2)
+        storage.account_list.add('kevin')
+        storage.account_list.add('howie')
+        storage.account_list.remove('howie')
+        storage.account_list.add('Joseph')
+        mailbox = storage.undelivered_msg.mailbox('kevin')
+        mailbox.append(('Joseph', 'hello'))
+        mailbox.requeue([('Joseph', 'line one\rline=two\n☃')])
+        storage.close()
+
+        storage = SqliteStorage(self.path)
+        self.assertEqual(list(storage.account_list), ['Joseph', 'kevin'])
+        mailbox = storage.undelivered_msg['kevin']
+        self.assertEqual(mailbox.pop_all(), [('Joseph', 'line one\rline=two\n☃'), ('Joseph', 'hello')])
+        # New mail goes after the seqs that were loaded
+        mailbox.append(('kevin', 'again'))
+        self.assertEqual(list(mailbox), [('kevin', 'again')])
+        storage.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,17 @@
+import unittest
+from striped_lock import StripedLock
+
+
+class StripedLockTest(unittest.TestCase):
+    def test_same_key_same_lock(self):
+        locks = StripedLock(8)
+        self.assertIs(locks['kevin'], locks['kevin'])
+        self.assertEqual(len({id(locks[f'user{i}']) for i in range(1000)}), 8)
+        lock = locks['kevin']
+        lock.acquire()
+        self.assertFalse(locks['kevin'].acquire(blocking=False))
+        lock.release()
+
+
+if __name__ == '__main__':
+    unittest.main()
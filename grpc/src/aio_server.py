@@ -0,0 +1,124 @@
+import asyncio
+import os
+import sys
+
+import chat_service_pb2_grpc
+from chat_service_pb2 import (
+    CreateAccountRequest,
+    DeleteAccountRequest,
+    GetMessagesRequest,
+    ListAccountsRequest,
+    LogInRequest,
+    LogOffRequest,
+    SendMessageMultiRequest,
+    SendMessageRequest,
+    SubscribeRequest
+)
+from server import ChatServiceServicer
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'common'))
+from mailboxes import Subscription  # noqa: E402
+
+
+class AsyncSubscription(Subscription):
+    """A stream that awaits its mailbox on the event loop instead of blocking a thread.
+    Senders may run on any thread, so waking goes through call_soon_threadsafe.
+    """
+
+    def __init__(self, mailbox, username):
+        super().__init__(mailbox, username)
+        self.loop = asyncio.get_running_loop()
+        self.arrived = asyncio.Event()
+
+    def wake(self):
+        self.loop.call_soon_threadsafe(self.arrived.set)
+
+    def wait(self):
+        raise TypeError('Await arrived instead of blocking the event loop.')
+
+
+class AsyncChatServiceServicer(chat_service_pb2_grpc.ChatServiceServicer):
+    """
+    ChatService for a grpc.aio server. All state and request handling is shared with
+    ChatServiceServicer: its handlers only hold a lock for a few dictionary operations and
+    never while streaming, so they run directly on the event loop, or on a worker thread
+    when a message log makes them wait for disk. Only Subscribe differs, awaiting the
+    mailbox so each open stream costs a coroutine rather than a worker thread.
+    """
+
+    def __init__(self, servicer=None):
+        self.servicer = servicer or ChatServiceServicer()
+
+    async def _unary(self, handler, request, context):
+        """Runs a unary handler. With a message log the handler waits for an fsync, so it runs
+        on a worker thread instead of stalling every other stream on the event loop."""
+        if self.servicer.message_log is None:
+            return handler(request, context)
+        return await asyncio.get_running_loop().run_in_executor(None, handler, request, context)
+
+    async def CreateAccount(self, request: CreateAccountRequest, context):
+        return await self._unary(self.servicer.CreateAccount, request, context)
+
+    async def ListAccounts(self, request: ListAccountsRequest, context):
+        return await self._unary(self.servicer.ListAccounts, request, context)
+
+    async def StreamAccounts(self, request: ListAccountsRequest, context):
+        async for response in self._stream(self.servicer.StreamAccounts(request, context)):
+            yield response
+
+    async def SendMessage(self, request: SendMessageRequest, context):
+        return await self._unary(self.servicer.SendMessage, request, context)
+
+    async def SendMessageMulti(self, request: SendMessageMultiRequest, context):
+        return await self._unary(self.servicer.SendMessageMulti, request, context)
+
+    async def DeleteAccount(self, request: DeleteAccountRequest, context):
+        return await self._unary(self.servicer.DeleteAccount, request, context)
+
+    async def LogIn(self, request: LogInRequest, context):
+        return await self._unary(self.servicer.LogIn, request, context)
+
+    async def LogOff(self, request: LogOffRequest, context):
+        return await self._unary(self.servicer.LogOff, request, context)
+
+    async def GetMessages(self, request: GetMessagesRequest, context):
+        async for message in self._stream(self.servicer.GetMessages(request, context)):
+            yield message
+
+    async def Subscribe(self, request: SubscribeRequest, context):
+        """
+        Streams the logged in user's messages as they arrive, like ChatServiceServicer.Subscribe,
+        but waits for mail on an asyncio.Event. The mailbox lock is never held across an await.
+        """
+        servicer = self.servicer
+        subscription = servicer._subscribe(context.peer(), AsyncSubscription)
+        if subscription is None:
+            return
+        mailbox = subscription.mailbox
+        try:
+            while True:
+                mailbox.lock.acquire()
+                while not mailbox and mailbox.subscriber is subscription:
+                    # Cleared under the lock, so a wake after this point is never lost
+                    subscription.arrived.clear()
+                    mailbox.lock.release()
+                    await subscription.arrived.wait()
+                    mailbox.lock.acquire()
+                if mailbox.subscriber is not subscription:
+                    mailbox.lock.release()
+                    return
+                messages = mailbox.pop_all()
+                mailbox.lock.release()
+                async for message in self._stream(servicer._streamMessages(subscription.username, mailbox, messages)):
+                    yield message
+        finally:
+            servicer._unsubscribe(subscription)
+
+    async def _stream(self, responses):
+        """Re-yield a synchronous response generator, closing it if the RPC is cancelled."""
+        try:
+            for response in responses:
+                yield response
+        finally:
+            responses.close()
@@ -42,18 +42,24 @@ class GetMessagesRequest(_message.Message):
     def __init__(self) -> None: ...
 
 class ListAccountsRequest(_message.Message):
-    __slots__ = ["query"]
+    __slots__ = ["cursor", "limit", "query"]
+    CURSOR_FIELD_NUMBER: _ClassVar[int]
+    LIMIT_FIELD_NUMBER: _ClassVar[int]
     QUERY_FIELD_NUMBER: _ClassVar[int]
+    cursor: str
+    limit: int
     query: str
-    def __init__(self, query: _Optional[str] = ...) -> None: ...
+    def __init__(self, query: _Optional[str] = ..., limit: _Optional[int] = ..., cursor: _Optional[str] = ...) -> None: ...
 
 class ListAccountsResponse(_message.Message):
-    __slots__ = ["accounts", "status"]
+    __slots__ = ["accounts", "next_cursor", "status"]
     ACCOUNTS_FIELD_NUMBER: _ClassVar[int]
+    NEXT_CURSOR_FIELD_NUMBER: _ClassVar[int]
     STATUS_FIELD_NUMBER: _ClassVar[int]
     accounts: _containers.RepeatedScalarFieldContainer[str]
+    next_cursor: str
     status: str
-    def __init__(self, status: _Optional[str] = ..., accounts: _Optional[_Iterable[str]] = ...) -> None: ...
+    def __init__(self, status: _Optional[str] = ..., accounts: _Optional[_Iterable[str]] = ..., next_cursor: _Optional[str] = ...) -> None: ...
 
 class LogInRequest(_message.Message):
     __slots__ = ["username"]
@@ -79,6 +85,22 @@ class LogOffResponse(_message.Message):
     status: str
     def __init__(self, status: _Optional[str] = ...) -> None: ...
 
+class SendMessageMultiRequest(_message.Message):
+    __slots__ = ["message", "recipients"]
+    MESSAGE_FIELD_NUMBER: _ClassVar[int]
+    RECIPIENTS_FIELD_NUMBER: _ClassVar[int]
+    message: str
+    recipients: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, recipients: _Optional[_Iterable[str]] = ..., message: _Optional[str] = ...) -> None: ...
+
+class SendMessageMultiResponse(_message.Message):
+    __slots__ = ["invalid_recipients", "status"]
+    INVALID_RECIPIENTS_FIELD_NUMBER: _ClassVar[int]
+    STATUS_FIELD_NUMBER: _ClassVar[int]
+    invalid_recipients: _containers.RepeatedScalarFieldContainer[str]
+    status: str
+    def __init__(self, status: _Optional[str] = ..., invalid_recipients: _Optional[_Iterable[str]] = ...) -> None: ...
+
 class SendMessageRequest(_message.Message):
     __slots__ = ["message", "recipient"]
     MESSAGE_FIELD_NUMBER: _ClassVar[int]
@@ -92,3 +114,7 @@ class SendMessageResponse(_message.Message):
     STATUS_FIELD_NUMBER: _ClassVar[int]
     status: str
     def __init__(self, status: _Optional[str] = ...) -> None: ...
+
+class SubscribeRequest(_message.Message):
+    __slots__ = []
+    def __init__(self) -> None: ...
@@ -24,11 +24,21 @@ class ChatServiceStub(object):
                 request_serializer=chat__service__pb2.ListAccountsRequest.SerializeToString,
                 response_deserializer=chat__service__pb2.ListAccountsResponse.FromString,
                 )
+        self.StreamAccounts = channel.unary_stream(
+                '/chatservice.ChatService/StreamAccounts',
+                request_serializer=chat__service__pb2.ListAccountsRequest.SerializeToString,
+                response_deserializer=chat__service__pb2.ListAccountsResponse.FromString,
+                )
         self.SendMessage = channel.unary_unary(
                 '/chatservice.ChatService/SendMessage',
                 request_serializer=chat__service__pb2.SendMessageRequest.SerializeToString,
                 response_deserializer=chat__service__pb2.SendMessageResponse.FromString,
                 )
+        self.SendMessageMulti = channel.unary_unary(
+                '/chatservice.ChatService/SendMessageMulti',
+                request_serializer=chat__service__pb2.SendMessageMultiRequest.SerializeToString,
+                response_deserializer=chat__service__pb2.SendMessageMultiResponse.FromString,
+                )
         self.DeleteAccount = channel.unary_unary(
                 '/chatservice.ChatService/DeleteAccount',
                 request_serializer=chat__service__pb2.DeleteAccountRequest.SerializeToString,
@@ -49,6 +59,11 @@ class ChatServiceStub(object):
                 request_serializer=chat__service__pb2.GetMessagesRequest.SerializeToString,
                 response_deserializer=chat__service__pb2.ChatMessage.FromString,
                 )
+        self.Subscribe = channel.unary_stream(
+                '/chatservice.ChatService/Subscribe',
+                request_serializer=chat__service__pb2.SubscribeRequest.SerializeToString,
+                response_deserializer=chat__service__pb2.ChatMessage.FromString,
+                )
 
 
 class ChatServiceServicer(object):
@@ -66,12 +81,24 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def StreamAccounts(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def SendMessage(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def SendMessageMulti(self, request, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
     def DeleteAccount(self, request, context):
         """Missing associated documentation comment in .proto file."""
         context.set_code(grpc.StatusCode.UNIMPLEMENTED)
@@ -96,6 +123,13 @@ class ChatServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def Subscribe(self, request, context):
+        """Stays open while the caller is logged in, pushing each message as soon as it is queued
+        """
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_ChatServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -109,11 +143,21 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__service__pb2.ListAccountsRequest.FromString,
                     response_serializer=chat__service__pb2.ListAccountsResponse.SerializeToString,
             ),
+            'StreamAccounts': grpc.unary_stream_rpc_method_handler(
+                    servicer.StreamAccounts,
+                    request_deserializer=chat__service__pb2.ListAccountsRequest.FromString,
+                    response_serializer=chat__service__pb2.ListAccountsResponse.SerializeToString,
+            ),
             'SendMessage': grpc.unary_unary_rpc_method_handler(
                     servicer.SendMessage,
                     request_deserializer=chat__service__pb2.SendMessageRequest.FromString,
                     response_serializer=chat__service__pb2.SendMessageResponse.SerializeToString,
             ),
+            'SendMessageMulti': grpc.unary_unary_rpc_method_handler(
+                    servicer.SendMessageMulti,
+                    request_deserializer=chat__service__pb2.SendMessageMultiRequest.FromString,
+                    response_serializer=chat__service__pb2.SendMessageMultiResponse.SerializeToString,
+            ),
             'DeleteAccount': grpc.unary_unary_rpc_method_handler(
                     servicer.DeleteAccount,
                     request_deserializer=chat__service__pb2.DeleteAccountRequest.FromString,
@@ -134,6 +178,11 @@ def add_ChatServiceServicer_to_server(servicer, server):
                     request_deserializer=chat__service__pb2.GetMessagesRequest.FromString,
                     response_serializer=chat__service__pb2.ChatMessage.SerializeToString,
             ),
+            'Subscribe': grpc.unary_stream_rpc_method_handler(
+                    servicer.Subscribe,
+                    request_deserializer=chat__service__pb2.SubscribeRequest.FromString,
+                    response_serializer=chat__service__pb2.ChatMessage.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'chatservice.ChatService', rpc_method_handlers)
@@ -178,6 +227,23 @@ class ChatService(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def StreamAccounts(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/chatservice.ChatService/StreamAccounts',
+            chat__service__pb2.ListAccountsRequest.SerializeToString,
+            chat__service__pb2.ListAccountsResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
     @staticmethod
     def SendMessage(request,
             target,
@@ -195,6 +261,23 @@ class ChatService(object):
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
 
+    @staticmethod
+    def SendMessageMulti(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_unary(request, target, '/chatservice.ChatService/SendMessageMulti',
+            chat__service__pb2.SendMessageMultiRequest.SerializeToString,
+            chat__service__pb2.SendMessageMultiResponse.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
     @staticmethod
     def DeleteAccount(request,
             target,
@@ -262,3 +345,20 @@ class ChatService(object):
             chat__service__pb2.ChatMessage.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def Subscribe(request,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.unary_stream(request, target, '/chatservice.ChatService/Subscribe',
+            chat__service__pb2.SubscribeRequest.SerializeToString,
+            chat__service__pb2.ChatMessage.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
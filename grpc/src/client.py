@@ -9,6 +9,9 @@ import chat_service_pb2
 
 std_out_lock = threading.Lock()
 
+# Number of accounts to fetch per ListAccounts call
+LIST_PAGE_SIZE = 100
+
 
 def atomic_print(lock, msg, end=None):
     # Function for printing to stdout in a thread-safe manner
@@ -23,10 +26,37 @@ class Client:
         self.username = None
 
         self.listen_for_messages_flag = True
+        # Set while logged in, so the listening thread only subscribes when there is a mailbox
+        self.logged_in_event = threading.Event()
+        # Cleared if the server predates Subscribe, falling back to polling GetMessages
+        self.subscribe_supported = True
 
     def listen_for_messages(self):
         while self.listen_for_messages_flag:
-            self._fetch_and_print_messages()
+            if self.subscribe_supported:
+                self._subscribe_and_print_messages()
+            else:
+                self._fetch_and_print_messages()
+
+    def _subscribe_and_print_messages(self):
+        """Once logged in, keeps a Subscribe stream open and prints messages as the server pushes them."""
+        if not self.logged_in_event.wait(1):
+            return
+        try:
+            for message in self.stub.Subscribe(chat_service_pb2.SubscribeRequest()):
+                atomic_print(
+                    std_out_lock, f"\nMessage from {message.sender}: {message.message}")
+                atomic_print(std_out_lock, self._get_prompt())
+        except grpc.RpcError as e:
+            if e.code() == grpc.StatusCode.UNIMPLEMENTED:
+                self.subscribe_supported = False
+            else:
+                # Some grpc error occurred, quietly wait a second and try again
+                sleep(1)
+        else:
+            if self.logged_in_event.is_set():
+                # Stream was closed by the server while we think we are logged in, don't spin
+                sleep(0.05)
 
     def _fetch_and_print_messages(self):
         """Fetches available messages from the server and prints them to stdout."""
@@ -116,6 +146,7 @@ class Client:
 
             if response.status == 'Success':
                 self.username = username
+                self.logged_in_event.set()
                 atomic_print(std_out_lock, f'Success! Logged in as {username}')
             else:
                 atomic_print(std_out_lock, response.status)
@@ -127,22 +158,42 @@ class Client:
         """Ask for a query string and send a request to the server to list accounts matching the query."""
         query = input('Enter query: ')
         start = time.time()
-        response = self.stub.ListAccounts(
-            chat_service_pb2.ListAccountsRequest(query=query))
+        # Fetch the results a page at a time, printing each page as soon as it arrives
+        cursor = ''
+        while True:
+            response = self.stub.ListAccounts(
+                chat_service_pb2.ListAccountsRequest(query=query, limit=LIST_PAGE_SIZE, cursor=cursor))
+            if response.status != "Success":
+                atomic_print(std_out_lock, response.status)
+                break
+            accounts = '\n'.join(response.accounts)
+            if not cursor:
+                logging.info(
+                    f"Start: {start}, Time to first page: {time.time() - start}")
+                accounts = f"Account search results:\n{accounts}"
+            if accounts:
+                atomic_print(std_out_lock, accounts)
+            cursor = response.next_cursor
+            if not cursor:
+                break
         logging.info(
             f"Start: {start}, Time to complete call: {time.time() - start}")
-        if response.status == "Success":
-            accounts = '\n'.join(response.accounts)
-            atomic_print(std_out_lock, f"Account search results:\n{accounts}")
-        else:
-            atomic_print(std_out_lock, response.status)
 
     def _send_message(self):
-        """Ask for a recipient username and message and send a request to the server to send the message."""
-        user = input('Enter recipient username: ')
+        """Ask for one or more recipient usernames and a message and send a request to the server to send the message."""
+        user = input('Enter recipient username (separate several with commas): ')
         user_msg = input('Enter message: ')
-        response = self.stub.SendMessage(
-            chat_service_pb2.SendMessageRequest(recipient=user, message=user_msg))
+        recipients = [recipient.strip()
+                      for recipient in user.split(',') if recipient.strip()]
+        if len(recipients) > 1:
+            response = self.stub.SendMessageMulti(
+                chat_service_pb2.SendMessageMultiRequest(recipients=recipients, message=user_msg))
+            if response.status == "Success" and response.invalid_recipients:
+                atomic_print(
+                    std_out_lock, f"These recipients do not exist: {', '.join(response.invalid_recipients)}")
+        else:
+            response = self.stub.SendMessage(
+                chat_service_pb2.SendMessageRequest(recipient=user, message=user_msg))
         if response.status == "Success":
             atomic_print(std_out_lock, "Message sent successfully.")
         else:
@@ -153,6 +204,7 @@ class Client:
         response = self.stub.LogOff(chat_service_pb2.LogOffRequest())
         if response.status == "Success":
             self.username = None
+            self.logged_in_event.clear()
             msg = "You are now logged out."
         else:
             msg = response.status
@@ -165,6 +217,7 @@ class Client:
             chat_service_pb2.DeleteAccountRequest())
         if response.status == "Success":
             self.username = None
+            self.logged_in_event.clear()
             atomic_print(
                 std_out_lock, "Deleting account successful; you are now logged out.")
         else:
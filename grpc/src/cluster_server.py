@@ -0,0 +1,174 @@
+import os
+import sys
+
+from chat_service_pb2 import (
+    CreateAccountRequest,
+    CreateAccountResponse,
+    LogInRequest,
+    LogInResponse,
+    SendMessageMultiRequest,
+    SendMessageMultiResponse,
+    SendMessageRequest,
+    SendMessageResponse
+)
+from server import UNAVAILABLE_RECIPIENT_STATUS, ChatServiceServicer
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'common'))
+from cluster import ClusterNode  # noqa: E402
+from hash_ring import DEFAULT_REPLICAS  # noqa: E402
+from message_log import RecordType  # noqa: E402
+
+
+class ClusterChatServiceServicer(ChatServiceServicer):
+    """A ChatService that is one node of a cluster, see cluster.ClusterNode.
+
+    The node owning a user holds their account, mailbox and login. Creating or logging into
+    an account owned by another node fails with the address of the node to use instead.
+    Sends to users of other nodes and account searches go to the other nodes.
+    """
+
+    def __init__(self, cluster_address, client_address, message_log=None, storage=None,
+                 replicas=DEFAULT_REPLICAS):
+        super().__init__(message_log, storage)
+        self.cluster = ClusterNode(self, cluster_address, client_address, replicas)
+
+    def joinCluster(self, seed=None):
+        """Start answering the other nodes, and join the cluster of seed, the cluster
+        address of any member, if given. Call it before serving clients."""
+        self.cluster.start()
+        if seed is not None:
+            self.cluster.join(seed)
+
+    def leaveCluster(self):
+        """Hand every user to the remaining nodes and stop answering them."""
+        self.cluster.leave()
+        self.cluster.stop()
+
+    def _redirectStatus(self, username):
+        return f'Error: That account is served by {self.cluster.client_address(username)}, connect there instead.'
+
+    def CreateAccount(self, request: CreateAccountRequest, context):
+        if not self.cluster.is_local(request.username):
+            return CreateAccountResponse(status=self._redirectStatus(request.username), username=request.username)
+        return super().CreateAccount(request, context)
+
+    def LogIn(self, request: LogInRequest, context):
+        if not self.cluster.is_local(request.username):
+            return LogInResponse(status=self._redirectStatus(request.username), username=request.username)
+        return super().LogIn(request, context)
+
+    def SendMessage(self, request: SendMessageRequest, context):
+        """Queue the message, through the owning node if the recipient is on another one."""
+        username = self.logged_in.username_for(context.peer())
+        if username is None or self.cluster.is_local(request.recipient):
+            return super().SendMessage(request, context)
+        missing, unavailable = self.cluster.send([request.recipient], username, request.message)
+        if unavailable:
+            return SendMessageResponse(status=UNAVAILABLE_RECIPIENT_STATUS)
+        if missing:
+            return SendMessageResponse(status='Error: The recipient of the message does not exist.')
+        return SendMessageResponse(status='Success')
+
+    def SendMessageMulti(self, request: SendMessageMultiRequest, context):
+        """Queue one message for many recipients, each other node getting its share of the
+        recipients in a single call."""
+        username = self.logged_in.username_for(context.peer())
+        if username is None:
+            return super().SendMessageMulti(request, context)
+        recipients = list(dict.fromkeys(request.recipients))
+        missing, unavailable = self.cluster.send(recipients, username, request.message)
+        # Recipients whose node couldn't be reached are reported with those that don't exist
+        invalid = set(missing) | set(unavailable)
+        invalid_recipients = [recipient for recipient in recipients if recipient in invalid]
+        if len(invalid) < len(recipients):
+            status = 'Success'
+        elif unavailable:
+            status = UNAVAILABLE_RECIPIENT_STATUS
+        else:
+            status = 'Error: None of the recipients exist.'
+        return SendMessageMultiResponse(status=status, invalid_recipients=invalid_recipients)
+
+    def _searchPage(self, query, limit=None, cursor=None):
+        return self.cluster.search_page(query, limit, cursor)
+
+    def _searchPages(self, query, page_size):
+        return self.cluster.search_pages(query, page_size)
+
+    def node_send(self, recipients, sender, message):
+        """Queue a message for recipients this node owns. Returns those that don't exist."""
+        recipients, missing = self.account_list.partition(recipients)
+        self._queueForRecipients(recipients, (sender, message))
+        return missing
+
+    def node_search_page(self, query, limit, cursor):
+        return super()._searchPage(query, limit, cursor)
+
+    def node_export(self, keep):
+        """Copy the accounts for which keep(username) is false, with their queued messages,
+        to hand them over; nothing is removed until node_remove. Returns the usernames and
+        the (recipient, sender, message) of their messages, oldest first."""
+        accounts, messages = [], []
+        for username in list(self.account_list):
+            if keep(username):
+                continue
+            mailbox = self.undelivered_msg.mailbox(username)
+            mailbox.lock.acquire()
+            if username in self.account_list:
+                accounts.append(username)
+                messages.extend((username,) + message_info for message_info in mailbox)
+            mailbox.lock.release()
+        return accounts, messages
+
+    def node_remove(self, handed_over):
+        """Remove users another node has taken over, given as username to the number of their
+        oldest messages it has, logging off and ending the streams of their users. A user who
+        got mail since node_export only loses the messages handed over."""
+        sequence_number = 0
+        for username, count in handed_over.items():
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
+            if username in self.account_list:
+                mailbox = self.undelivered_msg.mailbox(username)
+                # USER > MAILBOX
+                mailbox.lock.acquire()
+                count = min(count, len(mailbox))
+                for _ in range(count):
+                    mailbox.popleft()
+                if count:
+                    sequence_number = self._log(RecordType.ACK, username, str(count))
+                if not mailbox:
+                    self.logged_in.pop(username, None)
+                    mailbox.unsubscribe()
+                    # MAILBOX > ACCOUNT LIST, so no message is queued between the check and the removal
+                    self.account_list_lock.acquire()
+                    self.account_list.remove(username)
+                    self.account_list_lock.release()
+                    sequence_number = self._log(RecordType.DELETE_ACCOUNT, username)
+                mailbox.lock.release()
+            user_lock.release()
+        self._waitDurable(sequence_number)
+
+    def node_import(self, accounts, messages):
+        """Take over accounts and their queued messages, oldest first, from another node."""
+        sequence_number = 0
+        for username in accounts:
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
+            if username not in self.account_list:
+                # USER > ACCOUNT LIST
+                self.account_list_lock.acquire()
+                self.account_list.add(username)
+                self.account_list_lock.release()
+                sequence_number = self._log(RecordType.CREATE_ACCOUNT, username)
+            user_lock.release()
+        for recipient, sender, message in messages:
+            mailbox = self.undelivered_msg.mailbox(recipient)
+            mailbox.lock.acquire()
+            mailbox.append((sender, message))
+            sequence_number = self._log(RecordType.ENQUEUE, recipient, sender, message)
+            mailbox.notify()
+            mailbox.lock.release()
+        self._waitDurable(sequence_number)
+        if accounts:
+            print(f"Took over {len(accounts)} accounts")
@@ -0,0 +1,42 @@
+import os
+import sys
+
+from chat_service_pb2 import CreateAccountRequest, CreateAccountResponse, LogInRequest, LogInResponse
+from server import ChatServiceServicer
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'common'))
+from replication import ReplicationNode  # noqa: E402
+
+READ_ONLY_STATUS = 'Error: This server is a read-only replica; create accounts and log in on the primary.'
+
+
+class ReplicatedChatServiceServicer(ChatServiceServicer):
+    """A ChatService that is the primary or a replica, see replication.ReplicationNode.
+
+    A replica serves ListAccounts and StreamAccounts from the state shipped by the primary,
+    and refuses CreateAccount and LogIn, which every other write needs. Once promoted it
+    serves everything.
+    """
+
+    def __init__(self, replication_address, primary=None, message_log=None, failover_timeout=None,
+                 open_log=None):
+        super().__init__(message_log)
+        self.replication = ReplicationNode(self, replication_address, primary, failover_timeout, open_log)
+
+    def startReplication(self):
+        """Start answering the replicas, or following the primary. Call it before serving clients."""
+        self.replication.start()
+
+    def stopReplication(self):
+        self.replication.stop()
+
+    def CreateAccount(self, request: CreateAccountRequest, context):
+        if self.replication.is_replica():
+            return CreateAccountResponse(status=READ_ONLY_STATUS, username=request.username)
+        return super().CreateAccount(request, context)
+
+    def LogIn(self, request: LogInRequest, context):
+        if self.replication.is_replica():
+            return LogInResponse(status=READ_ONLY_STATUS, username=request.username)
+        return super().LogIn(request, context)
@@ -0,0 +1,23 @@
+import asyncio
+
+import grpc
+import chat_service_pb2_grpc
+from aio_server import AsyncChatServiceServicer
+from run_server import HOST, PORT, open_message_log, open_storage, parse_args
+from server import ChatServiceServicer
+
+
+async def serve(message_log=None, storage=None, port=PORT):
+    server = grpc.aio.server()
+    chat_service_pb2_grpc.add_ChatServiceServicer_to_server(
+        AsyncChatServiceServicer(ChatServiceServicer(message_log, storage)), server)
+    server.add_insecure_port(f'{HOST}:{port}')
+    await server.start()
+    print(f"Server started on {HOST}:{port}")
+    await server.wait_for_termination()
+
+
+if __name__ == '__main__':
+    # Cluster mode calls the other nodes from the request handlers, so it needs run_server.py
+    args = parse_args(cluster=False, replication=False)
+    asyncio.run(serve(open_message_log(args), open_storage(args), args.port))
@@ -1,23 +1,136 @@
-
+import argparse
+import os
+import socket
+import sys
 from concurrent import futures
 
 import grpc
 import chat_service_pb2_grpc
+from cluster_server import ClusterChatServiceServicer
+from replicated_server import ReplicatedChatServiceServicer
 from server import ChatServiceServicer
 
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'common'))
+from message_log import DEFAULT_SEGMENT_SIZE, MessageLog  # noqa: E402
+from storage import MemoryStorage, SqliteStorage  # noqa: E402
+
 HOST = '[::]'
 PORT = 6000
+# Every client holds a worker for its Subscribe stream while logged in
+MAX_WORKERS = 100
+
+
+def parse_args(cluster=True, replication=True):
+    """Parse the server options, including those of cluster mode if cluster is set and of
+    replication if replication is set."""
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='port clients connect to')
+    parser.add_argument('--log-dir',
+                        help='keep accounts and queued messages in a write-ahead log and snapshots in this directory, so they survive restarts')
+    parser.add_argument('--commit-delay', type=float, default=0.0,
+                        help='seconds to gather more log records before each fsync')
+    parser.add_argument('--segment-size', type=int, default=DEFAULT_SEGMENT_SIZE,
+                        help='bytes per log segment; every few sealed segments are compacted into a snapshot')
+    parser.add_argument('--storage', choices=['memory', 'sqlite'], default='memory',
+                        help='memory keeps accounts and queued messages in memory, sqlite keeps them in --db-file')
+    parser.add_argument('--db-file', default='chat.db',
+                        help='SQLite database used by --storage sqlite')
+    if cluster:
+        parser.add_argument('--cluster-port', type=int,
+                            help='run as a node of a cluster, answering the other nodes on this port')
+        parser.add_argument('--join',
+                            help='host:port of the cluster port of any node already in the cluster to join')
+        parser.add_argument('--advertise', default=socket.gethostname(),
+                            help='hostname the other nodes and redirected clients reach this node on')
+    if replication:
+        parser.add_argument('--replication-port', type=int,
+                            help='run as the primary, or with --replica-of a replica, answering replication on this port')
+        parser.add_argument('--replica-of',
+                            help='host:port of the replication port of the primary to follow, serving account lists but no writes until promoted')
+        parser.add_argument('--failover-timeout', type=float,
+                            help='seconds without hearing from the primary after which a replica promotes itself')
+        parser.add_argument('--sync-replicas', type=int, default=0,
+                            help='caught-up replicas that must have applied a write before the primary answers it')
+    args = parser.parse_args()
+    if args.storage == 'sqlite' and args.log_dir:
+        parser.error('--log-dir only applies to --storage memory; the SQLite database already survives restarts')
+    if cluster and args.join and args.cluster_port is None:
+        parser.error('--join needs --cluster-port')
+    if replication:
+        if (args.replica_of or args.failover_timeout is not None) and args.replication_port is None:
+            parser.error('--replica-of and --failover-timeout need --replication-port')
+        if args.failover_timeout is not None and not args.replica_of:
+            parser.error('--failover-timeout only applies to a replica')
+        if args.replication_port is not None:
+            if args.storage == 'sqlite' or (cluster and args.cluster_port is not None):
+                parser.error('--replication-port only applies outside a cluster with --storage memory')
+            if not args.replica_of and not args.log_dir:
+                parser.error('a primary ships its message log, so it needs --log-dir')
+            if args.replica_of and args.log_dir and os.path.isdir(args.log_dir) and os.listdir(args.log_dir):
+                parser.error('a replica only writes --log-dir once promoted, so it must be empty')
+        if args.sync_replicas and (args.replication_port is None or args.replica_of):
+            parser.error('--sync-replicas only applies to a primary')
+    return args
+
+
+def open_message_log(args, sync_replicas=0):
+    return MessageLog(args.log_dir, args.commit_delay, args.segment_size,
+                      sync_replicas=sync_replicas) if args.log_dir else None
 
 
-def serve():
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    chat_service_pb2_grpc.add_ChatServiceServicer_to_server(
-        ChatServiceServicer(), server)
-    server.add_insecure_port(f'{HOST}:{PORT}')
+def open_storage(args):
+    return SqliteStorage(args.db_file) if args.storage == 'sqlite' else MemoryStorage()
+
+
+def serve(message_log=None, storage=None, servicer=None, port=PORT):
+    servicer = servicer or ChatServiceServicer(message_log, storage)
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=MAX_WORKERS))
+    chat_service_pb2_grpc.add_ChatServiceServicer_to_server(servicer, server)
+    server.add_insecure_port(f'{HOST}:{port}')
     server.start()
-    print(f"Server started on {HOST}:{PORT}")
+    print(f"Server started on {HOST}:{port}")
     server.wait_for_termination()
 
 
+def serve_cluster_node(args, message_log=None, storage=None):
+    """Serve as a node of a cluster, joining args.join if given, and hand this node's users
+    to the rest of the cluster on ctrl-C"""
+    servicer = ClusterChatServiceServicer(f'{args.advertise}:{args.cluster_port}',
+                                          f'{args.advertise}:{args.port}', message_log, storage)
+    servicer.joinCluster(args.join)
+    try:
+        serve(servicer=servicer, port=args.port)
+    except KeyboardInterrupt:
+        servicer.leaveCluster()
+
+
+def serve_replicated(args):
+    """Serve as the primary, or as a replica of args.replica_of that only writes its
+    --log-dir once promoted"""
+    def open_log(account_list, undelivered_msg):
+        return MessageLog.from_state(args.log_dir, account_list, undelivered_msg,
+                                     commit_delay=args.commit_delay, segment_size=args.segment_size)
+    if args.replica_of:
+        servicer = ReplicatedChatServiceServicer(f'{HOST}:{args.replication_port}', args.replica_of,
+                                                 failover_timeout=args.failover_timeout,
+                                                 open_log=open_log if args.log_dir else None)
+    else:
+        servicer = ReplicatedChatServiceServicer(f'{HOST}:{args.replication_port}',
+                                                 message_log=open_message_log(args, args.sync_replicas))
+    servicer.startReplication()
+    try:
+        serve(servicer=servicer, port=args.port)
+    except KeyboardInterrupt:
+        servicer.stopReplication()
+
+
 if __name__ == '__main__':
-    serve()
+    args = parse_args()
+    if args.cluster_port is not None:
+        serve_cluster_node(args, open_message_log(args), open_storage(args))
+    elif args.replication_port is not None:
+        serve_replicated(args)
+    else:
+        serve(open_message_log(args), open_storage(args), port=args.port)
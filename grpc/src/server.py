@@ -1,6 +1,6 @@
+import os
+import sys
 import threading
-import re
-from collections import defaultdict
 import time
 import logging
 
@@ -18,42 +18,73 @@ from chat_service_pb2 import (
     LogInResponse,
     LogOffRequest,
     LogOffResponse,
+    SendMessageMultiRequest,
+    SendMessageMultiResponse,
     SendMessageRequest,
-    SendMessageResponse
+    SendMessageResponse,
+    SubscribeRequest
 )
 
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'common'))
+from account_query import DEFAULT_PAGE_SIZE, page_accounts, stream_accounts  # noqa: E402
+from mailboxes import Subscription  # noqa: E402
+from message_log import RecordType  # noqa: E402
+from session_registry import SessionRegistry  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+from striped_lock import StripedLock  # noqa: E402
+
+# Answers when the node holding a recipient, or some of the listed accounts, can't be reached
+UNAVAILABLE_RECIPIENT_STATUS = "Error: The recipient's server is unavailable, try again later."
+UNAVAILABLE_ACCOUNTS_STATUS = 'Error: Some accounts are unavailable, try again later.'
+
 
 class ChatServiceServicer(chat_service_pb2_grpc.ChatServiceServicer):
-    def __init__(self):
-        self.account_list = []  # List of usernames
+    def __init__(self, message_log=None, storage=None):
+        # Anything that must be atomic for one user (creating, deleting, logging in or off,
+        # queueing mail for them) holds that username's lock, so different users don't contend
+        self.user_locks = StripedLock()
+
+        # Storage engine holding the accounts and mailboxes, in memory unless given one
+        self.storage = storage or MemoryStorage()
+
+        self.account_list = self.storage.account_list  # Set of usernames, iterated in sorted order
+        # Only serializes writes to account_list; reads and snapshots need no lock
         self.account_list_lock = threading.Lock()
 
-        self.logged_in = {}  # Map of username to socket ID
-        self.logged_in_lock = threading.Lock()
+        # Map of username to socket ID, indexed both ways. Changed under the username's
+        # user lock, read without a lock.
+        self.logged_in = SessionRegistry()
 
-        # Map of recipient username to list of (sender, message) for that recipient
-        self.undelivered_msg = defaultdict(list)
-        self.undelivered_msg_lock = threading.Lock()
+        # Map of recipient username to the Mailbox of (sender, message) waiting for them,
+        # each guarded by its own lock
+        self.undelivered_msg = self.storage.undelivered_msg
+
+        # Optional MessageLog that accounts and queued messages are recovered from and written to
+        self.message_log = message_log
+        if message_log is not None:
+            message_log.recover(self.account_list, self.undelivered_msg)
+
+    def _log(self, record_type, *fields):
+        """Append a record to the message log, if there is one, while holding the lock of the
+        state it changes. Returns the sequence number to _waitDurable on, 0 without a log."""
+        if self.message_log is None:
+            return 0
+        return self.message_log.append(record_type, *fields)
+
+    def _waitDurable(self, sequence_number):
+        """Block until a logged record is on disk. Called after releasing every lock, so other
+        requests join the same group commit."""
+        if sequence_number:
+            self.message_log.wait(sequence_number)
 
     def _atomicIsLoggedIn(self, client_socket):
-        """Determine if client_socket ID is logged in."""
-        self.logged_in_lock.acquire()
-        ret = client_socket in self.logged_in.values()
-        self.logged_in_lock.release()
-        return ret
-
-    def _atomicLogIn(self, client_socket, account_name):
-        """Log in client_socket ID with account_name."""
-        self.logged_in_lock.acquire()
-        self.logged_in[account_name] = client_socket
-        self.logged_in_lock.release()
+        """Determine if client_socket ID is logged in. A single lookup, so no lock is needed."""
+        return self.logged_in.has_connection(client_socket)
 
     def _atomicIsAccountCreated(self, recipient):
-        """Check if account has been created."""
-        self.account_list_lock.acquire()
-        ret = recipient in self.account_list
-        self.account_list_lock.release()
-        return ret
+        """Check if account has been created. A single lookup, so no lock is needed."""
+        return recipient in self.account_list
 
     def CreateAccount(self, request: CreateAccountRequest, context):
         """Create an account with username request.username."""
@@ -62,16 +93,21 @@ class ChatServiceServicer(chat_service_pb2_grpc.ChatServiceServicer):
         if self._atomicIsLoggedIn(client_socket):
             status = 'Error: User can\'t create an account while logged in.'
         else:
-            self.account_list_lock.acquire()
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
             if (username in self.account_list):
-                self.account_list_lock.release()
+                user_lock.release()
                 status = 'Error: Account already exists.'
             else:
-                self.account_list.append(username)
-                # accountLock > login
-                self._atomicLogIn(client_socket, username)
-                # if we release the lock earlier, someone else can create the same acccount and try to log in while we wait for the log in lock
+                # USER > ACCOUNT LIST
+                self.account_list_lock.acquire()
+                self.account_list.add(username)
                 self.account_list_lock.release()
+                sequence_number = self._log(RecordType.CREATE_ACCOUNT, username)
+                # if we release the user lock earlier, someone else can log into the new account before we do
+                self.logged_in[username] = client_socket
+                user_lock.release()
+                self._waitDurable(sequence_number)
                 print("Account created: ", username)
 
                 status = 'Success'
@@ -81,54 +117,93 @@ class ChatServiceServicer(chat_service_pb2_grpc.ChatServiceServicer):
         return response
 
     def ListAccounts(self, request: ListAccountsRequest, context):
-        """Process request to list accounts according to some regex pattern."""
+        """Process request to list accounts according to some regex pattern.
+        If request.limit is set, only that many accounts are returned along with a next_cursor
+        which can be sent back as request.cursor to get the following page."""
         logging.info(f"Time received: {time.time()}")
-        try:
-            pattern = re.compile(
-                fr"{request.query}", flags=re.IGNORECASE)
-            self.account_list_lock.acquire()
-            accounts = []
-            for account in self.account_list:
-                if pattern.match(account):
-                    accounts.append(account)
-            self.account_list_lock.release()
-            status = 'Success'
-        except:
-            status = 'Error: regex is malformed.'
+        next_cursor = ''
+        if request.limit < 0:
+            status = 'Error: limit must be a positive integer.'
             accounts = []
+        else:
+            try:
+                accounts, next_cursor = self._searchPage(
+                    request.query, request.limit or None, request.cursor)
+                status = 'Success'
+            except ConnectionError:
+                # Another node holding some of the accounts can't be reached
+                status = UNAVAILABLE_ACCOUNTS_STATUS
+                accounts = []
+            except:
+                status = 'Error: regex is malformed.'
+                accounts = []
 
-        response = ListAccountsResponse(status=status, accounts=accounts)
+        response = ListAccountsResponse(
+            status=status, accounts=accounts, next_cursor=next_cursor)
         logging.info(
             f"ListAccount request size: {request.ByteSize()}, response size: {response.ByteSize()}")
         return response
 
+    def StreamAccounts(self, request: ListAccountsRequest, context):
+        """
+        Lists accounts according to some regex pattern, yielding one ListAccountsResponse per
+        page of request.limit accounts so the whole result never has to be built in memory.
+        The last page has an empty next_cursor.
+        """
+        if request.limit < 0:
+            yield ListAccountsResponse(status='Error: limit must be a positive integer.')
+            return
+        try:
+            pages = self._searchPages(request.query, request.limit or DEFAULT_PAGE_SIZE)
+        except:
+            yield ListAccountsResponse(status='Error: regex is malformed.')
+            return
+        try:
+            for accounts, next_cursor in pages:
+                yield ListAccountsResponse(status='Success', accounts=accounts, next_cursor=next_cursor)
+        except ConnectionError:
+            yield ListAccountsResponse(status=UNAVAILABLE_ACCOUNTS_STATUS)
+
+    def _accountsSnapshot(self):
+        """Take a snapshot of the account index that can be searched without the lock.
+        The index is copy-on-write, so this needs no lock either."""
+        return self.account_list.snapshot()
+
+    def _searchPage(self, query, limit=None, cursor=None):
+        """Find one page of the accounts matching query, see account_query.page_accounts.
+        Searches a snapshot, so creates and sends aren't blocked."""
+        return page_accounts(self._accountsSnapshot(), query, limit, cursor)
+
+    def _searchPages(self, query, page_size):
+        """Find the accounts matching query one page at a time, see account_query.stream_accounts"""
+        return stream_accounts(self._accountsSnapshot(), query, page_size)
+
     def SendMessage(self, request: SendMessageRequest, context):
         """Process send message request by queueing it in the undelivered_msg list."""
-        # Check if sender is logged in
-        self.logged_in_lock.acquire()
-        client_socket = context.peer()
-        if client_socket not in self.logged_in.values():
-            self.logged_in_lock.release()
+        # Check if sender is logged in, and get sender's username
+        username = self.logged_in.username_for(context.peer())
+        if username is None:
             status = 'Error: Need to be logged in to send a message.'
         else:
-            # Get sender's username
-            username = [k for k, v in self.logged_in.items() if v ==
-                        client_socket][0]
-            self.logged_in_lock.release()
-
             recipient = request.recipient
             message = request.message
-            self.account_list_lock.acquire()
+            # Hold the recipient's user lock so the account can't be deleted before we queue
+            user_lock = self.user_locks[recipient]
+            user_lock.acquire()
             if recipient not in self.account_list:
-                self.account_list_lock.release()
+                user_lock.release()
                 status = 'Error: The recipient of the message does not exist.'
             else:
                 # Queue message to be delivered
-                self.undelivered_msg_lock.acquire()
-                self.undelivered_msg[recipient].append((username, message))
-                self.undelivered_msg_lock.release()
-                # ACCOUNT LIST > UNDELIVERED MSG)
-                self.account_list_lock.release()
+                mailbox = self.undelivered_msg.mailbox(recipient)
+                # USER > MAILBOX
+                mailbox.lock.acquire()
+                mailbox.append((username, message))
+                sequence_number = self._log(RecordType.ENQUEUE, recipient, username, message)
+                mailbox.notify()
+                mailbox.lock.release()
+                user_lock.release()
+                self._waitDurable(sequence_number)
                 status = 'Success'
                 print(f"Queued message from {username} to {recipient}")
 
@@ -137,48 +212,172 @@ class ChatServiceServicer(chat_service_pb2_grpc.ChatServiceServicer):
             f"SendMessage request size: {request.ByteSize()}, response size: {response.ByteSize()}")
         return response
 
+    def SendMessageMulti(self, request: SendMessageMultiRequest, context):
+        """
+        Queue one message for many recipients. The recipients are checked against the account
+        list all at once, and every recipient's queue shares the same (sender, message) tuple.
+        Recipients whose account doesn't exist are skipped and returned in invalid_recipients.
+        """
+        invalid_recipients = []
+        username = self.logged_in.username_for(context.peer())
+        if username is None:
+            status = 'Error: Need to be logged in to send a message.'
+        else:
+            recipients, invalid_recipients = self.account_list.partition(
+                request.recipients)
+            if not recipients:
+                status = 'Error: None of the recipients exist.'
+            else:
+                self._queueForRecipients(recipients, (username, request.message))
+                status = 'Success'
+                print(
+                    f"Queued message from {username} to {len(recipients)} recipients")
+
+        response = SendMessageMultiResponse(
+            status=status, invalid_recipients=invalid_recipients)
+        logging.info(
+            f"SendMessageMulti request size: {request.ByteSize()}, response size: {response.ByteSize()}")
+        return response
+
+    def _queueForRecipients(self, recipients, message_info):
+        """Queue one (sender, message) tuple for every recipient, skipping any deleted since
+        they were checked against the account list."""
+        sequence_number = 0
+        for recipient in recipients:
+            # One recipient's locks at a time, so senders to other users aren't held up
+            user_lock = self.user_locks[recipient]
+            user_lock.acquire()
+            # Skip recipients deleted since the partition
+            if recipient in self.account_list:
+                mailbox = self.undelivered_msg.mailbox(recipient)
+                # USER > MAILBOX
+                mailbox.lock.acquire()
+                mailbox.append(message_info)
+                sequence_number = self._log(
+                    RecordType.ENQUEUE, recipient, *message_info)
+                mailbox.notify()
+                mailbox.lock.release()
+            user_lock.release()
+        self._waitDurable(sequence_number)
+
     def GetMessages(self, request: GetMessagesRequest, context):
         """
         Fetches all messages for the logged in user and returns them to the client.
         Yields message one by one, as a stream of ChatMessage objects.
+        The whole mailbox is taken under one lock acquisition; if the stream is cancelled
+        part way, the messages that were not yielded go back to the front of the mailbox.
         """
-        client_socket = context.peer()
-        self.logged_in_lock.acquire()
-        if client_socket in self.logged_in.values():
-            # Get requestor's username
-            username = [k for k, v in self.logged_in.items() if v ==
-                        client_socket][0]
+        username = self.logged_in.username_for(context.peer())
+        if username is None:
+            return
+        mailbox = self.undelivered_msg.mailbox(username)
+        mailbox.lock.acquire()
+        messages = mailbox.pop_all()
+        mailbox.lock.release()
+        if messages:
+            print(f"Sending messages to {username}")
+        yield from self._streamMessages(username, mailbox, messages)
+
+    def Subscribe(self, request: SubscribeRequest, context):
+        """
+        Streams the logged in user's messages as they arrive, starting with any that are
+        already waiting. The stream stays open, waiting on the mailbox's condition variable
+        while it is empty, until the user logs off or deletes their account, another stream
+        subscribes to the same mailbox, or the client cancels.
+        """
+        subscription = self._subscribe(context.peer(), Subscription)
+        if subscription is None:
+            return
+        mailbox = subscription.mailbox
+        context.add_callback(lambda: self._unsubscribe(subscription))
+        try:
             while True:
-                deliver_msg = False
-                self.undelivered_msg_lock.acquire()
-                if len(self.undelivered_msg[username]):
-                    deliver_msg = True
-                    sender, msg = self.undelivered_msg[username].pop(0)
-                self.undelivered_msg_lock.release()
-                if deliver_msg:  # if there are messages to deliver
-                    print(f"Sending messages to {username}")
-                    yield ChatMessage(sender=sender, message=msg)
-                else:  # no messages to deliver
-                    break
-        self.logged_in_lock.release()
+                mailbox.lock.acquire()
+                while not mailbox and mailbox.subscriber is subscription:
+                    subscription.wait()
+                if mailbox.subscriber is not subscription:
+                    mailbox.lock.release()
+                    return
+                messages = mailbox.pop_all()
+                mailbox.lock.release()
+                yield from self._streamMessages(subscription.username, mailbox, messages)
+        finally:
+            self._unsubscribe(subscription)
+
+    def _subscribe(self, client_socket, subscription_type):
+        """
+        Subscribe a new subscription_type to the mailbox of the user logged in on client_socket.
+        Returns the subscription, or None if client_socket isn't logged in.
+        """
+        username = self.logged_in.username_for(client_socket)
+        if username is None:
+            return None
+        mailbox = self.undelivered_msg.mailbox(username)
+        subscription = subscription_type(mailbox, username)
+
+        mailbox.lock.acquire()
+        # Check again under the mailbox lock so a log off can't slip in before we subscribe:
+        # log off ends the subscription under the mailbox lock after leaving logged_in
+        still_logged_in = self.logged_in.username_for(client_socket) == username
+        if still_logged_in:
+            mailbox.subscribe(subscription)
+        mailbox.lock.release()
+        if still_logged_in:
+            print(f"Subscribed: {username}")
+            return subscription
+        return None
+
+    def _unsubscribe(self, subscription):
+        """Stop subscription if it is still its mailbox's subscriber."""
+        mailbox = subscription.mailbox
+        mailbox.lock.acquire()
+        mailbox.unsubscribe(subscription)
+        mailbox.lock.release()
+
+    def _streamMessages(self, recipient, mailbox, messages):
+        """Yield messages taken from recipient's mailbox as ChatMessages. If the stream is
+        cancelled part way, the messages not yet streamed go back to the front of the mailbox.
+        The streamed ones are acknowledged in the message log."""
+        sent = 0
+        try:
+            for sender, msg in messages:
+                yield ChatMessage(sender=sender, message=msg)
+                sent += 1
+        finally:
+            if messages:
+                mailbox.lock.acquire()
+                if sent < len(messages):
+                    mailbox.requeue(messages[sent:])
+                if sent:
+                    self._log(RecordType.ACK, recipient, str(sent))
+                mailbox.lock.release()
+
+    def _endSubscription(self, username):
+        """Close the stream subscribed to username's mailbox, if there is one."""
+        mailbox = self.undelivered_msg.mailbox(username)
+        mailbox.lock.acquire()
+        mailbox.unsubscribe()
+        mailbox.lock.release()
 
     def DeleteAccount(self, request: DeleteAccountRequest, context):
         """Delete the account of the logged in user."""
-        self.logged_in_lock.acquire()
-        client_socket = context.peer()
-        if client_socket in self.logged_in.values():
-            # Get requestor's username
-            username = [k for k, v in self.logged_in.items() if v ==
-                        client_socket][0]
+        # Get requestor's username
+        username = self.logged_in.username_for(context.peer())
+        if username is not None:
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
             self.logged_in.pop(username)
-            self.logged_in_lock.release()
+            # USER > ACCOUNT LIST
             self.account_list_lock.acquire()
             self.account_list.remove(username)
             self.account_list_lock.release()
+            sequence_number = self._log(RecordType.DELETE_ACCOUNT, username)
+            user_lock.release()
+            self._waitDurable(sequence_number)
+            self._endSubscription(username)
             status = 'Success'
             print("Account deleted: ", username)
         else:
-            self.logged_in_lock.release()
             status = 'Error: Need to be logged in to delete your account.'
 
         response = DeleteAccountResponse(status=status)
@@ -190,20 +389,20 @@ class ChatServiceServicer(chat_service_pb2_grpc.ChatServiceServicer):
         """Process log in request."""
         client_socket = context.peer()
         username = request.username
-        self.logged_in_lock.acquire()
-        if client_socket in self.logged_in.values():
-            self.logged_in_lock.release()
+        if self.logged_in.has_connection(client_socket):
             status = 'Error: Already logged into an account, please log off first.'
         else:
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
             if (not self._atomicIsAccountCreated(username)):
-                self.logged_in_lock.release()
+                user_lock.release()
                 status = 'Error: Account does not exist.'
-            elif username in self.logged_in.keys():
-                self.logged_in_lock.release()
+            elif username in self.logged_in:
+                user_lock.release()
                 status = 'Error: Someone else is logged into that account.'
             else:
                 self.logged_in[username] = client_socket
-                self.logged_in_lock.release()
+                user_lock.release()
                 status = 'Success'
                 print("Logged in: ", username)
 
@@ -214,17 +413,17 @@ class ChatServiceServicer(chat_service_pb2_grpc.ChatServiceServicer):
 
     def LogOff(self, request: LogOffRequest, context):
         """Log off the account of the logged in user."""
-        self.logged_in_lock.acquire()
         client_socket = context.peer()
-        if client_socket in self.logged_in.values():
-            username = [k for k, v in self.logged_in.items() if v ==
-                        client_socket][0]
-            self.logged_in.pop(username)
-            self.logged_in_lock.release()
+        username = self.logged_in.username_for(client_socket)
+        if username is not None:
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
+            self.logged_in.pop_connection(client_socket)
+            user_lock.release()
+            self._endSubscription(username)
             status = 'Success'
             print("Logged off: ", username)
         else:
-            self.logged_in_lock.release()
             status = 'Error: Need to be logged in to log out of your account.'
 
         response = LogOffResponse(status=status)
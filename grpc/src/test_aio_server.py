@@ -0,0 +1,87 @@
+import asyncio
+import unittest
+import grpc
+import chat_service_pb2
+import chat_service_pb2_grpc
+from aio_server import AsyncChatServiceServicer
+
+TEST_HOST = "127.0.0.1"
+# More concurrent streams than the thread pool server has workers
+NUM_SUBSCRIBERS = 50
+
+
+class AsyncServerTest(unittest.IsolatedAsyncioTestCase):
+    async def asyncSetUp(self):
+        self.servicer = AsyncChatServiceServicer()
+        self.server = grpc.aio.server()
+        chat_service_pb2_grpc.add_ChatServiceServicer_to_server(
+            self.servicer, self.server)
+        self.port = self.server.add_insecure_port(f'{TEST_HOST}:0')
+        await self.server.start()
+        self.channels = []
+
+    async def asyncTearDown(self):
+        for channel in self.channels:
+            await channel.close()
+        await self.server.stop(None)
+
+    async def connect(self, username):
+        # Each client needs its own connection, since the server tells clients apart by peer
+        channel = grpc.aio.insecure_channel(
+            f'{TEST_HOST}:{self.port}', options=[('grpc.use_local_subchannel_pool', 1)])
+        self.channels.append(channel)
+        stub = chat_service_pb2_grpc.ChatServiceStub(channel)
+        response = await stub.CreateAccount(chat_service_pb2.CreateAccountRequest(username=username))
+        self.assertEqual(response.status, 'Success')
+        return stub
+
+    async def test_many_subscribers(self):
+        usernames = [f'user{i}' for i in range(NUM_SUBSCRIBERS)]
+        stubs = [await self.connect(username) for username in usernames]
+        streams = [stub.Subscribe(chat_service_pb2.SubscribeRequest()) for stub in stubs]
+        sender = await self.connect('howie')
+        response = await sender.SendMessageMulti(chat_service_pb2.SendMessageMultiRequest(
+            recipients=usernames, message='hello all'))
+        self.assertEqual(response.status, 'Success')
+
+        messages = await asyncio.wait_for(
+            asyncio.gather(*(stream.read() for stream in streams)), 5)
+        self.assertEqual({(message.sender, message.message) for message in messages},
+                         {('howie', 'hello all')})
+
+        # The server still answers other requests while every stream is open
+        response = await sender.ListAccounts(chat_service_pb2.ListAccountsRequest(query='user1.*'))
+        self.assertEqual(len(response.accounts), 11)
+
+    async def test_log_off_ends_subscription(self):
+        stub = await self.connect('kevin')
+        sender = await self.connect('howie')
+        stream = stub.Subscribe(chat_service_pb2.SubscribeRequest())
+        await sender.SendMessage(chat_service_pb2.SendMessageRequest(recipient='kevin', message='hello'))
+        message = await asyncio.wait_for(stream.read(), 5)
+        self.assertEqual(message.message, 'hello')
+
+        await stub.LogOff(chat_service_pb2.LogOffRequest())
+        self.assertIs(await asyncio.wait_for(stream.read(), 5), grpc.aio.EOF)
+        await sender.SendMessage(chat_service_pb2.SendMessageRequest(recipient='kevin', message='later'))
+        self.assertEqual(list(self.servicer.servicer.undelivered_msg['kevin']), [('howie', 'later')])
+
+    async def test_cancel_unsubscribes(self):
+        stub = await self.connect('kevin')
+        stream = stub.Subscribe(chat_service_pb2.SubscribeRequest())
+        mailbox = self.servicer.servicer.undelivered_msg.mailbox('kevin')
+        for _ in range(50):
+            if mailbox.subscriber is not None:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNotNone(mailbox.subscriber)
+        stream.cancel()
+        for _ in range(50):
+            if mailbox.subscriber is None:
+                break
+            await asyncio.sleep(0.01)
+        self.assertIsNone(mailbox.subscriber)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,6 @@
 
 import unittest
+import grpc
 from io import StringIO
 import chat_service_pb2
 from client import Client
@@ -28,6 +29,24 @@ class ClientTest(unittest.TestCase):
             self.assertEqual(fake_out.getvalue(),
                              "\nMessage from kevin: Hello\n\nMessage from joseph: Hello2\n> Enter command (type 'help' for list of commands): \n")
 
+    def test_subscribe_prints_messages(self):
+        self.stub.Subscribe.return_value = message_generator(
+            [chat_service_pb2.ChatMessage(sender="kevin", message="Hello")])
+        self.client.username = "howie"
+        self.client.logged_in_event.set()
+        with patch('sys.stdout', new=StringIO()) as fake_out:
+            self.client._subscribe_and_print_messages()
+            self.assertEqual(fake_out.getvalue(),
+                             "\nMessage from kevin: Hello\nhowie > Enter command (type 'help' for list of commands): \n")
+
+    def test_subscribe_unimplemented_falls_back(self):
+        error = grpc.RpcError()
+        error.code = MagicMock(return_value=grpc.StatusCode.UNIMPLEMENTED)
+        self.stub.Subscribe.side_effect = error
+        self.client.logged_in_event.set()
+        self.client._subscribe_and_print_messages()
+        self.assertFalse(self.client.subscribe_supported)
+
     def test_create_account_success(self):
         username = "howie"
         self.stub.CreateAccount.return_value = chat_service_pb2.CreateAccountResponse(
@@ -77,6 +96,20 @@ class ClientTest(unittest.TestCase):
             self.assertEqual(fake_out.getvalue().strip(),
                              f'Account search results:\nhowie\nhowie2')
 
+    def test_list_accounts_multiple_pages(self):
+        query = ".*"
+        self.stub.ListAccounts.side_effect = [
+            chat_service_pb2.ListAccountsResponse(
+                status="Success", accounts=['howie'], next_cursor='howie'),
+            chat_service_pb2.ListAccountsResponse(
+                status="Success", accounts=['howie2'])]
+        with patch('builtins.input', return_value=query), patch('sys.stdout', new=StringIO()) as fake_out:
+            self.client._list_accounts()
+            self.assertEqual(fake_out.getvalue().strip(),
+                             f'Account search results:\nhowie\nhowie2')
+        self.assertEqual(
+            self.stub.ListAccounts.call_args[0][0].cursor, 'howie')
+
     def test_list_accounts_fail(self):
         query = "["
         self.stub.ListAccounts.return_value = chat_service_pb2.ListAccountsResponse(
@@ -95,6 +128,17 @@ class ClientTest(unittest.TestCase):
             self.assertEqual(fake_out.getvalue().strip(),
                              f'Message sent successfully.')
 
+    def test_send_message_multiple_recipients(self):
+        self.stub.SendMessageMulti.return_value = chat_service_pb2.SendMessageMultiResponse(
+            status="Success", invalid_recipients=['nobody'])
+        with patch('builtins.input', side_effect=['kevin, nobody,howie', 'hi']), \
+                patch('sys.stdout', new=StringIO()) as fake_out:
+            self.client._send_message()
+            self.assertEqual(fake_out.getvalue().strip(),
+                             'These recipients do not exist: nobody\nMessage sent successfully.')
+        request = self.stub.SendMessageMulti.call_args[0][0]
+        self.assertEqual(list(request.recipients), ['kevin', 'nobody', 'howie'])
+
     def test_logoff_success(self):
         self.stub.LogOff.return_value = chat_service_pb2.LogOffResponse(
             status="Success")
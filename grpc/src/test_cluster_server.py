@@ -0,0 +1,145 @@
+import itertools
+import socket
+import unittest
+import chat_service_pb2
+from cluster_server import ClusterChatServiceServicer
+# The cluster messages come from common, which importing cluster_server puts on the path
+from cluster_pb2 import Member, Membership
+from unittest.mock import MagicMock
+
+TEST_HOST = "127.0.0.1"
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((TEST_HOST, 0))
+        return s.getsockname()[1]
+
+
+def start_node(seed=None):
+    node = ClusterChatServiceServicer(f'{TEST_HOST}:{free_port()}', f'{TEST_HOST}:{free_port()}')
+    node.joinCluster(seed)
+    return node
+
+
+def context_for(peer):
+    context = MagicMock()
+    context.peer.return_value = peer
+    return context
+
+
+def owned_by(node, prefix):
+    """The first username starting with prefix that the node owns"""
+    i = 0
+    while not node.cluster.is_local(f'{prefix}{i}'):
+        i += 1
+    return f'{prefix}{i}'
+
+
+class ClusterServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        first = start_node()
+        cls.nodes = [first, start_node(first.cluster.address)]
+
+    @classmethod
+    def tearDownClass(cls):
+        for node in cls.nodes:
+            node.cluster.stop()
+
+    def test_create_account_goes_to_owner(self):
+        username = owned_by(self.nodes[1], 'owned')
+        response = self.nodes[0].CreateAccount(
+            chat_service_pb2.CreateAccountRequest(username=username), context_for('owned_socket'))
+        self.assertEqual(response.status, f'Error: That account is served by '
+                                          f'{self.nodes[1].cluster.members[self.nodes[1].cluster.address]}, connect there instead.')
+        response = self.nodes[1].CreateAccount(
+            chat_service_pb2.CreateAccountRequest(username=username), context_for('owned_socket'))
+        self.assertEqual(response.status, 'Success')
+
+    def test_send_and_list_across_nodes(self):
+        sender, recipient = owned_by(self.nodes[0], 'sender'), owned_by(self.nodes[1], 'recipient')
+        self.nodes[0].CreateAccount(chat_service_pb2.CreateAccountRequest(username=sender), context_for('sender_socket'))
+        self.nodes[1].account_list.add(recipient)
+        response = self.nodes[0].SendMessage(chat_service_pb2.SendMessageRequest(
+            recipient=recipient, message='hi'), context_for('sender_socket'))
+        self.assertEqual(response.status, 'Success')
+        self.assertEqual(list(self.nodes[1].undelivered_msg[recipient]), [(sender, 'hi')])
+        missing = owned_by(self.nodes[1], 'nobody')
+        response = self.nodes[0].SendMessageMulti(chat_service_pb2.SendMessageMultiRequest(
+            recipients=[missing, recipient], message='all'), context_for('sender_socket'))
+        self.assertEqual(response.status, 'Success')
+        self.assertEqual(list(response.invalid_recipients), [missing])
+        self.assertEqual(list(self.nodes[1].undelivered_msg[recipient]), [(sender, 'hi'), (sender, 'all')])
+
+        response = self.nodes[1].ListAccounts(chat_service_pb2.ListAccountsRequest(query='(sender|recipient)'),
+                                              context_for('lister'))
+        self.assertEqual(list(response.accounts), sorted([sender, recipient]))
+        pages = list(self.nodes[1].StreamAccounts(chat_service_pb2.ListAccountsRequest(
+            query='(sender|recipient)', limit=1), context_for('lister')))
+        self.assertEqual([list(page.accounts) for page in pages], [[name] for name in sorted([sender, recipient])])
+
+    def test_rebalance_on_join_and_leave(self):
+        usernames = [f'mover{i}' for i in range(30)]
+        for username in usernames:
+            owner = next(node for node in self.nodes if node.cluster.is_local(username))
+            owner.account_list.add(username)
+            owner.undelivered_msg.mailbox(username).append(('kevin', f'for {username}'))
+        joined = start_node(self.nodes[0].cluster.address)
+        moved = [username for username in usernames if joined.cluster.is_local(username)]
+        self.assertTrue(moved)
+        for username in usernames:
+            for node in self.nodes + [joined]:
+                self.assertEqual(username in node.account_list, node.cluster.is_local(username))
+        self.assertEqual(list(joined.undelivered_msg[moved[0]]), [('kevin', f'for {moved[0]}')])
+
+        joined.leaveCluster()
+        self.assertEqual(len(joined.account_list), 0)
+        for username in usernames:
+            owner = next(node for node in self.nodes if node.cluster.is_local(username))
+            self.assertEqual(list(owner.undelivered_msg[username]), [('kevin', f'for {username}')])
+
+    def test_remove_keeps_mail_queued_since_export(self):
+        node = start_node()
+        for username in ['quiet', 'busy']:
+            node.account_list.add(username)
+            node.undelivered_msg.mailbox(username).append(('kevin', f'for {username}'))
+        accounts, messages = node.node_export(lambda username: False)
+        self.assertEqual(sorted(accounts), ['busy', 'quiet'])
+        self.assertEqual(sorted(messages), [('busy', 'kevin', 'for busy'), ('quiet', 'kevin', 'for quiet')])
+        # Exporting removes nothing, and mail keeps arriving until the new owner has the users
+        node.undelivered_msg.mailbox('busy').append(('kevin', 'late'))
+
+        node.node_remove({'busy': 1, 'quiet': 1})
+        self.assertEqual(list(node.account_list), ['busy'])
+        self.assertEqual(list(node.undelivered_msg['busy']), [('kevin', 'late')])
+        node.cluster.stop()
+
+    def test_requests_answered_when_a_node_is_down(self):
+        node = start_node()
+        # Nothing answers for the new member
+        unreachable = f'{TEST_HOST}:{free_port()}'
+        node.cluster.UpdateMembership(Membership(epoch=node.cluster.epoch + 1, members=[
+            Member(address=node.cluster.address, client_address=node.cluster.members[node.cluster.address]),
+            Member(address=unreachable, client_address=unreachable)]), None)
+        sender, local = owned_by(node, 'lonely'), owned_by(node, 'near')
+        remote = next(f'far{i}' for i in itertools.count() if not node.cluster.is_local(f'far{i}'))
+        node.account_list.add(local)
+        node.CreateAccount(chat_service_pb2.CreateAccountRequest(username=sender), context_for('lonely_socket'))
+
+        response = node.SendMessage(chat_service_pb2.SendMessageRequest(recipient=remote, message='hi'),
+                                    context_for('lonely_socket'))
+        self.assertEqual(response.status, "Error: The recipient's server is unavailable, try again later.")
+        # The recipients of nodes that are up still get the message
+        response = node.SendMessageMulti(chat_service_pb2.SendMessageMultiRequest(
+            recipients=[remote, local], message='hi'), context_for('lonely_socket'))
+        self.assertEqual(response.status, 'Success')
+        self.assertEqual(list(response.invalid_recipients), [remote])
+        self.assertEqual(list(node.undelivered_msg[local]), [(sender, 'hi')])
+        response = node.ListAccounts(chat_service_pb2.ListAccountsRequest(query=''), context_for('lonely_socket'))
+        self.assertEqual(response.status, 'Error: Some accounts are unavailable, try again later.')
+        node.cluster.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
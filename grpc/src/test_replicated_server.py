@@ -0,0 +1,90 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+import chat_service_pb2
+from replicated_server import READ_ONLY_STATUS, ReplicatedChatServiceServicer
+from test_cluster_server import TEST_HOST, context_for, free_port
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'common'))
+from message_log import MessageLog  # noqa: E402
+
+
+def start_node(message_log=None, primary=None, failover_timeout=None):
+    node = ReplicatedChatServiceServicer(f'{TEST_HOST}:{free_port()}', primary, message_log, failover_timeout)
+    node.startReplication()
+    return node
+
+
+class ReplicatedServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.message_log = MessageLog(os.path.join(self.directory.name, 'log'), sync_replicas=1)
+        self.primary = start_node(self.message_log)
+        self.primary.CreateAccount(chat_service_pb2.CreateAccountRequest(username='kevin'), context_for('kevin_socket'))
+        self.primary.SendMessage(chat_service_pb2.SendMessageRequest(recipient='kevin', message='note'),
+                                 context_for('kevin_socket'))
+        self.nodes = [self.primary]
+
+    def tearDown(self):
+        for node in self.nodes:
+            node.stopReplication()
+        self.message_log.close()
+        self.directory.cleanup()
+
+    def start_replica(self, failover_timeout=None):
+        replica = start_node(primary=self.primary.replication.address, failover_timeout=failover_timeout)
+        self.nodes.append(replica)
+        self.assertTrue(replica.replication.caught_up.wait(5))
+        for _ in range(250):
+            if any(follower.caught_up for follower in self.message_log.followers):
+                break
+            time.sleep(0.02)
+        return replica
+
+    def test_replica_serves_lists(self):
+        replica = self.start_replica()
+        self.assertEqual(list(replica.account_list), ['kevin'])
+        self.assertEqual(list(replica.undelivered_msg['kevin']), [('kevin', 'note')])
+        self.primary.CreateAccount(chat_service_pb2.CreateAccountRequest(username='howie'), context_for('howie_socket'))
+        self.primary.SendMessage(chat_service_pb2.SendMessageRequest(recipient='kevin', message='hello'),
+                                 context_for('howie_socket'))
+        self.assertEqual(list(replica.undelivered_msg['kevin']), [('kevin', 'note'), ('howie', 'hello')])
+
+        response = replica.ListAccounts(chat_service_pb2.ListAccountsRequest(query=''), context_for('lister'))
+        self.assertEqual(list(response.accounts), ['howie', 'kevin'])
+        response = replica.CreateAccount(chat_service_pb2.CreateAccountRequest(username='joseph'),
+                                         context_for('joseph_socket'))
+        self.assertEqual(response.status, READ_ONLY_STATUS)
+        response = replica.LogIn(chat_service_pb2.LogInRequest(username='howie'), context_for('lister'))
+        self.assertEqual(response.status, READ_ONLY_STATUS)
+
+    def test_failover(self):
+        replica = self.start_replica(failover_timeout=1)
+        self.primary.stopReplication()
+        for _ in range(250):
+            if not replica.replication.is_replica():
+                break
+            time.sleep(0.02)
+        self.assertFalse(replica.replication.is_replica())
+        response = replica.CreateAccount(chat_service_pb2.CreateAccountRequest(username='howie'),
+                                         context_for('howie_socket'))
+        self.assertEqual(response.status, 'Success')
+        response = replica.SendMessage(chat_service_pb2.SendMessageRequest(recipient='kevin', message='hello'),
+                                       context_for('howie_socket'))
+        self.assertEqual(response.status, 'Success')
+        self.assertEqual(list(replica.undelivered_msg['kevin']), [('kevin', 'note'), ('howie', 'hello')])
+
+    def test_no_failover_without_the_primary_state(self):
+        # Nothing answers at the primary's address, so the replica never gets its state
+        replica = start_node(primary=f'{TEST_HOST}:{free_port()}', failover_timeout=0.2)
+        self.nodes.append(replica)
+        time.sleep(1)
+        self.assertTrue(replica.replication.is_replica())
+        self.assertFalse(replica.replication.caught_up.is_set())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,18 @@
 
+import os
+import sys
+import tempfile
 import unittest
 import threading
 import chat_service_pb2
 from server import ChatServiceServicer
 from unittest.mock import MagicMock
 
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', '..', 'common'))
+from message_log import MessageLog  # noqa: E402
+from storage import SqliteStorage  # noqa: E402
+
 TEST_HOST = "127.0.0.1"
 TEST_PORT = 6000
 
@@ -12,8 +20,8 @@ TEST_PORT = 6000
 class ServerTest(unittest.TestCase):
     def setUp(self):
         self.server = ChatServiceServicer()
-        self.server.account_list.append("kevin")
-        self.server.account_list.append("howie")
+        self.server.account_list.add("kevin")
+        self.server.account_list.add("howie")
         kevin_socket = "kevin_socket"
         howie_socket = "howie_socket"
         self.server.logged_in["kevin"] = kevin_socket
@@ -93,6 +101,27 @@ class ServerTest(unittest.TestCase):
         self.assertEqual(response.status, 'Success')
         self.assertEqual(response.accounts, ['kevin'])
 
+    def test_list_account_paginated(self):
+        context = MagicMock()
+        response = self.server.ListAccounts(
+            chat_service_pb2.ListAccountsRequest(query='.*', limit=1), context)
+        self.assertEqual(response.accounts, ['howie'])
+        self.assertEqual(response.next_cursor, 'howie')
+        response = self.server.ListAccounts(
+            chat_service_pb2.ListAccountsRequest(query='.*', limit=1, cursor=response.next_cursor), context)
+        self.assertEqual(response.accounts, ['kevin'])
+        self.assertEqual(response.next_cursor, '')
+
+    def test_stream_accounts(self):
+        context = MagicMock()
+        pages = list(self.server.StreamAccounts(
+            chat_service_pb2.ListAccountsRequest(query='.*', limit=1), context))
+        self.assertEqual([list(page.accounts) for page in pages], [['howie'], ['kevin']])
+        self.assertEqual(pages[-1].next_cursor, '')
+        pages = list(self.server.StreamAccounts(
+            chat_service_pb2.ListAccountsRequest(query='['), context))
+        self.assertEqual(pages[0].status, 'Error: regex is malformed.')
+
     def test_list_account_regex_bad(self):
         query = '['
         context = MagicMock()
@@ -110,6 +139,26 @@ class ServerTest(unittest.TestCase):
         self.assertEqual(response.status, 'Success')
         self.assertTrue("kevin" in self.server.undelivered_msg.keys())
 
+    def test_send_msg_multi(self):
+        self.server.account_list.add("joseph")
+        context = MagicMock()
+        context.peer.return_value = 'howie_socket'
+        response = self.server.SendMessageMulti(chat_service_pb2.SendMessageMultiRequest(
+            recipients=['kevin', 'nobody', 'joseph', 'kevin'], message='hello all'), context)
+        self.assertEqual(response.status, 'Success')
+        self.assertEqual(list(response.invalid_recipients), ['nobody'])
+        self.assertEqual(list(self.server.undelivered_msg['kevin']), [('howie', 'hello all')])
+        # Every recipient's queue shares the same message
+        self.assertIs(self.server.undelivered_msg['kevin'][0], self.server.undelivered_msg['joseph'][0])
+
+    def test_send_msg_multi_no_valid_recipient(self):
+        context = MagicMock()
+        context.peer.return_value = 'howie_socket'
+        response = self.server.SendMessageMulti(chat_service_pb2.SendMessageMultiRequest(
+            recipients=['nobody'], message='hello'), context)
+        self.assertEqual(response.status, 'Error: None of the recipients exist.')
+        self.assertEqual(list(response.invalid_recipients), ['nobody'])
+
     def test_send_msg_failure_no_recipient(self):
         recipient = 'joseph'
         message = 'hello'
@@ -162,7 +211,89 @@ class ServerTest(unittest.TestCase):
         for i, msg_info in enumerate(self.server.GetMessages(
                 chat_service_pb2.GetMessagesRequest(), context)):
             self.assertEqual((msg_info.sender, msg_info.message), messages[i])
+        self.assertFalse('kevin' in self.server.undelivered_msg)
+
+    def test_get_msg_cancelled_requeues(self):
+        messages = [('howie', f'hello {i}') for i in range(5)]
+        self.server.undelivered_msg['kevin'] = messages[:]
+        context = MagicMock()
+        context.peer.return_value = 'kevin_socket'
+        stream = self.server.GetMessages(chat_service_pb2.GetMessagesRequest(), context)
+        next(stream)
+        next(stream)
+        # Client went away after two messages; the last one handed to gRPC may not
+        # have reached it, so it is kept as well
+        stream.close()
+        self.assertEqual(list(self.server.undelivered_msg['kevin']), messages[1:])
+
+    def test_subscribe_pushes_until_log_off(self):
+        self.server.undelivered_msg['kevin'] = [('howie', 'waiting')]
+        kevin_context = MagicMock()
+        kevin_context.peer.return_value = 'kevin_socket'
+        howie_context = MagicMock()
+        howie_context.peer.return_value = 'howie_socket'
+        stream = self.server.Subscribe(chat_service_pb2.SubscribeRequest(), kevin_context)
+        self.assertEqual(next(stream).message, 'waiting')
+
+        # The stream waits for the next message instead of ending
+        sender = threading.Timer(0.1, lambda: self.server.SendMessage(
+            chat_service_pb2.SendMessageRequest(recipient='kevin', message='hello'), howie_context))
+        sender.start()
+        self.assertEqual(next(stream).message, 'hello')
+
+        # Logging off ends it, leaving later messages for the next log in
+        log_off = threading.Timer(0.1, lambda: self.server.LogOff(
+            chat_service_pb2.LogOffRequest(), kevin_context))
+        log_off.start()
+        self.assertEqual(list(stream), [])
+        self.server.SendMessage(chat_service_pb2.SendMessageRequest(
+            recipient='kevin', message='later'), howie_context)
+        self.assertEqual(list(self.server.undelivered_msg['kevin']), [('howie', 'later')])
+
+    def test_subscribe_not_logged_in(self):
+        context = MagicMock()
+        context.peer.return_value = 'joseph_socket'
+        self.assertEqual(list(self.server.Subscribe(
+            chat_service_pb2.SubscribeRequest(), context)), [])
+
+    def check_survives_restart(self, start, stop):
+        """Queues mail and reads part of it across a restart. start() starts a servicer on the
+        same storage every time, and stop(server) shuts it down."""
+        server = start()
+        joseph_context = MagicMock()
+        joseph_context.peer.return_value = 'joseph_socket'
+        howie_context = MagicMock()
+        howie_context.peer.return_value = 'howie_socket'
+        server.CreateAccount(chat_service_pb2.CreateAccountRequest(username='joseph'), joseph_context)
+        server.CreateAccount(chat_service_pb2.CreateAccountRequest(username='howie'), howie_context)
+        server.SendMessageMulti(chat_service_pb2.SendMessageMultiRequest(
+            recipients=['joseph', 'howie'], message='hello all'), howie_context)
+        server.SendMessage(chat_service_pb2.SendMessageRequest(
+            recipient='joseph', message='hello'), howie_context)
+        # joseph reads the first message, then the stream is cancelled
+        stream = server.GetMessages(chat_service_pb2.GetMessagesRequest(), joseph_context)
+        next(stream)
+        next(stream)
+        stream.close()
+        stop(server)
+
+        server = start()
+        self.assertEqual(list(server.account_list), ['howie', 'joseph'])
+        self.assertEqual(list(server.undelivered_msg['joseph']), [('howie', 'hello')])
+        self.assertEqual(list(server.undelivered_msg['howie']), [('howie', 'hello all')])
+        stop(server)
+
+    def test_message_log_recovery(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'log')
+            self.check_survives_restart(lambda: ChatServiceServicer(MessageLog(path)),
+                                        lambda server: server.message_log.close())
 
+    def test_sqlite_storage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'chat.db')
+            self.check_survives_restart(lambda: ChatServiceServicer(storage=SqliteStorage(path)),
+                                        lambda server: server.storage.close())
 
 if __name__ == '__main__':
     unittest.main()
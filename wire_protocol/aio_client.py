@@ -0,0 +1,175 @@
+import asyncio
+from typing import Dict, List, Optional, Tuple
+
+from protocol import (
+    MAX_MESSAGE_ID,
+    OPERATION_CODES,
+    RECEIVE_BUFFER_SIZE,
+    OperationCode,
+    PacketParser,
+    protocol_instance
+)
+
+# Requests sent but not answered yet, after which callers wait for a response first.
+# It has to stay below the number of message ids, so no two requests in flight share one.
+DEFAULT_MAX_IN_FLIGHT = 1024
+
+
+class AsyncClient:
+    """An asyncio client for programs, such as bots and integrations, rather than people.
+
+    Every call sends its request right away and awaits the response, so many calls from
+    concurrent tasks are pipelined on the one connection instead of each waiting for the
+    previous response. Requests are numbered consecutively, wrapping around with the
+    message id field, and the server echoes each request's id in its response, which is
+    how responses are matched to requests. Messages the server pushes to the logged in
+    user have ids of their own and are queued for receive.
+
+    Calls return the response's arguments, e.g. {'status': 'Success', 'username': 'kevin'};
+    failed requests have a status starting with 'Error:' like in the interactive client.
+    """
+
+    def __init__(self, host, port, protocol=protocol_instance, max_in_flight=DEFAULT_MAX_IN_FLIGHT):
+        """
+        Args:
+            host (str): The server's host
+            port (int): The server's port
+            protocol (protocol.Protocol, optional): Protocol, and so version, to speak. Defaults to protocol_instance.
+            max_in_flight (int, optional): Requests that may be waiting for a response at once.
+                Defaults to DEFAULT_MAX_IN_FLIGHT.
+        """
+        if not 0 < max_in_flight <= MAX_MESSAGE_ID:
+            raise ValueError(f"max_in_flight must be between 1 and {MAX_MESSAGE_ID}")
+        self.host = host
+        self.port = port
+        self.protocol = protocol
+        self.reader = None
+        self.writer = None
+        self.listener = None
+        self.message_counter = 0
+        # Map of message id to (expected response operation code, future of its arguments)
+        self.pending: Dict[int, Tuple[int, asyncio.Future]] = {}
+        self.in_flight = asyncio.Semaphore(max_in_flight)
+        # (sender, message) of every message pushed by the server, oldest first
+        self.received: asyncio.Queue = asyncio.Queue()
+        self.error: Optional[Exception] = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.listener = asyncio.create_task(self._listen())
+
+    async def close(self):
+        if self.writer is None:
+            return
+        self.writer.close()
+        try:
+            await self.writer.wait_closed()
+        except ConnectionError:
+            pass
+        await self.listener
+
+    async def __aenter__(self):
+        await self.connect()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def create_account(self, username: str) -> Dict[str, str]:
+        """Creates an account and logs into it"""
+        return await self.request('CREATE_ACCOUNT', {'username': username})
+
+    async def login(self, username: str) -> Dict[str, str]:
+        return await self.request('LOG_IN', {'username': username})
+
+    async def log_off(self) -> Dict[str, str]:
+        return await self.request('LOG_OFF')
+
+    async def delete_account(self) -> Dict[str, str]:
+        return await self.request('DELETE_ACCOUNT')
+
+    async def send_message(self, recipient: str, message: str) -> Dict[str, str]:
+        return await self.request('SEND_MESSAGE', {'recipient': recipient, 'message': message})
+
+    async def send_message_multi(self, recipients: List[str], message: str) -> Dict[str, str]:
+        """Sends one message to several recipients. The response's invalid_recipients are
+        joined by ';'."""
+        return await self.request('SEND_MESSAGE_MULTI', {'recipients': ';'.join(recipients), 'message': message})
+
+    async def list_accounts(self, query: str = '', limit: Optional[int] = None,
+                            cursor: Optional[str] = None) -> Dict[str, str]:
+        """Lists a page of the accounts matching query. The response's accounts are joined
+        by ';', and its next_cursor, if not empty, is passed as cursor to get the next page."""
+        args = {'query': query}
+        if limit is not None:
+            args['limit'] = str(limit)
+        if cursor:
+            args['cursor'] = cursor
+        return await self.request('LIST_ACCOUNTS', args)
+
+    async def receive(self) -> Tuple[str, str]:
+        """Waits for the next message pushed to the logged in user
+
+        Returns:
+            Tuple[str, str]: The sender and the message
+        """
+        return await self.received.get()
+
+    async def request(self, operation: str, args: Dict[str, str] = {}) -> Dict[str, str]:
+        """Sends a request and waits for its response
+
+        Args:
+            operation (str): The request operation, e.g. 'SEND_MESSAGE'
+            args (dict, optional): The request's arguments. Defaults to {}.
+
+        Raises:
+            ConnectionError: The connection closed before the response arrived
+
+        Returns:
+            Dict[str, str]: The response's arguments
+        """
+        async with self.in_flight:
+            if self.error is not None:
+                raise self.error
+            message_id = self.message_counter & MAX_MESSAGE_ID
+            self.message_counter += 1
+            response = asyncio.get_running_loop().create_future()
+            self.pending[message_id] = (OperationCode[operation + '_RESPONSE'].value, response)
+            # Nothing is awaited between taking the id and writing, so requests go out in id order
+            self.writer.writelines(self.protocol.encode(operation, message_id, args))
+            await self.writer.drain()
+            return await response
+
+    async def _listen(self):
+        """Reads responses and pushed messages until the connection closes, then fails the
+        requests still waiting"""
+        parser = PacketParser(self.protocol)
+        try:
+            while True:
+                data = await self.reader.read(RECEIVE_BUFFER_SIZE)
+                if not data:
+                    break
+                for metadata, msg, _ in parser.feed(data):
+                    self._dispatch(metadata, msg)
+            self.error = ConnectionError('Connection closed by the server')
+        except (ConnectionError, ValueError) as e:
+            self.error = ConnectionError(f'Connection lost: {e}')
+        for _, response in self.pending.values():
+            if not response.done():
+                response.set_exception(self.error)
+        self.pending.clear()
+
+    def _dispatch(self, metadata, msg):
+        operation_code = metadata.operation_code.value
+        args = self.protocol.parse_data(operation_code, msg, metadata.version)
+        if operation_code == OperationCode.RECV_MESSAGE.value:
+            # Pushed messages aren't answers to a request, whatever their message id
+            self.received.put_nowait((args['sender'], args['message']))
+            return
+        expected, response = self.pending.get(metadata.message_id, (None, None))
+        if expected != operation_code:
+            print(f"Ignoring unexpected {OPERATION_CODES[operation_code].name} for message {metadata.message_id}")
+            return
+        del self.pending[metadata.message_id]
+        if not response.done():
+            response.set_result(args)
@@ -0,0 +1,350 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from unittest.mock import MagicMock
+
+from aio_client import AsyncClient
+from protocol import METADATA_LENGTH, OperationCode, PacketParser, binary_protocol_instance, protocol_instance
+from server import Server
+from shard_server import shard_for, start_shards
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from message_log import MessageLog, RecordType  # noqa: E402
+from storage import MemoryStorage, SqliteStorage  # noqa: E402
+
+# Size of each simulated recv call
+CHUNK_SIZE = 65536
+
+
+def legacy_parse(chunks):
+    """The reassembly loop read_packets used before PacketParser existed: it concatenates the
+    leftover bytes with every received chunk, slices a new bytes object per packet and grows
+    the running message with string +=. Kept here only as the baseline for bench_parser.
+    """
+    count = 0
+    curr_msg_id = -1
+    curr_op = -1
+    left_over_packet = bytes()
+    running_msg = ""
+    for received_data in chunks:
+        curr_msg_to_parse = left_over_packet + received_data
+        while len(curr_msg_to_parse) >= METADATA_LENGTH:
+            metadata = protocol_instance.parse_metadata(curr_msg_to_parse)
+            if len(curr_msg_to_parse[METADATA_LENGTH:]) < metadata.payload_size:
+                break
+            incomplete_msg = curr_msg_to_parse[METADATA_LENGTH:
+                                               metadata.payload_size + METADATA_LENGTH].decode('ascii')
+            if curr_msg_id == metadata.message_id and curr_op == metadata.operation_code:
+                running_msg += incomplete_msg
+            else:
+                running_msg = incomplete_msg
+                curr_msg_id = metadata.message_id
+                curr_op = metadata.operation_code
+            if running_msg[-1] == '\n':
+                count += 1
+                curr_msg_id = -1
+                curr_op = -1
+                running_msg = ''
+            curr_msg_to_parse = curr_msg_to_parse[metadata.payload_size +
+                                                  METADATA_LENGTH:]
+        left_over_packet = curr_msg_to_parse
+    return count
+
+
+def packet_parser_parse(chunks):
+    parser = PacketParser(protocol_instance)
+    count = 0
+    for chunk in chunks:
+        count += len(parser.feed(chunk))
+    return count
+
+
+def bench_parser(message_length, message_count):
+    """Measures how many bytes/second each parser reassembles from a stream of SEND_MESSAGE
+    messages with message_length characters each, received in CHUNK_SIZE chunks.
+    """
+    stream = b''.join(packet for i in range(message_count) for packet in protocol_instance.encode(
+        'SEND_MESSAGE', i, {'recipient': 'kevin', 'message': 'x' * message_length}))
+    chunks = [stream[i:i + CHUNK_SIZE]
+              for i in range(0, len(stream), CHUNK_SIZE)]
+    results = {}
+    for name, parse in [('legacy', legacy_parse), ('PacketParser', packet_parser_parse)]:
+        start = time.perf_counter()
+        assert parse(chunks) == message_count
+        results[name] = len(stream) / (time.perf_counter() - start)
+    print(f"Parsing {message_count} messages of {message_length} bytes: " + ", ".join(
+        f"{name} {rate / 1e6:.1f} MB/s" for name, rate in results.items()) +
+        f" ({results['PacketParser'] / results['legacy']:.1f}x)")
+
+
+def bench_header(count):
+    """Measures how many headers/second the header codec encodes and decodes."""
+    operation = OperationCode.SEND_MESSAGE.value
+    encode_header = protocol_instance.encode_header
+    start = time.perf_counter()
+    for i in range(count):
+        encode_header(operation, 100, 100, i & 0xFFFF)
+    encode_rate = count / (time.perf_counter() - start)
+
+    header = bytes(protocol_instance._encode(operation, 1, 'x\n')[0])
+    parse_metadata = protocol_instance.parse_metadata
+    start = time.perf_counter()
+    for _ in range(count):
+        parse_metadata(header)
+    decode_rate = count / (time.perf_counter() - start)
+    print(f"Headers: {encode_rate / 1e6:.2f}M encodes/s, {decode_rate / 1e6:.2f}M decodes/s")
+
+
+def bench_payload_size():
+    """Compares the encoded size of typical messages in protocol versions 1 and 2."""
+    for operation, args in [('SEND_MESSAGE', {'recipient': 'kevin', 'message': 'hello'}),
+                            ('RECV_MESSAGE', {'sender': 'kevin', 'message': 'x' * 100}),
+                            ('LIST_ACCOUNTS', {'query': 'kev', 'limit': 100}),
+                            ('LOG_OFF', {})]:
+        v1, v2 = [sum(map(len, encoder.encode(operation, 0, args)))
+                  for encoder in (protocol_instance, binary_protocol_instance)]
+        print(f"{operation}: version 1 {v1} bytes, version 2 {v2} bytes")
+
+
+def bench_binary_decode(count):
+    """Measures how many SEND_MESSAGE payloads/second each protocol version decodes."""
+    args = {'recipient': 'kevin', 'message': 'hello there'}
+    operation = OperationCode.SEND_MESSAGE.value
+    for encoder, strip in [(protocol_instance, 1), (binary_protocol_instance, 0)]:
+        packet = encoder.encode('SEND_MESSAGE', 0, args)[0]
+        data = bytes(packet[METADATA_LENGTH:len(packet) - strip])
+        if encoder.version == 1:
+            data = data.decode('ascii')
+        start = time.perf_counter()
+        for _ in range(count):
+            encoder.parse_data(operation, data, encoder.version)
+        print(f"Version {encoder.version} payloads: {count / (time.perf_counter() - start) / 1e6:.2f}M decodes/s")
+
+
+def bench_state_contention(operations_per_thread):
+    """Measures server request throughput when 1 to 8 threads, each logged in as its own user,
+    send messages to offline recipients. Every request only takes per-user and per-mailbox
+    locks, so added threads shouldn't make the others slower.
+    """
+    for num_threads in [1, 2, 4, 8]:
+        server = Server('127.0.0.1', 0, protocol_instance)
+        connections = [(MagicMock(), threading.Lock()) for _ in range(num_threads)]
+        for i, connection in enumerate(connections):
+            server.account_list.add(f'recipient{i}')
+            server.process_create_account({'username': f'sender{i}'}, *connection)
+
+        def worker(i):
+            for j in range(operations_per_thread):
+                server.process_send_msg({'recipient': f'recipient{i}', 'message': 'hi'}, *connections[i])
+                if j % 10 == 0:
+                    server.process_logoff(*connections[i])
+                    server.process_login({'username': f'sender{i}'}, *connections[i])
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        rate = num_threads * operations_per_thread / (time.perf_counter() - start)
+        print(f"{num_threads} threads: {rate / 1e3:.0f}k sends/s")
+
+
+def bench_group_commit(records_per_thread):
+    """Measures how many durable message log appends/second 1 to 8 threads get when each
+    waits for its record to be fsynced, and how many records share each fsync.
+    """
+    for num_threads in [1, 8]:
+        with tempfile.TemporaryDirectory() as directory:
+            log = MessageLog(os.path.join(directory, 'log'))
+            fsyncs = [0]
+            fsync = os.fsync
+
+            def counting_fsync(fd):
+                fsyncs[0] += 1
+                fsync(fd)
+            os.fsync = counting_fsync
+
+            def worker(i):
+                for j in range(records_per_thread):
+                    log.wait(log.append(RecordType.ENQUEUE, 'kevin', f'sender{i}', 'hi'))
+            threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+            start = time.perf_counter()
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+            elapsed = time.perf_counter() - start
+            os.fsync = fsync
+            log.close()
+        records = num_threads * records_per_thread
+        print(f"{num_threads} threads: {records / elapsed:.0f} durable appends/s, "
+              f"{records / fsyncs[0]:.1f} records per fsync")
+
+
+def bench_recovery(message_count):
+    """Measures startup time with message_count messages pending for 1000 users, replaying
+    the whole log versus loading a snapshot and replaying only the last segment.
+    """
+    with tempfile.TemporaryDirectory() as directory:
+        log = MessageLog(directory, segment_size=message_count * 10,
+                         snapshot_segments=message_count)
+        for i in range(1000):
+            log.append(RecordType.CREATE_ACCOUNT, f'user{i}')
+        for i in range(message_count):
+            log.append(RecordType.ENQUEUE, f'user{i % 1000}', 'kevin', 'hello there')
+        log.close()
+        for name in ['log replay', 'snapshot']:
+            if name == 'snapshot':
+                start = time.perf_counter()
+                log.compact(log.segment - 1)
+                print(f"Snapshot written in {time.perf_counter() - start:.2f}s")
+            start = time.perf_counter()
+            server = Server('127.0.0.1', 0, protocol_instance, message_log=MessageLog(directory))
+            print(f"Recovering {message_count} messages from {name}: {time.perf_counter() - start:.2f}s")
+            server.message_log.close()
+
+
+def bench_storage(message_count):
+    """Measures how many messages/second each storage engine queues for 100 offline users and
+    then drains, and, in a second pass under tracemalloc, how much memory the queued messages take.
+    """
+    for name in ['memory', 'sqlite']:
+        with tempfile.TemporaryDirectory() as directory:
+            storage = SqliteStorage(os.path.join(directory, 'chat.db')) if name == 'sqlite' else MemoryStorage()
+            server = Server('127.0.0.1', 0, protocol_instance, storage=storage)
+
+            def send():
+                for i in range(message_count):
+                    server.queue_or_deliver(f'user{i % 100}', ('kevin', f'hello there {i} ' * 8))
+
+            def drain():
+                for i in range(100):
+                    mailbox = server.undelivered_msg.mailbox(f'user{i}')
+                    mailbox.lock.acquire()
+                    assert len(mailbox.pop_all()) == message_count // 100
+                    mailbox.lock.release()
+            start = time.perf_counter()
+            send()
+            send_rate = message_count / (time.perf_counter() - start)
+            start = time.perf_counter()
+            drain()
+            drain_rate = message_count / (time.perf_counter() - start)
+            tracemalloc.start()
+            send()
+            memory = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            drain()
+            storage.close()
+        print(f"{name} storage: {send_rate / 1e3:.0f}k sends/s, {drain_rate / 1e3:.0f}k drained/s, "
+              f"{memory / 1e6:.1f} MB held for {message_count} queued messages")
+
+
+def free_port():
+    with socket.socket() as probe:
+        probe.bind(('127.0.0.1', 0))
+        return probe.getsockname()[1]
+
+
+def _bench_client(port, client, requests_per_client, start_barrier, done):
+    """One benchmark client process: creates its own account, then sends messages one
+    request at a time to offline users spread over every shard"""
+    connection = socket.create_connection(('127.0.0.1', port))
+    parser = PacketParser(protocol_instance)
+
+    def request(operation, message_id, args):
+        protocol_instance.send(connection, protocol_instance.encode(operation, message_id, args))
+        while not parser.feed(connection.recv(4096)):
+            pass
+    request('CREATE_ACCOUNT', 0, {'username': f'client{client}'})
+    start_barrier.wait()
+    for i in range(requests_per_client):
+        request('SEND_MESSAGE', i + 1, {'recipient': f'inbox{i % 100}', 'message': 'hi'})
+    done.put(True)
+    connection.close()
+
+
+def bench_shards(num_clients, requests_per_client):
+    """Measures SEND_MESSAGE requests/second from num_clients client processes against 1 to 4
+    shard processes, through real sockets. Only scales with as many free cores as shards.
+    """
+    context = multiprocessing.get_context('fork')
+    for num_shards in [1, 2, 4]:
+        port = free_port()
+
+        def open_shard(shard):
+            storage = MemoryStorage()
+            storage.account_list.add_all(f'inbox{i}' for i in range(100)
+                                         if shard_for(f'inbox{i}', num_shards) == shard)
+            return None, storage
+        with open(os.devnull, 'w') as devnull:
+            # The shards inherit stdout, so they don't print every request
+            stdout = sys.stdout
+            sys.stdout = devnull
+            shards = start_shards('127.0.0.1', port, protocol_instance, num_shards, open_shard)
+            sys.stdout = stdout
+        start_barrier = context.Barrier(num_clients + 1)
+        done = context.Queue()
+        clients = [context.Process(target=_bench_client, args=(
+            port, client, requests_per_client, start_barrier, done)) for client in range(num_clients)]
+        for client in clients:
+            client.start()
+        start_barrier.wait()
+        start = time.perf_counter()
+        for _ in clients:
+            done.get()
+        rate = num_clients * requests_per_client / (time.perf_counter() - start)
+        for client in clients:
+            client.join()
+        for shard in shards:
+            shard.terminate()
+            shard.join()
+        print(f"{num_shards} shards, {num_clients} clients: {rate / 1e3:.1f}k sends/s "
+              f"({os.cpu_count()} cores)")
+
+
+def bench_pipelining(request_count):
+    """Measures SEND_MESSAGE requests/second on a single connection, waiting for each
+    response before the next request against keeping up to 1 to 1024 in flight with AsyncClient
+    """
+    port = free_port()
+    server = Server('127.0.0.1', port, protocol_instance)
+    server.account_list.add_all(f'inbox{i}' for i in range(100))
+    with open(os.devnull, 'w') as devnull:
+        stdout = sys.stdout
+        sys.stdout = devnull
+        threading.Thread(target=server.run, daemon=True).start()
+        time.sleep(0.1)
+
+        async def run(in_flight):
+            async with AsyncClient('127.0.0.1', port, max_in_flight=in_flight) as client:
+                await client.create_account(f'pipeliner{in_flight}')
+                start = time.perf_counter()
+                await asyncio.gather(*[client.send_message(f'inbox{i % 100}', 'hi')
+                                       for i in range(request_count)])
+                return request_count / (time.perf_counter() - start)
+        rates = {in_flight: asyncio.run(run(in_flight)) for in_flight in [1, 16, 1024]}
+        sys.stdout = stdout
+    for in_flight, rate in rates.items():
+        print(f"{in_flight} requests in flight on one connection: {rate / 1e3:.1f}k sends/s")
+
+
+if __name__ == '__main__':
+    bench_pipelining(20000)
+    bench_shards(8, 2000)
+    bench_storage(200000)
+    bench_recovery(1000000)
+    bench_group_commit(500)
+    bench_state_contention(20000)
+    bench_payload_size()
+    bench_binary_decode(200000)
+    bench_header(1000000)
+    bench_parser(100, 20000)
+    bench_parser(10000, 1000)
+    bench_parser(200000, 20)
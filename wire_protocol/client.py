@@ -16,6 +16,7 @@ class Client:
         self.protocol = protocol
         self.message_counter = 0
         self.username = None
+        self.listed_first_page = False
 
     def connect(self):
         """
@@ -101,8 +102,10 @@ class Client:
         # Send list accounts query
         query = input('Enter query: ')
         logging.info('Start time', time.time())
+        # Results are streamed back a page at a time, so print the header along with the first page
+        self.listed_first_page = False
         message = self.protocol.encode(
-            'LIST_ACCOUNTS', self.message_counter, {'query': query})
+            'LIST_ACCOUNTS_STREAM', self.message_counter, {'query': query})
         self.message_counter += 1
         self.protocol.send(self.socket, message)
 
@@ -110,11 +113,17 @@ class Client:
         """
         Handles sending a send message request to the server
         """
-        # Get recipient username and message and send
-        user = input('Enter recipient username: ')
+        # Get recipient username(s) and message and send
+        user = input('Enter recipient username (separate several with commas): ')
         user_msg = input('Enter message: ')
-        message = self.protocol.encode(
-            'SEND_MESSAGE', self.message_counter, {'recipient': user, 'message': user_msg})
+        recipients = [recipient.strip()
+                      for recipient in user.split(',') if recipient.strip()]
+        if len(recipients) > 1:
+            message = self.protocol.encode(
+                'SEND_MESSAGE_MULTI', self.message_counter, {'recipients': ';'.join(recipients), 'message': user_msg})
+        else:
+            message = self.protocol.encode(
+                'SEND_MESSAGE', self.message_counter, {'recipient': user.strip(), 'message': user_msg})
         self.message_counter += 1
         self.protocol.send(self.socket, message)
 
@@ -136,6 +145,20 @@ class Client:
         self.message_counter += 1
         self.protocol.send(self.socket, message)
 
+    def send_batch(self, operations):
+        """
+        Sends several requests to the server in a single BATCH message. The server answers
+        all of them in one BATCH_RESPONSE, in the same order. Needs protocol version 2.
+
+        Args:
+            operations (List[Tuple[str, dict]]): (operation, operation args) of each request,
+                e.g. [('SEND_MESSAGE', {'recipient': 'kevin', 'message': 'hi'})]
+        """
+        message = self.protocol.encode_batch(
+            'BATCH', self.message_counter, operations)
+        self.message_counter += 1
+        self.protocol.send(self.socket, message)
+
     def process_operation_curry(self, out_lock):
         """Processes the operation. This is a curried function to work with the
         read packets api provided in protocol. See the relevant process functions
@@ -145,9 +168,8 @@ class Client:
             out_lock (threading.Lock): lock to control accesses to stdou
         """
         def process_operation(client_socket, metadata: protocol.Metadata, msg, id_accum):
-            """Processes the operation. When the response is an error, we print the
-            error message. When we are receiving the message, we print out the sender
-            and the message.
+            """Processes the operation by handing the response, or each response of a
+            batch, to process_response.
 
             Args:
                 client (socket.socket): The client socket; not used for this function
@@ -156,52 +178,88 @@ class Client:
                 id_accum (it): integer accumulator for message
             """
             operation_code = metadata.operation_code.value
-            args = self.protocol.parse_data(operation_code, msg)
             atomic_print(out_lock, '')
-            match operation_code:
-                case 2:  # Create account response
-                    if args['status'] == "Success":
-                        self.username = args['username']
-                        atomic_print(
-                            out_lock, "Account creation successful. You are now logged in.")
-                    else:
-                        atomic_print(out_lock, args['status'])
-                case 4:  # List accounts response
-                    logging.info('End time', time.time())
-                    if args['status'] == "Success":
-                        accounts = args['accounts'].split(';')
-                        accounts_str = '\n'.join(accounts)
-                        atomic_print(
-                            out_lock, f"Account search results:\n{accounts_str}")
-                    else:
-                        atomic_print(out_lock, args['status'])
-                case 6:  # Send message response
-                    if not args['status'] == "Success":
-                        atomic_print(out_lock, args['status'])
-                case 8:  # Delete Account response
-                    if args['status'] == "Success":
-                        self.username = None
-                        atomic_print(
-                            out_lock, "Deleting account successful; you are now logged out.")
-                    else:
-                        atomic_print(out_lock, args['status'])
-                case 10:  # Login response
-                    if args['status'] == "Success":
-                        self.username = args['username']
-                        atomic_print(out_lock, "You are now logged in.")
-                    else:
-                        atomic_print(out_lock, args['status'])
-                case 12:  # Logoff response
-                    if args['status'] == "Success":
-                        self.username = None
-                        atomic_print(out_lock, "You are now logged out.")
-                    else:
-                        atomic_print(out_lock, args['status'])
-                case 13:  # Receive message
-                    atomic_print(
-                        out_lock, f"Message from {args['sender']}: {args['message']} \n\n{self._get_prompt()}")
+            if operation_code == 17 and metadata.version == protocol.BINARY_VERSION:
+                # Batch response, one response per operation in the batch
+                for sub_operation_code, args in self.protocol.parse_batch('BATCH_RESPONSE', msg):
+                    self.process_response(out_lock, sub_operation_code, args)
+            else:
+                self.process_response(out_lock, operation_code, self.protocol.parse_data(
+                    operation_code, msg, metadata.version))
         return process_operation
 
+    def process_response(self, out_lock, operation_code, args):
+        """Processes a single response from the server. When the response is an error, we
+        print the error message. When we are receiving the message, we print out the sender
+        and the message.
+
+        Args:
+            out_lock (threading.Lock): lock to control accesses to stdout
+            operation_code (int): operation code of the response
+            args (dict): arguments parsed from the response
+        """
+        match operation_code:
+            case 2:  # Create account response
+                if args['status'] == "Success":
+                    self.username = args['username']
+                    atomic_print(
+                        out_lock, "Account creation successful. You are now logged in.")
+                else:
+                    atomic_print(out_lock, args['status'])
+            case 4:  # List accounts response
+                logging.info('End time', time.time())
+                if args['status'] == "Success":
+                    accounts = args['accounts'].split(';')
+                    accounts_str = '\n'.join(accounts)
+                    atomic_print(
+                        out_lock, f"Account search results:\n{accounts_str}")
+                else:
+                    atomic_print(out_lock, args['status'])
+            case 6:  # Send message response
+                if not args['status'] == "Success":
+                    atomic_print(out_lock, args['status'])
+            case 8:  # Delete Account response
+                if args['status'] == "Success":
+                    self.username = None
+                    atomic_print(
+                        out_lock, "Deleting account successful; you are now logged out.")
+                else:
+                    atomic_print(out_lock, args['status'])
+            case 10:  # Login response
+                if args['status'] == "Success":
+                    self.username = args['username']
+                    atomic_print(out_lock, "You are now logged in.")
+                else:
+                    atomic_print(out_lock, args['status'])
+            case 12:  # Logoff response
+                if args['status'] == "Success":
+                    self.username = None
+                    atomic_print(out_lock, "You are now logged out.")
+                else:
+                    atomic_print(out_lock, args['status'])
+            case 13:  # Receive message
+                atomic_print(
+                    out_lock, f"Message from {args['sender']}: {args['message']} \n\n{self._get_prompt()}")
+            case 15:  # List accounts stream response, one per page
+                if args['status'] == "Success":
+                    accounts_str = '\n'.join(
+                        account for account in args['accounts'].split(';') if account)
+                    if not self.listed_first_page:
+                        accounts_str = f"Account search results:\n{accounts_str}"
+                        self.listed_first_page = True
+                    if accounts_str:
+                        atomic_print(out_lock, accounts_str)
+                else:
+                    atomic_print(out_lock, args['status'])
+            case 17:  # Batch response in version 1, for a batch that couldn't be processed
+                atomic_print(out_lock, args['status'])
+            case 19:  # Send message to many recipients response
+                if not args['status'] == "Success":
+                    atomic_print(out_lock, args['status'])
+                elif args['invalid_recipients']:
+                    atomic_print(
+                        out_lock, f"These recipients do not exist: {', '.join(args['invalid_recipients'].split(';'))}")
+
 
 def atomic_print(lock, msg, end=None):
     """
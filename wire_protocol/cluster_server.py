@@ -0,0 +1,203 @@
+import os
+import sys
+
+from outbound import DEFAULT_HIGH_WATER_MARK, DEFAULT_MAX_QUEUED_BYTES
+from server import UNAVAILABLE_RECIPIENT_STATUS, Server
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from cluster import ClusterNode  # noqa: E402
+from hash_ring import DEFAULT_REPLICAS  # noqa: E402
+from message_log import RecordType  # noqa: E402
+
+
+class ClusterServer(Server):
+    """A server that is one node of a cluster, each node on its own machine or port.
+
+    Users are placed on the nodes by a consistent hash ring (see cluster.ClusterNode), and
+    the owning node holds the account, the mailbox and the login, so process_login enforces
+    the single login rule as a lone server does. A connection can't move between machines,
+    so creating or logging into an account owned by another node is answered with an
+    error naming the address to connect to instead. Sends to users of other nodes and
+    account searches are forwarded to the other nodes over their ClusterService.
+    """
+
+    def __init__(self, host, port, protocol, cluster_address, client_address=None,
+                 high_water_mark=DEFAULT_HIGH_WATER_MARK, max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES,
+                 message_log=None, storage=None, replicas=DEFAULT_REPLICAS):
+        """
+        Args:
+            cluster_address (str): host:port to answer the other nodes on
+            client_address (str, optional): host:port clients are told to connect to for
+                accounts this node owns. Defaults to None, which uses host:port.
+            replicas (int, optional): Points per node on the hash ring, the same on every node.
+                Defaults to DEFAULT_REPLICAS.
+        """
+        super().__init__(host, port, protocol, high_water_mark,
+                         max_queued_bytes, message_log, storage)
+        self.cluster = ClusterNode(self, cluster_address, client_address or f'{host}:{port}', replicas)
+
+    def join_cluster(self, seed=None):
+        """Starts answering the other nodes, and joins the cluster of seed if given. Call it
+        before run, so the users this node owns are here before clients look for them.
+
+        Args:
+            seed (str, optional): The cluster address of any member. Defaults to None, which
+                starts a new cluster.
+        """
+        self.cluster.start()
+        if seed is not None:
+            self.cluster.join(seed)
+
+    def _redirect(self, username):
+        # Error for creating or logging into an account another node owns
+        return {'status': f'Error: That account is served by {self.cluster.client_address(username)}, connect there instead.',
+                'username': username}
+
+    def process_create_account(self, args, client_socket, socket_lock):
+        if not self.cluster.is_local(args['username']):
+            return self._redirect(args['username'])
+        return super().process_create_account(args, client_socket, socket_lock)
+
+    def process_login(self, args, client_socket, socket_lock):
+        if not self.cluster.is_local(args['username']):
+            return self._redirect(args['username'])
+        return super().process_login(args, client_socket, socket_lock)
+
+    def process_send_msg(self, args, client_socket, socket_lock):
+        """Like Server.process_send_msg, but a recipient owned by another node gets the
+        message through that node, which also checks that the account exists
+        """
+        username = self.logged_in.username_for((client_socket, socket_lock))
+        if username is None or self.cluster.is_local(args['recipient']):
+            return super().process_send_msg(args, client_socket, socket_lock)
+        missing, unavailable = self.cluster.send([args['recipient']], username, args['message'])
+        if unavailable:
+            return {'status': UNAVAILABLE_RECIPIENT_STATUS}
+        if missing:
+            return {'status': 'Error: The recipient of the message does not exist.'}
+        return {'status': 'Success'}
+
+    def process_send_msg_multi(self, args, client_socket, socket_lock):
+        """Like Server.process_send_msg_multi, but the recipients are split by owning node,
+        and every other node gets its share in a single call, all made at once
+        """
+        username = self.logged_in.username_for((client_socket, socket_lock))
+        if username is None:
+            return super().process_send_msg_multi(args, client_socket, socket_lock)
+        recipients = list(dict.fromkeys(
+            recipient for recipient in args['recipients'].split(';') if recipient))
+        missing, unavailable = self.cluster.send(recipients, username, args['message'])
+        # Recipients that couldn't be reached are reported with those that don't exist
+        invalid = set(missing) | set(unavailable)
+        invalid_recipients = ';'.join(recipient for recipient in recipients if recipient in invalid)
+        if len(invalid) == len(recipients):
+            status = UNAVAILABLE_RECIPIENT_STATUS if unavailable else 'Error: None of the recipients exist.'
+            return {'status': status, 'invalid_recipients': invalid_recipients}
+        return {'status': 'Success', 'invalid_recipients': invalid_recipients}
+
+    def search_page(self, query, limit=None, cursor=None):
+        return self.cluster.search_page(query, limit, cursor)
+
+    def search_pages(self, query, page_size):
+        return self.cluster.search_pages(query, page_size)
+
+    def node_send(self, recipients, sender, message):
+        """Delivers or queues a message for recipients this node owns
+
+        Returns:
+            List[str]: The recipients that don't exist
+        """
+        recipients, missing = self.account_list.partition(recipients)
+        if recipients:
+            self.send_to_recipients(recipients, (sender, message))
+        return missing
+
+    def node_search_page(self, query, limit, cursor):
+        return super().search_page(query, limit, cursor)
+
+    def node_export(self, keep):
+        """Copies the accounts this node no longer owns, with their queued messages, to hand
+        them over. Nothing is removed until node_remove, once the new owner has them.
+
+        Args:
+            keep (Callable): Returns whether a username stays on this node
+
+        Returns:
+            Tuple[List[str], List[tuple]]: The usernames, and (recipient, sender, message) of
+                their queued messages, oldest first
+        """
+        accounts, messages = [], []
+        for username in list(self.account_list):
+            if keep(username):
+                continue
+            mailbox = self.undelivered_msg.mailbox(username)
+            mailbox.lock.acquire()
+            if username in self.account_list:
+                accounts.append(username)
+                messages.extend((username,) + message_info for message_info in mailbox)
+            mailbox.lock.release()
+        return accounts, messages
+
+    def node_remove(self, handed_over):
+        """Removes users another node has taken over. Users logged into them are logged off;
+        they log in again at the new owner. A user who got mail since node_export only loses
+        the messages handed over, and is exported again with the rest.
+
+        Args:
+            handed_over (Dict[str, int]): Username to the number of their oldest queued
+                messages the new owner has
+        """
+        sequence_number = 0
+        for username, count in handed_over.items():
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
+            if username in self.account_list:
+                mailbox = self.undelivered_msg.mailbox(username)
+                # USER > MAILBOX
+                mailbox.lock.acquire()
+                count = min(count, len(mailbox))
+                for _ in range(count):
+                    mailbox.popleft()
+                if count:
+                    sequence_number = self.log(RecordType.ACK, username, str(count))
+                if not mailbox:
+                    self.logged_in.pop(username, None)
+                    # MAILBOX > ACCOUNT LIST, so no message is queued between the check and the removal
+                    self.account_list_lock.acquire()
+                    self.account_list.remove(username)
+                    self.account_list_lock.release()
+                    sequence_number = self.log(RecordType.DELETE_ACCOUNT, username)
+                mailbox.lock.release()
+            user_lock.release()
+        self.wait_durable(sequence_number)
+
+    def node_import(self, accounts, messages):
+        """Takes over accounts and their queued messages from another node
+
+        Args:
+            accounts (List[str]): The usernames
+            messages (List[tuple]): (recipient, sender, message) of their queued messages, oldest first
+        """
+        sequence_number = 0
+        for username in accounts:
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
+            if username not in self.account_list:
+                # USER > ACCOUNT LIST
+                self.account_list_lock.acquire()
+                self.account_list.add(username)
+                self.account_list_lock.release()
+                sequence_number = self.log(RecordType.CREATE_ACCOUNT, username)
+            user_lock.release()
+        for recipient, sender, message in messages:
+            sequence_number = max(sequence_number, self.queue_or_deliver(recipient, (sender, message)))
+        self.wait_durable(sequence_number)
+        if accounts:
+            print(f"Took over {len(accounts)} accounts")
+
+    def disconnect(self):
+        # Hand every user to the remaining nodes while the storage is still open
+        self.cluster.leave()
+        self.cluster.stop()
+        super().disconnect()
@@ -0,0 +1,253 @@
+import itertools
+import logging
+import selectors
+import socket
+import threading
+from collections import deque
+
+import protocol
+from outbound import DEFAULT_HIGH_WATER_MARK, DEFAULT_MAX_QUEUED_BYTES
+from server import Server
+
+
+class Connection:
+    """The state an EventLoop keeps for one client"""
+
+    def __init__(self, client, socket_lock, parser, process_operation, outbox):
+        self.client = client
+        self.socket_lock = socket_lock
+        self.parser = parser
+        self.process_operation = process_operation
+        self.outbox = outbox
+        self.events = 0  # Events the selector currently watches for
+        # Responses paused until the outbound queue drains, see Server.process_operation
+        self.work = None
+        # Requests parsed while work was paused, processed once it is done
+        self.requests = deque()
+
+
+class EventLoop:
+    """A single-threaded selector loop that owns a set of client connections.
+
+    Each connection only costs its socket, a PacketParser and an OutboundQueue, instead
+    of a dedicated thread, so one loop can hold many thousands of idle clients. The loop
+    is also the writer of its connections' queues: it finishes flushes that hit a full
+    socket and stops reading from clients whose queue is over its high-water mark. A request
+    with more responses than fit, like a streamed account list or the mailbox flush after a
+    login, is paused instead and resumed once the queue drains to its low-water mark; the
+    client's later requests wait until it is done.
+    """
+
+    def __init__(self, server):
+        self.server = server
+        self.selector = selectors.DefaultSelector()
+        # Map of OutboundQueue to the Connection it belongs to
+        self.connections = {}
+
+        # Connections handed over by the accepting loop, registered on our next wakeup
+        self.pending = deque()
+        # Queues whose state changed on another thread, updated on our next wakeup
+        self.notified = deque()
+        # Socket pair used to interrupt select() when another thread hands us work
+        self.wakeup_reader, self.wakeup_writer = socket.socketpair()
+        self.wakeup_reader.setblocking(False)
+        self.wakeup_writer.setblocking(False)
+        self.selector.register(
+            self.wakeup_reader, selectors.EVENT_READ, self._drain_wakeup)
+
+    def add_listener(self, server_socket, loops):
+        """Registers the listening socket; accepted clients are spread round robin over loops
+
+        Args:
+            server_socket (socket.socket): The non-blocking listening socket
+            loops (List[EventLoop]): The loops to hand accepted connections to
+        """
+        assignment = itertools.cycle(loops)
+
+        def accept(_):
+            try:
+                client, addr = server_socket.accept()
+            except BlockingIOError:
+                return
+            print('Connection created with:', addr)
+            next(assignment).add_connection(client)
+        self.selector.register(server_socket, selectors.EVENT_READ, accept)
+
+    def add_connection(self, client):
+        """Hands a freshly accepted client to this loop. Safe to call from any thread.
+
+        Args:
+            client (socket.socket): The accepted client socket
+        """
+        self.pending.append(client)
+        self._wakeup()
+
+    def notify(self, outbox):
+        """Called by an OutboundQueue of ours, from any thread, when it became blocked,
+        stopped being throttled or closed.
+
+        Args:
+            outbox (outbound.OutboundQueue): The queue whose state changed
+        """
+        self.notified.append(outbox)
+        self._wakeup()
+
+    def _wakeup(self):
+        try:
+            self.wakeup_writer.send(b'\0')
+        except BlockingIOError:
+            # The wakeup pipe is already full, so the loop will wake up anyway
+            pass
+
+    def _drain_wakeup(self, _):
+        try:
+            while self.wakeup_reader.recv(4096):
+                pass
+        except BlockingIOError:
+            pass
+        while self.pending:
+            self._register_client(self.pending.popleft())
+        while self.notified:
+            connection = self.connections.get(self.notified.popleft())
+            if connection is not None:
+                self._update_events(connection)
+
+    def _register_client(self, client):
+        # Writes go through the outbound queue, which never waits for the socket
+        client.setblocking(False)
+        socket_lock = threading.Lock()
+        connection = Connection(
+            client, socket_lock, protocol.PacketParser(self.server.protocol),
+            self.server.process_operation_curried(socket_lock),
+            self.server.open_outbound(client, self))
+        self.connections[connection.outbox] = connection
+        self._update_events(connection)
+
+    def _on_event(self, connection, mask):
+        if mask & selectors.EVENT_WRITE and connection.outbox.blocked:
+            connection.outbox.flush()
+        if mask & selectors.EVENT_READ:
+            self._read_client(connection)
+        if connection.outbox in self.connections:
+            self._update_events(connection)
+
+    def _update_events(self, connection):
+        """Watches the client for reads unless it is throttled, and for writes while its queue is blocked"""
+        outbox = connection.outbox
+        if outbox.closed:
+            self._close_client(connection)
+            return
+        if connection.work is not None or connection.requests:
+            self._process_requests(connection)
+            if outbox not in self.connections:
+                return
+        events = 0 if outbox.throttle() or connection.work is not None else selectors.EVENT_READ
+        if outbox.blocked:
+            events |= selectors.EVENT_WRITE
+        if events == connection.events:
+            return
+        if not connection.events:
+            self.selector.register(
+                connection.client, events, lambda mask: self._on_event(connection, mask))
+        elif not events:
+            # Throttled while another thread is flushing; it notifies us once the queue drains
+            self.selector.unregister(connection.client)
+        else:
+            self.selector.modify(connection.client, events,
+                                 lambda mask: self._on_event(connection, mask))
+        connection.events = events
+
+    def _read_client(self, connection):
+        try:
+            received = connection.parser.recv_into(connection.client)
+        except BlockingIOError:
+            return
+        except OSError:
+            received = 0
+        if not received:
+            # Socket disconnected
+            self._close_client(connection)
+            return
+        try:
+            connection.requests.extend(connection.parser.parse())
+        except ValueError:
+            # Unsupported protocol version
+            self._close_client(connection)
+
+    def _process_requests(self, connection):
+        """Resumes the connection's paused work while its queue has room, then processes
+        its parsed requests until one has to pause"""
+        try:
+            while True:
+                if connection.work is not None:
+                    if connection.outbox.throttle():
+                        # _update_events resumes it once the queue drains
+                        return
+                    connection.work = self.server.advance(connection.work)
+                elif connection.requests:
+                    metadata, msg, msg_id = connection.requests.popleft()
+                    connection.work = connection.process_operation(
+                        connection.client, metadata, msg, msg_id)
+                else:
+                    return
+        except ValueError:
+            # Unsupported protocol version
+            self._close_client(connection)
+        except Exception:
+            logging.exception('Error while processing client message')
+            self._close_client(connection)
+
+    def _close_client(self, connection):
+        if self.connections.pop(connection.outbox, None) is None:
+            return
+        if connection.work is not None:
+            # A paused mailbox flush leaves the rest in the mailbox
+            connection.work.close()
+            connection.work = None
+        if connection.events:
+            self.selector.unregister(connection.client)
+        connection.client.close()
+        self.server.release_client(connection.client, connection.socket_lock)
+
+    def run(self):
+        """Dispatches socket events forever."""
+        while True:
+            for key, mask in self.selector.select():
+                key.data(mask)
+
+
+class EventServer(Server):
+    """Server that multiplexes all clients over a small number of selector loops
+    instead of spawning a thread per client. The request handlers are shared with Server.
+
+    The handlers run on the loop threads, so a write waiting for a message log's fsync
+    would stall every connection of its loop, and group commit would never batch more
+    than one connection's records. Event loops therefore don't take a message log.
+    """
+
+    def __init__(self, host, port, protocol, num_loops=1, high_water_mark=DEFAULT_HIGH_WATER_MARK,
+                 max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES, message_log=None, storage=None):
+        if message_log is not None:
+            raise ValueError('The event server blocks its loops on every fsync, so it takes no message log')
+        super().__init__(host, port, protocol, high_water_mark,
+                         max_queued_bytes, message_log, storage)
+        self.num_loops = num_loops
+
+    def run(self):
+        """ Runs the server on num_loops event loops. The first loop runs on the
+        calling thread and also accepts connections.
+        """
+        server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket = server_socket
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        server_socket.setblocking(0)
+        server_socket.bind((self.host, self.port))
+        print("Server started.")
+        server_socket.listen(socket.SOMAXCONN)
+
+        loops = [EventLoop(self) for _ in range(self.num_loops)]
+        loops[0].add_listener(server_socket, loops)
+        for loop in loops[1:]:
+            thread = threading.Thread(target=loop.run, daemon=True)
+            thread.start()
+        loops[0].run()
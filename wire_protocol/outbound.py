@@ -0,0 +1,208 @@
+import itertools
+import select
+import socket
+import threading
+from collections import deque
+from typing import List
+
+from protocol import HAS_SENDMSG, MAX_SEND_BUFFERS
+
+# Bytes queued for a connection above which the server stops reading that connection's requests
+DEFAULT_HIGH_WATER_MARK = 256 * 1024
+# Bytes queued for a connection above which it is considered a slow consumer and disconnected
+DEFAULT_MAX_QUEUED_BYTES = 4 * 1024 * 1024
+# Makes a send on a blocking socket fail with EAGAIN instead of waiting for buffer space
+SEND_FLAGS = getattr(socket, 'MSG_DONTWAIT', 0)
+
+
+class OutboundQueue:
+    """Bounded queue of encoded messages waiting to be written to one client socket.
+
+    push never waits for the client: it appends the packets, and if nobody is writing to
+    the socket yet, the pushing thread writes everything queued so far with non-blocking
+    scatter/gather calls, so a burst of small RECV_MESSAGE frames goes out in one syscall.
+    When the socket's send buffer is full the queue is marked blocked and its writer (the
+    connection's event loop, or a ThreadedWriter) finishes the flush once it is writable,
+    so a slow reader never holds up the thread that sent it a message.
+
+    Once more than high_water_mark bytes are queued the connection is throttled: its own
+    requests should not be read until the queue drains to low_water_mark. A client that
+    lets more than max_queued_bytes pile up is disconnected.
+
+    The writer is any object with a notify(queue) method, called whenever the queue
+    becomes blocked, stops being throttled or closes.
+    """
+
+    def __init__(self, client_socket, writer, high_water_mark=DEFAULT_HIGH_WATER_MARK,
+                 max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES) -> None:
+        self.socket = client_socket
+        self.writer = writer
+        self.high_water_mark = high_water_mark
+        self.low_water_mark = high_water_mark // 2
+        self.max_queued_bytes = max_queued_bytes
+
+        self.lock = threading.Lock()
+        self.resumed = threading.Condition(self.lock)
+        self.packets = deque()  # [memoryview, token] per packet; the token is on a message's last packet
+        self.queued_bytes = 0
+        self.writing = False  # Some thread, or the writer, is responsible for flushing
+        self.blocked = False  # The socket was full, so the writer has to finish the flush
+        self.throttled = False
+        self.closed = False
+
+    def push(self, message: List[bytes], token=None) -> bool:
+        """Queues the packets of one message and starts writing them if nobody else is
+
+        Args:
+            message (List[bytes]): The encoded packets of the message
+            token (optional): Returned by discard if the message was never fully written. Defaults to None.
+
+        Returns:
+            bool: True if the message was queued, False if the connection is closed or too far behind
+        """
+        size = sum(map(len, message))
+        with self.lock:
+            if self.closed:
+                return False
+            overflow = self.queued_bytes + size > self.max_queued_bytes
+            if not overflow:
+                for packet in message:
+                    self.packets.append([memoryview(packet), None])
+                self.packets[-1][1] = token
+                self.queued_bytes += size
+                if self.writing:
+                    return True
+                self.writing = True
+        if overflow:
+            print("Disconnecting slow client.")
+            self.close()
+            return False
+        self.flush()
+        return True
+
+    def flush(self) -> None:
+        """Writes queued packets until the queue is empty, the socket is full or the
+        connection closes. Only whoever is responsible for writing may call this.
+        """
+        while True:
+            with self.lock:
+                if self.closed or not self.packets:
+                    self.writing = False
+                    self.blocked = False
+                    # Wakes wait_until_empty
+                    self.resumed.notify_all()
+                    return
+                buffers = [packet for packet, _ in itertools.islice(
+                    self.packets, MAX_SEND_BUFFERS)]
+            try:
+                if HAS_SENDMSG:
+                    bytes_sent = self.socket.sendmsg(buffers, [], SEND_FLAGS)
+                else:
+                    bytes_sent = self.socket.send(buffers[0], SEND_FLAGS)
+            except BlockingIOError:
+                bytes_sent = None
+            except OSError:
+                bytes_sent = 0
+            if bytes_sent == 0:
+                # Socket connection broken
+                self.close()
+                return
+            with self.lock:
+                if self.closed:
+                    continue
+                self.blocked = bytes_sent is None
+                if not self.blocked:
+                    self._consume(bytes_sent)
+                resumed = self.throttled and self.queued_bytes <= self.low_water_mark
+                if resumed:
+                    self.throttled = False
+                    self.resumed.notify_all()
+            if resumed or bytes_sent is None:
+                self.writer.notify(self)
+            if bytes_sent is None:
+                return
+
+    def _consume(self, bytes_sent: int) -> None:
+        self.queued_bytes -= bytes_sent
+        while bytes_sent:
+            packet = self.packets[0]
+            if bytes_sent < len(packet[0]):
+                packet[0] = packet[0][bytes_sent:]
+                return
+            bytes_sent -= len(packet[0])
+            self.packets.popleft()
+
+    def throttle(self) -> bool:
+        """Checks whether the connection's requests should stop being read for now
+
+        Returns:
+            bool: True while the queue hasn't drained back to low_water_mark after passing high_water_mark
+        """
+        with self.lock:
+            if self.queued_bytes > self.high_water_mark and not self.closed:
+                self.throttled = True
+            return self.throttled
+
+    def wait_for_capacity(self) -> None:
+        """Blocks the calling thread while the connection is throttled"""
+        with self.lock:
+            if self.queued_bytes > self.high_water_mark:
+                self.throttled = True
+            while self.throttled and not self.closed:
+                self.resumed.wait()
+
+    def wait_until_empty(self) -> None:
+        """Blocks the calling thread until everything queued has been written or the connection closes"""
+        with self.lock:
+            while self.packets and not self.closed:
+                self.resumed.wait()
+
+    def close(self) -> None:
+        """Stops accepting messages and shuts the socket down, so the connection's reader
+        sees a disconnect and releases the client as usual
+        """
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.resumed.notify_all()
+        try:
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.writer.notify(self)
+
+    def discard(self) -> list:
+        """Closes the queue and drops everything still queued
+
+        Returns:
+            list: The tokens of the messages that were not fully written, oldest first
+        """
+        with self.lock:
+            self.closed = True
+            tokens = [token for _, token in self.packets if token is not None]
+            self.packets.clear()
+            self.queued_bytes = 0
+            self.resumed.notify_all()
+        return tokens
+
+
+class ThreadedWriter:
+    """Writer for the thread per client server. A blocked queue gets a short-lived thread
+    that waits for the socket to become writable, so a slow reader only ever ties up a
+    thread of its own.
+    """
+
+    def notify(self, queue: OutboundQueue) -> None:
+        if queue.blocked and not queue.closed:
+            threading.Thread(target=self._finish_flush,
+                             args=(queue,), daemon=True).start()
+
+    def _finish_flush(self, queue: OutboundQueue) -> None:
+        try:
+            select.select([], [queue.socket], [])
+        except (OSError, ValueError):
+            # The socket was closed in the meantime
+            queue.close()
+            return
+        queue.flush()
@@ -2,7 +2,8 @@ from enum import Enum
 import errno
 import select
 import socket
-from typing import Callable, Dict, List
+import struct
+from typing import Callable, Dict, List, Tuple
 import logging
 
 METADATA_SIZES = {
@@ -15,9 +16,26 @@ METADATA_SIZES = {
 }
 
 METADATA_LENGTH = sum(METADATA_SIZES.values())
+# version, header_length, operation_code, message_size (high byte, low 2 bytes), payload_size, message_id
+HEADER_STRUCT = struct.Struct('>BBBBHHH')
 MAX_PACKET_SIZE = 2048
+# Maximum number of buffers handed to a single sendmsg call (the usual IOV_MAX)
+MAX_SEND_BUFFERS = 1024
+# sendmsg isn't available on every platform (e.g. Windows)
+HAS_SENDMSG = hasattr(socket.socket, 'sendmsg')
+# Initial size of the buffer each PacketParser receives into
+RECEIVE_BUFFER_SIZE = 16 * MAX_PACKET_SIZE
 MAX_PAYLOAD_SIZE = MAX_PACKET_SIZE - METADATA_LENGTH
+MAX_MESSAGE_SIZE = (1 << (8 * METADATA_SIZES['message_size'])) - 1
+MAX_MESSAGE_ID = (1 << (8 * METADATA_SIZES['message_id'])) - 1
+# Multi-packet messages a PacketParser reassembles at once before it gives up on the sender
+MAX_PARTIAL_MESSAGES = 1024
+# Version 1 payloads are ASCII key=value pairs separated by \r and terminated by \n.
+# Version 2 payloads are the operation's arguments in OPERATION_ARGS order (then
+# OPTIONAL_OPERATION_ARGS order), each UTF-8 encoded and prefixed by its length as a varint.
 VERSION = 1
+BINARY_VERSION = 2
+SUPPORTED_VERSIONS = (VERSION, BINARY_VERSION)
 
 
 class OperationCode(Enum):
@@ -34,6 +52,16 @@ class OperationCode(Enum):
     LOG_OFF = 11
     LOG_OFF_RESPONSE = 12
     RECV_MESSAGE = 13
+    LIST_ACCOUNTS_STREAM = 14
+    LIST_ACCOUNTS_STREAM_RESPONSE = 15
+    BATCH = 16
+    BATCH_RESPONSE = 17
+    SEND_MESSAGE_MULTI = 18
+    SEND_MESSAGE_MULTI_RESPONSE = 19
+
+
+# Operation code value to OperationCode, which is much faster than calling OperationCode(value)
+OPERATION_CODES = {code.value: code for code in OperationCode}
 
 
 # Necessary arguments needed for each operation
@@ -50,9 +78,62 @@ OPERATION_ARGS = {
     'LOG_IN_RESPONSE': ['status', 'username'],
     'LOG_OFF': [],
     'LOG_OFF_RESPONSE': ['status'],
-    'RECV_MESSAGE': ['sender', 'message']
+    'RECV_MESSAGE': ['sender', 'message'],
+    'LIST_ACCOUNTS_STREAM': ['query'],
+    'LIST_ACCOUNTS_STREAM_RESPONSE': ['status', 'accounts', 'next_cursor'],
+    # Recipients are joined by ';' like the accounts of a LIST_ACCOUNTS_RESPONSE
+    'SEND_MESSAGE_MULTI': ['recipients', 'message'],
+    'SEND_MESSAGE_MULTI_RESPONSE': ['status', 'invalid_recipients'],
+    # Only for a BATCH that couldn't be processed, in version 1; see encode_batch for the batch itself
+    'BATCH_RESPONSE': ['status']
+}
+
+# Arguments that may be left out for each operation
+OPTIONAL_OPERATION_ARGS = {
+    'LIST_ACCOUNTS': ['limit', 'cursor'],
+    'LIST_ACCOUNTS_RESPONSE': ['next_cursor'],
+    'LIST_ACCOUNTS_STREAM': ['limit'],
+}
+
+# Operations that can be sent inside a BATCH; a BATCH_RESPONSE carries their responses
+BATCH_OPERATIONS = ['CREATE_ACCOUNT', 'LIST_ACCOUNTS', 'SEND_MESSAGE',
+                    'DELETE_ACCOUNT', 'LOG_IN', 'LOG_OFF', 'SEND_MESSAGE_MULTI']
+# Operation codes allowed inside each kind of batch
+BATCH_CONTENTS = {
+    'BATCH': {OperationCode[operation].value for operation in BATCH_OPERATIONS},
+    'BATCH_RESPONSE': {OperationCode[operation + '_RESPONSE'].value for operation in BATCH_OPERATIONS},
 }
 
+# Every argument of each operation in the order they appear in a version 2 payload
+PAYLOAD_FIELDS = {operation: args + OPTIONAL_OPERATION_ARGS.get(operation, [])
+                  for operation, args in OPERATION_ARGS.items()}
+
+
+def append_varint(buffer: bytearray, value: int) -> None:
+    """Appends value to buffer as a varint: 7 bits per byte, least significant first,
+    with the high bit set on every byte but the last"""
+    while value >= 0x80:
+        buffer.append((value & 0x7F) | 0x80)
+        value >>= 7
+    buffer.append(value)
+
+
+def read_varint(data, position: int) -> Tuple[int, int]:
+    """Reads the varint starting at data[position]
+
+    Returns:
+        Tuple[int, int]: The value and the position right after it
+    """
+    value = 0
+    shift = 0
+    while True:
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            return value, position
+        shift += 7
+
 
 class Message:
     def __init__(self, version, operation, data):
@@ -68,15 +149,29 @@ class Message:
 
 
 class Metadata:
-    def __init__(self, version: bytes, header_length: bytes, operation_code: bytes,
-                 message_size: bytes, payload_size: bytes, message_id: bytes) -> None:
-        self.version = int.from_bytes(version, 'big')
-        self.header_length = int.from_bytes(header_length, 'big')
-        self.operation_code = OperationCode(
-            int.from_bytes(operation_code, 'big'))
-        self.message_size = int.from_bytes(message_size, 'big')
-        self.payload_size = int.from_bytes(payload_size, 'big')
-        self.message_id = int.from_bytes(message_id, 'big')
+    __slots__ = ('version', 'header_length', 'operation_code',
+                 'message_size', 'payload_size', 'message_id')
+
+    def __init__(self, version: int, header_length: int, operation_code: int,
+                 message_size: int, payload_size: int, message_id: int) -> None:
+        self.version = version
+        self.header_length = header_length
+        try:
+            self.operation_code = OPERATION_CODES[operation_code]
+        except KeyError:
+            raise ValueError(
+                f"{operation_code} is not a valid OperationCode") from None
+        self.message_size = message_size
+        self.payload_size = payload_size
+        self.message_id = message_id
+
+    @classmethod
+    def unpack_from(cls, buffer, offset: int = 0) -> 'Metadata':
+        """Decodes the header starting at offset of a bytes-like buffer"""
+        version, header_length, operation_code, size_high, size_low, payload_size, message_id = \
+            HEADER_STRUCT.unpack_from(buffer, offset)
+        return cls(version, header_length, operation_code,
+                   (size_high << 16) | size_low, payload_size, message_id)
 
 
 class Protocol:
@@ -93,16 +188,19 @@ class Protocol:
             self.metadata_sizes['payload_size'] + \
             self.metadata_sizes['message_id']
 
-    def encode(self, operation: OperationCode, message_id: int, operation_args={}) -> List[bytes]:
+    def encode(self, operation: OperationCode, message_id: int, operation_args={}, version: int = None) -> List[bytes]:
         """Encode an operation into a list of byte packets to be sent to the server.
 
-        This function just joins the keyword arguments into a data string and passes it to _encode
+        This function just serialises the keyword arguments into the payload of the given
+        protocol version and passes it on to be split into packets
 
         Args:
             operation (OperationCode): Enum value of the operation to be encoded.
             message_id (int): The message ID of the resulting message to send.
             operation_args (dict, optional): Dict of key-value arguments for the operation. 
-                Refer to OPERATION_ARGS for what arguments are required for each operation. Defaults to {}.
+                Refer to OPERATION_ARGS for what arguments are required for each operation,
+                and OPTIONAL_OPERATION_ARGS for the ones that may be left out. Defaults to {}.
+            version (int, optional): Protocol version to encode with. Defaults to None, which uses this protocol's version.
 
         Raises:
             ValueError: Missing required arguments for target operation.
@@ -115,14 +213,70 @@ class Protocol:
             raise ValueError(
                 f"Missing arguments for operation {operation}. Required arguments: {OPERATION_ARGS[operation]}")
 
+        if version is None:
+            version = self.version
+        if version == BINARY_VERSION:
+            return self._encode_packets(OperationCode[operation].value, message_id,
+                                        self._encode_fields(operation, operation_args), version)
+
         # Join keyword arguments with separator
+        known_args = OPERATION_ARGS[operation] + \
+            OPTIONAL_OPERATION_ARGS.get(operation, [])
         data = self.separator.join(
-            [f"{key}={value}" if key in OPERATION_ARGS[operation] else "" for key, value in operation_args.items()])
+            [f"{key}={value}" if key in known_args else "" for key, value in operation_args.items()])
         data += '\n'
 
         # Encode metadata and data into byte packets (may be multiple packets for large messages)
         return self._encode(OperationCode[operation].value, message_id, data)
 
+    def _encode_fields(self, operation: str, operation_args: dict) -> bytearray:
+        """Serialises the arguments as a version 2 payload. Optional arguments that are left
+        out are sent as empty fields, or not at all if no later field is given.
+        """
+        required = OPERATION_ARGS[operation]
+        fields = [str(operation_args.get(key, '')).encode('utf-8')
+                  for key in PAYLOAD_FIELDS[operation]]
+        while len(fields) > len(required) and not fields[-1]:
+            fields.pop()
+        encoded_data = bytearray()
+        for field in fields:
+            append_varint(encoded_data, len(field))
+            encoded_data += field
+        return encoded_data
+
+    def encode_batch(self, operation: str, message_id: int, sub_operations: List[Tuple[str, dict]]) -> List[bytes]:
+        """Encode several operations into one BATCH (or their responses into one BATCH_RESPONSE).
+        Batches only exist in protocol version 2.
+
+        The payload holds each sub-operation in order as its operation code byte, followed by
+        the varint length of its version 2 payload and the payload itself.
+
+        Args:
+            operation (str): 'BATCH' or 'BATCH_RESPONSE'.
+            message_id (int): The message ID of the resulting message to send.
+            sub_operations (List[Tuple[str, dict]]): (operation, operation_args) for each
+                sub-operation. Requests must be in BATCH_OPERATIONS, responses must answer one.
+
+        Raises:
+            ValueError: A sub-operation can't be batched or is missing required arguments.
+
+        Returns:
+            List[bytes]: List of bytes representing packets to be sent.
+        """
+        encoded_data = bytearray()
+        for sub_operation, operation_args in sub_operations:
+            if OperationCode[sub_operation].value not in BATCH_CONTENTS[operation]:
+                raise ValueError(
+                    f"Operation {sub_operation} can't be part of a {operation}")
+            if not set(OPERATION_ARGS[sub_operation]).issubset(operation_args.keys()):
+                raise ValueError(
+                    f"Missing arguments for operation {sub_operation}. Required arguments: {OPERATION_ARGS[sub_operation]}")
+            fields = self._encode_fields(sub_operation, operation_args)
+            encoded_data.append(OperationCode[sub_operation].value)
+            append_varint(encoded_data, len(fields))
+            encoded_data += fields
+        return self._encode_packets(OperationCode[operation].value, message_id, encoded_data, BINARY_VERSION)
+
     def _encode(self, operation: int, message_id: int, data: str) -> List[bytes]:
         """Encode an operation into a list of byte packets to be sent to the server containing the metadata and data.
 
@@ -136,42 +290,72 @@ class Protocol:
         Returns:
             List[bytes]: List of bytes representing packets to be sent to the server.
         """
-        # Encode data
-        encoded_data = self._encode_data(data)
+        return self._encode_packets(operation, message_id, self._encode_data(data), self.version)
 
-        # Encode metadata
-        bytes = bytearray(self._encode_component('version', self.version))
-        bytes.extend(self._encode_component(
-            'header_length', self.header_length))
-        bytes.extend(self._encode_component('operation_code', operation))
-        bytes.extend(self._encode_component('message_size', len(encoded_data)))
+    def _encode_packets(self, operation: int, message_id: int, encoded_data: bytes, version: int) -> List[bytes]:
+        """Split an encoded payload into packets, each prefixed with the metadata.
+
+        Args:
+            operation (int): Operation code of the operation to be encoded.
+            message_id (int): The message ID of the resulting message to send.
+            encoded_data (bytes): The whole payload of the message.
+            version (int): Protocol version the payload was encoded with.
+
+        Returns:
+            List[bytes]: List of bytes representing packets to be sent to the server.
+        """
+        message_size = len(encoded_data)
+        if message_size > MAX_MESSAGE_SIZE:
+            raise ValueError(
+                f"Message of {message_size} bytes is larger than the maximum of {MAX_MESSAGE_SIZE}")
+        # Message IDs wrap around once they no longer fit in their header field
+        message_id &= MAX_MESSAGE_ID
 
         encoded_payloads = []
 
         # Split into payloads of MAX_PAYLOAD_SIZE bytes, all with same common metadata
-        for i in range(0, len(encoded_data), MAX_PAYLOAD_SIZE):
+        for i in range(0, max(message_size, 1), MAX_PAYLOAD_SIZE):
             payload = encoded_data[i:i+MAX_PAYLOAD_SIZE]
             # Calculate payload size for this specific payload
-            payload_bytes = bytes + \
-                self._encode_component('payload_size', len(payload))
-            payload_bytes.extend(
-                self._encode_component('message_id', message_id))
+            payload_bytes = bytearray(self.encode_header(
+                operation, message_size, len(payload), message_id, version))
             payload_bytes.extend(payload)
             encoded_payloads.append(payload_bytes)
 
-        logging.info(
-            f"Packet sizes: {sum([len(payload) for payload in encoded_payloads])}")
+        if logging.getLogger().isEnabledFor(logging.INFO):
+            logging.info(
+                f"Packet sizes: {sum([len(payload) for payload in encoded_payloads])}")
         return encoded_payloads
 
-    def _encode_component(self, component: str, value: int) -> bytes:
-        return value.to_bytes(self.metadata_sizes[component], byteorder='big')
+    def encode_header(self, operation: int, message_size: int, payload_size: int, message_id: int,
+                      version: int = None) -> bytes:
+        """Encode the metadata at the start of a packet.
+
+        Args:
+            operation (int): Operation code of the message.
+            message_size (int): Size of the whole message's data.
+            payload_size (int): Size of the data carried by this packet.
+            message_id (int): The message ID, which must already fit in its header field.
+            version (int, optional): Protocol version of the payload. Defaults to None, which uses this protocol's version.
+
+        Returns:
+            bytes: The METADATA_LENGTH bytes of the header.
+        """
+        return HEADER_STRUCT.pack(version or self.version, self.header_length, operation,
+                                  message_size >> 16, message_size & 0xFFFF, payload_size, message_id)
 
     def _encode_data(self, data: str) -> bytes:
-        return data.encode('ascii')
+        # Version 1 payloads are ASCII. Text from version 2 clients may not be, and reaches
+        # version 1 clients with the rest escaped, e.g. '\\u2603', rather than not at all.
+        return data.encode('ascii', 'backslashreplace')
 
     def send(self, client_socket, message: List[bytes], socket_lock=None) -> bool:
         """Send a list of encoded packets to the client_socket
 
+        The lock is taken once for the whole message, and all the packets are handed to the
+        kernel together with scatter/gather sendmsg calls, so a large message costs a few
+        syscalls instead of one per packet.
+
         Args:
             client_socket (socket.socket): The socket to send the packets to
             message (List[bytes]): List of bytes to send to the client_socket, each representing a packet
@@ -180,74 +364,130 @@ class Protocol:
         Returns:
             bool: True if all packets were sent successfully, False otherwise
         """
-        for packet in message:
-            status = self._send_one_packet(
-                client_socket, packet, socket_lock)
-            if not status:
-                return False
-        return True
+        if socket_lock is not None:
+            socket_lock.acquire()
+        try:
+            return self._send_buffers(client_socket, [memoryview(packet) for packet in message])
+        finally:
+            if socket_lock is not None:
+                socket_lock.release()
 
-    def _send_one_packet(self, client_socket, packet: bytes, socket_lock=None) -> bool:
-        """Send a single of encoded packet to the client_socket
+    def _send_buffers(self, client_socket, buffers: List[memoryview]) -> bool:
+        """Send every buffer in order, continuing after partial writes
 
         Args:
-            client_socket (socket.socket): The socket to send the packets to
-            packet (bytes): Bytes to send to the client_socket, representing a packet
-            socket_lock (threading.Lock, optional): Thread lock for client if needed. Defaults to None.
+            client_socket (socket.socket): The socket to send the buffers to
+            buffers (List[memoryview]): The buffers to send; consumed by this call
 
         Returns:
-            bool: True if the packet was sent successfully, False otherwise
+            bool: True if all buffers were sent successfully, False otherwise
         """
-        if socket_lock is not None:
-            socket_lock.acquire()
-        total_sent = 0
-        # Send the packet in chunks until all bytes are sent
-        while total_sent < len(packet):
+        first = 0
+        while first < len(buffers):
             try:
-                bytes_sent = client_socket.send(packet, MAX_PACKET_SIZE)
+                if HAS_SENDMSG:
+                    bytes_sent = client_socket.sendmsg(
+                        buffers[first:first + MAX_SEND_BUFFERS])
+                else:
+                    bytes_sent = client_socket.send(buffers[first])
                 if bytes_sent == 0:
                     # Socket connection broken
-                    if socket_lock is not None:
-                        socket_lock.release()
                     return False
-                total_sent += bytes_sent
             except socket.error as e:
-                # For nonblocking sockets, EAGAIN and EWOULDBLOCK are raised when there is no data to write
-                # so we just need to wait for more data This code actually will never run because we are now using
-                # blocking sockets.
+                # For nonblocking sockets, EAGAIN and EWOULDBLOCK are raised when the send buffer is full
+                # so we just need to wait for the client to read
                 if e.errno != errno.EAGAIN and e.errno != errno.EWOULDBLOCK:
                     # Socket connection broken, unknown error
-                    if socket_lock is not None:
-                        socket_lock.release()
                     return False
                 # Wait for client_socket until ready for writing
                 select.select([], [client_socket], [])
-
-        if socket_lock is not None:
-            socket_lock.release()
-
+                continue
+            # Skip the buffers that were fully sent, and the sent part of the last one
+            while bytes_sent >= len(buffers[first]):
+                bytes_sent -= len(buffers[first])
+                first += 1
+                if first == len(buffers):
+                    return True
+            buffers[first] = buffers[first][bytes_sent:]
         return True
 
-    def parse_data(self, op: int, data: str) -> Dict[str, str]:
+    def parse_data(self, op: int, data, version: int = VERSION) -> Dict[str, str]:
         """Parses the data string into a dictionary of keyword arguments for the given operation.
 
         Args:
             op (int): Operation code
-            data (str): Data string to parse
+            data (str | bytes): Data string to parse, or the payload bytes for version 2
+            version (int, optional): Protocol version of the message. Defaults to VERSION.
 
         Returns:
             Dict[str, str]: Key-value pairs of keyword arguments
         """
+        # Unknown codes fall through to OperationCode, which raises the ValueError
+        operation = (OPERATION_CODES.get(op) or OperationCode(op)).name
+        if version == BINARY_VERSION:
+            return self._parse_fields(operation, data)
         kv_pairs = data.split(
-            self.separator, len(OPERATION_ARGS[OperationCode(op).name]))
+            self.separator, len(OPERATION_ARGS[operation]) + len(OPTIONAL_OPERATION_ARGS.get(operation, [])))
         kv_pairs = [kv_pair for kv_pair in kv_pairs if kv_pair]
         return dict(map(lambda x: tuple(x.split("=", 1)), kv_pairs))
 
+    def _parse_fields(self, operation: str, data: bytes) -> Dict[str, str]:
+        """Parses a version 2 payload. Empty optional fields count as left out."""
+        required = len(OPERATION_ARGS[operation])
+        args = {}
+        position = 0
+        end = len(data)
+        for i, key in enumerate(PAYLOAD_FIELDS[operation]):
+            if position >= end:
+                break
+            length = data[position]
+            position += 1
+            if length & 0x80:
+                # Fields of 128 bytes or more need more than one length byte
+                length, position = read_varint(data, position - 1)
+            if length or i < required:
+                args[key] = str(data[position:position + length], 'utf-8')
+            position += length
+        return args
+
+    def parse_batch(self, operation: str, data: bytes) -> List[Tuple[int, Dict[str, str]]]:
+        """Parses the payload of a BATCH or BATCH_RESPONSE into its sub-operations.
+
+        Args:
+            operation (str): 'BATCH' or 'BATCH_RESPONSE'
+            data (bytes): The version 2 payload of the batch
+
+        Raises:
+            ValueError: The payload is truncated or holds an operation that can't be batched.
+
+        Returns:
+            List[Tuple[int, Dict[str, str]]]: (operation code, keyword arguments) of each sub-operation, in order
+        """
+        allowed = BATCH_CONTENTS[operation]
+        data = memoryview(data)
+        sub_operations = []
+        position = 0
+        while position < len(data):
+            operation_code = data[position]
+            if operation_code not in allowed:
+                raise ValueError(
+                    f"Operation {operation_code} can't be part of a batch")
+            try:
+                length, position = read_varint(data, position + 1)
+            except IndexError:
+                raise ValueError("Truncated batch") from None
+            if position + length > len(data):
+                raise ValueError("Truncated batch")
+            sub_operations.append((operation_code, self._parse_fields(
+                OPERATION_CODES[operation_code].name, data[position:position + length])))
+            position += length
+        return sub_operations
+
     def parse_metadata(self, bytes: bytes) -> Metadata:
         """
             Takes in a bytes object and parses the metadata at the beginning according to the specifications.
         """
-        return Metadata(bytes[0:1], bytes[1:2], bytes[2:3], bytes[3:6], bytes[6:8], bytes[8:10])
+        return Metadata.unpack_from(bytes)
 
     def read_packets(self, client: socket.socket, message_processor: Callable) -> None:
         """Continuously reads packets from the client and calls message_processor on each completed message.
@@ -255,78 +495,178 @@ class Protocol:
         Here packet refers to a single data transmission from the client which contains a header (metadata) and a payload.
         A singular message may be split into multiple packets, each packet only contains a portion of one message.
         Each recv call may return bytes that make up multiple packets, and a single packet may be split up among multiple recv calls,
-        so we need to keep track of the current message we are building and the leftover bytes from the last recv call.
+        so the reassembly is delegated to a PacketParser which keeps track of the leftover bytes between calls.
 
         Args:
             client (socket.socket): The socket to read from.
             message_processor (Callable): The function to call on each completed message.
-                The function should take in the message metadata, data, and message ID for outbound messages.
+                The function should take in the message metadata, data, and number of messages completed before it.
         """
-        curr_msg_id = -1
-        curr_op = -1
-        msg_id_accum = 0
-
-        # Leftover bytes after the last complete packet in the last recv call.
-        # ALWAYS starts with a header (though may be incomplete).
-        left_over_packet = bytes()
-        running_msg = ""
+        parser = PacketParser(self)
 
         # Infinite loop to read packets
         while True:
-            received_data = client.recv(MAX_PACKET_SIZE)
-            if (int.from_bytes(received_data, 'big') <= 0):
+            if parser.recv_into(client) <= 0:
                 # Socket disconnected
                 return 0
-            curr_msg_to_parse = left_over_packet + received_data
-            if (len(curr_msg_to_parse) < METADATA_LENGTH):
-                left_over_packet = curr_msg_to_parse
-            else:
-                # Keeps track of whether we should continue reading the next packet in this recv output
-                # Set to false if we don't have the whole packet yet and need to wait for the rest
-                continue_packet_iteration = True
-
-                while continue_packet_iteration and len(curr_msg_to_parse) > METADATA_LENGTH:
-                    # Invariant here is that we at least have the metadata available
-                    packet_metadata = self.parse_metadata(curr_msg_to_parse)
-                    if packet_metadata.version != VERSION:
-                        return None
+            try:
+                messages = parser.parse()
+            except ValueError:
+                # Unsupported protocol version, or too many unfinished messages
+                return None
+            for metadata, msg, msg_id in messages:
+                message_processor(client, metadata, msg, msg_id)
+
+
+class PacketParser:
+    """Incremental parser turning a stream of received bytes into completed messages.
+
+    The parser does no I/O itself beyond recv_into, so it can be driven both by the blocking
+    read_packets loop and by an event loop that only reads when the socket is readable.
+    Bytes are received straight into one reusable bytearray, headers are unpacked in place,
+    and payloads are only copied out once, into the message they belong to.
+    """
+
+    def __init__(self, protocol: Protocol) -> None:
+        self.protocol = protocol
+        self.msg_id_accum = 0
+
+        # Received bytes live in buffer[start:end], which ALWAYS starts with a header (though may be incomplete).
+        self.buffer = bytearray(RECEIVE_BUFFER_SIZE)
+        self.start = 0
+        self.end = 0
+        # Map of (message id, operation code) to the payloads received so far of each
+        # multi-packet message, so the packets of several messages may be interleaved
+        self.partial_msgs = {}
+
+    def __getstate__(self) -> dict:
+        """Pickles the parser with only its unparsed bytes, e.g. to hand a connection over to another process"""
+        state = self.__dict__.copy()
+        state['buffer'] = self.buffer[self.start:self.end]
+        state['start'] = 0
+        state['end'] = self.end - self.start
+        return state
+
+    def recv_into(self, client: socket.socket) -> int:
+        """Receives as many bytes as are available (and fit) from client straight into the buffer.
+
+        Args:
+            client (socket.socket): The socket to read from.
+
+        Returns:
+            int: The number of bytes received, 0 if the socket disconnected.
+        """
+        self._make_room(MAX_PACKET_SIZE)
+        with memoryview(self.buffer) as view:
+            received = client.recv_into(view[self.end:])
+        self.end += received
+        return received
+
+    def feed(self, received_data: bytes) -> List[Tuple[Metadata, str, int]]:
+        """Adds bytes that were received elsewhere to the parser and returns every message completed by them.
+
+        Args:
+            received_data (bytes): Bytes just received from the socket.
+
+        Raises:
+            ValueError: See parse.
+
+        Returns:
+            List[Tuple[Metadata, str, int]]: See parse.
+        """
+        self._make_room(len(received_data))
+        self.buffer[self.end:self.end + len(received_data)] = received_data
+        self.end += len(received_data)
+        return self.parse()
+
+    def parse(self) -> List[Tuple[Metadata, str, int]]:
+        """Parses the buffered bytes and returns every message they complete.
+
+        Raises:
+            ValueError: A packet was sent with an unsupported protocol version, or too many
+                multi-packet messages were started without being finished.
+
+        Returns:
+            List[Tuple[Metadata, str, int]]: (metadata, message data, number of messages completed before it)
+                for each completed message, in the order they were received. The message data is a
+                str for version 1 messages and the raw payload bytes for version 2 messages.
+        """
+        completed = []
+        view = memoryview(self.buffer)
+        try:
+            # Keep reading packets while we at least have the metadata available
+            while self.end - self.start >= METADATA_LENGTH:
+                version, header_length, operation_code, size_high, size_low, payload_size, message_id = \
+                    HEADER_STRUCT.unpack_from(view, self.start)
+                if version not in SUPPORTED_VERSIONS:
+                    raise ValueError(f"Unsupported protocol version {version}")
+
+                # Check if we have the whole packet
+                payload_start = self.start + METADATA_LENGTH
+                payload_end = payload_start + payload_size
+                if payload_end > self.end:
+                    # We don't have the whole payload yet, so we need to wait to receive the next packet
+                    break
+                message_size = (size_high << 16) | size_low
+
+                # Check if this is a continuation of a message being reassembled
+                key = (message_id, operation_code)
+                running_msg = self.partial_msgs.get(key) if self.partial_msgs else None
+                if running_msg is not None:
+                    running_msg += view[payload_start:payload_end]
+                    if len(running_msg) >= message_size:
+                        msg = running_msg
+                        del self.partial_msgs[key]
+                    else:
+                        msg = None
+                elif payload_size >= message_size:
+                    # Single packet message, decode it straight out of the receive buffer
+                    msg = view[payload_start:payload_end]
+                else:
+                    # Else this is the first packet of a new multi-packet message
+                    if len(self.partial_msgs) >= MAX_PARTIAL_MESSAGES:
+                        raise ValueError("Too many multi-packet messages in progress")
+                    self.partial_msgs[key] = bytearray(view[payload_start:payload_end])
+                    msg = None
+
+                # If the message is done, then hand it back along with its metadata
+                if msg is not None:
+                    if version == BINARY_VERSION:
+                        data = bytes(msg)
                     else:
-                        # Read current packet's payload and add it to the running message
-                        curr_payload_size = packet_metadata.payload_size
-
-                        # Check if we have the whole packet
-                        if (len(curr_msg_to_parse[METADATA_LENGTH:]) < curr_payload_size):
-                            # We don't have the whole payload yet, so we need to wait to receive the next packet
-                            continue_packet_iteration = False
-                        else:
-                            # Whole packet available, parse payload size of the built up msg starting from after the metadata
-                            packet_to_parse = curr_msg_to_parse[METADATA_LENGTH:
-                                                                curr_payload_size + METADATA_LENGTH]
-                            incomplete_msg = packet_to_parse.decode(
-                                'ascii')
-                            # Check if this is a continuation of the current running message
-
-                            if (curr_msg_id == packet_metadata.message_id and curr_op == packet_metadata.operation_code):
-
-                                running_msg += incomplete_msg
-                            else:
-                                # Else this is a new message
-                                running_msg = incomplete_msg
-                                curr_msg_id = packet_metadata.message_id
-                                curr_op = packet_metadata.operation_code
-                            # If running msg is done, then do something based on metadata
-                            if (running_msg[-1] == '\n'):
-                                message_processor(client, packet_metadata, running_msg[:-1],
-                                                  msg_id_accum)
-                                msg_id_accum += 1
-                                curr_msg_id = -1
-                                curr_op = -1
-                                running_msg = ''
-                            # Once we've processed the current packet, we want to set the curr_msg_to_parse
-                            # to be the rest of the received, and then continue iterating to process the rest of the packets
-                            curr_msg_to_parse = curr_msg_to_parse[curr_payload_size +
-                                                                  METADATA_LENGTH:]
-                left_over_packet = curr_msg_to_parse
+                        # Strip the trailing newline which terminates every version 1 message
+                        data = str(msg[:-1] if msg[-1:] == b'\n' else msg, 'ascii')
+                    metadata = Metadata(version, header_length, operation_code,
+                                        message_size, payload_size, message_id)
+                    completed.append((metadata, data, self.msg_id_accum))
+                    self.msg_id_accum += 1
+                    msg = None
+
+                # Continue with the rest of the received bytes
+                self.start = payload_end
+        finally:
+            # The buffer can only be resized again once no views of it are left
+            view.release()
+
+        if self.start == self.end:
+            self.start = self.end = 0
+        return completed
+
+    def _make_room(self, size: int) -> None:
+        """Ensures at least size bytes are free at the end of the buffer, first by moving the
+        unparsed bytes to the front and then, for bursts larger than the buffer, by growing it."""
+        if len(self.buffer) - self.end >= size:
+            return
+        unparsed = self.end - self.start
+        if unparsed + size > len(self.buffer):
+            buffer = bytearray(max(2 * len(self.buffer), unparsed + size))
+        else:
+            buffer = self.buffer
+        buffer[:unparsed] = self.buffer[self.start:self.end]
+        self.buffer = buffer
+        self.start = 0
+        self.end = unparsed
 
 
 protocol_instance = Protocol(VERSION, METADATA_SIZES)
+binary_protocol_instance = Protocol(BINARY_VERSION, METADATA_SIZES)
@@ -0,0 +1,58 @@
+import os
+import sys
+
+from outbound import DEFAULT_HIGH_WATER_MARK, DEFAULT_MAX_QUEUED_BYTES
+from server import Server
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from replication import ReplicationNode  # noqa: E402
+
+
+class ReplicatedServer(Server):
+    """A server that is the primary or a replica of a replicated pair or group.
+
+    The primary ships its message log to the replicas (see replication.ReplicationNode),
+    which apply it to their own state. A replica serves account lists, taking those reads
+    off the primary, but every other request needs a login, and logins and new accounts
+    are refused with an error pointing at the primary. Once promoted, a replica serves
+    every request as the primary.
+    """
+
+    def __init__(self, host, port, protocol, replication_address, primary=None,
+                 high_water_mark=DEFAULT_HIGH_WATER_MARK, max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES,
+                 message_log=None, failover_timeout=None, open_log=None):
+        """
+        Args:
+            replication_address (str): host:port to answer the replicas and Promote on
+            primary (str, optional): Replication address of the primary to follow. Defaults to
+                None, which makes this server the primary; it then needs a message_log.
+            failover_timeout (float, optional): Seconds without hearing from the primary after
+                which a replica promotes itself. Defaults to None.
+            open_log (Callable, optional): Opens the message log a replica continues with once
+                promoted, see ReplicationNode. Defaults to None.
+        """
+        super().__init__(host, port, protocol, high_water_mark, max_queued_bytes, message_log)
+        self.replication = ReplicationNode(self, replication_address, primary, failover_timeout, open_log)
+
+    def start_replication(self):
+        """Starts answering the replicas, or following the primary. Call it before run."""
+        self.replication.start()
+
+    def _read_only(self, username):
+        return {'status': 'Error: This server is a read-only replica; create accounts and log in on the primary.',
+                'username': username}
+
+    def process_create_account(self, args, client_socket, socket_lock):
+        if self.replication.is_replica():
+            return self._read_only(args['username'])
+        return super().process_create_account(args, client_socket, socket_lock)
+
+    def process_login(self, args, client_socket, socket_lock):
+        if self.replication.is_replica():
+            return self._read_only(args['username'])
+        return super().process_login(args, client_socket, socket_lock)
+
+    def disconnect(self):
+        self.replication.stop()
+        super().disconnect()
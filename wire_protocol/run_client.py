@@ -5,7 +5,8 @@ if __name__ == '__main__':
     host = input('Enter host: ')
     port = int(input('Enter port: '))
 
-    client_instance = client.Client(host, port, protocol.protocol_instance)
+    client_instance = client.Client(
+        host, port, protocol.binary_protocol_instance)
 
     try:
         client_instance.connect()
@@ -1,13 +1,130 @@
-import server
+import argparse
+import os
 import socket
-import threading
+import sys
+import server
+import event_server
 import protocol
+import outbound
+import shard_server
+import cluster_server
+import replicated_server
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from message_log import DEFAULT_SEGMENT_SIZE, MessageLog  # noqa: E402
+from storage import MemoryStorage, SqliteStorage  # noqa: E402
 
 HOST = ''
 PORT = 6000
 
 if __name__ == '__main__':
-    server = server.Server(HOST, PORT, protocol.protocol_instance)
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--port', type=int, default=PORT,
+                        help='port clients connect to')
+    parser.add_argument('--mode', choices=['threaded', 'event'], default='threaded',
+                        help='threaded spawns a thread per client, event multiplexes clients over selector loops')
+    parser.add_argument('--loops', type=int, default=1,
+                        help='number of event loops to run in event mode')
+    parser.add_argument('--shards', type=int, default=1,
+                        help='number of processes in threaded mode, each owning the users that hash to it; keep it the same across restarts')
+    parser.add_argument('--high-water-mark', type=int, default=outbound.DEFAULT_HIGH_WATER_MARK,
+                        help='bytes queued for a client above which its requests stop being read')
+    parser.add_argument('--max-queued-bytes', type=int, default=outbound.DEFAULT_MAX_QUEUED_BYTES,
+                        help='bytes queued for a client above which it is disconnected')
+    parser.add_argument('--log-dir',
+                        help='keep accounts and queued messages in a write-ahead log and snapshots in this directory, so they survive restarts')
+    parser.add_argument('--commit-delay', type=float, default=0.0,
+                        help='seconds to gather more log records before each fsync')
+    parser.add_argument('--segment-size', type=int, default=DEFAULT_SEGMENT_SIZE,
+                        help='bytes per log segment; every few sealed segments are compacted into a snapshot')
+    parser.add_argument('--storage', choices=['memory', 'sqlite'], default='memory',
+                        help='memory keeps accounts and queued messages in memory, sqlite keeps them in --db-file')
+    parser.add_argument('--db-file', default='chat.db',
+                        help='SQLite database used by --storage sqlite')
+    parser.add_argument('--cluster-port', type=int,
+                        help='run as a node of a cluster, answering the other nodes on this port')
+    parser.add_argument('--join',
+                        help='host:port of the cluster port of any node already in the cluster to join')
+    parser.add_argument('--advertise', default=socket.gethostname(),
+                        help='hostname the other nodes and redirected clients reach this node on')
+    parser.add_argument('--replication-port', type=int,
+                        help='run as the primary, or with --replica-of a replica, answering replication on this port')
+    parser.add_argument('--replica-of',
+                        help='host:port of the replication port of the primary to follow, serving account lists but no writes until promoted')
+    parser.add_argument('--failover-timeout', type=float,
+                        help='seconds without hearing from the primary after which a replica promotes itself')
+    parser.add_argument('--sync-replicas', type=int, default=0,
+                        help='caught-up replicas that must have applied a write before the primary answers it')
+    args = parser.parse_args()
+    if args.storage == 'sqlite' and args.log_dir:
+        parser.error('--log-dir only applies to --storage memory; the SQLite database already survives restarts')
+    if args.shards > 1 and args.mode == 'event':
+        parser.error('--shards only applies to --mode threaded')
+    if args.log_dir and args.mode == 'event':
+        parser.error('--log-dir only applies to --mode threaded; the event loops would stall on every fsync')
+    if args.join and args.cluster_port is None:
+        parser.error('--join needs --cluster-port')
+    if args.cluster_port is not None and (args.shards > 1 or args.mode == 'event'):
+        parser.error('--cluster-port only applies to a single threaded process')
+    if (args.replica_of or args.failover_timeout is not None) and args.replication_port is None:
+        parser.error('--replica-of and --failover-timeout need --replication-port')
+    if args.failover_timeout is not None and not args.replica_of:
+        parser.error('--failover-timeout only applies to a replica')
+    if args.replication_port is not None:
+        if args.shards > 1 or args.mode == 'event' or args.cluster_port is not None or args.storage == 'sqlite':
+            parser.error('--replication-port only applies to a single threaded process with --storage memory')
+        if not args.replica_of and not args.log_dir:
+            parser.error('a primary ships its message log, so it needs --log-dir')
+        if args.replica_of and args.log_dir and os.path.isdir(args.log_dir) and os.listdir(args.log_dir):
+            parser.error('a replica only writes --log-dir once promoted, so it must be empty')
+    if args.sync_replicas and (args.replication_port is None or args.replica_of):
+        parser.error('--sync-replicas only applies to a primary')
+
+    def open_shard(shard=None):
+        """Opens the message log and storage, each shard in its own files"""
+        log_dir, db_file = args.log_dir, args.db_file
+        if shard is not None:
+            log_dir = log_dir and os.path.join(log_dir, f'shard{shard}')
+            root, extension = os.path.splitext(db_file)
+            db_file = f'{root}.shard{shard}{extension}'
+        message_log = MessageLog(
+            log_dir, args.commit_delay, args.segment_size, sync_replicas=args.sync_replicas) if log_dir else None
+        storage = SqliteStorage(db_file) if args.storage == 'sqlite' else MemoryStorage()
+        return message_log, storage
+
+    if args.shards > 1:
+        try:
+            shard_server.run_shards(HOST, args.port, protocol.protocol_instance, args.shards, open_shard,
+                                    high_water_mark=args.high_water_mark, max_queued_bytes=args.max_queued_bytes)
+        except KeyboardInterrupt:
+            print('Server dropped')
+        sys.exit()
+
+    # A replica's --log-dir stays empty until it is promoted
+    message_log, storage = open_shard() if not args.replica_of else (None, None)
+    if args.mode == 'event':
+        server = event_server.EventServer(
+            HOST, args.port, protocol.protocol_instance, args.loops, args.high_water_mark, args.max_queued_bytes,
+            message_log, storage)
+    elif args.cluster_port is not None:
+        server = cluster_server.ClusterServer(
+            HOST, args.port, protocol.protocol_instance, f'{args.advertise}:{args.cluster_port}',
+            f'{args.advertise}:{args.port}', args.high_water_mark, args.max_queued_bytes, message_log, storage)
+        server.join_cluster(args.join)
+    elif args.replication_port is not None:
+        def open_log(account_list, undelivered_msg):
+            """Starts a promoted replica's message log from the state it was shipped"""
+            return MessageLog.from_state(args.log_dir, account_list, undelivered_msg,
+                                         commit_delay=args.commit_delay, segment_size=args.segment_size)
+        server = replicated_server.ReplicatedServer(
+            HOST, args.port, protocol.protocol_instance, f'[::]:{args.replication_port}', args.replica_of,
+            args.high_water_mark, args.max_queued_bytes, message_log, args.failover_timeout,
+            open_log if args.replica_of and args.log_dir else None)
+        server.start_replication()
+    else:
+        server = server.Server(HOST, args.port, protocol.protocol_instance,
+                               args.high_water_mark, args.max_queued_bytes, message_log, storage)
     try:
         server.run()
     except KeyboardInterrupt:
@@ -1,33 +1,101 @@
+import itertools
+import os
+import sys
 import socket
-from time import sleep
 import time
 import protocol
 import threading
-import re
 import logging
+from outbound import DEFAULT_HIGH_WATER_MARK, DEFAULT_MAX_QUEUED_BYTES, OutboundQueue, ThreadedWriter
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from account_query import DEFAULT_PAGE_SIZE, page_accounts, stream_accounts  # noqa: E402
+from message_log import RecordType  # noqa: E402
+from session_registry import SessionRegistry  # noqa: E402
+from storage import MemoryStorage  # noqa: E402
+from striped_lock import StripedLock  # noqa: E402
+
+# Answers when the shard or node holding a recipient, or some of the listed accounts, can't be reached
+UNAVAILABLE_RECIPIENT_STATUS = "Error: The recipient's server is unavailable, try again later."
+UNAVAILABLE_ACCOUNTS_STATUS = 'Error: Some accounts are unavailable, try again later.'
 
 
 class Server:
-    def __init__(self, host, port, protocol):
+    def __init__(self, host, port, protocol, high_water_mark=DEFAULT_HIGH_WATER_MARK,
+                 max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES, message_log=None, storage=None):
         self.host = host
         self.port = port
 
-        self.msg_counter = 0
+        # Message ids of the RECV_MESSAGEs pushed to clients. They are their own id space, told
+        # apart from responses, which echo their request's id, by the operation code. Taking the
+        # next id from a count is atomic, so senders on any thread need no lock.
+        self.push_ids = itertools.count()
+
+        # Anything that must be atomic for one user (creating, deleting, logging in or off)
+        # holds that username's lock, so requests for different users don't contend
+        self.user_locks = StripedLock()
+
+        # Storage engine holding the accounts and mailboxes, in memory unless given one
+        self.storage = storage or MemoryStorage()
 
-        self.account_list = []  # List of usernames
+        self.account_list = self.storage.account_list  # Set of usernames, iterated in sorted order
+        # Only serializes writes to account_list; reads and snapshots need no lock
         self.account_list_lock = threading.Lock()
 
-        self.logged_in = {}  # Map of username to (client_socket, socket lock)
-        self.logged_in_lock = threading.Lock()
+        # Map of username to (client_socket, socket lock), indexed both ways. Changed
+        # under the username's user lock, read without a lock.
+        self.logged_in = SessionRegistry()
 
-        # Map of recipient username to list of (sender, message) for that recipient
-        self.undelivered_msg = {}
-        self.undelivered_msg_lock = threading.Lock()
+        # Map of recipient username to the Mailbox of (sender, message) waiting for them,
+        # each guarded by its own lock
+        self.undelivered_msg = self.storage.undelivered_msg
+
+        # Map of client socket to its OutboundQueue. Single dict operations are atomic,
+        # so this is only touched when a connection opens or closes and needs no lock.
+        self.outbound = {}
+        self.high_water_mark = high_water_mark
+        self.max_queued_bytes = max_queued_bytes
+        # Map of client socket to the protocol version it last spoke, also atomic without a lock
+        self.client_versions = {}
+
+        # Optional MessageLog that accounts and queued messages are recovered from and written to
+        self.message_log = message_log
+        if message_log is not None:
+            message_log.recover(self.account_list, self.undelivered_msg)
 
         self.protocol = protocol
 
     def disconnect(self):
         self.socket.close()
+        if self.message_log is not None:
+            self.message_log.close()
+        self.storage.close()
+
+    def log(self, record_type, *fields):
+        """Appends a record to the message log, if there is one. Call it while holding the
+        lock of the state the record changes, so the log has the same order.
+
+        Args:
+            record_type (message_log.RecordType): The type of the record
+            *fields (str): The record's fields
+
+        Returns:
+            int: The sequence number to pass to wait_durable, 0 without a log
+        """
+        if self.message_log is None:
+            return 0
+        return self.message_log.append(record_type, *fields)
+
+    def wait_durable(self, sequence_number):
+        """Blocks until a logged record is on disk. Call it after releasing every lock, so
+        other requests join the same group commit instead of waiting behind it.
+
+        Args:
+            sequence_number (int): Returned by log
+        """
+        if sequence_number:
+            self.message_log.wait(sequence_number)
 
     def handle_client(self, client, socket_lock):
         """Function to handle a client on a single thread, which continuously reads the socket and processes the messages
@@ -36,56 +104,137 @@ class Server:
             client (socket.socket): The socket to read from.
             socket_lock (threading.Lock): Lock to prevent concurrent socket read
         """
-        value = self.protocol.read_packets(
-            client, self.process_operation_curried(socket_lock))
+        outbox = self.open_outbound(client, ThreadedWriter())
+        process_operation = self.process_operation_curried(socket_lock)
+
+        def process_and_throttle(client, metadata, msg, id_accum):
+            self.finish(process_operation(client, metadata, msg, id_accum), outbox)
+            # Stop reading this client's requests while it isn't reading our responses
+            outbox.wait_for_capacity()
+        try:
+            value = self.protocol.read_packets(client, process_and_throttle)
+        except Exception:
+            # The client is still released, so it isn't left logged in
+            logging.exception('Error while processing client message')
+            value = None
         if value is None:
             client.close()
-        self.logged_in_lock.acquire()
-        username = [k for k, v in self.logged_in.items() if v == (
-            client, socket_lock)]
-        if len(username) > 0:
-            self.logged_in.pop(username[0])
-        self.logged_in_lock.release()
-        print("Closing client.")
+        self.release_client(client, socket_lock)
 
-    def atomicIsLoggedIn(self, client_socket, socket_lock):
-        """Atomically checks if the client is logged in 
+    def open_outbound(self, client, writer):
+        """Creates the outbound queue that every message to client goes through
 
         Args:
-            client (socket.socket): The client socket
+            client (socket.socket): The newly connected client socket
+            writer: Finishes writes when the socket is full, see OutboundQueue
+
+        Returns:
+            OutboundQueue: The client's queue
+        """
+        outbox = OutboundQueue(
+            client, writer, self.high_water_mark, self.max_queued_bytes)
+        self.outbound[client] = outbox
+        return outbox
+
+    def advance(self, work):
+        """Runs work, a generator that yields whenever its client's outbound queue is throttled,
+        until it pauses like that or is done
+
+        Args:
+            work (Generator): The work, e.g. the pages of a streamed account list
+
+        Returns:
+            Generator: work if it paused and should be resumed once the queue drains, else None
+        """
+        for _ in work:
+            return work
+        return None
+
+    def finish(self, work, outbox):
+        """Resumes paused work on the calling thread every time the client's queue drains,
+        until it is done
+
+        Args:
+            work (Generator): Returned by process_operation, None if nothing is paused
+            outbox (OutboundQueue): The client's queue
+        """
+        while work is not None:
+            outbox.wait_for_capacity()
+            if outbox.closed:
+                # Nobody reads the rest; a mailbox flush leaves it in the mailbox
+                work.close()
+                return
+            work = self.advance(work)
+
+    def release_client(self, client, socket_lock):
+        """Logs out whichever account the disconnected client was logged into. Messages
+        that were still waiting in its outbound queue are queued again for the recipient.
+
+        Args:
+            client (socket.socket): The client socket that disconnected
             socket_lock (threading.Lock): The socket's associated lock
         """
-        ret = True
-        self.logged_in_lock.acquire()
-        if (client_socket, socket_lock) not in self.logged_in.values():
-            ret = False
-        self.logged_in_lock.release()
-        return ret
+        self.log_off((client, socket_lock))
+        self.client_versions.pop(client, None)
+        outbox = self.outbound.pop(client, None)
+        if outbox is not None:
+            self.requeue_messages(outbox.discard())
+        print("Closing client.")
 
-    def atomicLogIn(self, client_socket, socket_lock, account_name):
-        """Atomically logs client in with the account name
+    def requeue_messages(self, message_infos):
+        """Puts messages that could not be written back in front of their recipients' queues
+
+        Args:
+            message_infos (List[tuple]): (recipient, sender, message) of each message, oldest first
+        """
+        if not message_infos:
+            return
+        unsent = {}
+        for recipient, sender, message in message_infos:
+            unsent.setdefault(recipient, []).append((sender, message))
+        for recipient, messages in unsent.items():
+            mailbox = self.undelivered_msg.mailbox(recipient)
+            mailbox.lock.acquire()
+            mailbox.requeue(messages)
+            self.log(RecordType.REQUEUE, recipient,
+                     *(field for message_info in messages for field in message_info))
+            mailbox.lock.release()
+
+    def atomicIsLoggedIn(self, client_socket, socket_lock):
+        """Atomically checks if the client is logged in. A single registry lookup, so no lock is needed.
 
         Args:
             client (socket.socket): The client socket
             socket_lock (threading.Lock): The socket's associated lock
-            account_name (str): The account name to log in
         """
-        self.logged_in_lock.acquire()
-        self.logged_in[account_name] = (
-            client_socket, socket_lock)
-        self.logged_in_lock.release()
+        return self.logged_in.has_connection((client_socket, socket_lock))
 
     def atomicIsAccountCreated(self, recipient):
-        """Atomically checks if an account is created
+        """Atomically checks if an account is created. A single set lookup, so no lock is needed.
 
         Args:
             recipient (str): The account name to check
         """
-        ret = True
-        self.account_list_lock.acquire()
-        ret = recipient in self.account_list
-        self.account_list_lock.release()
-        return ret
+        return recipient in self.account_list
+
+    def log_off(self, connection):
+        """Logs out whichever account the connection is logged into
+
+        Args:
+            connection (tuple): The client's (client_socket, socket_lock)
+
+        Returns:
+            str: The username that was logged out, or None if the connection wasn't logged in
+        """
+        # A connection's requests are handled one at a time, so its account can't change under us
+        username = self.logged_in.username_for(connection)
+        if username is None:
+            return None
+        user_lock = self.user_locks[username]
+        user_lock.acquire()
+        self.logged_in.pop_connection(connection)
+        user_lock.release()
+        return username
 
     def process_create_account(self, args, client_socket, socket_lock):
         """Processes a create account request. We require that the requester is not 
@@ -101,43 +250,95 @@ class Server:
             response = {
                 'status': 'Error: User can\'t create an account while logged in.', 'username': account_name}
         else:
-            self.account_list_lock.acquire()
+            user_lock = self.user_locks[account_name]
+            user_lock.acquire()
             if (account_name in self.account_list):
-                self.account_list_lock.release()
+                user_lock.release()
                 response = {
                     'status': 'Error: Account already exists.', 'username': account_name}
             else:
-                self.account_list.append(account_name)
-                self.atomicLogIn(client_socket, socket_lock,
-                                 account_name)  # accountLock > login
-                # if we release the lock earlier, someone else can create the same acccount and try to log in while we wait for the log in lock
+                # USER > ACCOUNT LIST
+                self.account_list_lock.acquire()
+                self.account_list.add(account_name)
                 self.account_list_lock.release()
+                sequence_number = self.log(RecordType.CREATE_ACCOUNT, account_name)
+                # if we release the user lock earlier, someone else can log into the new account before we do
+                self.logged_in[account_name] = (client_socket, socket_lock)
+                user_lock.release()
+                self.wait_durable(sequence_number)
                 print("Account created: " + account_name)
                 response = {'status': 'Success', 'username': account_name}
         return response
 
     def process_list_accounts(self, args):
         """Processes a list account request. We don't require the requester to be logged in.
+        If a limit is given, only that many accounts are returned along with a next_cursor
+        which can be sent back as the cursor to get the following page.
 
         Args:
-            account_name (str): The args object for creating an account parsed from the received message
+            args (dict): The args object for listing accounts parsed from the received message
         """
         logging.info('Received', time.time())
         try:
-            pattern = re.compile(
-                fr"{args['query']}", flags=re.IGNORECASE)
-            self.account_list_lock.acquire()
-            result = []
-            for account in self.account_list:
-                if pattern.match(account):
-                    result.append(account)
-            self.account_list_lock.release()
-            response = {'status': 'Success', 'accounts': ";".join(result)}
+            limit = self._parse_limit(args.get('limit'))
+        except ValueError:
+            return {'status': 'Error: limit must be a positive integer.', 'accounts': ''}
+        try:
+            result, next_cursor = self.search_page(
+                args['query'], limit, args.get('cursor'))
+            response = {'status': 'Success', 'accounts': ";".join(
+                result), 'next_cursor': next_cursor}
+        except ConnectionError:
+            # Another shard or node holding some of the accounts can't be reached
+            response = {'status': UNAVAILABLE_ACCOUNTS_STATUS, 'accounts': ''}
         except:
             response = {'status': 'Error: regex is malformed.', 'accounts': ''}
         finally:
             return response
 
+    def process_list_accounts_stream(self, args):
+        """Processes a streaming list account request, yielding one response per page of
+        accounts so the whole result never has to be built in memory. The last page has an
+        empty next_cursor. We don't require the requester to be logged in.
+
+        Args:
+            args (dict): The args object for listing accounts parsed from the received message
+        """
+        try:
+            page_size = self._parse_limit(
+                args.get('limit')) or DEFAULT_PAGE_SIZE
+        except ValueError:
+            yield {'status': 'Error: limit must be a positive integer.', 'accounts': '', 'next_cursor': ''}
+            return
+        try:
+            pages = self.search_pages(args['query'], page_size)
+        except:
+            yield {'status': 'Error: regex is malformed.', 'accounts': '', 'next_cursor': ''}
+            return
+        try:
+            for page, next_cursor in pages:
+                yield {'status': 'Success', 'accounts': ";".join(page), 'next_cursor': next_cursor}
+        except ConnectionError:
+            yield {'status': UNAVAILABLE_ACCOUNTS_STATUS, 'accounts': '', 'next_cursor': ''}
+
+    def search_page(self, query, limit=None, cursor=None):
+        """Finds one page of the accounts matching query, see account_query.page_accounts.
+        The index is copy-on-write, so searching it blocks no creates or sends.
+        """
+        return page_accounts(self.account_list.snapshot(), query, limit, cursor)
+
+    def search_pages(self, query, page_size):
+        """Finds the accounts matching query one page at a time, see account_query.stream_accounts"""
+        return stream_accounts(self.account_list.snapshot(), query, page_size)
+
+    def _parse_limit(self, limit):
+        if not limit:
+            return None
+        limit = int(limit)
+        if limit <= 0:
+            raise ValueError(limit)
+        return limit
+
     def process_send_msg(self, args, client_socket, socket_lock):
         """Processes a send message request. We require that the requester is 
         logged in and the recipient exists.
@@ -147,36 +348,106 @@ class Server:
             client (socket.socket): The client socket
             socket_lock (threading.Lock): The socket's associated lock
         """
-        self.logged_in_lock.acquire()
-        if (not (client_socket, socket_lock) in self.logged_in.values()):
-            self.logged_in_lock.release()
+        username = self.logged_in.username_for((client_socket, socket_lock))
+        if username is None:
             response = {
                 'status': 'Error: Need to be logged in to send a message.'}
         else:
-            username = [k for k, v in self.logged_in.items() if v == (
-                client_socket, socket_lock)][0]
-            self.logged_in_lock.release()
             recipient = args["recipient"]
             message = args["message"]
             print("sending message", recipient, message)
-            self.account_list_lock.acquire()
-            if recipient not in self.account_list:
-                self.account_list_lock.release()
+            if not self.atomicIsAccountCreated(recipient):
                 response = {
                     'status': 'Error: The recipient of the message does not exist.'}
             else:
-                self.undelivered_msg_lock.acquire()
-                if recipient in self.undelivered_msg:
-                    self.undelivered_msg[recipient] += [
-                        (username, message)]
-                else:
-                    self.undelivered_msg[recipient] = [
-                        (username, message)]
-                self.undelivered_msg_lock.release()
-                self.account_list_lock.release()
+                self.wait_durable(self.queue_or_deliver(recipient, (username, message)))
                 response = {'status': 'Success'}
         return response
 
+    def process_send_msg_multi(self, args, client_socket, socket_lock):
+        """Processes a send message request to many recipients. We require that the requester
+        is logged in and at least one recipient exists. The recipients are checked against the
+        account list all at once, every mailbox shares the same (sender, message) tuple, and
+        online recipients speaking the same protocol version share one encoding of the message.
+
+        Args:
+            args (dict): The args object for sending a message, with the recipients joined by ';'
+            client (socket.socket): The client socket
+            socket_lock (threading.Lock): The socket's associated lock
+        """
+        username = self.logged_in.username_for((client_socket, socket_lock))
+        if username is None:
+            return {'status': 'Error: Need to be logged in to send a message.', 'invalid_recipients': ''}
+
+        recipients, invalid_recipients = self.account_list.partition(
+            recipient for recipient in args['recipients'].split(';') if recipient)
+        if not recipients:
+            return {'status': 'Error: None of the recipients exist.',
+                    'invalid_recipients': ';'.join(invalid_recipients)}
+
+        self.send_to_recipients(recipients, (username, args['message']))
+        return {'status': 'Success', 'invalid_recipients': ';'.join(invalid_recipients)}
+
+    def send_to_recipients(self, recipients, message_info):
+        """Delivers or queues one message for every recipient, which must all exist. Online
+        recipients speaking the same protocol version share one encoding of the message.
+
+        Args:
+            recipients (List[str]): The recipients' usernames
+            message_info (tuple): (sender, message) to deliver
+        """
+        sender, message = message_info
+        message_id = next(self.push_ids)
+        encodings = {}  # Protocol version to the encoded RECV_MESSAGE
+
+        def deliver(client_socket, socket_lock, recipient):
+            version = self.client_versions.get(client_socket)
+            if version not in encodings:
+                encodings[version] = self.protocol.encode('RECV_MESSAGE', message_id, {
+                    'sender': sender, 'message': message}, version)
+            return self.send(client_socket, socket_lock, encodings[version], (recipient,) + message_info)
+        sequence_number = 0
+        for recipient in recipients:
+            sequence_number = max(sequence_number, self.queue_or_deliver(
+                recipient, message_info, deliver))
+        self.wait_durable(sequence_number)
+        print("sending message to", len(recipients), "recipients")
+
+    def queue_or_deliver(self, recipient, message_info, deliver=None):
+        """Pushes a message to an online recipient's outbound queue, unless older mail is
+        still waiting to be flushed to them, and otherwise adds it to their mailbox
+
+        Args:
+            recipient (str): The recipient's username
+            message_info (tuple): (sender, message) to deliver
+            deliver (Callable, optional): Called with the recipient's client socket, socket lock and
+                username to send the message. Defaults to None, which uses deliver_message.
+
+        Returns:
+            int: The message log sequence number to wait_durable on if the message was queued, else 0
+        """
+        mailbox = self.undelivered_msg.mailbox(recipient)
+        mailbox.lock.acquire()
+        try:
+            # Looked up under the mailbox lock: a recipient logging in after this flushes the
+            # mailbox only once we release it, so the message can't be stranded
+            recipient_connection = self.logged_in.get(recipient)
+            if recipient_connection is None or mailbox:
+                delivered = False
+            elif deliver is None:
+                delivered = self.deliver_message(
+                    *recipient_connection, recipient, *message_info)
+            else:
+                delivered = deliver(*recipient_connection, recipient)
+            sequence_number = 0
+            if not delivered:
+                mailbox.append(message_info)
+                sequence_number = self.log(RecordType.ENQUEUE, recipient, *message_info)
+        finally:
+            # A message that fails to encode must not leave every later send to the recipient waiting
+            mailbox.lock.release()
+        return sequence_number
+
     def process_delete_account(self, client_socket, socket_lock):
         """Processes a delete account request. We require that the requester is 
         logged in.
@@ -185,19 +456,20 @@ class Server:
             client (socket.socket): The client socket
             socket_lock (threading.Lock): The socket's associated lock
         """
-        self.logged_in_lock.acquire()
-
-        if ((client_socket, socket_lock) in self.logged_in.values()):
-            username = [k for k, v in self.logged_in.items() if v == (
-                client_socket, socket_lock)][0]
+        username = self.logged_in.username_for((client_socket, socket_lock))
+        if username is not None:
+            user_lock = self.user_locks[username]
+            user_lock.acquire()
             self.logged_in.pop(username)
-            self.logged_in_lock.release()
+            # USER > ACCOUNT LIST
             self.account_list_lock.acquire()
             self.account_list.remove(username)
             self.account_list_lock.release()
+            sequence_number = self.log(RecordType.DELETE_ACCOUNT, username)
+            user_lock.release()
+            self.wait_durable(sequence_number)
             response = {'status': 'Success'}
         else:
-            self.logged_in_lock.release()
             response = {
                 'status': 'Error: Need to be logged in to delete your account.'}
         return response
@@ -211,25 +483,25 @@ class Server:
             client (socket.socket): The client socket
             socket_lock (threading.Lock): The socket's associated lock
         """
-        self.logged_in_lock.acquire()
-        if ((client_socket, socket_lock) in self.logged_in.values()):
-            self.logged_in_lock.release()
+        if (self.logged_in.has_connection((client_socket, socket_lock))):
             response = {
                 'status': 'Error: Already logged into an account, please log off first.', 'username': ''}
         else:
             account_name = args['username']
+            user_lock = self.user_locks[account_name]
+            user_lock.acquire()
             if (not self.atomicIsAccountCreated(account_name)):
-                self.logged_in_lock.release()
+                user_lock.release()
                 response = {
                     'status': 'Error: Account does not exist.', 'username': account_name}
-            elif (account_name in self.logged_in.keys()):
-                self.logged_in_lock.release()
+            elif (account_name in self.logged_in):
+                user_lock.release()
                 response = {
                     'status': 'Error: Someone else is logged into that account.', 'username': account_name}
             else:
                 self.logged_in[account_name] = (
                     client_socket, socket_lock)
-                self.logged_in_lock.release()
+                user_lock.release()
                 response = {'status': 'Success', 'username': account_name}
         return response
 
@@ -241,15 +513,9 @@ class Server:
             client (socket.socket): The client socket
             socket_lock (threading.Lock): The socket's associated lock
         """
-        self.logged_in_lock.acquire()
-        if ((client_socket, socket_lock) in self.logged_in.values()):
-            username = [k for k, v in self.logged_in.items() if v == (
-                client_socket, socket_lock)][0]
-            self.logged_in.pop(username)
-            self.logged_in_lock.release()
+        if self.log_off((client_socket, socket_lock)) is not None:
             response = {'status': 'Success'}
         else:
-            self.logged_in_lock.release()
             response = {
                 'status': 'Error: Need to be logged in to log out of your account.'}
         return response
@@ -270,89 +536,233 @@ class Server:
                 client (socket.socket): The client socket
                 metadata (protocol.Metadata): The metadata parsed from the message
                 msg (str): message to parse for operation arguments
-                id_accum (it): integer accumulator for message 
+                id_accum (int): number of messages received on the connection before this one;
+                    unused, as responses echo metadata.message_id
+
+            Returns:
+                Generator: The rest of the responses, paused because the client's outbound queue
+                    is throttled, to resume with advance once it drains; None if all were queued
             """
             operation_code = metadata.operation_code.value
-            args = self.protocol.parse_data(operation_code, msg)
+            # Every response carries the id of its request, so clients can pipeline requests
+            message_id = metadata.message_id
+            # Responses, and messages pushed to this client from now on, use the version of its latest request
+            version = metadata.version
+            self.client_versions[client_socket] = version
+            logged_in_as = None
             match operation_code:
-                case 1:  # CREATE_ACCOUNT
-                    response = self.protocol.encode(
-                        'CREATE_ACCOUNT_RESPONSE', id_accum, self.process_create_account(args, client_socket, socket_lock))
-                case 3:  # LIST ACCOUNTS
-                    response = self.protocol.encode(
-                        'LIST_ACCOUNTS_RESPONSE', id_accum, self.process_list_accounts(args))
-                case 5:  # SENDMSG
-                    # in this case we want to add to undelivered messages, which the server iterator will figure out i think
-                    # here we check the person sending is logged in and the recipient account has been created
-                    response = self.protocol.encode(
-                        'SEND_MESSAGE_RESPONSE', id_accum, self.process_send_msg(args, client_socket, socket_lock))
-                case 7:  # DELETE
-                    response = self.protocol.encode(
-                        'DELETE_ACCOUNT_RESPONSE', id_accum, self.process_delete_account(client_socket, socket_lock))
-                case 9:  # LOGIN
-                    response = self.protocol.encode(
-                        'LOG_IN_RESPONSE', id_accum, self.process_login(args, client_socket, socket_lock))
-                case 11:  # LOGOFF
-                    response = self.protocol.encode(
-                        'LOG_OFF_RESPONSE', id_accum, self.process_logoff(client_socket, socket_lock))
-            if not response is None:
-                self.protocol.send(client_socket, response, socket_lock)
+                case 14:  # LIST ACCOUNTS STREAM
+                    args = self.protocol.parse_data(operation_code, msg, version)
+                    return self.advance(self.send_pages(
+                        client_socket, socket_lock, message_id, version, args))
+                case 16:  # BATCH
+                    # Every sub-operation is processed in order and answered in one BATCH_RESPONSE
+                    try:
+                        if version != protocol.BINARY_VERSION:
+                            raise ValueError('Batches need protocol version 2')
+                        sub_operations = self.protocol.parse_batch('BATCH', msg)
+                    except ValueError as e:
+                        # Answered like any other bad request. A version 1 BATCH_RESPONSE only
+                        # carries a status, as batches themselves only exist in version 2.
+                        self.send(client_socket, socket_lock, self.protocol.encode(
+                            'BATCH_RESPONSE', message_id, {'status': f'Error: {e}.'},
+                            protocol.VERSION))
+                        return None
+                    responses = []
+                    for sub_operation_code, args in sub_operations:
+                        response = self.process_request(
+                            sub_operation_code, args, client_socket, socket_lock)
+                        responses.append(response)
+                        if sub_operation_code in (1, 9) and response[1]['status'] == 'Success':
+                            logged_in_as = response[1]['username']
+                    self.send(client_socket, socket_lock, self.protocol.encode_batch(
+                        'BATCH_RESPONSE', message_id, responses))
+                case _:
+                    args = self.protocol.parse_data(operation_code, msg, version)
+                    result = self.process_request(
+                        operation_code, args, client_socket, socket_lock)
+                    if result is None:
+                        # Not an operation the server answers
+                        return
+                    response_operation, response = result
+                    self.send(client_socket, socket_lock, self.protocol.encode(
+                        response_operation, message_id, response, version))
+                    if operation_code in (1, 9) and response['status'] == 'Success':
+                        logged_in_as = response['username']
+            if logged_in_as is not None:
+                # Mail queued while the user was offline goes out right after the login response.
+                # Creating an account logs into it too, and a recreated account may have mail
+                # left over, which would otherwise hold back every new message to it.
+                return self.deliver_undelivered_messages(logged_in_as)
+            return None
         return process_operation
 
-    def handle_undelivered_messages(self):
-        """Sends any undelivered messages to the recipients. If the recipient is not logged in
-        or sending fails, the undelivered message remains on the work queue. 
+    def send_pages(self, client_socket, socket_lock, message_id, version, args):
+        """Sends each page of a streamed account list as soon as it is found, all under the
+        request's message id. Pauses before a page while the client's queue is throttled, so a
+        long list is paced by the client instead of piling up until it counts as a slow consumer.
+
+        Args:
+            client_socket (socket.socket): The client socket
+            socket_lock (threading.Lock): The socket's associated lock
+            message_id (int): The id of the request
+            version (int): The protocol version to answer in
+            args (dict): The args parsed from the request
         """
-        self.undelivered_msg_lock.acquire()
-        for recipient, message_infos in self.undelivered_msg.items():
-            self.logged_in_lock.acquire()
-            if recipient in self.logged_in:
-                client_socket, socket_lock = self.logged_in[recipient]
-                undelivered_messages = []
-                for (sender, msg) in message_infos:
-                    response = self.protocol.encode(
-                        "RECV_MESSAGE", self.msg_counter, {"sender": sender, "message": msg})
-                    status = self.protocol.send(
-                        client_socket, response, socket_lock)
-                    if not status:
-                        undelivered_messages.append((sender, msg))
-                    self.msg_counter = self.msg_counter + 1
-                self.undelivered_msg[recipient] = undelivered_messages
-            self.logged_in_lock.release()
-        self.undelivered_msg_lock.release()
-
-    def send_messages(self):
-        """ Handles undelivered messages in a loop, and sleeps to provide better 
-        responsiveness on the client side
+        outbox = self.outbound.get(client_socket)
+        for page in self.process_list_accounts_stream(args):
+            if outbox is not None and outbox.throttle():
+                yield
+            if not self.send(client_socket, socket_lock, self.protocol.encode(
+                    'LIST_ACCOUNTS_STREAM_RESPONSE', message_id, page, version)):
+                return
+
+    def send(self, client_socket, socket_lock, message, message_info=None):
+        """Queues an encoded message on the client's outbound queue. Sockets without a
+        queue, which only happens when handlers are driven directly, are written synchronously.
+
+        Args:
+            client_socket (socket.socket): The socket to send to
+            socket_lock (threading.Lock): The socket's associated lock
+            message (List[bytes]): The encoded packets
+            message_info (tuple, optional): (recipient, sender, message) of a chat message, which is
+                queued for the recipient again if the connection closes before it is written. Defaults to None.
+
+        Returns:
+            bool: True if the message was queued or sent, False otherwise
+        """
+        outbox = self.outbound.get(client_socket)
+        if outbox is None:
+            return self.protocol.send(client_socket, message, socket_lock)
+        return outbox.push(message, message_info)
+
+    def process_request(self, operation_code, args, client_socket, socket_lock):
+        """Processes a single request and builds its response. See the relevant process
+        functions for functionality.
+
+        Args:
+            operation_code (int): Operation code of the request
+            args (dict): The args parsed from the request
+            client_socket (socket.socket): The client socket
+            socket_lock (threading.Lock): The socket's associated lock
+
+        Returns:
+            Tuple[str, dict]: The response operation and its args, or None if the operation isn't a request
         """
+        match operation_code:
+            case 1:  # CREATE_ACCOUNT
+                return 'CREATE_ACCOUNT_RESPONSE', self.process_create_account(args, client_socket, socket_lock)
+            case 3:  # LIST ACCOUNTS
+                return 'LIST_ACCOUNTS_RESPONSE', self.process_list_accounts(args)
+            case 5:  # SENDMSG
+                # here we check the person sending is logged in and the recipient account has been created,
+                # then either write the message to the online recipient or queue it until they log in
+                return 'SEND_MESSAGE_RESPONSE', self.process_send_msg(args, client_socket, socket_lock)
+            case 7:  # DELETE
+                return 'DELETE_ACCOUNT_RESPONSE', self.process_delete_account(client_socket, socket_lock)
+            case 9:  # LOGIN
+                return 'LOG_IN_RESPONSE', self.process_login(args, client_socket, socket_lock)
+            case 11:  # LOGOFF
+                return 'LOG_OFF_RESPONSE', self.process_logoff(client_socket, socket_lock)
+            case 18:  # SENDMSG TO MANY RECIPIENTS
+                return 'SEND_MESSAGE_MULTI_RESPONSE', self.process_send_msg_multi(args, client_socket, socket_lock)
+
+    def deliver_message(self, client_socket, socket_lock, recipient, sender, message):
+        """Queues a single message for a logged in recipient
+
+        Args:
+            client_socket (socket.socket): The recipient's socket
+            socket_lock (threading.Lock): The socket's associated lock
+            recipient (str): The username of the recipient
+            sender (str): The username of the sender
+            message (str): The message to deliver
+
+        Returns:
+            bool: True if the message was queued successfully, False otherwise
+        """
+        response = self.protocol.encode(
+            "RECV_MESSAGE", next(self.push_ids), {"sender": sender, "message": message},
+            self.client_versions.get(client_socket))
+        return self.send(client_socket, socket_lock, response, (recipient, sender, message))
+
+    def deliver_undelivered_messages(self, recipient):
+        """Flushes the messages queued while the recipient was offline, as far as their
+        outbound queue has room
+
+        Args:
+            recipient (str): The username that just logged in
+
+        Returns:
+            Generator: The rest of the flush, to resume with advance once the queue drains, or None
+        """
+        return self.advance(self.flush_mailbox(recipient))
+
+    def flush_mailbox(self, recipient):
+        """Moves messages from the recipient's mailbox to their outbound queue until the queue
+        is throttled, then pauses until it drains. A mailbox is only flushed that way, so the
+        server never disconnects a client as a slow consumer for mail it decided to send. New
+        messages keep going to the mailbox until it is empty, behind the older ones. If the
+        recipient logs off or sending fails, the remaining messages stay in the mailbox.
+
+        Args:
+            recipient (str): The username that just logged in
+        """
+        recipient_connection = self.logged_in.get(recipient)
+        if recipient_connection is None:
+            return
+        outbox = self.outbound.get(recipient_connection[0])
+        mailbox = self.undelivered_msg.mailbox(recipient)
         while True:
-            self.handle_undelivered_messages()
-            sleep(0.01)
+            mailbox.lock.acquire()
+            delivered = 0
+            try:
+                if self.logged_in.get(recipient) != recipient_connection:
+                    # Logged off, or logged in elsewhere, which flushes the mailbox itself
+                    return
+                failed = False
+                while mailbox and not (outbox is not None and outbox.throttle()):
+                    sender, msg = mailbox.popleft()
+                    try:
+                        sent = self.deliver_message(*recipient_connection, recipient, sender, msg)
+                    except Exception:
+                        mailbox.requeue([(sender, msg)])
+                        raise
+                    if not sent:
+                        mailbox.requeue([(sender, msg)])
+                        failed = True
+                        break
+                    delivered += 1
+                done = failed or not mailbox
+            finally:
+                if delivered:
+                    # Messages the connection drops before writing them are logged again by requeue_messages
+                    self.log(RecordType.ACK, recipient, str(delivered))
+                mailbox.lock.release()
+            if done:
+                return
+            yield
 
     def run(self):
-        """ Runs the server by starting the message delivery thread. It then
-        accepts any connections and spawns a new thread to handle the connection
+        """ Runs the server by accepting any connections and spawning a new
+        thread to handle each connection
         """
         server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket = server_socket
-        server_socket.setblocking(0)
         server_socket.bind((self.host, self.port))
         print("Server started.")
         server_socket.listen()
+        self.accept_clients(server_socket)
 
-        message_delivery_thread = threading.Thread(
-            target=self.send_messages, daemon=True)
-        message_delivery_thread.start()
+    def accept_clients(self, server_socket):
+        """Accepts connections on a listening socket forever, handling each on its own thread
+
+        Args:
+            server_socket (socket.socket): The listening socket
+        """
         while(True):
-            try:
-                clientsocket, addr = server_socket.accept()
-                clientsocket.setblocking(1)
-                lock = threading.Lock()
-                thread = threading.Thread(
-                    target=self.handle_client, args=(clientsocket, lock, ), daemon=True)
-                thread.start()
-                print('Connection created with:', addr)
-            except BlockingIOError:
-                pass
-            finally:
-                self.handle_undelivered_messages()
+            clientsocket, addr = server_socket.accept()
+            lock = threading.Lock()
+            thread = threading.Thread(
+                target=self.handle_client, args=(clientsocket, lock, ), daemon=True)
+            thread.start()
+            print('Connection created with:', addr)
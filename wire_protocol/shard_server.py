@@ -0,0 +1,459 @@
+import itertools
+import logging
+import multiprocessing
+import os
+import socket
+import sys
+import threading
+import zlib
+from concurrent.futures import Future, ThreadPoolExecutor
+from multiprocessing import reduction
+
+import protocol
+from outbound import DEFAULT_HIGH_WATER_MARK, DEFAULT_MAX_QUEUED_BYTES, ThreadedWriter
+from protocol import PacketParser
+from server import UNAVAILABLE_RECIPIENT_STATUS, Server
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from account_query import compile_query, merge_pages, page_through  # noqa: E402
+
+# Threads per shard answering requests from the other shards
+REQUEST_WORKERS = 8
+
+# Kinds of frames sent between shards
+REQUEST = 0  # (REQUEST, request id, (method, args)), answered by a REPLY or ERROR
+REPLY = 1  # (REPLY, request id, result)
+ERROR = 2  # (ERROR, request id, exception)
+ADOPT = 3  # (ADOPT, None, (parser, messages)), immediately followed by the connection's fd
+
+
+def shard_for(username, num_shards):
+    """Finds the shard that owns a user's account, mailbox and login. The hash is stable
+    across processes and restarts, unlike hash() on a str.
+
+    Args:
+        username (str): The username
+        num_shards (int): The number of shards
+
+    Returns:
+        int: The owning shard
+    """
+    return zlib.crc32(username.encode('utf-8')) % num_shards
+
+
+class ShardLink:
+    """One end of the pipe between two shard processes.
+
+    Requests are answered on the receiving shard's worker threads, so a request waiting
+    for an fsync doesn't hold up the ones behind it, and each reply resolves the Future its
+    caller waits on. A handed off connection's file descriptor is passed over the pipe
+    right behind its ADOPT frame, under the same lock so nothing comes between them.
+    """
+
+    def __init__(self, connection, server):
+        self.connection = connection  # multiprocessing.connection.Connection to the other shard
+        self.server = server
+        self.send_lock = threading.Lock()
+        self.request_ids = itertools.count()
+        # Guards pending and dead, so no request is registered after the pending ones are failed
+        self.lock = threading.Lock()
+        self.pending = {}  # Request id to the Future of its reply
+        self.dead = False  # Set once the other shard has gone away
+
+    def start(self):
+        threading.Thread(target=self._read_loop, daemon=True).start()
+
+    def request(self, method, *args):
+        """Asks the other shard to run its shard_<method>(*args)
+
+        Raises:
+            ConnectionError: The other shard has gone away
+
+        Returns:
+            Future: Resolves to the method's result, or raises its exception
+        """
+        future = Future()
+        request_id = next(self.request_ids)
+        self.lock.acquire()
+        if self.dead:
+            self.lock.release()
+            raise ConnectionError('Shard went away')
+        self.pending[request_id] = future
+        self.lock.release()
+        try:
+            self._send((REQUEST, request_id, (method, args)))
+        except OSError:
+            self.lock.acquire()
+            self.pending.pop(request_id, None)
+            self.lock.release()
+            raise ConnectionError('Shard went away') from None
+        return future
+
+    def call(self, method, *args):
+        """Runs the other shard's shard_<method>(*args) and waits for its result"""
+        return self.request(method, *args).result()
+
+    def hand_off(self, client, parser, messages):
+        """Sends a connection to the other shard, which continues reading it with parser
+        after processing messages. The caller still has to close its copy of the socket.
+        """
+        self._send((ADOPT, None, (parser, messages)), client.fileno())
+
+    def _send(self, frame, handle=None):
+        self.send_lock.acquire()
+        try:
+            self.connection.send(frame)
+            if handle is not None:
+                reduction.send_handle(self.connection, handle, None)
+        finally:
+            self.send_lock.release()
+
+    def _read_loop(self):
+        while True:
+            try:
+                kind, request_id, payload = self.connection.recv()
+            except (EOFError, OSError):
+                self.lock.acquire()
+                self.dead = True
+                print(f"Lost the link to a shard, {len(self.pending)} requests failed")
+                for future in self.pending.values():
+                    future.set_exception(ConnectionError('Shard went away'))
+                self.pending.clear()
+                self.lock.release()
+                return
+            if kind == REQUEST:
+                self.server.executor.submit(self._answer, request_id, *payload)
+            elif kind == ADOPT:
+                client = socket.socket(fileno=reduction.recv_handle(self.connection))
+                self.server.adopt_client(client, *payload)
+            else:
+                self.lock.acquire()
+                future = self.pending.pop(request_id)
+                self.lock.release()
+                if kind == REPLY:
+                    future.set_result(payload)
+                else:
+                    future.set_exception(payload)
+
+    def _answer(self, request_id, method, args):
+        try:
+            frame = (REPLY, request_id, getattr(self.server, 'shard_' + method)(*args))
+        except Exception as e:
+            frame = (ERROR, request_id, RuntimeError(f'{method} failed on shard: {e!r}'))
+        self._send(frame)
+
+
+class ShardServer(Server):
+    """One of num_shards processes serving the same port, so requests run on as many cores.
+
+    Users are partitioned across shards by shard_for(username): the owning shard holds the
+    account, the mailbox and the login, so process_login enforces the single login rule as
+    it does with one process. A connection is accepted by whichever shard, and when it
+    creates or logs into an account owned by another shard it is handed over to that shard
+    before the request is processed, together with its parser and any requests after it.
+    Once logged in, a connection therefore lives with its own user's state, and only
+    messages to users on other shards, and account searches, cross the pipes to the others.
+    """
+
+    def __init__(self, host, port, protocol, shard, num_shards, connections, server_socket=None,
+                 high_water_mark=DEFAULT_HIGH_WATER_MARK, max_queued_bytes=DEFAULT_MAX_QUEUED_BYTES,
+                 message_log=None, storage=None):
+        """
+        Args:
+            shard (int): This shard's number, from 0 to num_shards - 1
+            num_shards (int): The number of shards
+            connections (Dict[int, Connection]): Pipe to every other shard, by shard number
+            server_socket (socket.socket, optional): Listening socket shared by every shard.
+                Defaults to None, which binds host and port on run.
+        """
+        super().__init__(host, port, protocol, high_water_mark,
+                         max_queued_bytes, message_log, storage)
+        self.shard = shard
+        self.num_shards = num_shards
+        self.socket = server_socket
+        self.executor = ThreadPoolExecutor(REQUEST_WORKERS)
+        # Map of shard number to the ShardLink to it
+        self.links = {peer: ShardLink(connection, self) for peer, connection in connections.items()}
+        for link in self.links.values():
+            link.start()
+
+    def run(self):
+        """Accepts connections on the shared listening socket, or binds one if there is none"""
+        if self.socket is None:
+            super().run()
+        else:
+            print(f"Shard {self.shard} started.")
+            self.accept_clients(self.socket)
+
+    def owner(self, username):
+        return shard_for(username, self.num_shards)
+
+    def handle_client(self, client, socket_lock, parser=None, messages=()):
+        """Like Server.handle_client, but hands the connection over to another shard before
+        processing a request that creates or logs into an account that shard owns
+
+        Args:
+            client (socket.socket): The socket to read from.
+            socket_lock (threading.Lock): Lock to prevent concurrent socket read
+            parser (PacketParser, optional): The parser of a connection handed over by another shard
+            messages (list, optional): Requests it parsed but didn't process, processed first
+        """
+        outbox = self.open_outbound(client, ThreadedWriter())
+        process_operation = self.process_operation_curried(socket_lock)
+        parser = parser or PacketParser(self.protocol)
+        try:
+            while True:
+                for i, (metadata, msg, msg_id) in enumerate(messages):
+                    owner = self.handoff_owner(metadata, msg, client, socket_lock)
+                    if owner is not None:
+                        self.hand_off(owner, client, parser, messages[i:])
+                        return
+                    self.finish(process_operation(client, metadata, msg, msg_id), outbox)
+                    # Stop reading this client's requests while it isn't reading our responses
+                    outbox.wait_for_capacity()
+                if parser.recv_into(client) <= 0:
+                    # Socket disconnected
+                    break
+                try:
+                    messages = parser.parse()
+                except ValueError:
+                    # Unsupported protocol version
+                    client.close()
+                    break
+        except Exception:
+            # The client is still released, so it isn't left logged in on this shard
+            logging.exception('Error while processing client message')
+            client.close()
+        self.release_client(client, socket_lock)
+
+    def handoff_owner(self, metadata, msg, client, socket_lock):
+        """Checks whether a request should be processed by another shard: it creates or logs
+        into an account owned by that shard, and the connection isn't logged in. A batch
+        goes by its first create or login.
+
+        Returns:
+            int: The shard to hand the connection over to, or None to process the request here
+        """
+        if not self.links or self.atomicIsLoggedIn(client, socket_lock):
+            return None
+        operation_code = metadata.operation_code.value
+        if operation_code in (1, 9):  # CREATE_ACCOUNT, LOGIN
+            username = self.protocol.parse_data(operation_code, msg, metadata.version)['username']
+        elif operation_code == 16 and metadata.version == protocol.BINARY_VERSION:  # BATCH
+            try:
+                sub_operations = self.protocol.parse_batch('BATCH', msg)
+            except ValueError:
+                return None
+            username = next((args['username'] for sub_operation_code, args in sub_operations
+                             if sub_operation_code in (1, 9)), None)
+            if username is None:
+                return None
+        else:
+            return None
+        owner = self.owner(username)
+        return None if owner == self.shard else owner
+
+    def hand_off(self, owner, client, parser, messages):
+        """Moves a connection that isn't logged in to the owner shard, once every response
+        already queued for it has been written
+
+        Args:
+            owner (int): The shard to move it to
+            client (socket.socket): The client socket
+            parser (PacketParser): The connection's parser
+            messages (list): Requests parsed but not processed yet
+        """
+        outbox = self.outbound[client]
+        outbox.wait_until_empty()
+        self.outbound.pop(client, None)
+        self.requeue_messages(outbox.discard())
+        self.client_versions.pop(client, None)
+        self.links[owner].hand_off(client, parser, messages)
+        # Only closes our copy; the owner shard has its own descriptor of the connection
+        client.close()
+
+    def adopt_client(self, client, parser, messages):
+        """Starts handling a connection handed over by another shard"""
+        parser.protocol = self.protocol
+        thread = threading.Thread(target=self.handle_client, args=(
+            client, threading.Lock(), parser, messages), daemon=True)
+        thread.start()
+
+    def _foreign_account(self, username, client_socket, socket_lock):
+        # Only possible in a batch that already moved the connection for another account
+        return self.owner(username) != self.shard and not self.atomicIsLoggedIn(client_socket, socket_lock)
+
+    def process_create_account(self, args, client_socket, socket_lock):
+        if self._foreign_account(args['username'], client_socket, socket_lock):
+            return {'status': 'Error: Create that account in a separate request.', 'username': args['username']}
+        return super().process_create_account(args, client_socket, socket_lock)
+
+    def process_login(self, args, client_socket, socket_lock):
+        if self._foreign_account(args['username'], client_socket, socket_lock):
+            return {'status': 'Error: Log into that account in a separate request.', 'username': args['username']}
+        return super().process_login(args, client_socket, socket_lock)
+
+    def process_send_msg(self, args, client_socket, socket_lock):
+        """Like Server.process_send_msg, but a recipient owned by another shard gets the
+        message through that shard, which also checks that the account exists
+        """
+        owner = self.owner(args['recipient'])
+        username = self.logged_in.username_for((client_socket, socket_lock))
+        if owner == self.shard or username is None:
+            return super().process_send_msg(args, client_socket, socket_lock)
+        try:
+            missing = self.links[owner].call('send', [args['recipient']], username, args['message'])
+        except ConnectionError:
+            return {'status': UNAVAILABLE_RECIPIENT_STATUS}
+        if missing:
+            return {'status': 'Error: The recipient of the message does not exist.'}
+        return {'status': 'Success'}
+
+    def process_send_msg_multi(self, args, client_socket, socket_lock):
+        """Like Server.process_send_msg_multi, but the recipients are split by owning shard,
+        and every other shard gets its share in a single request, all sent at once
+        """
+        username = self.logged_in.username_for((client_socket, socket_lock))
+        if username is None:
+            return super().process_send_msg_multi(args, client_socket, socket_lock)
+        recipients = list(dict.fromkeys(
+            recipient for recipient in args['recipients'].split(';') if recipient))
+        by_owner = {}
+        for recipient in recipients:
+            by_owner.setdefault(self.owner(recipient), []).append(recipient)
+        replies = []
+        unavailable = set()  # Recipients on shards that have gone away
+        for owner, owned in by_owner.items():
+            if owner == self.shard:
+                continue
+            try:
+                replies.append((owned, self.links[owner].request('send', owned, username, args['message'])))
+            except ConnectionError:
+                unavailable.update(owned)
+        missing = set(self.shard_send(by_owner.get(self.shard, []), username, args['message']))
+        for owned, reply in replies:
+            try:
+                missing.update(reply.result())
+            except ConnectionError:
+                unavailable.update(owned)
+        # Recipients that couldn't be reached are reported with those that don't exist
+        invalid_recipients = ';'.join(recipient for recipient in recipients
+                                      if recipient in missing or recipient in unavailable)
+        if len(missing) + len(unavailable) == len(recipients):
+            status = UNAVAILABLE_RECIPIENT_STATUS if unavailable else 'Error: None of the recipients exist.'
+            return {'status': status, 'invalid_recipients': invalid_recipients}
+        return {'status': 'Success', 'invalid_recipients': invalid_recipients}
+
+    def shard_send(self, recipients, sender, message):
+        """Delivers or queues a message for the recipients owned by this shard
+
+        Args:
+            recipients (List[str]): The recipients' usernames
+            sender (str): The sender's username
+            message (str): The message
+
+        Returns:
+            List[str]: The recipients that don't exist
+        """
+        recipients, missing = self.account_list.partition(recipients)
+        if recipients:
+            self.send_to_recipients(recipients, (sender, message))
+        return missing
+
+    def shard_search_page(self, query, limit, cursor):
+        return super().search_page(query, limit, cursor)
+
+    def search_page(self, query, limit=None, cursor=None):
+        """Finds one page of the accounts matching query on every shard. Each shard returns
+        its own first limit matches after cursor, so the first limit of them merged in
+        sorted order are the page.
+        """
+        # Raises on a malformed regex before asking the other shards
+        compile_query(query)
+        replies = [link.request('search_page', query, limit, cursor) for link in self.links.values()]
+        pages = [super().search_page(query, limit, cursor)] + [reply.result() for reply in replies]
+        return merge_pages(pages, limit)
+
+    def search_pages(self, query, page_size):
+        """Finds the accounts matching query on every shard one page at a time, see
+        account_query.page_through
+        """
+        return page_through(self.search_page, query, page_size)
+
+    def disconnect(self):
+        super().disconnect()
+        self.executor.shutdown(wait=False)
+
+
+def _run_shard(host, port, protocol, shard, num_shards, server_socket, pipes, open_shard, options):
+    """Entry point of each shard's process"""
+    connections = {}
+    for (first, second), (first_end, second_end) in pipes.items():
+        if shard == first:
+            connections[second] = first_end
+            second_end.close()
+        elif shard == second:
+            connections[first] = second_end
+            first_end.close()
+        else:
+            first_end.close()
+            second_end.close()
+    message_log, storage = open_shard(shard) if open_shard else (None, None)
+    server = ShardServer(host, port, protocol, shard, num_shards, connections, server_socket,
+                         message_log=message_log, storage=storage, **options)
+    try:
+        server.run()
+    except KeyboardInterrupt:
+        server.disconnect()
+
+
+def start_shards(host, port, protocol, num_shards, open_shard=None, **options):
+    """Forks num_shards ShardServer processes that accept connections from one listening
+    socket, bound before they are forked, and are connected to each other by pipes
+
+    Args:
+        host (str): The host to listen on
+        port (int): The port to listen on
+        protocol (protocol.Protocol): The protocol to speak
+        num_shards (int): The number of processes
+        open_shard (Callable, optional): Called in each shard's process with its number, returns the
+            (message_log, storage) it uses. Defaults to None, which keeps everything in memory.
+        **options: high_water_mark and max_queued_bytes, see Server
+
+    Returns:
+        List[multiprocessing.Process]: The shards' processes
+    """
+    server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server_socket.bind((host, port))
+    server_socket.listen(socket.SOMAXCONN)
+    pipes = {(first, second): multiprocessing.Pipe()
+             for first in range(num_shards) for second in range(first + 1, num_shards)}
+    # Forked, so the shards inherit the listening socket and the pipes
+    context = multiprocessing.get_context('fork')
+    processes = [context.Process(target=_run_shard, args=(
+        host, port, protocol, shard, num_shards, server_socket, pipes, open_shard, options), daemon=True)
+        for shard in range(num_shards)]
+    for process in processes:
+        process.start()
+    # Only the shards use them from now on
+    server_socket.close()
+    for first_end, second_end in pipes.values():
+        first_end.close()
+        second_end.close()
+    return processes
+
+
+def run_shards(host, port, protocol, num_shards, open_shard=None, **options):
+    """Runs the shards of start_shards until every one of them has stopped"""
+    processes = start_shards(host, port, protocol, num_shards, open_shard, **options)
+    print(f"Server started with {num_shards} shards.")
+    try:
+        for process in processes:
+            process.join()
+    except KeyboardInterrupt:
+        # Every shard got the interrupt too, and closes its own log and storage
+        for process in processes:
+            process.join()
+        raise
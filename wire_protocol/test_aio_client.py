@@ -0,0 +1,71 @@
+import asyncio
+import threading
+import unittest
+from aio_client import AsyncClient
+from protocol import binary_protocol_instance, protocol_instance
+from server import Server
+from test_event_server import free_port
+
+TEST_HOST = "127.0.0.1"
+
+
+class AsyncClientTest(unittest.IsolatedAsyncioTestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        cls.server = Server(TEST_HOST, cls.port, protocol_instance)
+        threading.Thread(target=cls.server.run, daemon=True).start()
+
+    async def connect(self, protocol=protocol_instance):
+        for _ in range(100):
+            try:
+                client = AsyncClient(TEST_HOST, self.port, protocol)
+                await client.connect()
+                return client
+            except ConnectionRefusedError:
+                await asyncio.sleep(0.02)
+        raise ConnectionError('Server never came up')
+
+    async def test_pipelined_requests(self):
+        sender = await self.connect()
+        recipient = await self.connect(binary_protocol_instance)
+        self.assertEqual(await recipient.create_account('aiorecipient'),
+                         {'status': 'Success', 'username': 'aiorecipient'})
+        self.assertEqual((await sender.create_account('aiorecipient'))['status'], 'Error: Account already exists.')
+        await sender.create_account('aiosender')
+
+        # Every request is written before any response is read, and each gets its own answer
+        responses = await asyncio.gather(
+            *[sender.send_message('aiorecipient', f'message {i}') for i in range(500)],
+            sender.send_message('nobody', 'lost'),
+            sender.list_accounts('aio'),
+            sender.send_message_multi(['aiorecipient', 'nobody'], 'both'))
+        self.assertEqual(responses[:500], [{'status': 'Success'}] * 500)
+        self.assertEqual(responses[500], {'status': 'Error: The recipient of the message does not exist.'})
+        self.assertEqual(responses[501]['accounts'], 'aiorecipient;aiosender')
+        self.assertEqual(responses[502], {'status': 'Success', 'invalid_recipients': 'nobody'})
+        for i in range(500):
+            self.assertEqual(await recipient.receive(), ('aiosender', f'message {i}'))
+        self.assertEqual(await recipient.receive(), ('aiosender', 'both'))
+
+        page = await recipient.list_accounts('aio', limit=1)
+        self.assertEqual(page['accounts'], 'aiorecipient')
+        page = await recipient.list_accounts('aio', limit=1, cursor=page['next_cursor'])
+        self.assertEqual(page['accounts'], 'aiosender')
+        self.assertEqual(await recipient.log_off(), {'status': 'Success'})
+        self.assertEqual(await recipient.login('aiorecipient'), {'status': 'Success', 'username': 'aiorecipient'})
+        self.assertEqual(await recipient.delete_account(), {'status': 'Success'})
+        await sender.close()
+        await recipient.close()
+
+    async def test_requests_fail_once_disconnected(self):
+        client = await self.connect()
+        self.assertEqual((await client.list_accounts())['status'], 'Success')
+        client.writer.transport.abort()
+        with self.assertRaises(ConnectionError):
+            await client.list_accounts()
+        await client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
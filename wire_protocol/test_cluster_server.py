@@ -0,0 +1,201 @@
+import itertools
+import threading
+import unittest
+from unittest import mock
+from cluster_server import ClusterServer
+# The cluster messages come from common, which importing cluster_server puts on the path
+from cluster_pb2 import Member, Membership
+from protocol import PacketParser, protocol_instance
+from test_event_server import connect, free_port, receive, request
+
+TEST_HOST = "127.0.0.1"
+TEST_PROTOCOL = protocol_instance
+
+
+def by_name(username):
+    return username.lower(), username
+
+
+def start_node(seed=None):
+    node = ClusterServer(TEST_HOST, free_port(), TEST_PROTOCOL, f'{TEST_HOST}:{free_port()}')
+    node.join_cluster(seed)
+    threading.Thread(target=node.run, daemon=True).start()
+    return node
+
+
+def receive_many(client, count):
+    """Receives count packets, which may arrive in the same read"""
+    parser = PacketParser(TEST_PROTOCOL)
+    messages = []
+    while len(messages) < count:
+        messages.extend(parser.feed(client.recv(2048)))
+    return [(metadata.operation_code.name, TEST_PROTOCOL.parse_data(metadata.operation_code.value, msg))
+            for metadata, msg, _ in messages]
+
+
+def owned_by(node, prefix):
+    """The first username starting with prefix that the node owns"""
+    i = 0
+    while not node.cluster.is_local(f'{prefix}{i}'):
+        i += 1
+    return f'{prefix}{i}'
+
+
+class ClusterServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Two nodes on their own ports, the second joining the first
+        first = start_node()
+        cls.nodes = [first, start_node(first.cluster.address)]
+
+    def test_create_and_login_go_to_owner(self):
+        username = owned_by(self.nodes[1], 'owned')
+        client = connect(self.nodes[0].port)
+        op, args = request(client, 'CREATE_ACCOUNT', 0, {'username': username})
+        self.assertEqual(args['status'], f'Error: That account is served by {TEST_HOST}:{self.nodes[1].port}, '
+                                         'connect there instead.')
+        self.assertFalse(username in self.nodes[0].account_list)
+        client.close()
+
+        client = connect(self.nodes[1].port)
+        op, args = request(client, 'CREATE_ACCOUNT', 0, {'username': username})
+        self.assertEqual(args['status'], 'Success')
+        other = connect(self.nodes[0].port)
+        op, args = request(other, 'LOG_IN', 0, {'username': username})
+        self.assertTrue(args['status'].startswith('Error: That account is served by'))
+        client.close()
+        other.close()
+
+    def test_send_across_nodes(self):
+        sender_name, recipient_name = owned_by(self.nodes[0], 'sender'), owned_by(self.nodes[1], 'recipient')
+        recipient = connect(self.nodes[1].port)
+        request(recipient, 'CREATE_ACCOUNT', 0, {'username': recipient_name})
+        sender = connect(self.nodes[0].port)
+        op, args = request(sender, 'CREATE_ACCOUNT', 0, {'username': sender_name})
+        self.assertEqual(args['status'], 'Success')
+
+        op, args = request(sender, 'SEND_MESSAGE', 1, {'recipient': recipient_name, 'message': 'hi'})
+        self.assertEqual(args['status'], 'Success')
+        self.assertEqual(receive(recipient), ('RECV_MESSAGE', {'sender': sender_name, 'message': 'hi'}))
+        op, args = request(sender, 'SEND_MESSAGE', 2, {'recipient': owned_by(self.nodes[1], 'nobody'),
+                                                       'message': 'hi'})
+        self.assertEqual(args['status'], 'Error: The recipient of the message does not exist.')
+
+        missing = [owned_by(self.nodes[0], 'nobody'), owned_by(self.nodes[1], 'nobody')]
+        op, args = request(sender, 'SEND_MESSAGE_MULTI', 3, {
+            'recipients': ';'.join([missing[1], recipient_name, missing[0]]), 'message': 'all'})
+        self.assertEqual(args, {'status': 'Success', 'invalid_recipients': ';'.join([missing[1], missing[0]])})
+        self.assertEqual(receive(recipient), ('RECV_MESSAGE', {'sender': sender_name, 'message': 'all'}))
+        sender.close()
+        recipient.close()
+
+    def test_list_accounts_across_nodes(self):
+        usernames = [owned_by(self.nodes[1], 'lister'), owned_by(self.nodes[0], 'Lister')]
+        for username in usernames:
+            next(node for node in self.nodes if node.cluster.is_local(username)).account_list.add(username)
+        client = connect(self.nodes[0].port)
+        op, args = request(client, 'LIST_ACCOUNTS', 0, {'query': 'lister'})
+        self.assertEqual(args['accounts'], ';'.join(sorted(usernames, key=by_name)))
+        op, args = request(client, 'LIST_ACCOUNTS', 1, {'query': 'lister', 'limit': '1'})
+        first = args['accounts']
+        op, args = request(client, 'LIST_ACCOUNTS', 2, {'query': 'lister', 'limit': '1',
+                                                         'cursor': args['next_cursor']})
+        self.assertEqual([first, args['accounts']], sorted(usernames, key=by_name))
+        self.assertEqual(args['next_cursor'], '')
+        op, args = request(client, 'LIST_ACCOUNTS', 3, {'query': '['})
+        self.assertEqual(args['status'], 'Error: regex is malformed.')
+        client.close()
+
+    def test_rebalance_on_join_and_leave(self):
+        usernames = [f'mover{i}' for i in range(30)]
+        for username in usernames:
+            owner = next(node for node in self.nodes if node.cluster.is_local(username))
+            owner.account_list.add(username)
+            owner.undelivered_msg.mailbox(username).append(('kevin', f'for {username}'))
+
+        def assert_placed(nodes):
+            for username in usernames:
+                for node in nodes:
+                    owns = node.cluster.is_local(username)
+                    self.assertEqual(username in node.account_list, owns)
+                    self.assertEqual(list(node.undelivered_msg.get(username, [])),
+                                     [('kevin', f'for {username}')] if owns else [])
+
+        joined = start_node(self.nodes[1].cluster.address)
+        self.assertEqual(set(self.nodes[0].cluster.members), {node.cluster.address for node in self.nodes + [joined]})
+        moved = [username for username in usernames if joined.cluster.is_local(username)]
+        self.assertTrue(moved)
+        assert_placed(self.nodes + [joined])
+
+        # A moved user logs in at its new owner and gets the mail queued at the old one
+        client = connect(joined.port)
+        TEST_PROTOCOL.send(client, TEST_PROTOCOL.encode('LOG_IN', 0, {'username': moved[0]}))
+        self.assertEqual(receive_many(client, 2), [
+            ('LOG_IN_RESPONSE', {'status': 'Success', 'username': moved[0]}),
+            ('RECV_MESSAGE', {'sender': 'kevin', 'message': f'for {moved[0]}'})])
+        request(client, 'LOG_OFF', 1)
+        client.close()
+        joined.undelivered_msg.mailbox(moved[0]).append(('kevin', f'for {moved[0]}'))
+
+        joined.cluster.leave()
+        joined.cluster.stop()
+        self.assertEqual(len(self.nodes[0].cluster.members), 2)
+        self.assertEqual(len(joined.account_list), 0)
+        assert_placed(self.nodes)
+        for username in usernames:
+            node = next(node for node in self.nodes if node.cluster.is_local(username))
+            node.account_list.remove(username)
+            del node.undelivered_msg[username]
+
+    def add_unreachable_member(self, node):
+        """Adds a member to the node's cluster that nothing answers for
+
+        Returns:
+            str: The member's address
+        """
+        unreachable = f'{TEST_HOST}:{free_port()}'
+        with mock.patch('cluster.RETRY_DELAY', 0):
+            node.cluster.UpdateMembership(Membership(epoch=node.cluster.epoch + 1, members=[
+                Member(address=node.cluster.address, client_address=f'{TEST_HOST}:{node.port}'),
+                Member(address=unreachable, client_address=unreachable)]), None)
+        return unreachable
+
+    def test_users_kept_when_their_owner_is_unreachable(self):
+        node = start_node()
+        usernames = [f'stranded{i}' for i in range(30)]
+        for username in usernames:
+            node.account_list.add(username)
+            node.undelivered_msg.mailbox(username).append(('kevin', f'for {username}'))
+        # The new member never takes its users
+        unreachable = self.add_unreachable_member(node)
+        self.assertTrue(any(node.cluster.owner(username) == unreachable for username in usernames))
+        for username in usernames:
+            self.assertIn(username, node.account_list)
+            self.assertEqual(list(node.undelivered_msg[username]), [('kevin', f'for {username}')])
+        node.cluster.stop()
+
+    def test_requests_answered_when_a_node_is_down(self):
+        node = start_node()
+        self.add_unreachable_member(node)
+        sender_name, local_name = owned_by(node, 'lonely'), owned_by(node, 'near')
+        remote_name = next(f'far{i}' for i in itertools.count() if not node.cluster.is_local(f'far{i}'))
+        node.account_list.add(local_name)
+        client = connect(node.port)
+        request(client, 'CREATE_ACCOUNT', 0, {'username': sender_name})
+
+        op, args = request(client, 'SEND_MESSAGE', 1, {'recipient': remote_name, 'message': 'hi'})
+        self.assertEqual(args['status'], "Error: The recipient's server is unavailable, try again later.")
+        # The recipients of nodes that are up still get the message
+        op, args = request(client, 'SEND_MESSAGE_MULTI', 2, {
+            'recipients': ';'.join([remote_name, local_name]), 'message': 'hi'})
+        self.assertEqual(args, {'status': 'Success', 'invalid_recipients': remote_name})
+        self.assertEqual(list(node.undelivered_msg[local_name]), [(sender_name, 'hi')])
+        op, args = request(client, 'LIST_ACCOUNTS', 3, {'query': ''})
+        self.assertEqual(args['status'], 'Error: Some accounts are unavailable, try again later.')
+        self.assertIn(sender_name, node.logged_in)
+        client.close()
+        node.cluster.stop()
+
+
+if __name__ == '__main__':
+    unittest.main()
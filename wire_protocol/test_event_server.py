@@ -0,0 +1,164 @@
+import socket
+import threading
+import time
+import unittest
+from event_server import EventServer
+from protocol import PacketParser, binary_protocol_instance, protocol_instance
+
+TEST_HOST = "127.0.0.1"
+TEST_PROTOCOL = protocol_instance
+
+
+def free_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as s:
+        s.bind((TEST_HOST, 0))
+        return s.getsockname()[1]
+
+
+def connect(port, receive_buffer_size=None):
+    for _ in range(100):
+        client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        client.settimeout(5)
+        if receive_buffer_size is not None:
+            # Set before connecting, so the window the server sees stays small
+            client.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, receive_buffer_size)
+        try:
+            client.connect((TEST_HOST, port))
+            return client
+        except ConnectionRefusedError:
+            client.close()
+            time.sleep(0.02)
+    raise ConnectionError('Server never came up')
+
+
+def request(client, operation, message_id, args={}):
+    TEST_PROTOCOL.send(client, TEST_PROTOCOL.encode(
+        operation, message_id, args))
+    return receive(client)
+
+
+def receive(client):
+    metadata, msg = receive_message(client)
+    return (metadata.operation_code.name,
+            TEST_PROTOCOL.parse_data(metadata.operation_code.value, msg))
+
+
+def receive_message(client):
+    parser = PacketParser(TEST_PROTOCOL)
+    while True:
+        messages = parser.feed(client.recv(2048))
+        if messages:
+            metadata, msg, _ = messages[0]
+            return metadata, msg
+
+
+class EventServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.port = free_port()
+        cls.server = EventServer(TEST_HOST, cls.port, TEST_PROTOCOL, 2)
+        threading.Thread(target=cls.server.run, daemon=True).start()
+
+    def test_create_account_and_list(self):
+        client = connect(self.port)
+        op, args = request(client, 'CREATE_ACCOUNT', 0, {'username': 'eventuser'})
+        self.assertEqual(op, 'CREATE_ACCOUNT_RESPONSE')
+        self.assertEqual(args['status'], 'Success')
+        op, args = request(client, 'LIST_ACCOUNTS', 1, {'query': 'eventu'})
+        self.assertEqual(op, 'LIST_ACCOUNTS_RESPONSE')
+        self.assertEqual(args['accounts'], 'eventuser')
+        client.close()
+
+    def test_send_message_pushed_to_online_recipient(self):
+        sender, recipient = connect(self.port), connect(self.port)
+        request(recipient, 'CREATE_ACCOUNT', 0, {'username': 'pushrecv'})
+        request(sender, 'CREATE_ACCOUNT', 0, {'username': 'pushsend'})
+        op, args = request(sender, 'SEND_MESSAGE', 1,
+                           {'recipient': 'pushrecv', 'message': 'hi'})
+        self.assertEqual(args['status'], 'Success')
+        op, args = receive(recipient)
+        self.assertEqual(op, 'RECV_MESSAGE')
+        self.assertEqual(args, {'sender': 'pushsend', 'message': 'hi'})
+        sender.close()
+        recipient.close()
+
+    def test_batch_fan_out(self):
+        recipients = [connect(self.port) for _ in range(3)]
+        for i, recipient in enumerate(recipients):
+            request(recipient, 'CREATE_ACCOUNT', 0, {'username': f'fanout{i}'})
+        sender = connect(self.port)
+        TEST_PROTOCOL.send(sender, binary_protocol_instance.encode_batch('BATCH', 0, [
+            ('CREATE_ACCOUNT', {'username': 'fanoutsender'})] + [
+            ('SEND_MESSAGE', {'recipient': f'fanout{i}', 'message': 'hi'}) for i in range(3)]))
+        metadata, msg = receive_message(sender)
+        self.assertEqual(metadata.operation_code.name, 'BATCH_RESPONSE')
+        responses = binary_protocol_instance.parse_batch('BATCH_RESPONSE', msg)
+        self.assertEqual([code for code, _ in responses], [2, 6, 6, 6])
+        self.assertTrue(all(args['status'] == 'Success' for _, args in responses))
+        for recipient in recipients:
+            self.assertEqual(receive(recipient), (
+                'RECV_MESSAGE', {'sender': 'fanoutsender', 'message': 'hi'}))
+            recipient.close()
+        sender.close()
+
+    def test_disconnect_logs_off(self):
+        client = connect(self.port)
+        request(client, 'CREATE_ACCOUNT', 0, {'username': 'leaving'})
+        self.assertIn('leaving', self.server.logged_in)
+        client.close()
+        for _ in range(100):
+            if 'leaving' not in self.server.logged_in:
+                break
+            time.sleep(0.01)
+        self.assertNotIn('leaving', self.server.logged_in)
+
+    def test_many_connections_one_thread_each_loop(self):
+        threads_before = threading.active_count()
+        clients = [connect(self.port) for _ in range(50)]
+        for i, client in enumerate(clients):
+            op, args = request(client, 'LIST_ACCOUNTS', i, {'query': 'zzz'})
+            self.assertEqual(args['status'], 'Success')
+        self.assertEqual(threading.active_count(), threads_before)
+        for client in clients:
+            client.close()
+
+    def test_paced_responses(self):
+        # Small queues, and a login flush and account list far larger than them and the socket buffers
+        server = EventServer(TEST_HOST, free_port(), TEST_PROTOCOL,
+                             high_water_mark=16384, max_queued_bytes=65536)
+        accounts = sorted(f'paced{i:04}' + 'x' * 100 for i in range(2000))
+        server.account_list.add_all(accounts)
+        mail = [('paced0000' + 'x' * 100, str(i) + 'x' * 4000) for i in range(1000)]
+        server.undelivered_msg[accounts[1]] = mail
+        threading.Thread(target=server.run, daemon=True).start()
+
+        client = connect(server.port, 4096)
+        TEST_PROTOCOL.send(client, TEST_PROTOCOL.encode('LOG_IN', 0, {'username': accounts[1]}))
+        TEST_PROTOCOL.send(client, TEST_PROTOCOL.encode(
+            'LIST_ACCOUNTS_STREAM', 1, {'query': 'paced', 'limit': '20'}))
+        # Not reading for a while doesn't get the client disconnected
+        time.sleep(0.2)
+        parser = PacketParser(TEST_PROTOCOL)
+        messages = []
+        while len(messages) < 1 + len(mail) + 100:
+            data = client.recv(65536)
+            self.assertTrue(data, 'Disconnected')
+            for metadata, msg, _ in parser.feed(data):
+                messages.append((metadata.operation_code.name,
+                                 TEST_PROTOCOL.parse_data(metadata.operation_code.value, msg)))
+        self.assertEqual(messages[0][0], 'LOG_IN_RESPONSE')
+        self.assertEqual([(args['sender'], args['message']) for _, args in messages[1:1 + len(mail)]], mail)
+        pages = messages[1 + len(mail):]
+        self.assertEqual({op for op, _ in pages}, {'LIST_ACCOUNTS_STREAM_RESPONSE'})
+        self.assertEqual([account for _, page in pages for account in page['accounts'].split(';')], accounts)
+        self.assertFalse(accounts[1] in server.undelivered_msg)
+        client.close()
+
+    def test_no_message_log(self):
+        # The loops would wait for every write's fsync, stalling all their other clients
+        with self.assertRaises(ValueError):
+            EventServer(TEST_HOST, free_port(), TEST_PROTOCOL, message_log=object())
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,90 @@
+import unittest
+from unittest.mock import MagicMock
+
+from outbound import OutboundQueue
+from protocol import protocol_instance
+
+
+def recv_message(i):
+    return protocol_instance.encode('RECV_MESSAGE', i, {'sender': 'kevin', 'message': 'hi'})
+
+
+class OutboundQueueTest(unittest.TestCase):
+    def setUp(self):
+        self.socket = MagicMock()
+        self.writer = MagicMock()
+        self.queue = OutboundQueue(
+            self.socket, self.writer, high_water_mark=1000, max_queued_bytes=4000)
+
+    def block(self):
+        self.socket.sendmsg.side_effect = BlockingIOError
+
+    def unblock(self):
+        self.socket.sendmsg.side_effect = lambda buffers, ancdata, flags: sum(
+            map(len, buffers))
+
+    def test_idle_queue_writes_immediately(self):
+        self.unblock()
+        self.assertTrue(self.queue.push(recv_message(0)))
+        self.assertEqual(self.socket.sendmsg.call_count, 1)
+        self.assertEqual(self.queue.queued_bytes, 0)
+        self.assertFalse(self.queue.writing)
+
+    def test_coalesces_messages_queued_while_blocked(self):
+        self.block()
+        for i in range(5):
+            self.assertTrue(self.queue.push(recv_message(i)))
+        self.assertEqual(self.socket.sendmsg.call_count, 1)
+        self.writer.notify.assert_called_once_with(self.queue)
+        self.assertTrue(self.queue.blocked)
+
+        # Once writable, all five messages go out in a single call
+        self.unblock()
+        self.queue.flush()
+        self.assertEqual(self.socket.sendmsg.call_count, 2)
+        self.assertEqual(b''.join(self.socket.sendmsg.call_args[0][0]),
+                         b''.join(packet for i in range(5) for packet in recv_message(i)))
+        self.assertFalse(self.queue.blocked)
+
+    def test_throttles_until_low_water_mark(self):
+        self.block()
+        while self.queue.queued_bytes <= 1000:
+            self.queue.push(recv_message(0))
+        self.assertTrue(self.queue.throttle())
+        self.writer.notify.reset_mock()
+
+        self.unblock()
+        self.queue.flush()
+        self.assertFalse(self.queue.throttle())
+        self.writer.notify.assert_called_once_with(self.queue)
+        # Already drained, so this returns right away
+        self.queue.wait_for_capacity()
+
+    def test_slow_consumer_disconnected(self):
+        self.block()
+        tokens = []
+        while self.queue.push(recv_message(len(tokens)), len(tokens)):
+            tokens.append(len(tokens))
+        self.assertTrue(self.queue.closed)
+        self.socket.shutdown.assert_called_once()
+        self.assertEqual(self.queue.discard(), tokens)
+
+    def test_discard_returns_partially_written_messages(self):
+        self.block()
+        for i in range(3):
+            self.queue.push(recv_message(i), i)
+        first = len(b''.join(recv_message(0)))
+        self.socket.sendmsg.side_effect = [first + 1, BlockingIOError]
+        self.queue.flush()
+        self.assertEqual(self.queue.discard(), [1, 2])
+        self.assertFalse(self.queue.push(recv_message(3)))
+
+    def test_broken_connection_closes(self):
+        self.socket.sendmsg.return_value = 0
+        self.queue.push(recv_message(0), 0)
+        self.assertTrue(self.queue.closed)
+        self.assertEqual(self.queue.discard(), [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -15,6 +15,17 @@ METADATA_SIZES = {
 METADATA_LENGTH = sum(METADATA_SIZES.values())
 
 
+def recv_into_from(chunks):
+    """Mocks socket.recv_into, receiving each chunk in turn and then disconnecting"""
+    chunks = iter(chunks)
+
+    def recv_into(buffer, nbytes=0):
+        chunk = next(chunks, b'')
+        buffer[:len(chunk)] = chunk
+        return len(chunk)
+    return recv_into
+
+
 class ProtocolTest(unittest.TestCase):
     def setUp(self):
         self.protocol = protocol.protocol_instance
@@ -25,10 +36,7 @@ class ProtocolTest(unittest.TestCase):
         client = MagicMock()
         processFn = MagicMock(return_value=True)
         md = self.protocol.parse_metadata(encoding)
-        m = MagicMock()
-        zero = 0
-        m.side_effect = [encoding, zero.to_bytes(2, 'big')]
-        client.recv = m
+        client.recv_into.side_effect = recv_into_from([encoding])
         self.protocol.read_packets(client, processFn)
         curr_payload_size = md.payload_size
         packet_to_parse = encoding[METADATA_LENGTH:
@@ -44,11 +52,8 @@ class ProtocolTest(unittest.TestCase):
         client = MagicMock()
         processFn = MagicMock(return_value=True)
         md = self.protocol.parse_metadata(encoding)
-        m = MagicMock()
-        zero = 0
-        m.side_effect = [
-            encoding[:len(encoding)//2], encoding[len(encoding)//2:], zero.to_bytes(2, 'big')]
-        client.recv = m
+        client.recv_into.side_effect = recv_into_from(
+            [encoding[:len(encoding)//2], encoding[len(encoding)//2:]])
         self.protocol.read_packets(client, processFn)
         curr_payload_size = md.payload_size
         packet_to_parse = encoding[METADATA_LENGTH:
@@ -66,10 +71,7 @@ class ProtocolTest(unittest.TestCase):
         client = MagicMock()
         processFn = MagicMock(return_value=True)
         md = self.protocol.parse_metadata(encoding2)
-        m = MagicMock()
-        zero = 0
-        m.side_effect = [encoding1 + encoding2, zero.to_bytes(2, 'big')]
-        client.recv = m
+        client.recv_into.side_effect = recv_into_from([encoding1 + encoding2])
         self.protocol.read_packets(client, processFn)
         curr_payload_size = md.payload_size
         packet_to_parse = encoding2[METADATA_LENGTH:
@@ -84,21 +86,147 @@ class ProtocolTest(unittest.TestCase):
             'CREATE_ACCOUNT', 0, {'username': 'kevin' * 2048})
         client = MagicMock()
         processFn = MagicMock(return_value=True)
-        m = MagicMock()
-        zero = 0
-        m.side_effect = encoding1 + [zero.to_bytes(2, 'big')]
-        client.recv = m
+        client.recv_into.side_effect = recv_into_from(encoding1)
         self.protocol.read_packets(client, processFn)
 
         processFn.assert_called_with(
             client, unittest.mock.ANY, 'username=' + 'kevin'*2048, 0)
 
+    def test_read_packets_interleaved_chunks(self):
+        # A long message followed by a short one, received in chunks that ignore packet boundaries
+        encoding = b''.join(self.protocol.encode(
+            'SEND_MESSAGE', 0, {'recipient': 'kevin', 'message': 'x' * 5000}) +
+            self.protocol.encode('LOG_OFF', 1))
+        client = MagicMock()
+        processFn = MagicMock(return_value=True)
+        client.recv_into.side_effect = recv_into_from(
+            [encoding[i:i + 777] for i in range(0, len(encoding), 777)])
+        self.protocol.read_packets(client, processFn)
+        self.assertEqual(processFn.call_count, 2)
+        self.assertEqual(processFn.call_args_list[0][0][2],
+                         'recipient=kevin\rmessage=' + 'x' * 5000)
+        self.assertEqual(processFn.call_args_list[1][0][2], '')
+        self.assertEqual(processFn.call_args_list[1][0][3], 1)
+
+    def test_interleaved_packets_of_several_messages(self):
+        # Packets of two multi-packet messages alternate, one sharing the other's id
+        first = self.protocol.encode('SEND_MESSAGE', 7, {'recipient': 'kevin', 'message': 'a' * 5000})
+        second = self.protocol.encode('SEND_MESSAGE', 8, {'recipient': 'howie', 'message': 'b' * 5000})
+        third = self.protocol.encode('LIST_ACCOUNTS', 7, {'query': 'c' * 3000})
+        packets = [packet for packets in zip(first, second, third) for packet in packets]
+        packets += first[len(third):] + second[len(third):]
+        parser = protocol.PacketParser(self.protocol)
+        messages = parser.feed(b''.join(packets))
+        self.assertEqual([(metadata.message_id, metadata.operation_code.name, data) for metadata, data, _ in messages], [
+            (7, 'LIST_ACCOUNTS', 'query=' + 'c' * 3000),
+            (7, 'SEND_MESSAGE', 'recipient=kevin\rmessage=' + 'a' * 5000),
+            (8, 'SEND_MESSAGE', 'recipient=howie\rmessage=' + 'b' * 5000)])
+        self.assertEqual(parser.partial_msgs, {})
+
+    def test_too_many_partial_messages(self):
+        parser = protocol.PacketParser(self.protocol)
+        with self.assertRaises(ValueError):
+            for message_id in range(protocol.MAX_PARTIAL_MESSAGES + 1):
+                parser.feed(self.protocol.encode('LIST_ACCOUNTS', message_id, {'query': 'x' * 3000})[0])
+
+    def test_read_packets_unsupported_version(self):
+        encoding = bytearray(self.protocol.encode('LOG_OFF', 0)[0])
+        encoding[0] = 99
+        client = MagicMock()
+        client.recv_into.side_effect = recv_into_from([bytes(encoding)])
+        self.assertIsNone(self.protocol.read_packets(client, MagicMock()))
+
+    def test_send_single_lock_round_trip(self):
+        message = self.protocol.encode(
+            'SEND_MESSAGE', 0, {'recipient': 'kevin', 'message': 'x' * 100000})
+        client = MagicMock()
+        sent = bytearray()
+
+        def sendmsg(buffers):
+            # Accept at most 5000 bytes per call to exercise partial writes
+            chunk = b''.join(bytes(buffer) for buffer in buffers)[:5000]
+            sent.extend(chunk)
+            return len(chunk)
+        client.sendmsg.side_effect = sendmsg
+        lock = MagicMock()
+        self.assertTrue(self.protocol.send(client, message, lock))
+        self.assertEqual(bytes(sent), b''.join(message))
+        self.assertEqual(lock.acquire.call_count, 1)
+        self.assertEqual(lock.release.call_count, 1)
+
+    def test_send_broken_connection(self):
+        client = MagicMock()
+        client.sendmsg.return_value = 0
+        lock = MagicMock()
+        self.assertFalse(self.protocol.send(
+            client, self.protocol.encode('LOG_OFF', 0), lock))
+        self.assertEqual(lock.release.call_count, 1)
+
     def test_parse_data(self):
         data = 'recipient=kevin\rmessage=hello'
         parse = self.protocol.parse_data(5, data)
         self.assertEqual(parse['recipient'], 'kevin')
         self.assertEqual(parse['message'], 'hello')
 
+    def test_optional_args(self):
+        encoding = self.protocol.encode(
+            'LIST_ACCOUNTS', 0, {'query': 'kev', 'limit': 10, 'other': 'x'})[0]
+        data = encoding[METADATA_LENGTH:-1].decode('ascii')
+        self.assertEqual(self.protocol.parse_data(3, data),
+                         {'query': 'kev', 'limit': '10'})
+
+    def test_binary_round_trip(self):
+        binary = protocol.binary_protocol_instance
+        args = {'recipient': 'kévin', 'message': 'line one\rline=two\n☃' * 300}
+        encoding = binary.encode('SEND_MESSAGE', 3, args)
+        client = MagicMock()
+        processFn = MagicMock(return_value=True)
+        client.recv_into.side_effect = recv_into_from(encoding)
+        self.protocol.read_packets(client, processFn)
+        metadata, data = processFn.call_args[0][1:3]
+        self.assertEqual(metadata.version, protocol.BINARY_VERSION)
+        self.assertEqual(binary.parse_data(5, data, metadata.version), args)
+
+    def test_binary_optional_args(self):
+        binary = protocol.binary_protocol_instance
+        for args in [{'query': 'kev'}, {'query': '', 'cursor': 'kevin'}, {'query': 'kev', 'limit': 10}]:
+            encoding = binary.encode('LIST_ACCOUNTS', 0, args)[0]
+            self.assertEqual(binary.parse_data(3, bytes(encoding[METADATA_LENGTH:]), 2),
+                             {key: str(value) for key, value in args.items()})
+        # Operations without arguments have an empty payload
+        self.assertEqual(len(binary.encode('LOG_OFF', 0)[0]), METADATA_LENGTH)
+
+    def test_binary_payload_smaller(self):
+        args = {'recipient': 'kevin', 'message': 'hello'}
+        self.assertLess(len(protocol.binary_protocol_instance.encode('SEND_MESSAGE', 0, args)[0]),
+                        len(self.protocol.encode('SEND_MESSAGE', 0, args)[0]))
+
+    def test_batch_round_trip(self):
+        binary = protocol.binary_protocol_instance
+        operations = [('LOG_IN', {'username': 'kevin'}), ('LOG_OFF', {})] + \
+            [('SEND_MESSAGE', {'recipient': f'user{i}', 'message': 'é' * i}) for i in range(200)]
+        encoding = binary.encode_batch('BATCH', 7, operations)
+        client = MagicMock()
+        processFn = MagicMock(return_value=True)
+        client.recv_into.side_effect = recv_into_from(encoding)
+        self.protocol.read_packets(client, processFn)
+        metadata, data = processFn.call_args[0][1:3]
+        self.assertEqual(metadata.operation_code, protocol.OperationCode.BATCH)
+        self.assertEqual(binary.parse_batch('BATCH', data), [
+            (protocol.OperationCode[operation].value, args) for operation, args in operations])
+
+    def test_batch_rejects_operations(self):
+        binary = protocol.binary_protocol_instance
+        with self.assertRaises(ValueError):
+            binary.encode_batch('BATCH', 0, [('LOG_IN_RESPONSE', {'status': 'Success', 'username': 'kevin'})])
+        with self.assertRaises(ValueError):
+            binary.encode_batch('BATCH', 0, [('SEND_MESSAGE', {'recipient': 'kevin'})])
+        data = bytes(binary.encode_batch('BATCH', 0, [('LOG_IN', {'username': 'kevin'})])[0][METADATA_LENGTH:])
+        with self.assertRaises(ValueError):
+            binary.parse_batch('BATCH_RESPONSE', data)
+        with self.assertRaises(ValueError):
+            binary.parse_batch('BATCH', data[:-1])
+
     def test_parse_metadata(self):
         encoding = self.protocol.encode(
             'CREATE_ACCOUNT', 0, {'username': 'kevin'})[0]
@@ -111,6 +239,17 @@ class ProtocolTest(unittest.TestCase):
         self.assertEqual(md.payload_size, 15)
         self.assertEqual(md.version, 1)
 
+    def test_message_id_wraps(self):
+        encoding = self.protocol.encode(
+            'CREATE_ACCOUNT', 65537, {'username': 'kevin'})[0]
+        self.assertEqual(self.protocol.parse_metadata(encoding).message_id, 1)
+
+    def test_parse_metadata_bad_operation(self):
+        encoding = bytearray(self.protocol.encode('LOG_OFF', 0)[0])
+        encoding[2] = 200
+        with self.assertRaises(ValueError):
+            self.protocol.parse_metadata(encoding)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,123 @@
+import os
+import sys
+import tempfile
+import threading
+import time
+import unittest
+from replicated_server import ReplicatedServer
+from protocol import protocol_instance
+from test_event_server import connect, free_port, request
+
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from message_log import MessageLog  # noqa: E402
+
+TEST_HOST = "127.0.0.1"
+TEST_PROTOCOL = protocol_instance
+
+
+def start_server(message_log=None, primary=None, open_log=None):
+    server = ReplicatedServer(TEST_HOST, free_port(), TEST_PROTOCOL, f'{TEST_HOST}:{free_port()}', primary,
+                              message_log=message_log, open_log=open_log)
+    server.start_replication()
+    threading.Thread(target=server.run, daemon=True).start()
+    return server
+
+
+def wait_for(condition):
+    for _ in range(250):
+        if condition():
+            return
+        time.sleep(0.02)
+    raise AssertionError('Condition never held')
+
+
+class ReplicatedServerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.primary = start_server(MessageLog(os.path.join(self.directory.name, 'primary'), sync_replicas=1))
+        self.servers = [self.primary]
+
+    def tearDown(self):
+        for server in self.servers:
+            server.disconnect()
+        self.directory.cleanup()
+
+    def start_replica(self, open_log=None):
+        replica = start_server(primary=self.primary.replication.address, open_log=open_log)
+        self.servers.append(replica)
+        self.assertTrue(replica.replication.caught_up.wait(5))
+        # Writes wait for the replica once the primary has its acknowledgement of the state
+        wait_for(lambda: any(follower.caught_up for follower in self.primary.message_log.followers))
+        return replica
+
+    def write_before_replica(self):
+        writer = connect(self.primary.port)
+        request(writer, 'CREATE_ACCOUNT', 0, {'username': 'alice'})
+        request(writer, 'LOG_OFF', 1)
+        request(writer, 'CREATE_ACCOUNT', 2, {'username': 'bob'})
+        request(writer, 'SEND_MESSAGE', 3, {'recipient': 'alice', 'message': 'queued'})
+        writer.close()
+
+    def test_replica_gets_state_and_serves_lists(self):
+        self.write_before_replica()
+        replica = self.start_replica()
+        self.assertEqual(list(replica.account_list), ['alice', 'bob'])
+        self.assertEqual(list(replica.undelivered_msg['alice']), [('bob', 'queued')])
+
+        # With sync_replicas=1, a write returns once the caught-up replica has applied it
+        writer = connect(self.primary.port)
+        op, args = request(writer, 'CREATE_ACCOUNT', 0, {'username': 'carol'})
+        self.assertEqual(args['status'], 'Success')
+        self.assertTrue('carol' in replica.account_list)
+        request(writer, 'SEND_MESSAGE', 1, {'recipient': 'alice', 'message': 'hi'})
+        self.assertEqual(list(replica.undelivered_msg['alice']), [('bob', 'queued'), ('carol', 'hi')])
+        request(writer, 'DELETE_ACCOUNT', 2)
+        self.assertFalse('carol' in replica.account_list)
+        writer.close()
+
+        reader = connect(replica.port)
+        op, args = request(reader, 'LIST_ACCOUNTS', 0, {'query': ''})
+        self.assertEqual(args['accounts'], 'alice;bob')
+        op, args = request(reader, 'CREATE_ACCOUNT', 1, {'username': 'dave'})
+        self.assertEqual(args['status'], 'Error: This server is a read-only replica; '
+                                         'create accounts and log in on the primary.')
+        op, args = request(reader, 'LOG_IN', 2, {'username': 'alice'})
+        self.assertTrue(args['status'].startswith('Error: This server is a read-only replica'))
+        self.assertFalse('dave' in replica.account_list)
+        reader.close()
+
+    def test_promote(self):
+        self.write_before_replica()
+        log_dir = os.path.join(self.directory.name, 'replica')
+        still_replica = []
+
+        def open_log(account_list, undelivered_msg):
+            # Writes are still refused while the state is written into the new log
+            still_replica.append(replica.replication.is_replica())
+            return MessageLog.from_state(log_dir, account_list, undelivered_msg)
+        replica = self.start_replica(open_log)
+
+        self.assertTrue(replica.replication.promote())
+        self.assertEqual(still_replica, [True])
+        self.assertFalse(replica.replication.is_replica())
+        self.assertFalse(replica.replication.promote())
+        client = connect(replica.port)
+        op, args = request(client, 'CREATE_ACCOUNT', 0, {'username': 'carol'})
+        self.assertEqual(args['status'], 'Success')
+        request(client, 'SEND_MESSAGE', 1, {'recipient': 'alice', 'message': 'after'})
+        client.close()
+        replica.disconnect()
+        self.servers.remove(replica)
+
+        # The promoted replica's log holds what it had from the primary and what it took since
+        recovered = MessageLog(log_dir)
+        server = ReplicatedServer(TEST_HOST, free_port(), TEST_PROTOCOL, f'{TEST_HOST}:{free_port()}',
+                                  message_log=recovered)
+        self.assertEqual(list(server.account_list), ['alice', 'bob', 'carol'])
+        self.assertEqual(list(server.undelivered_msg['alice']), [('bob', 'queued'), ('carol', 'after')])
+        recovered.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,10 +1,21 @@
 
+import os
+import socket
+import sys
+import tempfile
 import unittest
 import threading
+from outbound import ThreadedWriter
+import protocol
 from server import Server
 from protocol import protocol_instance
 from unittest.mock import MagicMock
 
+sys.path.append(os.path.join(os.path.dirname(
+    os.path.abspath(__file__)), '..', 'common'))
+from message_log import MessageLog  # noqa: E402
+from storage import SqliteStorage  # noqa: E402
+
 TEST_HOST = "127.0.0.1"
 TEST_PORT = 6000
 TEST_PROTOCOL = protocol_instance
@@ -13,9 +24,10 @@ TEST_PROTOCOL = protocol_instance
 class ServerTest(unittest.TestCase):
     def setUp(self):
         self.server = Server(TEST_HOST, TEST_PORT, TEST_PROTOCOL)
-        self.server.account_list.append("kevin")
-        self.server.account_list.append("howie")
+        self.server.account_list.add("kevin")
+        self.server.account_list.add("howie")
         mock_kevin_socket = MagicMock()
+        mock_kevin_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
         mock_howie_socket = threading.Lock()
         mock_kevin_lock = MagicMock()
         mock_howie_lock = threading.Lock()
@@ -52,6 +64,7 @@ class ServerTest(unittest.TestCase):
         self.server.logged_in.pop("kevin")
         mock_kevin_lock = MagicMock()
         mock_kevin_socket = MagicMock()
+        mock_kevin_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
         response = self.server.process_login(
             args, mock_kevin_socket, mock_kevin_lock)
         self.assertEqual(response['status'], 'Success')
@@ -68,6 +81,7 @@ class ServerTest(unittest.TestCase):
         args = {"username": "kevin"}
         mock_kevin_lock = threading.Lock()
         mock_kevin_socket = MagicMock()
+        mock_kevin_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
         response = self.server.process_login(
             args, mock_kevin_socket, mock_kevin_lock)
         self.assertEqual(
@@ -79,6 +93,27 @@ class ServerTest(unittest.TestCase):
         self.assertEqual(response['status'], 'Success')
         self.assertEqual(response['accounts'], 'kevin')
 
+    def test_list_account_paginated(self):
+        args = {'query': ".*", 'limit': '1'}
+        response = self.server.process_list_accounts(args)
+        self.assertEqual(response['accounts'], 'howie')
+        self.assertEqual(response['next_cursor'], 'howie')
+        args['cursor'] = response['next_cursor']
+        response = self.server.process_list_accounts(args)
+        self.assertEqual(response['accounts'], 'kevin')
+        self.assertEqual(response['next_cursor'], '')
+
+    def test_list_account_bad_limit(self):
+        response = self.server.process_list_accounts({'query': ".*", 'limit': 'x'})
+        self.assertEqual(response['status'], 'Error: limit must be a positive integer.')
+
+    def test_list_account_stream(self):
+        pages = list(self.server.process_list_accounts_stream({'query': ".*", 'limit': '1'}))
+        self.assertEqual([page['accounts'] for page in pages], ['howie', 'kevin'])
+        self.assertEqual(pages[-1]['next_cursor'], '')
+        pages = list(self.server.process_list_accounts_stream({'query': "["}))
+        self.assertEqual(pages[0]['status'], 'Error: regex is malformed.')
+
     def test_list_account_regex_bad(self):
         args = {'query': "["}
         response = self.server.process_list_accounts(args)
@@ -89,7 +124,282 @@ class ServerTest(unittest.TestCase):
         response = self.server.process_send_msg(
             args, self.server.logged_in['kevin'][0], self.server.logged_in['kevin'][1])
         self.assertEqual(response['status'], 'Success')
-        self.assertTrue("kevin" in self.server.undelivered_msg.keys())
+        # kevin is online, so the message is written to his socket right away
+        self.assertFalse("kevin" in self.server.undelivered_msg.keys())
+        sent = self.server.logged_in['kevin'][0].sendmsg.call_args[0][0][0]
+        self.assertEqual(TEST_PROTOCOL.parse_metadata(sent).operation_code.name, 'RECV_MESSAGE')
+
+    def test_send_msg_offline_recipient_queued(self):
+        self.server.account_list.add("joseph")
+        args = {'recipient': 'joseph', 'message': 'hello'}
+        response = self.server.process_send_msg(
+            args, self.server.logged_in['kevin'][0], self.server.logged_in['kevin'][1])
+        self.assertEqual(response['status'], 'Success')
+        self.assertEqual(list(self.server.undelivered_msg['joseph']), [('kevin', 'hello')])
+
+    def test_login_flushes_undelivered(self):
+        self.server.account_list.add("joseph")
+        self.server.undelivered_msg['joseph'] = [('kevin', 'first'), ('howie', 'second')]
+        joseph_socket = MagicMock()
+        joseph_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        process_operation = self.server.process_operation_curried(threading.Lock())
+        login = TEST_PROTOCOL.encode('LOG_IN', 0, {'username': 'joseph'})[0]
+        process_operation(joseph_socket, TEST_PROTOCOL.parse_metadata(login), 'username=joseph', 0)
+        sent = [TEST_PROTOCOL.parse_metadata(call[0][0][0]).operation_code.name
+                for call in joseph_socket.sendmsg.call_args_list]
+        self.assertEqual(sent, ['LOG_IN_RESPONSE', 'RECV_MESSAGE', 'RECV_MESSAGE'])
+        self.assertFalse('joseph' in self.server.undelivered_msg)
+
+    def test_slow_consumer_disconnected_and_requeued(self):
+        self.server = Server(TEST_HOST, TEST_PORT, TEST_PROTOCOL,
+                             high_water_mark=16384, max_queued_bytes=65536)
+        self.server.account_list.add("joseph")
+        self.server.logged_in["kevin"] = (MagicMock(), MagicMock())
+        # joseph never reads, so his socket buffer and then his outbound queue fill up
+        joseph_socket, joseph_client = socket.socketpair()
+        joseph_lock = threading.Lock()
+        self.server.open_outbound(joseph_socket, ThreadedWriter())
+        self.server.logged_in["joseph"] = (joseph_socket, joseph_lock)
+        sent = []
+        while not self.server.undelivered_msg.get('joseph'):
+            sent.append(('kevin', str(len(sent)) + 'x' * 1000))
+            self.server.process_send_msg({'recipient': 'joseph', 'message': sent[-1][1]},
+                                         *self.server.logged_in['kevin'])
+        # The server side of the connection was shut down, so its reader sees a disconnect
+        self.assertEqual(joseph_socket.recv(1), b'')
+        self.server.release_client(joseph_socket, joseph_lock)
+        # Everything that didn't make it to the socket is queued again, in order
+        undelivered = list(self.server.undelivered_msg['joseph'])
+        self.assertGreater(len(undelivered), 1)
+        self.assertEqual(undelivered, sent[-len(undelivered):])
+        joseph_socket.close()
+        joseph_client.close()
+
+    def paced_connection(self):
+        """A server with small outbound queues and a logged out client that isn't reading yet"""
+        self.server = Server(TEST_HOST, TEST_PORT, TEST_PROTOCOL,
+                             high_water_mark=16384, max_queued_bytes=65536)
+        server_socket, client_socket = socket.socketpair()
+        self.addCleanup(server_socket.close)
+        self.addCleanup(client_socket.close)
+        return server_socket, client_socket, self.server.open_outbound(server_socket, ThreadedWriter())
+
+    def read_messages(self, client_socket, count):
+        parser = protocol.PacketParser(TEST_PROTOCOL)
+        messages = []
+        while len(messages) < count:
+            data = client_socket.recv(65536)
+            self.assertTrue(data, 'Disconnected')
+            for metadata, msg, _ in parser.feed(data):
+                messages.append((metadata.operation_code.name,
+                                 TEST_PROTOCOL.parse_data(metadata.operation_code.value, msg)))
+        return messages
+
+    def test_login_flush_paced(self):
+        server_socket, client_socket, outbox = self.paced_connection()
+        self.server.account_list.add_all(["joseph", "kevin"])
+        self.server.logged_in["kevin"] = (MagicMock(), MagicMock())
+        # Far more mail than the outbound queue may hold
+        mail = [('kevin', str(i) + 'x' * 1000) for i in range(1000)]
+        self.server.undelivered_msg['joseph'] = mail
+        process_operation = self.server.process_operation_curried(threading.Lock())
+        metadata, msg, _ = protocol.PacketParser(TEST_PROTOCOL).feed(
+            TEST_PROTOCOL.encode('LOG_IN', 0, {'username': 'joseph'})[0])[0]
+        work = process_operation(server_socket, metadata, msg, 0)
+        # The flush paused instead of disconnecting joseph, and the rest waits in his mailbox
+        self.assertIsNotNone(work)
+        self.assertFalse(outbox.closed)
+        self.assertGreater(len(self.server.undelivered_msg['joseph']), 0)
+        # Mail sent meanwhile goes behind the mail being flushed
+        self.server.process_send_msg({'recipient': 'joseph', 'message': 'late'},
+                                     *self.server.logged_in['kevin'])
+        mail.append(('kevin', 'late'))
+
+        finisher = threading.Thread(target=self.server.finish, args=(work, outbox))
+        finisher.start()
+        messages = self.read_messages(client_socket, len(mail) + 1)
+        finisher.join()
+        self.assertEqual(messages[0], ('LOG_IN_RESPONSE', {'status': 'Success', 'username': 'joseph'}))
+        self.assertEqual([(args['sender'], args['message']) for _, args in messages[1:]], mail)
+        self.assertFalse('joseph' in self.server.undelivered_msg)
+
+    def test_login_flush_stops_on_disconnect(self):
+        server_socket, client_socket, outbox = self.paced_connection()
+        self.server.account_list.add("joseph")
+        mail = [('kevin', str(i) + 'x' * 1000) for i in range(1000)]
+        self.server.undelivered_msg['joseph'] = mail
+        joseph_lock = threading.Lock()
+        self.server.logged_in['joseph'] = (server_socket, joseph_lock)
+        work = self.server.deliver_undelivered_messages('joseph')
+        self.assertIsNotNone(work)
+        outbox.close()
+        self.server.finish(work, outbox)
+        self.server.release_client(server_socket, joseph_lock)
+        # What wasn't written is back in the mailbox, in order
+        undelivered = list(self.server.undelivered_msg['joseph'])
+        self.assertGreater(len(undelivered), 900)
+        self.assertEqual(undelivered, mail[-len(undelivered):])
+
+    def test_list_account_stream_paced(self):
+        server_socket, client_socket, outbox = self.paced_connection()
+        accounts = sorted(f'account{i:04}' + 'x' * 100 for i in range(2000))
+        self.server.account_list.add_all(accounts)
+        process_operation = self.server.process_operation_curried(threading.Lock())
+        metadata, msg, _ = protocol.PacketParser(TEST_PROTOCOL).feed(
+            TEST_PROTOCOL.encode('LIST_ACCOUNTS_STREAM', 7, {'query': 'account', 'limit': '20'})[0])[0]
+        work = process_operation(server_socket, metadata, msg, 0)
+        self.assertIsNotNone(work)
+        self.assertFalse(outbox.closed)
+
+        finisher = threading.Thread(target=self.server.finish, args=(work, outbox))
+        finisher.start()
+        pages = self.read_messages(client_socket, 100)
+        finisher.join()
+        self.assertEqual([account for _, page in pages for account in page['accounts'].split(';')], accounts)
+        self.assertEqual(pages[-1][1]['next_cursor'], '')
+
+    def test_replies_in_request_version(self):
+        binary = protocol.binary_protocol_instance
+        self.server.undelivered_msg['kevin'] = [('howie', 'hi ☃')]
+        self.server.logged_in.pop('kevin')
+        kevin_socket = MagicMock()
+        kevin_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        process_operation = self.server.process_operation_curried(threading.Lock())
+        login = binary.encode('LOG_IN', 0, {'username': 'kevin'})[0]
+        process_operation(kevin_socket, TEST_PROTOCOL.parse_metadata(login),
+                          bytes(login[protocol.METADATA_LENGTH:]), 0)
+        parser = protocol.PacketParser(TEST_PROTOCOL)
+        received = parser.feed(b''.join(call[0][0][0] for call in kevin_socket.sendmsg.call_args_list))
+        self.assertEqual([metadata.version for metadata, _, _ in received], [2, 2])
+        metadata, data, _ = received[1]
+        self.assertEqual(binary.parse_data(metadata.operation_code.value, data, metadata.version),
+                         {'sender': 'howie', 'message': 'hi ☃'})
+
+    def test_non_ascii_to_version_1_recipient(self):
+        self.server.logged_in.pop('kevin')
+        kevin_socket = MagicMock()
+        kevin_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        self.server.logged_in['kevin'] = (kevin_socket, threading.Lock())
+        self.server.client_versions[kevin_socket] = protocol.VERSION
+        # howie sends in version 2, which carries any UTF-8 text
+        howie_socket = self.server.logged_in['howie'][0]
+        self.server.client_versions[howie_socket] = protocol.BINARY_VERSION
+        response = self.server.process_send_msg({'recipient': 'kevin', 'message': 'hi ☃'},
+                                                *self.server.logged_in['howie'])
+        self.assertEqual(response['status'], 'Success')
+        metadata, data, _ = protocol.PacketParser(TEST_PROTOCOL).feed(kevin_socket.sendmsg.call_args[0][0][0])[0]
+        self.assertEqual(metadata.version, protocol.VERSION)
+        self.assertEqual(TEST_PROTOCOL.parse_data(metadata.operation_code.value, data),
+                         {'sender': 'howie', 'message': 'hi \\u2603'})
+        # The recipient's mailbox is free for the next message
+        self.assertTrue(self.server.undelivered_msg.mailbox('kevin').lock.acquire(blocking=False))
+
+    def test_create_account_delivers_leftover_mail(self):
+        # Mail left in the mailbox of a deleted account reaches it once it is created again
+        self.server.undelivered_msg['joseph'] = [('howie', 'left over')]
+        joseph_socket = MagicMock()
+        joseph_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        packet = TEST_PROTOCOL.encode('CREATE_ACCOUNT', 0, {'username': 'joseph'})[0]
+        process_operation = self.server.process_operation_curried(threading.Lock())
+        process_operation(joseph_socket, TEST_PROTOCOL.parse_metadata(packet),
+                          bytes(packet[protocol.METADATA_LENGTH:-1]).decode('ascii'), 0)
+        received = protocol.PacketParser(TEST_PROTOCOL).feed(
+            b''.join(call[0][0][0] for call in joseph_socket.sendmsg.call_args_list))
+        self.assertEqual([metadata.operation_code.name for metadata, _, _ in received],
+                         ['CREATE_ACCOUNT_RESPONSE', 'RECV_MESSAGE'])
+        self.assertFalse('joseph' in self.server.undelivered_msg)
+
+    def test_batch_single_response(self):
+        binary = protocol.binary_protocol_instance
+        self.server.logged_in.pop('kevin')
+        self.server.undelivered_msg['kevin'] = [('howie', 'welcome back')]
+        kevin_socket = MagicMock()
+        kevin_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        self.server.account_list.add('joseph')
+        batch = binary.encode_batch('BATCH', 4, [
+            ('LOG_IN', {'username': 'kevin'}),
+            ('SEND_MESSAGE', {'recipient': 'joseph', 'message': 'one'}),
+            ('SEND_MESSAGE', {'recipient': 'nobody', 'message': 'two'}),
+            ('LIST_ACCOUNTS', {'query': 'jo'})])
+        process_operation = self.server.process_operation_curried(threading.Lock())
+        process_operation(kevin_socket, TEST_PROTOCOL.parse_metadata(batch[0]),
+                          bytes(batch[0][protocol.METADATA_LENGTH:]), 4)
+        received = protocol.PacketParser(TEST_PROTOCOL).feed(
+            b''.join(call[0][0][0] for call in kevin_socket.sendmsg.call_args_list))
+        # One response for the whole batch, then the mail queued while kevin was offline
+        self.assertEqual([metadata.operation_code.name for metadata, _, _ in received],
+                         ['BATCH_RESPONSE', 'RECV_MESSAGE'])
+        self.assertEqual(received[0][0].message_id, 4)
+        self.assertEqual(binary.parse_batch('BATCH_RESPONSE', received[0][1]), [
+            (10, {'status': 'Success', 'username': 'kevin'}),
+            (6, {'status': 'Success'}),
+            (6, {'status': 'Error: The recipient of the message does not exist.'}),
+            (4, {'status': 'Success', 'accounts': 'joseph'})])
+        self.assertEqual(list(self.server.undelivered_msg['joseph']), [('kevin', 'one')])
+
+    def test_rejected_batch_answered_with_error(self):
+        binary = protocol.binary_protocol_instance
+        kevin_socket = MagicMock()
+        kevin_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        process_operation = self.server.process_operation_curried(threading.Lock())
+        batch = binary.encode_batch('BATCH', 5, [('LIST_ACCOUNTS', {'query': 'jo'})])[0]
+        # A version 1 batch, then a version 2 batch cut short
+        version_1 = TEST_PROTOCOL.parse_metadata(batch)
+        version_1.version = protocol.VERSION
+        process_operation(kevin_socket, version_1, bytes(batch[protocol.METADATA_LENGTH:]), 0)
+        process_operation(kevin_socket, TEST_PROTOCOL.parse_metadata(batch),
+                          bytes(batch[protocol.METADATA_LENGTH:-1]), 0)
+        received = protocol.PacketParser(TEST_PROTOCOL).feed(
+            b''.join(call[0][0][0] for call in kevin_socket.sendmsg.call_args_list))
+        self.assertEqual(len(received), 2)
+        for metadata, msg, _ in received:
+            self.assertEqual(metadata.operation_code.name, 'BATCH_RESPONSE')
+            self.assertEqual(metadata.message_id, 5)
+            self.assertEqual(metadata.version, protocol.VERSION)
+            self.assertTrue(TEST_PROTOCOL.parse_data(17, msg, metadata.version)['status'].startswith('Error:'))
+
+    def test_responses_echo_request_ids(self):
+        howie_socket, howie_lock = MagicMock(), threading.Lock()
+        howie_socket.sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        self.server.logged_in.pop('howie')
+        self.server.logged_in['howie'] = (howie_socket, howie_lock)
+        process_operation = self.server.process_operation_curried(howie_lock)
+        # Requests arrive out of id order, as from a client with many in flight, and each
+        # response carries its own request's id whatever the connection received before
+        for message_id, operation, args in [(9, 'LIST_ACCOUNTS', {'query': 'kev'}),
+                                            (3, 'SEND_MESSAGE', {'recipient': 'kevin', 'message': 'hi'})]:
+            packet = TEST_PROTOCOL.encode(operation, message_id, args)[0]
+            process_operation(howie_socket, TEST_PROTOCOL.parse_metadata(packet),
+                              bytes(packet[protocol.METADATA_LENGTH:-1]).decode('ascii'), 0)
+
+        def received(client_socket):
+            return [(metadata.operation_code.name, metadata.message_id)
+                    for metadata, _, _ in protocol.PacketParser(TEST_PROTOCOL).feed(
+                        b''.join(call[0][0][0] for call in client_socket.sendmsg.call_args_list))]
+        self.assertEqual(received(howie_socket), [('LIST_ACCOUNTS_RESPONSE', 9), ('SEND_MESSAGE_RESPONSE', 3)])
+        # Pushed messages are numbered on their own
+        self.server.deliver_message(*self.server.logged_in['kevin'], 'kevin', 'howie', 'again')
+        self.assertEqual(received(self.server.logged_in['kevin'][0]), [('RECV_MESSAGE', 0), ('RECV_MESSAGE', 1)])
+
+    def test_send_msg_multi(self):
+        self.server.account_list.add("joseph")
+        self.server.account_list.add("aaron")
+        args = {'recipients': 'joseph;nobody;aaron;kevin;joseph', 'message': 'hello all'}
+        response = self.server.process_send_msg_multi(
+            args, self.server.logged_in['kevin'][0], self.server.logged_in['kevin'][1])
+        self.assertEqual(response, {'status': 'Success', 'invalid_recipients': 'nobody'})
+        # Offline recipients share one queued message, online ones get it right away
+        self.assertEqual(list(self.server.undelivered_msg['joseph']), [('kevin', 'hello all')])
+        self.assertIs(self.server.undelivered_msg['joseph'][0], self.server.undelivered_msg['aaron'][0])
+        self.assertFalse('kevin' in self.server.undelivered_msg)
+        sent = self.server.logged_in['kevin'][0].sendmsg.call_args[0][0][0]
+        self.assertEqual(TEST_PROTOCOL.parse_metadata(sent).operation_code.name, 'RECV_MESSAGE')
+
+    def test_send_msg_multi_no_valid_recipient(self):
+        response = self.server.process_send_msg_multi(
+            {'recipients': 'nobody;noone', 'message': 'hi'}, *self.server.logged_in['kevin'])
+        self.assertEqual(response, {'status': 'Error: None of the recipients exist.',
+                                    'invalid_recipients': 'nobody;noone'})
 
     def test_send_msg_failure_no_recipient(self):
         args = {'recipient': 'joseph', 'message': 'hello'}
@@ -123,6 +433,84 @@ class ServerTest(unittest.TestCase):
         self.assertEqual(
             response['status'], 'Error: Need to be logged in to log out of your account.')
 
+    def test_concurrent_users_stress(self):
+        num_threads, num_messages = 8, 300
+        for i in range(num_threads):
+            self.server.account_list.add(f'recipient{i}')
+        created = []
+
+        def worker(i):
+            connection = (MagicMock(), threading.Lock())
+            # Every thread races to create the same account, only one may succeed
+            if self.server.process_create_account({'username': 'contested'}, *connection)['status'] == 'Success':
+                created.append(i)
+                self.server.process_logoff(*connection)
+            self.server.process_create_account({'username': f'sender{i}'}, *connection)
+            for j in range(num_messages):
+                self.server.process_send_msg(
+                    {'recipient': f'recipient{i}', 'message': str(j)}, *connection)
+                if j % 50 == 0:
+                    self.server.process_logoff(*connection)
+                    self.server.process_login({'username': f'sender{i}'}, *connection)
+        threads = [threading.Thread(target=worker, args=(i,)) for i in range(num_threads)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(created), 1)
+        for i in range(num_threads):
+            self.assertEqual(list(self.server.undelivered_msg[f'recipient{i}']),
+                             [(f'sender{i}', str(j)) for j in range(num_messages)])
+            self.assertTrue(f'sender{i}' in self.server.logged_in)
+        self.assertEqual(len(self.server.logged_in), num_threads + 2)
+
+    def check_survives_restart(self, start, stop):
+        """Queues mail, delivers it and deletes an account across restarts. start() starts a
+        server on the same storage every time, and stop(server) shuts it down.
+        """
+        server = start()
+        joseph = (MagicMock(), threading.Lock())
+        howie = (MagicMock(), threading.Lock())
+        server.process_create_account({'username': 'joseph'}, *joseph)
+        server.process_logoff(*joseph)
+        server.process_create_account({'username': 'howie'}, *howie)
+        for i in range(3):
+            server.process_send_msg({'recipient': 'joseph', 'message': f'hello {i}'}, *howie)
+
+        stop(server)
+        server = start()
+        self.assertEqual(list(server.account_list), ['howie', 'joseph'])
+        self.assertEqual(list(server.undelivered_msg['joseph']),
+                         [('howie', f'hello {i}') for i in range(3)])
+        # Delivered messages are removed for good
+        joseph[0].sendmsg.side_effect = lambda buffers: sum(map(len, buffers))
+        server.process_login({'username': 'joseph'}, *joseph)
+        server.deliver_undelivered_messages('joseph')
+        # Sessions don't survive a restart
+        server.process_login({'username': 'howie'}, *howie)
+        server.process_delete_account(*howie)
+
+        stop(server)
+        server = start()
+        self.assertEqual(list(server.account_list), ['joseph'])
+        self.assertFalse('joseph' in server.undelivered_msg)
+        stop(server)
+
+    def test_message_log_recovery(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'log')
+            self.check_survives_restart(
+                lambda: Server(TEST_HOST, TEST_PORT, TEST_PROTOCOL, message_log=MessageLog(path)),
+                lambda server: server.message_log.close())
+
+    def test_sqlite_storage(self):
+        with tempfile.TemporaryDirectory() as directory:
+            path = os.path.join(directory, 'chat.db')
+            self.check_survives_restart(
+                lambda: Server(TEST_HOST, TEST_PORT, TEST_PROTOCOL, storage=SqliteStorage(path)),
+                lambda server: server.storage.close())
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,131 @@
+import multiprocessing
+import threading
+import unittest
+from protocol import protocol_instance
+from shard_server import ShardLink, ShardServer, shard_for
+from test_event_server import connect, free_port, receive, request
+
+TEST_HOST = "127.0.0.1"
+TEST_PROTOCOL = protocol_instance
+
+
+def owned_by(shard, prefix):
+    """The first username starting with prefix that the shard owns"""
+    i = 0
+    while shard_for(f'{prefix}{i}', 2) != shard:
+        i += 1
+    return f'{prefix}{i}'
+
+
+class ShardServerTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        # Two shards in this process, each listening on its own port, so tests pick the
+        # shard a connection lands on
+        cls.ports = [free_port(), free_port()]
+        first_end, second_end = multiprocessing.Pipe()
+        cls.shards = [ShardServer(TEST_HOST, cls.ports[0], TEST_PROTOCOL, 0, 2, {1: first_end}),
+                      ShardServer(TEST_HOST, cls.ports[1], TEST_PROTOCOL, 1, 2, {0: second_end})]
+        for shard in cls.shards:
+            threading.Thread(target=shard.run, daemon=True).start()
+
+    def test_connection_moves_to_owner(self):
+        username = owned_by(1, 'movee')
+        client = connect(self.ports[0])
+        op, args = request(client, 'CREATE_ACCOUNT', 0, {'username': username})
+        self.assertEqual(args['status'], 'Success')
+        self.assertTrue(username in self.shards[1].account_list)
+        self.assertFalse(username in self.shards[0].account_list)
+        self.assertTrue(username in self.shards[1].logged_in)
+        # The owner enforces the single login, wherever the second login arrives
+        other = connect(self.ports[0])
+        op, args = request(other, 'LOG_IN', 0, {'username': username})
+        self.assertEqual(args['status'], 'Error: Someone else is logged into that account.')
+        op, args = request(client, 'LOG_OFF', 1)
+        self.assertEqual(args['status'], 'Success')
+        op, args = request(other, 'LOG_IN', 1, {'username': username})
+        self.assertEqual(args['status'], 'Success')
+        client.close()
+        other.close()
+
+    def test_send_across_shards(self):
+        sender_name, recipient_name = owned_by(0, 'sender'), owned_by(1, 'recipient')
+        recipient = connect(self.ports[1])
+        request(recipient, 'CREATE_ACCOUNT', 0, {'username': recipient_name})
+        sender = connect(self.ports[1])
+        op, args = request(sender, 'CREATE_ACCOUNT', 0, {'username': sender_name})
+        self.assertEqual(args['status'], 'Success')
+
+        op, args = request(sender, 'SEND_MESSAGE', 1, {'recipient': recipient_name, 'message': 'hi'})
+        self.assertEqual(args['status'], 'Success')
+        self.assertEqual(receive(recipient), ('RECV_MESSAGE', {'sender': sender_name, 'message': 'hi'}))
+        op, args = request(sender, 'SEND_MESSAGE', 2, {'recipient': owned_by(1, 'nobody'), 'message': 'hi'})
+        self.assertEqual(args['status'], 'Error: The recipient of the message does not exist.')
+
+        missing = [owned_by(0, 'nobody'), owned_by(1, 'nobody')]
+        op, args = request(sender, 'SEND_MESSAGE_MULTI', 3, {
+            'recipients': ';'.join([missing[1], recipient_name, missing[0]]), 'message': 'all'})
+        self.assertEqual(args, {'status': 'Success', 'invalid_recipients': ';'.join([missing[1], missing[0]])})
+        self.assertEqual(receive(recipient), ('RECV_MESSAGE', {'sender': sender_name, 'message': 'all'}))
+        sender.close()
+        recipient.close()
+
+    def test_list_accounts_across_shards(self):
+        usernames = [owned_by(1, 'lister'), owned_by(0, 'Lister')]
+        for username in usernames:
+            self.shards[shard_for(username, 2)].account_list.add(username)
+        client = connect(self.ports[0])
+        op, args = request(client, 'LIST_ACCOUNTS', 0, {'query': 'lister'})
+        self.assertEqual(args['accounts'], ';'.join(sorted(usernames, key=str.lower)))
+        op, args = request(client, 'LIST_ACCOUNTS', 1, {'query': 'lister', 'limit': '1'})
+        first = args['accounts']
+        op, args = request(client, 'LIST_ACCOUNTS', 2, {'query': 'lister', 'limit': '1',
+                                                         'cursor': args['next_cursor']})
+        self.assertEqual([first, args['accounts']], sorted(usernames, key=str.lower))
+        self.assertEqual(args['next_cursor'], '')
+        op, args = request(client, 'LIST_ACCOUNTS', 3, {'query': '['})
+        self.assertEqual(args['status'], 'Error: regex is malformed.')
+        client.close()
+
+
+class ShardLinkTest(unittest.TestCase):
+    def test_requests_fail_once_the_shard_is_gone(self):
+        ours, theirs = multiprocessing.Pipe()
+        link = ShardLink(ours, None)
+        link.start()
+        waiting = link.request('send', ['kevin'], 'howie', 'hi')
+        theirs.close()
+        with self.assertRaises(ConnectionError):
+            waiting.result(5)
+        # Later requests fail right away instead of waiting forever
+        with self.assertRaises(ConnectionError):
+            link.call('send', ['kevin'], 'howie', 'again')
+
+    def test_requests_answered_once_the_shard_is_gone(self):
+        ours, theirs = multiprocessing.Pipe()
+        theirs.close()
+        port = free_port()
+        shard = ShardServer(TEST_HOST, port, TEST_PROTOCOL, 0, 2, {1: ours})
+        threading.Thread(target=shard.run, daemon=True).start()
+        sender_name, local_name, remote_name = owned_by(0, 'alone'), owned_by(0, 'near'), owned_by(1, 'far')
+        shard.account_list.add(local_name)
+        client = connect(port)
+        request(client, 'CREATE_ACCOUNT', 0, {'username': sender_name})
+
+        op, args = request(client, 'SEND_MESSAGE', 1, {'recipient': remote_name, 'message': 'hi'})
+        self.assertEqual(args['status'], "Error: The recipient's server is unavailable, try again later.")
+        # The recipients this shard owns still get the message
+        op, args = request(client, 'SEND_MESSAGE_MULTI', 2, {
+            'recipients': ';'.join([remote_name, local_name]), 'message': 'hi'})
+        self.assertEqual(args, {'status': 'Success', 'invalid_recipients': remote_name})
+        self.assertEqual(list(shard.undelivered_msg[local_name]), [(sender_name, 'hi')])
+        op, args = request(client, 'LIST_ACCOUNTS', 3, {'query': ''})
+        self.assertEqual(args['status'], 'Error: Some accounts are unavailable, try again later.')
+        op, args = request(client, 'LIST_ACCOUNTS_STREAM', 4, {'query': ''})
+        self.assertEqual(args['status'], 'Error: Some accounts are unavailable, try again later.')
+        self.assertIn(sender_name, shard.logged_in)
+        client.close()
+
+
+if __name__ == '__main__':
+    unittest.main()